@@ -0,0 +1,47 @@
+"""Benchmark for the experiment log formatters.
+
+Formats the same 100k log records with CsvFormatter and FastCsvFormatter,
+checks that both produce identical text and reports the time per record.
+
+Run from the root of the project with `python -m benchmarks.csv_formatter_benchmark`.
+"""
+
+import logging
+import time
+
+from elephant_vending_machine.libraries.experiment_logger import CsvFormatter, FastCsvFormatter
+
+RECORDS = 100000
+
+
+def make_records():
+    """Returns RECORDS log records, one millisecond apart, shaped like experiment logs."""
+    start = time.time()
+    records = []
+    for index in range(RECORDS):
+        record = logging.LogRecord('experiment_logger', logging.INFO, __file__, 0,
+                                   'Trial %s started', (index,), None)
+        record.created = start + index / 1000
+        records.append(record)
+    return records
+
+
+def measure(formatter, records):
+    """Returns the formatted records and the time taken per record in microseconds."""
+    start = time.perf_counter()
+    lines = [formatter.format(record) for record in records]
+    return lines, (time.perf_counter() - start) / len(records) * 1e6
+
+
+def main():
+    """Runs the benchmark and prints a summary."""
+    records = make_records()
+    csv_lines, csv_time = measure(CsvFormatter(), records)
+    fast_lines, fast_time = measure(FastCsvFormatter(), records)
+    assert csv_lines == fast_lines, 'FastCsvFormatter output differs from CsvFormatter'
+    print(f'CsvFormatter: {csv_time:.2f} us per record')
+    print(f'FastCsvFormatter: {fast_time:.2f} us per record ({csv_time / fast_time:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Benchmark for the latency of experiment_logger.info calls.
+
+Compares the time an experiment spends in each info call when records are
+written synchronously by a FileHandler with the time spent when they are
+queued for the BatchingFileHandler's writer thread.
+
+Run from the root of the project with `python -m benchmarks.experiment_logger_benchmark`.
+"""
+
+import logging
+import os
+import tempfile
+import time
+
+from elephant_vending_machine.libraries.experiment_logger import BatchingFileHandler, CsvFormatter
+
+RECORDS = 20000
+
+
+def measure_call_latency(handler):
+    """Returns the latency in microseconds of each info call through a handler, sorted."""
+    logger = logging.getLogger(f'benchmark_{id(handler)}')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler.setFormatter(CsvFormatter())
+    logger.addHandler(handler)
+    latencies = []
+    for trial in range(RECORDS):
+        start = time.perf_counter()
+        logger.info('Trial %s started', trial)
+        latencies.append((time.perf_counter() - start) * 1000000)
+    logger.removeHandler(handler)
+    handler.close()
+    return sorted(latencies)
+
+
+def summarize(name, latencies):
+    """Prints the median, 99th percentile and maximum of a set of latencies."""
+    print(f'{name} (us): median {latencies[len(latencies) // 2]:.2f}, '
+          f'p99 {latencies[int(len(latencies) * 0.99)]:.2f}, max {latencies[-1]:.2f}')
+
+
+def main():
+    """Runs the benchmark and prints a summary."""
+    with tempfile.TemporaryDirectory() as directory:
+        summarize('FileHandler', measure_call_latency(
+            logging.FileHandler(os.path.join(directory, 'file_handler.csv'))))
+        summarize('BatchingFileHandler', measure_call_latency(
+            BatchingFileHandler(os.path.join(directory, 'batching_handler.csv'))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark for pre-rendered stimuli.
+
+Compares the work a monitor pi does to load a stimulus for display: decoding a
+camera sized JPEG or PNG and scaling it to the screen, as display_agent.py does
+with Pillow, against loading the same stimulus pre-rendered as PPM at the
+screen's resolution. Run it on a pi for representative numbers.
+
+Requires Pillow. Run from the root of the project with
+`python -m benchmarks.prerender_benchmark`.
+"""
+
+import os
+import tempfile
+import time
+
+from elephant_vending_machine.libraries import prerender
+
+RESOLUTION = (1920, 1080)
+SOURCE_SIZE = (4032, 3024)
+REPEATS = 10
+
+
+def make_sources(directory):
+    """Writes a noisy camera sized test image as JPEG and PNG, and returns their paths."""
+    image = prerender.Image.effect_noise(SOURCE_SIZE, 64).convert('RGB')
+    paths = []
+    for name, options in (('source.jpg', {'quality': 90}), ('source.png', {})):
+        path = os.path.join(directory, name)
+        image.save(path, **options)
+        paths.append(path)
+    return paths
+
+
+def load_scaled(path):
+    """Decodes an image and scales it to fit the screen, as display_agent.py does."""
+    with prerender.Image.open(path) as image:
+        image.thumbnail(RESOLUTION)
+        image.load()
+
+
+def load_prerendered(path):
+    """Decodes a pre-rendered image, which needs no scaling."""
+    with prerender.Image.open(path) as image:
+        image.load()
+
+
+def measure(load, path):
+    """Returns the median time taken to load an image in milliseconds."""
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        load(path)
+        times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    """Runs the benchmark and prints a summary."""
+    if not prerender.can_prerender():
+        print('Pillow is required, install it with `pip install pillow`')
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        for source in make_sources(directory):
+            name = os.path.basename(source)
+            target = prerender.prerender_stimulus(directory, name, RESOLUTION)
+            scaled = measure(load_scaled, source)
+            prerendered = measure(load_prerendered, target)
+            print(f'{name} ({os.path.getsize(source) // 1024} KiB): decode and scale '
+                  f'{scaled:.1f} ms, pre-rendered PPM ({os.path.getsize(target) // 1024} KiB) '
+                  f'{prerendered:.1f} ms ({scaled / prerendered:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark comparing the time to copy an uploaded stimulus and its pre-rendered
+variant to every monitor pi, serially with an ssh call and an scp call per file
+as before, against push_files on all hosts concurrently.
+
+Starts a throwaway sshd listening on three loopback addresses, which stand in
+for the three pis, so it needs the OpenSSH server installed (but no remote
+Pis). Run from the root of the project with
+`python -m benchmarks.remote_sync_benchmark`.
+"""
+
+import getpass
+import os
+import tempfile
+import time
+
+from elephant_vending_machine.libraries.prerender import prerendered_name
+from elephant_vending_machine.libraries.remote_sync import fan_out, push_files
+from elephant_vending_machine.libraries.ssh_pool import SSHConnectionPool
+from benchmarks.ssh_pool_benchmark import PORT, start_local_sshd
+
+SAMPLES = 10
+HOSTS = ['127.0.0.1', '127.0.0.2', '127.0.0.3']
+IMAGE_SIZE = 5 * 1024 * 1024
+# Size of a 1920x1080 binary PPM file
+PRERENDERED_SIZE = 1920 * 1080 * 3
+
+
+def median_latency(sync):
+    """Returns the median time in milliseconds of SAMPLES calls to sync."""
+    latencies = []
+    for _ in range(SAMPLES):
+        start = time.perf_counter()
+        sync()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2]
+
+
+def main():
+    """Runs the benchmark and prints a summary."""
+    user = getpass.getuser()
+    with tempfile.TemporaryDirectory() as directory:
+        sshd, client_key = start_local_sshd(directory, addresses=HOSTS)
+        local_directory = os.path.join(directory, 'img')
+        names = ['stimulus.jpg', prerendered_name('stimulus.jpg')]
+        os.makedirs(os.path.dirname(os.path.join(local_directory, names[1])))
+        for name, size in zip(names, (IMAGE_SIZE, PRERENDERED_SIZE)):
+            with open(os.path.join(local_directory, name), 'wb') as file:
+                file.write(os.urandom(size))
+        pool = SSHConnectionPool(identity_file=client_key,
+                                 control_directory=os.path.join(directory, 'control'),
+                                 port=PORT)
+
+        def remote_directory(host):
+            return os.path.join(directory, 'remote', host)
+
+        def serial():
+            for host in HOSTS:
+                pool.run(user, host, 'mkdir -p ' + os.path.dirname(
+                    os.path.join(remote_directory(host), names[1])))
+                for name in names:
+                    pool.copy(user, host, os.path.join(local_directory, name),
+                              os.path.join(remote_directory(host), name))
+
+        def concurrent():
+            fan_out(HOSTS, lambda host: push_files(pool, user, host, local_directory, names,
+                                                   remote_directory(host)))
+
+        try:
+            for host in HOSTS:
+                pool.run(user, host, 'true')
+            serial_latency = median_latency(serial)
+            concurrent_latency = median_latency(concurrent)
+            for host in HOSTS:
+                pool.close(user, host)
+        finally:
+            sshd.terminate()
+    print(f'serial ssh and scp per host: {serial_latency:.1f} ms median')
+    print(f'concurrent tar stream:       {concurrent_latency:.1f} ms median')
+
+
+if __name__ == '__main__':
+    main()
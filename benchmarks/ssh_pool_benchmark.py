@@ -0,0 +1,92 @@
+"""Benchmark comparing per-command latency of SSHConnectionPool against a fresh
+ssh subprocess per command, the path used before the pool existed.
+
+Starts a throwaway sshd on localhost, so it needs the OpenSSH server installed
+(but no remote Pis). Run from the root of the project with
+`python -m benchmarks.ssh_pool_benchmark`.
+"""
+
+import getpass
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from elephant_vending_machine.libraries.ssh_pool import SSHConnectionPool
+
+SAMPLES = 50
+PORT = 2222
+
+
+def start_local_sshd(directory, port=PORT, addresses=('127.0.0.1',)):
+    """Starts sshd on localhost accepting a freshly generated key.
+
+    Parameters:
+        directory (str): A scratch directory for keys and configuration
+        port (int): The port for sshd to listen on
+        addresses (tuple): The loopback addresses for sshd to listen on
+
+    Returns:
+        tuple: The sshd process and the path of the client private key
+    """
+    sshd = shutil.which('sshd') or '/usr/sbin/sshd'
+    if not os.path.exists(sshd):
+        sys.exit('sshd is not installed, install the OpenSSH server to run this benchmark')
+    host_key = os.path.join(directory, 'host_key')
+    client_key = os.path.join(directory, 'client_key')
+    for key in (host_key, client_key):
+        subprocess.run(['ssh-keygen', '-q', '-t', 'ed25519', '-N', '', '-f', key], check=True)
+    shutil.copy(client_key + '.pub', os.path.join(directory, 'authorized_keys'))
+    config = os.path.join(directory, 'sshd_config')
+    listen = ''.join(f'ListenAddress {address}\n' for address in addresses)
+    with open(config, 'w') as file:
+        file.write(f'''Port {port}
+{listen}HostKey {host_key}
+AuthorizedKeysFile {directory}/authorized_keys
+PidFile {directory}/sshd.pid
+StrictModes no
+UsePAM no
+MaxSessions 16
+''')
+    process = subprocess.Popen([sshd, '-D', '-e', '-f', config],
+                               stderr=subprocess.DEVNULL)
+    time.sleep(0.5)
+    return process, client_key
+
+
+def time_commands(run_command):
+    """Returns the median latency in milliseconds of SAMPLES calls to run_command."""
+    latencies = []
+    for _ in range(SAMPLES):
+        start = time.perf_counter()
+        run_command()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2]
+
+
+def main():
+    """Runs the benchmark and prints a summary."""
+    user = getpass.getuser()
+    with tempfile.TemporaryDirectory() as directory:
+        sshd, client_key = start_local_sshd(directory)
+        try:
+            fresh = time_commands(lambda: subprocess.run(
+                f'ssh -oStrictHostKeyChecking=no -oUserKnownHostsFile=/dev/null -oLogLevel=ERROR \
+                -i {client_key} -p {PORT} {user}@127.0.0.1 true', check=True, shell=True))
+            pool = SSHConnectionPool(identity_file=client_key,
+                                     control_directory=os.path.join(directory, 'control'),
+                                     port=PORT)
+            pool.run(user, '127.0.0.1', 'true')
+            pooled = time_commands(lambda: pool.run(user, '127.0.0.1', 'true'))
+            pool.close(user, '127.0.0.1')
+        finally:
+            sshd.terminate()
+    print(f'subprocess per command: {fresh:.1f} ms median')
+    print(f'pooled connection:      {pooled:.1f} ms median')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark for VendingMachine.wait_for_input.
+
+Measures the CPU consumed by a trial blocked waiting for input, and the latency
+from a POST to /signal until wait_for_input returns the selection.
+
+Run from the root of the project with `python -m benchmarks.wait_for_input_benchmark`.
+"""
+
+import threading
+import time
+
+from elephant_vending_machine import APP, views
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
+
+ADDRESSES = ['192.168.0.11', '192.168.0.12', '192.168.0.13']
+IDLE_SECONDS = 2
+WAKE_SAMPLES = 200
+
+
+def measure_idle_cpu(vending_machine):
+    """Returns the fraction of one core used while waiting IDLE_SECONDS for input."""
+    groups = [vending_machine.left_group]
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    vending_machine.wait_for_input(groups, IDLE_SECONDS * 1000)
+    cpu_used = time.process_time() - cpu_start
+    return cpu_used / (time.perf_counter() - wall_start)
+
+
+def measure_wake_latency(vending_machine, client):
+    """Returns wake-up latencies in milliseconds from the signal POST to the selection."""
+    groups = [vending_machine.left_group, vending_machine.right_group]
+    latencies = []
+    for _ in range(WAKE_SAMPLES):
+        result = {}
+
+        def waiter(result=result):
+            vending_machine.wait_for_input(groups, 5000)
+            result['returned'] = time.perf_counter()
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.002)
+        posted = time.perf_counter()
+        client.post('/signal', data={'address': ADDRESSES[0]})
+        thread.join()
+        latencies.append((result['returned'] - posted) * 1000)
+    return sorted(latencies)
+
+
+def main():
+    """Runs the benchmark and prints a summary."""
+    vending_machine = VendingMachine(ADDRESSES)
+    transport = views.get_signal_transport()
+    transport.subscribe(vending_machine.receive_signal)
+    APP.config['TESTING'] = True
+    try:
+        print(f'idle cpu: {measure_idle_cpu(vending_machine) * 100:.2f}% of one core')
+        with APP.test_client() as client:
+            latencies = measure_wake_latency(vending_machine, client)
+    finally:
+        transport.unsubscribe()
+    print(f'wake latency (ms): median {latencies[len(latencies) // 2]:.3f}, '
+          f'p99 {latencies[int(len(latencies) * 0.99)]:.3f}, max {latencies[-1]:.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""A daemon which displays stimuli full screen and swaps between them on request.
+
+Runs on each monitor pi in place of launching feh for every stimulus. Images
+are decoded ahead of time with a "preload" request and kept in memory, so a
+"flip" request only has to swap the image shown on screen.
+
+Requests and replies are single lines of JSON over TCP:
+    {"op": "preload", "set": 1, "image": "/path/to/image.png"} -> {"ok": true}
+    {"op": "preload", "set": 1, "image": "/path/to/.prerendered/image.png.ppm",
+     "fallback": "/path/to/image.png"} -> {"ok": true}
+    {"op": "flip", "set": 1} -> {"ok": true, "shown": <unix time the image was shown>}
+    {"op": "arm", "set": 1, "at": <unix time>} -> {"ok": true, "shown": <unix time>}
+    {"op": "discard", "set": 1} -> {"ok": true}
+    {"op": "time"} -> {"ok": true, "time": <unix time>}
+    {"op": "ping"} -> {"ok": true}
+
+"arm" shows the set at the given time on the pi's clock, and replies once it has
+been shown. The backend uses "time" to estimate the offset between its clock and
+the pi's, so it can arm all screens to change at the same instant.
+
+Usage:
+    DISPLAY=:0 python3 display_agent.py [port]
+
+PNG, GIF and PPM images are supported natively. If Pillow is installed, any image
+format it supports can be used, and images are scaled to fit the screen. The
+backend sends the image pre-rendered at the screen's resolution as PPM, which
+loads fastest, along with a fallback to load instead if it is missing.
+"""
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+import tkinter
+
+try:
+    from PIL import Image, ImageTk
+except ImportError:
+    Image = None
+
+PORT = 5005
+# How often the display thread checks for requests, in milliseconds
+POLL_INTERVAL = 1
+# How early an armed flip wakes up before busy waiting for its exact time, in seconds
+ARM_SPIN_TIME = 0.003
+
+
+class Display:
+    """Owns the full screen window. All methods must be called on the Tk thread."""
+
+    def __init__(self):
+        self.root = tkinter.Tk()
+        self.root.attributes('-fullscreen', True)
+        self.root.configure(background='black', cursor='none')
+        self.width = self.root.winfo_screenwidth()
+        self.height = self.root.winfo_screenheight()
+        self.label = tkinter.Label(self.root, background='black', borderwidth=0)
+        self.label.pack(expand=True, fill='both')
+        self.sets = {}
+        self.requests = queue.Queue()
+
+    def load(self, path):
+        """Decodes an image and scales it to fit the screen."""
+        if Image is None:
+            return tkinter.PhotoImage(file=path)
+        image = Image.open(path)
+        image.thumbnail((self.width, self.height))
+        return ImageTk.PhotoImage(image)
+
+    def handle_message(self, message, replies):
+        """Applies a single request and returns the reply, or None if the reply
+        will be put on the replies queue later."""
+        operation = message.get('op')
+        try:
+            if operation == 'preload':
+                path = message['image']
+                if 'fallback' in message and not os.path.exists(path):
+                    path = message['fallback']
+                self.sets[message['set']] = self.load(path)
+                return {'ok': True}
+            if operation == 'flip':
+                return {'ok': True, 'shown': self.flip(message['set'])}
+            if operation == 'arm':
+                image = self.sets[message['set']]
+                delay = message['at'] - time.time() - ARM_SPIN_TIME
+                self.root.after(max(0, int(delay * 1000)), self.fire, image, message['at'], replies)
+                return None
+            if operation == 'discard':
+                self.sets.pop(message['set'], None)
+                return {'ok': True}
+            if operation == 'ping':
+                return {'ok': True}
+        except (KeyError, OSError, tkinter.TclError) as error:
+            return {'ok': False, 'error': str(error)}
+        return {'ok': False, 'error': f'Unknown operation {operation}'}
+
+    def flip(self, set_id):
+        """Shows a preloaded set and returns the time it was shown."""
+        self.label.configure(image=self.sets[set_id])
+        self.root.update_idletasks()
+        return time.time()
+
+    def fire(self, image, at_time, replies):
+        """Waits for the armed time, then shows the image and replies."""
+        while time.time() < at_time:
+            pass
+        self.label.configure(image=image)
+        self.root.update_idletasks()
+        replies.put({'ok': True, 'shown': time.time()})
+
+    def poll(self):
+        """Handles requests queued by the connection threads."""
+        while not self.requests.empty():
+            message, replies = self.requests.get()
+            reply = self.handle_message(message, replies)
+            if reply is not None:
+                replies.put(reply)
+        self.root.after(POLL_INTERVAL, self.poll)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Passes each request on a connection to the display thread and returns its reply."""
+
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        replies = queue.Queue()
+        for line in self.rfile:
+            message = json.loads(line)
+            if message.get('op') == 'time':
+                # Answered here rather than on the display thread to keep the round trip symmetric
+                self.wfile.write(json.dumps({'ok': True, 'time': time.time()}).encode() + b'\n')
+                continue
+            self.server.display.requests.put((message, replies))
+            self.wfile.write(json.dumps(replies.get()).encode() + b'\n')
+
+
+class Server(socketserver.ThreadingTCPServer):
+    """TCP server accepting connections from the backend."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if __name__ == '__main__':
+    DISPLAY = Display()
+    SERVER = Server(('0.0.0.0', int(sys.argv[1]) if len(sys.argv) > 1 else PORT), RequestHandler)
+    SERVER.display = DISPLAY
+    threading.Thread(target=SERVER.serve_forever, daemon=True).start()
+    DISPLAY.poll()
+    DISPLAY.root.mainloop()
@@ -4,17 +4,31 @@ This module creates the Flask appliaction object so that each
 module can import it safely and the __name__ variable will always
 resolve to the correct package.
 """
+import os
 import subprocess
 import atexit
 from flask import Flask
 from flask_cors import CORS, cross_origin
 
 APP = Flask(__name__)
+# The package directory, so the data files below do not depend on the working directory
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 CORS(APP)
 APP.config.update(
     REMOTE_HOSTS=['192.168.0.11', '192.168.0.12', '192.168.0.13'],
     REMOTE_HOST_USERNAME='pi',
-    REMOTE_IMAGE_DIRECTORY='/home/pi/elephant_vending_machine/images'
+    REMOTE_IMAGE_DIRECTORY='/home/pi/elephant_vending_machine/images',
+    SIGNAL_TRANSPORT='unix',
+    SIGNAL_SOCKET_PATH='/tmp/elephant_vending_machine_signal.sock',
+    STRUCTURED_LOGS=True,
+    LOG_CATALOG_PATH=os.path.join(PACKAGE_DIRECTORY, 'static', 'log', '.catalog.sqlite3'),
+    IMAGE_INDEX_DIRECTORY=os.path.join(PACKAGE_DIRECTORY, '.image_index'),
+    SYNC_QUEUE_PATH=os.path.join(PACKAGE_DIRECTORY, '.sync_queue.sqlite3'),
+    DISPLAY_AGENT_PORT=None,
+    DISPLAY_SETTLE_TIME=1000,
+    DISPLAY_ONSET_LEAD=20,
+    PRERENDER_IMAGES=True,
+    MONITOR_RESOLUTION=(1920, 1080)
 )
 
 for remote_host in APP.config['REMOTE_HOSTS']:
@@ -33,3 +47,6 @@ atexit.register(kill_processes)
 # Circular imports are bad, but views are not used here, only imported, so it's OK
 # pylint: disable=wrong-import-position
 import elephant_vending_machine.views
+import elephant_vending_machine.image_views
+import elephant_vending_machine.upload_views
+import elephant_vending_machine.log_views
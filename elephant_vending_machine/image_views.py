@@ -0,0 +1,808 @@
+"""Routes managing the images and groups of images.
+
+Here, the routes uploading, copying, deleting and listing the images of each
+group, managing the groups and syncing them to the monitor pis are defined,
+along with the stores the images are kept in, apart from the rest of the
+routes in views.
+"""
+
+# Circular import OK here. See https://flask.palletsprojects.com/en/1.1.x/patterns/packages/
+# pylint: disable=cyclic-import
+# pylint: disable=W0603
+from datetime import datetime
+import logging
+import os
+import sys
+import shlex
+import shutil
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from flask import json, request, make_response, jsonify, url_for
+from werkzeug.utils import secure_filename
+from elephant_vending_machine import APP
+from .libraries.blob_store import BLOB_DIRECTORY, BlobCorruptedError, BlobStore
+from .libraries.chunked_upload import UPLOAD_DIRECTORY, UploadStore
+from .libraries.image_index import ImageIndex, file_digest, SORTS as IMAGE_SORTS
+from .libraries.prerender import PRERENDER_DIRECTORY, copy_prerendered, prerender_stimulus, \
+    prerendered_group, prerendered_name, remove_prerendered, remove_prerendered_group
+from .libraries.remote_sync import RangeForwarder, push_files, push_range, reconcile
+from .libraries.sync_queue import CREATE, DELETE, GROUP_ACTIONS, LINK, PUSH, RECONCILE, \
+    REMOVE, RENAME, Job, SyncQueue
+from .libraries.thumbnails import ThumbnailPipeline
+from .libraries.ssh_pool import DEFAULT_POOL
+from .views import ALLOWED_IMG_EXTENSIONS, DIRECTORY_CACHE, IMAGE_UPLOAD_FOLDER, \
+    MAX_PAGE_SIZE, THUMBNAIL_FOLDER, flag_argument, listing_response, uploaded_file
+
+LOGGER = logging.getLogger(__name__)
+IMAGE_INDEX = None
+THUMBNAIL_PIPELINE = None
+BLOB_STORE = None
+UPLOAD_STORE = None
+RANGE_FORWARDER = None
+SYNC_QUEUE = None
+# Number of images of a batch pre-rendered at once
+BATCH_WORKERS = 4
+
+def get_image_index():
+    """Returns the index of the images in each group, saved in IMAGE_INDEX_DIRECTORY,
+    creating it on first use."""
+    global IMAGE_INDEX
+    if IMAGE_INDEX is None:
+        IMAGE_INDEX = ImageIndex(APP.config['IMAGE_INDEX_DIRECTORY'], DIRECTORY_CACHE)
+    return IMAGE_INDEX
+
+def get_thumbnail_pipeline():
+    """Returns the pipeline rendering thumbnails and previews of the images into the
+    thumbnails directory, creating it on first use."""
+    global THUMBNAIL_PIPELINE
+    if THUMBNAIL_PIPELINE is None:
+        THUMBNAIL_PIPELINE = ThumbnailPipeline(
+            os.path.dirname(os.path.abspath(__file__)) + THUMBNAIL_FOLDER)
+    return THUMBNAIL_PIPELINE
+
+def get_blob_store():
+    """Returns the store holding the content of every image, in the blob directory of
+    the image directory, creating it on first use."""
+    global BLOB_STORE
+    if BLOB_STORE is None:
+        BLOB_STORE = BlobStore(os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+                               + '/' + BLOB_DIRECTORY)
+    return BLOB_STORE
+
+def get_upload_store():
+    """Returns the store of the chunked uploads in progress, kept in the blob store's
+    directory so finished uploads are moved into it, creating it on first use."""
+    global UPLOAD_STORE
+    if UPLOAD_STORE is None:
+        UPLOAD_STORE = UploadStore(os.path.join(get_blob_store().directory, UPLOAD_DIRECTORY),
+                                   remove_remote_part)
+    return UPLOAD_STORE
+
+def remote_part_name(upload_id):
+    """Returns the name of the partial file a chunked upload is forwarded to on the
+    remote hosts, in the directory of its group."""
+    return f'.{upload_id}.part'
+
+def remove_remote_part(upload):
+    """Queues the removal of the partial file a chunked upload was forwarded to on the
+    remote hosts, once the upload was cancelled, expired or failed its hash check."""
+    get_sync_queue().enqueue(
+        [Job(DELETE, f"{upload['group']}/{remote_part_name(upload['upload_id'])}")])
+
+def get_range_forwarder():
+    """Returns the forwarder sending the chunks of uploads to the remote hosts while
+    the rest of the upload is arriving, creating it on first use."""
+    global RANGE_FORWARDER
+    if RANGE_FORWARDER is None:
+        user = APP.config['REMOTE_HOST_USERNAME']
+        def send(host, key, offset, length):
+            group, upload_id = key
+            push_range(DEFAULT_POOL, user, host, get_upload_store().part_path(upload_id), offset,
+                       length, f"{APP.config['REMOTE_IMAGE_DIRECTORY']}/{group}/"
+                               f"{remote_part_name(upload_id)}")
+        RANGE_FORWARDER = RangeForwarder(APP.config['REMOTE_HOSTS'], send)
+    return RANGE_FORWARDER
+
+def get_sync_queue():
+    """Returns the queue of the changes to make on the remote hosts, kept in the database
+    at SYNC_QUEUE_PATH, creating it and starting its workers on first use."""
+    global SYNC_QUEUE
+    if SYNC_QUEUE is None:
+        SYNC_QUEUE = SyncQueue(APP.config['SYNC_QUEUE_PATH'], APP.config['REMOTE_HOSTS'],
+                               sync_images)
+        SYNC_QUEUE.start()
+    return SYNC_QUEUE
+
+@APP.before_request
+def resume_sync():
+    """Starts the sync queue with the first request, so the jobs left queued when the
+    server stopped are resumed. Each server process starts its own workers, which lease
+    a host before performing its jobs, so no two of them sync the same host at once."""
+    get_sync_queue()
+
+def verifier(manifest):
+    """Returns a function verifying the stored images among the files about to be sent
+    to a host, for remote_sync.reconcile.
+
+    Parameters:
+        manifest (dict): The hash of each file the images were stored under, by path
+            relative to the image directory
+    """
+    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+    def verify(paths):
+        for path in paths:
+            # Pre-rendered variants were hashed for the manifest just now
+            if not path.startswith(PRERENDER_DIRECTORY + '/'):
+                get_blob_store().verify(os.path.join(directory, path), manifest[path])
+    return verify
+
+def sync_groups_on_host(user, host, jobs):
+    """Creates and removes the groups of the jobs queued for a remote host, in one ssh
+    session.
+
+    Parameters:
+        user (str): The user to log in to the host as
+        host (str): The address of the host
+        jobs (list): The sync_queue.Jobs queued for the host
+    """
+    commands = []
+    for job in jobs:
+        if job.action in GROUP_ACTIONS:
+            quoted = shlex.quote(job.path)
+            # A group created afresh must not keep the images of a group deleted before it
+            commands.append(f'rm -rf {quoted} {shlex.quote(prerendered_group(job.path))}'
+                            + (f' && mkdir -p {quoted}' if job.action == CREATE else ''))
+    if commands:
+        directory = shlex.quote(APP.config['REMOTE_IMAGE_DIRECTORY'])
+        DEFAULT_POOL.run(user, host, shlex.quote(
+            f'mkdir -p {directory} && cd {directory} && ' + ' && '.join(commands)))
+
+def image_digest(path):
+    """Returns the hex SHA-256 hash of an image, as group/name, from the index of its
+    group if it is there."""
+    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+    group, name = path.split('/', 1)
+    entry = get_image_index().entries(os.path.join(directory, group)).get(name)
+    return entry['sha256'] if entry is not None else file_digest(os.path.join(directory, path))
+
+def sync_images(host, jobs):
+    """Performs the jobs queued for a remote host, for the sync queue.
+
+    Groups are created and removed first, in one ssh session. The images to push,
+    rename and delete and their pre-rendered variants then go in a single transfer,
+    and the images to link are reconciled with the images the host already holds,
+    followed by the groups to reconcile.
+
+    Parameters:
+        host (str): The address of the host
+        jobs (list): The sync_queue.Jobs queued for the host
+
+    Raises:
+        CalledProcessError: If the host cannot be reached or the changes fail
+        BlobCorruptedError: If an image to be linked, and so maybe sent, is damaged
+    """
+    user = APP.config['REMOTE_HOST_USERNAME']
+    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+    remote_directory = APP.config['REMOTE_IMAGE_DIRECTORY']
+    sync_groups_on_host(user, host, jobs)
+    names = []
+    remove = []
+    renames = []
+    manifest = {}
+    scope = []
+    sources = []
+    for job in jobs:
+        if job.action in GROUP_ACTIONS or job.action == RECONCILE:
+            continue
+        variant = prerendered_name(job.path)
+        if job.action in (PUSH, DELETE) and job.source:
+            remove.append(job.source)
+        if job.action == DELETE or not os.path.exists(os.path.join(directory, job.path)):
+            remove.extend([job.path, variant])
+        elif job.action == LINK:
+            manifest[job.path] = image_digest(job.path)
+            if os.path.exists(os.path.join(directory, variant)):
+                manifest[variant] = file_digest(os.path.join(directory, variant))
+            scope.extend([job.path, variant])
+            sources.extend([job.source, prerendered_name(job.source)])
+        else:
+            if job.action == RENAME:
+                renames.append((job.source, job.path))
+            else:
+                # Removed first, so files the host hardlinked to it keep their content
+                remove.append(job.path)
+                names.append(job.path)
+            remove.append(variant)
+            if os.path.exists(os.path.join(directory, variant)):
+                names.append(variant)
+    if names or remove or renames:
+        push_files(DEFAULT_POOL, user, host, directory, names, remote_directory, remove,
+                   renames)
+    if manifest:
+        reconcile(DEFAULT_POOL, user, host, directory, remote_directory, manifest, scope,
+                  sources, verify=verifier(manifest))
+    reconcile_groups(user, host, [job.path.rstrip('/') for job in jobs
+                                  if job.action == RECONCILE])
+
+def save_images(group, digests, forwarded=(), part_name=None):
+    """Links uploaded images into a group, pre-renders them and queues them to be
+    copied to the remote hosts.
+
+    Parameters:
+        group (str): The group the images were uploaded to
+        digests (dict): The hex SHA-256 hash each image is stored under in the blob
+            store, by file name
+        forwarded (list): The hosts which were already sent the whole of the only image
+            while it was uploaded in chunks, as part_name
+        part_name (str): The name the image was forwarded under while it was uploaded,
+            which is renamed into place on the hosts it was forwarded to in full and
+            removed from the others
+    """
+    save_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER + "/" + group
+    store = get_blob_store()
+    replaced = get_image_index().entries(save_path)
+    for filename, digest in digests.items():
+        store.link(digest, os.path.join(save_path, filename))
+        if filename in replaced:
+            store.release(replaced[filename]['sha256'])
+    DIRECTORY_CACHE.invalidate(save_path)
+    get_image_index().refresh_images(save_path, digests)
+    if APP.config['PRERENDER_IMAGES']:
+        with ThreadPoolExecutor(BATCH_WORKERS, thread_name_prefix='prerender') as executor:
+            list(executor.map(lambda filename: prerender_stimulus(
+                os.path.dirname(save_path), f'{group}/{filename}',
+                APP.config['MONITOR_RESOLUTION']), digests))
+    part_path = f'{group}/{part_name}' if part_name else None
+    jobs = [Job(PUSH, f'{group}/{filename}', part_path) for filename in digests]
+    hosts = [host for host in APP.config['REMOTE_HOSTS'] if host not in forwarded]
+    get_sync_queue().enqueue(jobs, hosts)
+    if forwarded:
+        get_sync_queue().enqueue([Job(RENAME, f'{group}/{filename}', part_path)
+                                  for filename in digests], forwarded)
+    for filename, digest in digests.items():
+        get_thumbnail_pipeline().submit(os.path.join(save_path, filename), digest)
+
+@APP.route('/<group>/image', methods=['POST'])
+def upload_image(group):
+    """Return string indicating result of image upload request
+
+    **Example request**:
+
+    .. sourcecode::
+
+      POST /image HTTP/1.1
+      Host: 127.0.0.1:5000
+      Content-Type: multipart/form-data; boundary=--------------------------827430006917349763475527
+      Accept-Encoding: gzip, deflate, br
+      Content-Length: 737067
+      Connection: keep-alive
+      ----------------------------827430006917349763475527
+      Content-Disposition: form-data; name="file"; filename="elephant.jpeg"
+
+      <elephant.jpeg>
+      ----------------------------827430006917349763475527--
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: text/html; charset=utf-8
+      Content-Length: 21
+      Server: Werkzeug/0.16.1 Python/3.8.1
+      Date: Thu, 13 Feb 2020 15:35:32 GMT
+
+      {
+          "message":"Success: Image saved."
+      }
+
+    All requests sent to this route should have an image file
+    included in the body of the request, otherwise a 400 error
+    will be returned
+
+    :status 201: file saved
+    :status 400: malformed request
+    """
+
+    response_code = 400
+    response_body = {}
+    file, response = uploaded_file(ALLOWED_IMG_EXTENSIONS)
+    if file:
+        filename = secure_filename(file.filename)
+        digest = get_blob_store().write(file.stream)
+        save_images(group, {filename: digest})
+        response = "Success: Image saved."
+        response_code = 201
+    response_body['message'] = response
+    return  make_response(jsonify(response_body), response_code)
+
+@APP.route('/<group>/<image>/copy', methods=['POST'])
+def copy_image(group, image):
+    """Returns a message indicating whether copying of the specified file was successful
+
+    **Example request**:
+
+    .. sourcecode::
+
+      POST /test1/blank.jpg/copy HTTP/1.1
+      Host: 127.0.0.1
+      Content-Type: multipart/form-data; boundary=--------------------------827430006917349763475527
+      Accept-Encoding: gzip, deflate, br
+      Content-Length: 737067
+      Connection: keep-alive
+      ----------------------------827430006917349763475527
+      Content-Disposition: form-data; name="test2"
+
+      {name: "test2"}
+      ----------------------------827430006917349763475527--
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+      Content-Length: 59
+      Access-Control-Allow-Origin: *
+      Server: Werkzeug/0.16.1 Python/3.8.2
+      Date: Fri, 27 Mar 2020 16:13:42 GMT
+
+      {
+        "message": "File blank.jpg was successfully copied to group 'test2'."
+      }
+
+    :status 200: image file successfully copied
+    :status 400: group with specified name could not be found
+    """
+    response = ""
+    response_code = 400
+    response_body = {}
+    group2 = request.form["name"]
+    old_group = image_path = os.path.dirname(os.path.abspath(__file__)) + \
+      IMAGE_UPLOAD_FOLDER + "/" + group
+    image_path = os.path.dirname(os.path.abspath(__file__)) + \
+      IMAGE_UPLOAD_FOLDER + "/" + group + "/" + image
+    group_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER + "/" + group2
+    print(image_path, file=sys.stderr)
+    if group_exists(group2):
+        if os.path.isfile(image_path):
+            entry = get_image_index().entries(old_group).get(image)
+            digest = entry['sha256'] if entry is not None else file_digest(image_path)
+            replaced = get_image_index().entries(group_path).get(image)
+            # Images stored before the blob store existed join it on their first copy
+            try:
+                get_blob_store().adopt(image_path, digest)
+            except BlobCorruptedError as error:
+                return make_response(jsonify({'message': f"Error: {error}"}), 500)
+            get_blob_store().link(digest, os.path.join(group_path, image))
+            if replaced is not None:
+                get_blob_store().release(replaced['sha256'])
+            copy_prerendered(os.path.dirname(group_path), f'{group}/{image}', f'{group2}/{image}')
+            DIRECTORY_CACHE.invalidate(group_path)
+            get_image_index().refresh(group_path, image, digest)
+            # Hosts which already hold the image hardlink it, only the others are sent it
+            get_sync_queue().enqueue([Job(LINK, f'{group2}/{image}', f'{group}/{image}')])
+            get_thumbnail_pipeline().submit(os.path.join(group_path, image), digest)
+            response = "File " + image + " was successfully copied to group '" + 	group2 + "'."
+            response_code = 200
+        else:
+            response = "Error with request: " + image + " does not exist"
+    else:
+        response = "Error with request: " + group2 + " is not an existing directory"
+    response_body['message'] = response
+    return  make_response(jsonify(response_body), response_code)
+
+@APP.route('/image/<group>/<filename>', methods=['DELETE'])
+def delete_image(group, filename):
+    """Returns a message indicating whether deletion of the specified file was successful
+
+    **Example request**:
+
+    .. sourcecode::
+
+      DELETE /image/group-name/blank.jpg HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+      Content-Length: 59
+      Access-Control-Allow-Origin: *
+      Server: Werkzeug/0.16.1 Python/3.8.2
+      Date: Fri, 27 Mar 2020 16:13:42 GMT
+
+      {
+        "message": "File blank.jpg was successfully deleted."
+      }
+
+    :status 200: image file successfully deleted
+    :status 400: file with specified name could not be found
+    """
+    image_directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER + "/" + group
+    if not os.path.isdir(image_directory):
+        return make_response(jsonify({'message': f"Group {group} does not exist"}), 400)
+    if filename not in os.listdir(image_directory):
+        message = f"File {filename} does not exist and so couldn't be deleted."
+        return make_response(jsonify({'message': message}), 400)
+    entry = get_image_index().entries(image_directory).get(filename)
+    try:
+        os.remove(os.path.join(image_directory, filename))
+    except IsADirectoryError:
+        message = f"{filename} exists, but is a directory and not a file. Deletion failed."
+        return make_response(jsonify({'message': message}), 400)
+    if entry is not None:
+        get_blob_store().release(entry['sha256'])
+    remove_prerendered(os.path.dirname(image_directory), f'{group}/{filename}')
+    DIRECTORY_CACHE.invalidate(image_directory)
+    get_image_index().refresh(image_directory, filename)
+    get_sync_queue().enqueue([Job(DELETE, f'{group}/{filename}')])
+    return make_response(jsonify({'message': f"File {filename} was successfully deleted."}), 200)
+
+def image_metadata(entry, name, file_request_path):
+    """Returns the metadata of an image listed with metadata, from its index entry."""
+    return dict(entry, name=name, url=file_request_path + name,
+                modified=str(datetime.fromtimestamp(entry['modified'] / 1e9)))
+
+def variant_urls(images_path, page):
+    """Returns the URLs of the thumbnail and preview of each image on a page of a listing,
+    or None for those not rendered yet, whose rendering is started.
+
+    Parameters:
+        images_path (str): The group directory
+        page (ImagePage): The page of images, with their index entries
+    """
+    variant_path = request.base_url[:request.base_url.rfind('/')] + THUMBNAIL_FOLDER + '/'
+    pipeline = get_thumbnail_pipeline()
+    urls = {}
+    for variant, key in (('thumbnail', 'thumbnails'), ('preview', 'previews')):
+        urls[key] = []
+        for name in page.names:
+            rendered = pipeline.variant(os.path.join(images_path, name),
+                                        page.images[name]['sha256'], variant)
+            urls[key].append(rendered and variant_path + rendered)
+    return urls
+
+@APP.route('/<group>', methods=['GET'])
+def list_images(group):
+    """Returns a list of images from the images directory
+
+    Without query parameters every image is listed by name. Large groups can be listed
+    a page at a time: ``limit`` sets the page size, and the ``next_cursor`` of a page is
+    passed as ``cursor`` to get the next one. ``prefix`` only lists images whose name
+    starts with it, ``sort`` orders them by ``name``, ``size`` or ``modified`` time and
+    ``order`` is ``asc`` or ``desc``. With ``metadata=true`` each image is described by
+    an object with its size, modification time, dimensions and SHA-256 hash, read from
+    the group's image index. With ``thumbnails=true`` the response also has
+    ``thumbnails`` and ``previews`` lists, giving for each file the URL of a small
+    thumbnail and of a screen sized preview, or null while it is still being rendered.
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /image HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json; charset=utf-8
+      Content-Length: 212
+      Server: Werkzeug/0.16.1 Python/3.8.1
+      Date: Thu, 13 Feb 2020 15:35:32 GMT
+
+      {
+        "files": [
+          "http://localhost/static/img/allBlack.png",
+          "http://localhost/static/img/whiteStimuli.png"
+        ],
+        "next_cursor": null
+      }
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /Fixations?limit=1&sort=size&order=desc&metadata=true HTTP/1.1
+      Host: 127.0.0.1
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json; charset=utf-8
+
+      {
+        "files": [
+          {
+            "height": 1080,
+            "modified": "2020-03-17 04:26:02.085651",
+            "name": "allBlack.png",
+            "sha256": "5f70bf18a086007016e948b04aed3b82103a36bea41755b6cddfaf10ace3c6ef",
+            "size": 5630,
+            "url": "http://localhost/static/img/Fixations/allBlack.png",
+            "width": 1920
+          }
+        ],
+        "next_cursor": "WzU2MzAsICJhbGxCbGFjay5wbmciXQ"
+      }
+
+    :status 200: image file list successfully returned
+    :status 304: list unchanged since the ETag given in If-None-Match
+    :status 400: malformed query parameter or cursor
+    """
+    resource_route = "/static/img/" + group + "/"
+    file_request_path = request.base_url[:request.base_url.rfind('/')] + resource_route
+    path_to_current_file = os.path.dirname(os.path.abspath(__file__))
+    images_path = os.path.join(path_to_current_file, 'static', 'img', group)
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+    metadata = flag_argument('metadata')
+    thumbnails = flag_argument('thumbnails')
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        limit = 0
+    if sort not in IMAGE_SORTS or order not in ('asc', 'desc') \
+            or (limit is not None and not 1 <= limit <= MAX_PAGE_SIZE):
+        return make_response(jsonify({
+            'message': f'sort must be one of {", ".join(IMAGE_SORTS)}, order asc or desc '
+                       f'and limit between 1 and {MAX_PAGE_SIZE}'
+        }), 400)
+    try:
+        page = get_image_index().page(
+            images_path, sort=sort, prefix=request.args.get('prefix', ''), limit=limit,
+            cursor=request.args.get('cursor'), descending=order == 'desc',
+            metadata=metadata or thumbnails)
+    except ValueError:
+        return make_response(jsonify({'message': 'Invalid cursor'}), 400)
+    if metadata:
+        files = [image_metadata(page.images[name], name, file_request_path)
+                 for name in page.names]
+    else:
+        files = [file_request_path + name for name in page.names]
+    body = {'files': files, 'next_cursor': page.next_cursor}
+    if thumbnails:
+        body.update(variant_urls(images_path, page))
+    # Variants appear once rendered, without the listing changing
+    etag_source = request.url + json.dumps([body.get('thumbnails'), body.get('previews')])
+    etag = f'{page.etag}-{zlib.crc32(etag_source.encode()):08x}'
+    return listing_response(body, etag)
+
+def allowed_group(name):
+    """Determines whether a group exists in the directory already"""
+    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+    return not DIRECTORY_CACHE.contains(directory, name)
+
+def group_exists(name):
+    """Determines whether a group exists. Hidden directories of the image directory,
+    such as the blob store, are not groups."""
+    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+    return not name.startswith('.') and DIRECTORY_CACHE.contains(directory, name)
+
+def group_manifest(group):
+    """Returns the hash of every image in a group and of their pre-rendered variants.
+
+    Parameters:
+        group (str): The name of the group
+
+    Returns:
+        dict: The hex SHA-256 hash of each file, by path relative to the image directory
+    """
+    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+    manifest = {}
+    for name, entry in get_image_index().entries(os.path.join(directory, group)).items():
+        manifest[f'{group}/{name}'] = entry['sha256']
+        variant = prerendered_name(f'{group}/{name}')
+        if os.path.exists(os.path.join(directory, variant)):
+            manifest[variant] = file_digest(os.path.join(directory, variant))
+    return manifest
+
+def reconcile_groups(user, host, groups):
+    """Brings groups up to date on a remote host, for the reconcile jobs of the sync queue.
+
+    The host is sent only the files it is missing or holds a different version of,
+    hardlinks files it already holds elsewhere, and removes files no longer in the
+    groups. Groups deleted since the jobs were queued are skipped.
+
+    Parameters:
+        user (str): The user to log in to the host as
+        host (str): The address of the host
+        groups (list): The names of the groups
+
+    Raises:
+        CalledProcessError: If the host cannot be reached or the changes fail
+        BlobCorruptedError: If an image to be sent is damaged
+    """
+    groups = [group for group in groups if group_exists(group)]
+    if not groups:
+        return
+    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+    manifest = {}
+    for group in groups:
+        manifest.update(group_manifest(group))
+    counts = reconcile(DEFAULT_POOL, user, host, directory, APP.config['REMOTE_IMAGE_DIRECTORY'],
+                       manifest, groups + [prerendered_group(group) for group in groups],
+                       directories=groups, verify=verifier(manifest))
+    LOGGER.info('Synced %d groups to %s: %s', len(groups), host, counts)
+
+def sync_response(groups):
+    """Queues a job bringing each of the groups up to date on every remote host, and
+    returns the response pointing to the status of the sync queue.
+
+    Parameters:
+        groups (list): The names of the groups
+    """
+    get_sync_queue().enqueue([Job(RECONCILE, f'{group}/') for group in groups])
+    response = make_response(jsonify({
+        'message': f"Queued the sync of {len(groups)} groups to hosts.",
+        'status': url_for('sync_status')
+    }), 202)
+    response.headers['Location'] = url_for('sync_status')
+    return response
+
+@APP.route('/groups/sync', methods=['POST'])
+def sync_groups():
+    """Brings every group up to date on the remote hosts in the background
+
+    Each host is compared with the hash of every image, and sent only the images it
+    is missing or holds a different version of, such as after a monitor pi was
+    re-imaged. Images a host holds in another group are hardlinked rather than sent,
+    and images no longer in a group are removed. A reconcile job is queued for every
+    group and host, which ``/sync`` reports until it is done, retrying hosts which
+    cannot be reached.
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 202 ACCEPTED
+      Content-Type: application/json
+      Location: http://localhost/sync
+
+      {
+        "message": "Queued the sync of 3 groups to hosts.",
+        "status": "/sync"
+      }
+
+    :status 202: the sync was queued
+    """
+    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+    return sync_response([name for name in DIRECTORY_CACHE.listing(directory).directories
+                          if not name.startswith('.')])
+
+@APP.route('/groups/<name>/sync', methods=['POST'])
+def sync_group(name):
+    """Brings a group up to date on the remote hosts in the background, as
+    ``/groups/sync`` does for every group
+
+    :status 202: the sync was queued
+    :status 404: no group with the given name
+    """
+    if not group_exists(name):
+        return make_response(jsonify({'message': f"Group {name} does not exist"}), 404)
+    return sync_response([name])
+
+@APP.route('/sync', methods=['GET'])
+def sync_status():
+    """Returns the changes queued for each remote host
+
+    Images and groups are changed on the remote hosts in the background. Jobs which
+    failed are retried with a delay which doubles with each failure of their host, and
+    a job queued for an image or group replaces the job already queued for it.
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "hosts": {
+          "192.168.0.11": {
+            "error": null, "failed": [], "failures": 0, "pending": [], "retry_at": null
+          },
+          "192.168.0.12": {
+            "error": "exit status 255",
+            "failed": [
+              {
+                "action": "push",
+                "attempts": 2,
+                "path": "test1/elephant.jpeg",
+                "queued": "2020-03-17 05:15:06.558356"
+              }
+            ],
+            "failures": 2,
+            "pending": [
+              {
+                "action": "delete",
+                "attempts": 0,
+                "path": "test1/blank.jpg",
+                "queued": "2020-03-17 05:15:09.102733"
+              }
+            ],
+            "retry_at": "2020-03-17 05:15:16.558356"
+          }
+        }
+      }
+
+    :status 200: queue status successfully returned
+    """
+    return make_response(jsonify({'hosts': get_sync_queue().status()}), 200)
+
+@APP.route('/groups', methods=['GET'])
+def list_groups():
+    """Return JSON body with message of all folders in the static/img directory
+
+    Responds 304 Not Modified if the ETag given in If-None-Match is still current."""
+    path_to_current_file = os.path.dirname(os.path.abspath(__file__))
+    images_path = os.path.join(path_to_current_file, 'static', 'img')
+    listing = DIRECTORY_CACHE.listing(images_path)
+    # Hidden directories, such as the blob store, are not groups
+    names = [name for name in listing.directories if not name.startswith('.')]
+    return listing_response({'names': names}, listing.etag)
+
+@APP.route('/groups', methods=['POST'])
+def create_group():
+    """Return JSON body with message indicating result of group creation request"""
+    response = ""
+    response_code = 400
+    response_body = {}
+    if 'name' not in request.form:
+        response = "Error with request: No name field in body of request."
+    else:
+        group_name = request.form['name']
+        if group_name == '':
+            response = "Error with request: Group name must not be empty."
+        elif allowed_group(group_name):
+            filename = secure_filename(group_name)
+            save_path = os.path.dirname(os.path.abspath(__file__))+IMAGE_UPLOAD_FOLDER
+            folder = os.path.join(save_path, filename)
+            os.makedirs(folder)
+            DIRECTORY_CACHE.invalidate(save_path)
+            get_sync_queue().enqueue([Job(CREATE, filename)])
+            response = "Success: Group created."
+            response_code = 201
+        else:
+            response = "Error with request: Group already exists."
+    response_body['message'] = response
+    return make_response(jsonify(response_body), response_code)
+
+
+@APP.route('/groups/<name>', methods=['DELETE'])
+def delete_group(name):
+    """Return JSON body with message indicating result of group deletion request"""
+    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
+    response_code = 400
+    response = ""
+    response_body = {}
+    if name != "Fixations":
+        if group_exists(name):
+            try:
+                shutil.rmtree(os.path.join(directory, name))
+                remove_prerendered_group(directory, name)
+                get_blob_store().collect()
+                DIRECTORY_CACHE.invalidate(directory)
+                get_image_index().forget(os.path.join(directory, name))
+                get_sync_queue().enqueue([Job(REMOVE, name)])
+                response = f"Group {name} was successfully deleted."
+                response_code = 200
+            except OSError:
+                response = "An error has occurred and the group could not be deleted"
+        else:
+            response = f"Group {name} does not exist and so couldn't be deleted."
+    else:
+        response = "The fixations group cannot be deleted"
+    response_body['message'] = response
+    return make_response(jsonify(response_body), response_code)
@@ -0,0 +1,205 @@
+"""Content-addressed storage of the stimulus images.
+
+Every image is stored once, in the blob directory under its SHA-256 hash, and
+each group holds a hardlink to the blob rather than a copy of it. An image in
+five groups takes the disk space of one, and copying an image to another group
+only creates a link. Since the images in a group are still ordinary files, they
+are served, listed and synced to the pis exactly as before.
+
+Blobs are never written in place: an image replaced under the same name is
+linked to a different blob, so the other groups holding the old image keep it.
+A blob no group links to any more is removed by release or collect.
+
+Images are verified when they are read to be sent on: verify hashes an image
+again and raises BlobCorruptedError if it no longer matches the hash it was
+stored under, so a damaged image is not spread to the pis.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from .image_index import file_digest
+
+BLOB_DIRECTORY = '.blobs'
+_STAGING_PREFIX = '.staging-'
+# Size of the blocks streams are read in
+_BLOCK_SIZE = 64 * 1024
+
+
+class BlobCorruptedError(OSError):
+    """Raised when an image no longer matches the hash it was stored under."""
+
+
+class BlobStore:
+    """Stores files once by their SHA-256 hash, linking them into the groups.
+
+    Parameters:
+        directory (str): The directory holding the blobs, which must be on the same
+            file system as the groups
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def blob_path(self, digest):
+        """Returns the path of a blob.
+
+        Parameters:
+            digest (str): The hex SHA-256 hash of the blob
+
+        Returns:
+            str: The path, in a subdirectory named by the first two characters of the
+            hash so no directory grows too large
+        """
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def staging_path(self):
+        """Returns a new empty file in the store to write an incoming file to, before
+        it is added with add.
+
+        Returns:
+            str: The path of the file
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, path = tempfile.mkstemp(prefix=_STAGING_PREFIX, dir=self.directory)
+        os.close(descriptor)
+        return path
+
+    def add(self, path, digest=None):
+        """Moves a file into the store, unless the store already holds its content.
+
+        Parameters:
+            path (str): The path of the file, on the same file system as the store
+            digest (str): The hex SHA-256 hash of the file, if already known
+
+        Returns:
+            str: The hex SHA-256 hash of the file
+        """
+        if digest is None:
+            digest = file_digest(path)
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(path, blob)
+        return digest
+
+    def write(self, stream):
+        """Adds the content of a stream to the store, hashing it as it is written.
+
+        Parameters:
+            stream (file): The stream to read the content from, in binary mode
+
+        Returns:
+            str: The hex SHA-256 hash of the content
+        """
+        path = self.staging_path()
+        digest = hashlib.sha256()
+        try:
+            with open(path, 'wb') as staging_file:
+                for block in iter(lambda: stream.read(_BLOCK_SIZE), b''):
+                    staging_file.write(block)
+                    digest.update(block)
+        except BaseException:
+            os.remove(path)
+            raise
+        return self.add(path, digest.hexdigest())
+
+    def adopt(self, path, digest):
+        """Makes a file stored outside of the store, such as an image uploaded before
+        the store existed, a link to the blob of its content.
+
+        Parameters:
+            path (str): The path of the file
+            digest (str): The hex SHA-256 hash of the file
+
+        Raises:
+            BlobCorruptedError: If the file does not match the hash, which may come from
+                an index entry older than the file
+        """
+        blob = self.blob_path(digest)
+        if os.path.exists(blob) and os.path.samefile(path, blob):
+            return
+        self.verify(path, digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.link(path, blob)
+            return
+        self.link(digest, path)
+
+    def link(self, digest, target):
+        """Links a blob into a group, replacing any file of the same name.
+
+        Parameters:
+            digest (str): The hex SHA-256 hash of the blob
+            target (str): The path to link the blob to
+
+        Raises:
+            FileNotFoundError: If the store holds no blob with the hash
+        """
+        blob = self.blob_path(digest)
+        # Renaming a link over another link to the same file would do nothing
+        if os.path.exists(target) and os.path.samefile(blob, target):
+            return
+        directory, name = os.path.split(target)
+        # Linked under a hidden name first, as a link cannot replace an existing file
+        temporary_path = os.path.join(directory, f'.{name}.link')
+        try:
+            os.remove(temporary_path)
+        except FileNotFoundError:
+            pass
+        os.link(blob, temporary_path)
+        os.replace(temporary_path, target)
+
+    def release(self, digest):
+        """Removes a blob if no group links to it any more.
+
+        Parameters:
+            digest (str): The hex SHA-256 hash of the blob
+        """
+        blob = self.blob_path(digest)
+        try:
+            if os.stat(blob).st_nlink == 1:
+                os.remove(blob)
+        except FileNotFoundError:
+            pass
+
+    def collect(self):
+        """Removes every blob no group links to any more, such as after a group was
+        deleted.
+
+        Returns:
+            int: The number of blobs removed
+        """
+        removed = 0
+        try:
+            subdirectories = os.scandir(self.directory)
+        except FileNotFoundError:
+            return 0
+        with subdirectories:
+            for subdirectory in subdirectories:
+                if not subdirectory.is_dir() or subdirectory.name.startswith('.'):
+                    continue
+                with os.scandir(subdirectory.path) as blobs:
+                    for blob in blobs:
+                        if blob.stat().st_nlink == 1:
+                            os.remove(blob.path)
+                            removed += 1
+        return removed
+
+    @staticmethod
+    def verify(path, digest):
+        """Checks that a stored image still has the content it was stored with.
+
+        Parameters:
+            path (str): The path of the image
+            digest (str): The hex SHA-256 hash it was stored under
+
+        Raises:
+            BlobCorruptedError: If the image's content has changed
+        """
+        if file_digest(path) != digest:
+            raise BlobCorruptedError(f'{os.path.basename(path)} is damaged, '
+                                     f'it no longer matches its hash {digest}')
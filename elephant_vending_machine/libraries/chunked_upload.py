@@ -0,0 +1,240 @@
+"""Resumable uploads of stimulus images, sent in chunks.
+
+A stimulus can be up to 100MB, which over the lab's Wi-Fi takes a while and may
+fail part way. Instead of one request, an upload is started with the name and
+size of the image and then sent as a series of chunks, each at the offset the
+previous one ended at. When a chunk fails, the client asks for the upload's
+offset and carries on from there, on this or any other server process.
+
+Chunks are streamed to disk in fixed size blocks as they arrive, so memory use
+does not depend on the size of the upload, and hashed on the way, so the hash
+of the image is known as soon as its last chunk arrives. Every upload is kept
+as a partial file and a JSON file describing it, in a directory of their own,
+so uploads survive restarts. Uploads left unfinished for UPLOAD_EXPIRY seconds
+are discarded when the next upload starts.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+UPLOAD_DIRECTORY = '.uploads'
+# Size of the chunks clients are asked to send
+CHUNK_SIZE = 8 * 1024 * 1024
+# Size of the blocks chunks are read and written in
+BLOCK_SIZE = 64 * 1024
+# Number of seconds after which an unfinished upload is discarded
+UPLOAD_EXPIRY = 24 * 60 * 60
+
+
+class UploadError(ValueError):
+    """Raised when a chunk cannot be added to an upload.
+
+    Parameters:
+        message (str): Why the chunk was rejected
+        offset (int): The offset the next chunk of the upload must start at
+    """
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+class UploadConflictError(UploadError):
+    """Raised when a chunk does not start at the end of its upload, or another chunk of
+    the upload is being written, in which case nothing was written."""
+
+
+class UploadStore:
+    """Keeps the uploads in progress in a directory.
+
+    Parameters:
+        directory (str): The directory holding the uploads, which should be on the
+            same file system as the blob store so finished uploads can be moved there
+        expired (function): Called with each upload purge discards, to remove what
+            was kept of it elsewhere
+    """
+
+    def __init__(self, directory, expired=None):
+        self.directory = directory
+        self.expired = expired
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def _metadata_path(self, upload_id):
+        """Returns the path of the JSON file describing an upload."""
+        return os.path.join(self.directory, upload_id + '.json')
+
+    def part_path(self, upload_id):
+        """Returns the path of the partial file of an upload.
+
+        Parameters:
+            upload_id (str): The id of the upload
+
+        Returns:
+            str: The path of the file the chunks are written to
+        """
+        return os.path.join(self.directory, upload_id + '.part')
+
+    def create(self, group, name, size, digest=None):
+        """Starts an upload, discarding any which expired.
+
+        Parameters:
+            group (str): The group the image is uploaded to
+            name (str): The file name of the image
+            size (int): The size of the image in bytes
+            digest (str): The hex SHA-256 hash the image should have, if known
+
+        Returns:
+            dict: The upload, as returned by get
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.purge()
+        upload_id = uuid.uuid4().hex
+        upload = {'upload_id': upload_id, 'group': group, 'name': name, 'size': size,
+                  'sha256': digest, 'created': time.time()}
+        with open(self.part_path(upload_id), 'xb'):
+            pass
+        with open(self._metadata_path(upload_id), 'w') as metadata_file:
+            json.dump(upload, metadata_file)
+        upload['offset'] = 0
+        return upload
+
+    def get(self, upload_id):
+        """Returns an upload.
+
+        Parameters:
+            upload_id (str): The id of the upload
+
+        Returns:
+            dict: The group, name and size of the upload, its expected hash if given,
+            the time it was created and the offset the next chunk must start at, or
+            None if there is no such upload
+        """
+        # The id names files, so must not reach outside of the directory
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self._metadata_path(upload_id)) as metadata_file:
+                upload = json.load(metadata_file)
+            upload['offset'] = os.path.getsize(self.part_path(upload_id))
+        except (FileNotFoundError, ValueError):
+            return None
+        return upload
+
+    def _hash(self, upload_id, part_file, offset):
+        """Returns the hash of the first offset bytes of an upload, carrying on from
+        the hash of the previous chunk when this process received it."""
+        with self._lock:
+            cached = self._hashes.pop(upload_id, None)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        digest = hashlib.sha256()
+        part_file.seek(0)
+        remaining = offset
+        while remaining:
+            block = part_file.read(min(BLOCK_SIZE, remaining))
+            digest.update(block)
+            remaining -= len(block)
+        return digest
+
+    def write(self, upload_id, offset, stream):
+        """Appends a chunk to an upload, reading it from a stream in blocks.
+
+        If the stream breaks off, the part of the chunk received so far is kept, and
+        the upload carries on from there.
+
+        Parameters:
+            upload_id (str): The id of the upload
+            offset (int): The offset the chunk starts at
+            stream (file): The stream to read the chunk from
+
+        Returns:
+            tuple: The offset the next chunk must start at, and the hex SHA-256 hash of
+            the image once every chunk has been received, otherwise None
+
+        Raises:
+            UploadConflictError: If the chunk does not start at the end of the upload, or
+                another chunk is being written
+            UploadError: If the chunk would make the upload larger than its size, once
+                the part of the chunk which fits was written
+            KeyError: If there is no such upload
+        """
+        upload = self.get(upload_id)
+        if upload is None:
+            raise KeyError(upload_id)
+        try:
+            part_file = open(self.part_path(upload_id), 'r+b')
+        except FileNotFoundError:
+            # The upload was discarded since it was read
+            raise KeyError(upload_id) from None
+        with part_file:
+            try:
+                fcntl.flock(part_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadConflictError('Another chunk of this upload is being received',
+                                          upload['offset']) from None
+            end = os.fstat(part_file.fileno()).st_size
+            if offset != end:
+                raise UploadConflictError(f'Chunk must start at offset {end}', end)
+            digest = self._hash(upload_id, part_file, end)
+            part_file.seek(end)
+            try:
+                for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+                    if end + len(block) > upload['size']:
+                        raise UploadError(f"Upload is larger than its size of {upload['size']}",
+                                          end)
+                    part_file.write(block)
+                    digest.update(block)
+                    end += len(block)
+            finally:
+                part_file.flush()
+                with self._lock:
+                    self._hashes[upload_id] = (end, digest)
+        return end, digest.hexdigest() if end == upload['size'] else None
+
+    def discard(self, upload_id):
+        """Removes an upload and its partial file, if it still has one.
+
+        Parameters:
+            upload_id (str): The id of the upload
+        """
+        with self._lock:
+            self._hashes.pop(upload_id, None)
+        for path in (self.part_path(upload_id), self._metadata_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def purge(self, expiry=UPLOAD_EXPIRY):
+        """Discards every upload started more than expiry seconds ago, calling expired
+        with each of them.
+
+        Parameters:
+            expiry (float): The number of seconds after which an upload expires
+
+        Returns:
+            list: The ids of the discarded uploads
+        """
+        expired = []
+        deadline = time.time() - expiry
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return expired
+        for name in names:
+            upload_id, extension = os.path.splitext(name)
+            if extension != '.json':
+                continue
+            upload = self.get(upload_id)
+            if upload is not None and upload['created'] < deadline:
+                self.discard(upload_id)
+                expired.append(upload_id)
+                if self.expired is not None:
+                    self.expired(upload)
+        return expired
@@ -0,0 +1,121 @@
+"""Cache of directory listings for the static directories.
+
+Listing a directory is cached until its modification time changes, so a
+cached listing costs a single stat call. Each listing has an ETag derived
+from its contents, which the listing routes use to answer conditional
+requests with 304 Not Modified.
+
+Directory modification times only have the resolution of the kernel clock,
+so two changes a few milliseconds apart may leave the same time. A listing is
+therefore only cached once the directory has not changed for RACY_WINDOW
+seconds, and until then every request scans the directory again.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+# Number of seconds a directory must be unchanged before its listing is cached
+RACY_WINDOW = 1
+
+DirectoryListing = namedtuple('DirectoryListing', ['names', 'files', 'directories', 'etag'])
+DirectoryListing.__doc__ = """The contents of a directory.
+
+Attributes:
+    names (frozenset): The name of every entry
+    files (tuple): The names of the regular files, sorted
+    directories (tuple): The names of the subdirectories, sorted
+    etag (str): Changes whenever an entry is added, removed or changes type
+"""
+
+
+def scan_directory(path):
+    """Lists a directory with a single scandir, without a stat call per entry.
+
+    Parameters:
+        path (str): The directory to list
+
+    Returns:
+        DirectoryListing: The contents of the directory
+    """
+    files = []
+    directories = []
+    names = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            names.append(entry.name)
+            if entry.is_dir():
+                directories.append(entry.name)
+            elif entry.is_file():
+                files.append(entry.name)
+    files.sort()
+    directories.sort()
+    digest = hashlib.sha1()
+    for name in files:
+        digest.update(b'f' + name.encode(errors='surrogateescape') + b'\0')
+    for name in directories:
+        digest.update(b'd' + name.encode(errors='surrogateescape') + b'\0')
+    return DirectoryListing(frozenset(names), tuple(files), tuple(directories),
+                            digest.hexdigest())
+
+
+class DirectoryCache:
+    """Caches directory listings, revalidating them against each directory's
+    modification time.
+
+    Parameters:
+        racy_window (float): The number of seconds a directory must be unchanged before
+            its listing is cached
+    """
+
+    def __init__(self, racy_window=RACY_WINDOW):
+        self.racy_window = racy_window
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def listing(self, path):
+        """Returns the contents of a directory, scanning it only if it has changed.
+
+        Parameters:
+            path (str): The directory to list
+
+        Returns:
+            DirectoryListing: The contents of the directory
+
+        Raises:
+            FileNotFoundError: If the directory does not exist
+        """
+        path = os.path.normpath(path)
+        status = os.stat(path)
+        modified = status.st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(path)
+        if cached is not None and cached[0] == modified:
+            return cached[1]
+        listing = scan_directory(path)
+        with self._lock:
+            if time.time() - status.st_mtime > self.racy_window:
+                self._listings[path] = (modified, listing)
+            else:
+                self._listings.pop(path, None)
+        return listing
+
+    def contains(self, path, name):
+        """Returns whether a directory has an entry with the given name.
+
+        Parameters:
+            path (str): The directory to look in
+            name (str): The name of the entry
+        """
+        return name in self.listing(path).names
+
+    def invalidate(self, path):
+        """Forgets the cached listing of a directory, so it is scanned on next use.
+
+        Parameters:
+            path (str): The directory which has changed
+        """
+        with self._lock:
+            self._listings.pop(os.path.normpath(path), None)
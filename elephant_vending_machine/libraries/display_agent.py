@@ -0,0 +1,319 @@
+"""Client for the display agents running on the monitor pis.
+
+Each monitor pi runs display_agent.py, a small daemon which keeps preloaded
+stimuli in memory and swaps between them on request. The backend preloads a
+set of images ahead of time, then flips every screen to it with one short
+message per pi, instead of starting feh over ssh for every stimulus change.
+
+Messages are single lines of JSON sent over a TCP connection which is kept
+open between requests. Every request receives exactly one JSON line in reply.
+
+For synchronized onsets the backend estimates the offset between its clock and
+each pi's clock, then arms every agent to flip at the same instant and collects
+the time each screen actually changed.
+
+This module also provides LocalDisplayAgent, an in-process stand-in for the
+agent which speaks the same protocol, for use when no pis are available.
+"""
+
+import json
+import socket
+import socketserver
+import threading
+import time
+
+DEFAULT_AGENT_PORT = 5005
+# Number of time requests used to estimate the clock offset to each agent
+OFFSET_SAMPLES = 8
+# Number of seconds after which clock offsets are estimated again, to follow drift
+OFFSET_MAX_AGE = 60
+
+
+class DisplayAgentError(Exception):
+    """Raised when a display agent rejects a request or cannot be reached."""
+
+
+def split_address(address, default_port=DEFAULT_AGENT_PORT):
+    """Splits an address of the form host or host:port.
+
+    Parameters:
+        address (str): The address to split
+        default_port (int): The port used if the address does not include one
+
+    Returns:
+        tuple: The host and the port as an int
+    """
+    host, _, port = address.partition(':')
+    return host, int(port) if port else default_port
+
+
+# The connections and clock offsets are kept next to the connection settings
+# pylint: disable=too-many-instance-attributes
+class DisplayAgentClient:
+    """Keeps a connection open to the display agent on each monitor pi.
+
+    Requests to all agents are written before any reply is read, so the pis act
+    on them at nearly the same time. flip_synchronized goes further, arming every
+    agent to flip at the same instant on its own clock.
+
+    Parameters:
+        addresses (list): The addresses of the pis, optionally including a port
+        port (int): The port the agents listen on, if not part of the address
+        timeout (float): The number of seconds to wait for an agent to reply
+    """
+
+    def __init__(self, addresses, port=DEFAULT_AGENT_PORT, timeout=5):
+        self.addresses = addresses
+        self.port = port
+        self.timeout = timeout
+        self._connections = {}
+        self._next_set = 0
+        self._lock = threading.Lock()
+        self.offsets = {}
+        self._offsets_estimated = None
+
+    def _connection(self, address):
+        """Returns the open socket and reader for an agent, connecting if necessary."""
+        if address not in self._connections:
+            try:
+                sock = socket.create_connection(split_address(address, self.port), self.timeout)
+            except OSError as error:
+                raise DisplayAgentError(f'Could not connect to display agent at {address}') \
+                    from error
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connections[address] = (sock, sock.makefile('rb'))
+        return self._connections[address]
+
+    def request_all(self, messages):
+        """Sends one message to each agent and waits for all of the replies.
+
+        Parameters:
+            messages (list[dict]): The message for each agent, in the same order as addresses
+
+        Returns:
+            list[dict]: The reply from each agent, in the same order as addresses
+
+        Raises:
+            DisplayAgentError: If an agent cannot be reached or reports an error
+        """
+        with self._lock:
+            try:
+                for address, message in zip(self.addresses, messages):
+                    self._send(address, message)
+                replies = [self._receive(address) for address in self.addresses]
+            except (OSError, ValueError) as error:
+                self.close()
+                raise DisplayAgentError(f'Display agent request failed: {error}') from error
+        for address, reply in zip(self.addresses, replies):
+            if not reply.get('ok'):
+                raise DisplayAgentError(f'Display agent at {address} failed: '
+                                        f'''{reply.get('error')}''')
+        return replies
+
+    def _send(self, address, message):
+        """Writes a message to an agent."""
+        sock, _ = self._connection(address)
+        sock.sendall(json.dumps(message).encode() + b'\n')
+
+    def _receive(self, address):
+        """Reads the next reply from an agent."""
+        _, reader = self._connection(address)
+        line = reader.readline()
+        if not line:
+            raise DisplayAgentError(f'Display agent at {address} closed the connection')
+        return json.loads(line)
+
+    def estimate_offsets(self, samples=OFFSET_SAMPLES):
+        """Estimates the offset of each agent's clock from the local clock.
+
+        Each agent is asked for its time several times, and the sample with the shortest
+        round trip is kept, assuming the agent read its clock halfway through the trip.
+
+        Parameters:
+            samples (int): The number of time requests sent to each agent
+
+        Returns:
+            dict: For each address, the offset in seconds to add to a local time to get
+            the agent's time, and the round trip time in seconds of the sample used
+        """
+        offsets = {}
+        with self._lock:
+            try:
+                for address in self.addresses:
+                    best_trip = None
+                    for _ in range(samples):
+                        sent = time.time()
+                        self._send(address, {'op': 'time'})
+                        remote_time = self._receive(address)['time']
+                        received = time.time()
+                        if best_trip is None or received - sent < best_trip:
+                            best_trip = received - sent
+                            offsets[address] = (remote_time - (sent + received) / 2, best_trip)
+            except (OSError, ValueError, KeyError) as error:
+                self.close()
+                raise DisplayAgentError(f'Clock offset estimation failed: {error}') from error
+        self.offsets = offsets
+        self._offsets_estimated = time.monotonic()
+        return offsets
+
+    def flip_synchronized(self, set_id, lead=0.02):
+        """Displays a preloaded set on every screen at the same instant.
+
+        Every agent is armed to flip at a common target time, converted to its own clock,
+        and replies with the time its screen actually changed.
+
+        Parameters:
+            set_id (int): The identifier returned by preload
+            lead (float): The number of seconds between sending the request and the onset,
+                raised if needed to twice the longest round trip to an agent
+
+        Returns:
+            dict: The target onset time, the measured onset time of each screen, both as
+            local unix times, and the skew in milliseconds between the first and last screen
+        """
+        if self._offsets_estimated is None \
+                or time.monotonic() - self._offsets_estimated > OFFSET_MAX_AGE:
+            self.estimate_offsets()
+        longest_trip = max(round_trip for _, round_trip in self.offsets.values())
+        target = time.time() + max(lead, 2 * longest_trip)
+        replies = self.request_all([
+            {'op': 'arm', 'set': set_id, 'at': target + self.offsets[address][0]}
+            for address in self.addresses])
+        onsets = [reply['shown'] - self.offsets[address][0]
+                  for address, reply in zip(self.addresses, replies)]
+        return {'target': target, 'onsets': onsets, 'skew_ms': (max(onsets) - min(onsets)) * 1000}
+
+    def preload(self, images, fallbacks=None):
+        """Preloads a set of images, one per agent, without displaying them.
+
+        Parameters:
+            images (list[str]): The remote path of the image for each agent
+            fallbacks (list[str]): If given, the remote path of the image each agent
+                loads instead if its image does not exist
+
+        Returns:
+            int: The identifier of the preloaded set, to be passed to flip
+        """
+        with self._lock:
+            self._next_set += 1
+            set_id = self._next_set
+        messages = [{'op': 'preload', 'set': set_id, 'image': image} for image in images]
+        if fallbacks is not None:
+            for message, fallback in zip(messages, fallbacks):
+                if fallback != message['image']:
+                    message['fallback'] = fallback
+        self.request_all(messages)
+        return set_id
+
+    def flip(self, set_id):
+        """Displays a previously preloaded set on every screen.
+
+        Parameters:
+            set_id (int): The identifier returned by preload
+
+        Returns:
+            list[dict]: The reply from each agent, including the time the image was shown
+        """
+        return self.request_all([{'op': 'flip', 'set': set_id}] * len(self.addresses))
+
+    def discard(self, set_id):
+        """Frees a preloaded set on every agent.
+
+        Parameters:
+            set_id (int): The identifier returned by preload
+        """
+        self.request_all([{'op': 'discard', 'set': set_id}] * len(self.addresses))
+
+    def close(self):
+        """Closes the connections to all agents."""
+        for sock, reader in self._connections.values():
+            reader.close()
+            sock.close()
+        self._connections = {}
+        self._offsets_estimated = None
+
+
+class _AgentRequestHandler(socketserver.StreamRequestHandler):
+    """Handles the connection from a DisplayAgentClient to a LocalDisplayAgent."""
+
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        for line in self.rfile:
+            reply = self.server.agent.handle_message(json.loads(line))
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+class _AgentServer(socketserver.ThreadingTCPServer):
+    """TCP server for a LocalDisplayAgent."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalDisplayAgent:
+    """Stand-in for display_agent.py which records what would have been displayed.
+
+    Parameters:
+        host (str): The address to listen on
+        port (int): The port to listen on, 0 picks a free port
+        clock_offset (float): The number of seconds the simulated pi clock is ahead of
+            the local clock
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, clock_offset=0):
+        self.clock_offset = clock_offset
+        self.preloaded = {}
+        self.shown = []
+        self._server = _AgentServer((host, port), _AgentRequestHandler)
+        self._server.agent = self
+        self.address = f'{host}:{self._server.server_address[1]}'
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05}, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Starts serving requests in a background thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stops serving requests."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Each protocol operation returns its own reply
+    # pylint: disable=too-many-return-statements
+    def handle_message(self, message):
+        """Applies a single protocol message and returns the reply.
+
+        Parameters:
+            message (dict): The decoded request
+
+        Returns:
+            dict: The reply to send to the client
+        """
+        operation = message.get('op')
+        if operation == 'preload':
+            self.preloaded[message['set']] = message['image']
+            return {'ok': True}
+        if operation in ('flip', 'arm'):
+            if message['set'] not in self.preloaded:
+                return {'ok': False, 'error': f'''Set {message['set']} is not preloaded'''}
+            if operation == 'arm':
+                time.sleep(max(0, message['at'] - self.clock_offset - time.time()))
+            shown = time.time() + self.clock_offset
+            self.shown.append((message['set'], self.preloaded[message['set']], shown))
+            return {'ok': True, 'shown': shown}
+        if operation == 'discard':
+            self.preloaded.pop(message['set'], None)
+            return {'ok': True}
+        if operation == 'time':
+            return {'ok': True, 'time': time.time() + self.clock_offset}
+        if operation == 'ping':
+            return {'ok': True}
+        return {'ok': False, 'error': f'Unknown operation {operation}'}
@@ -2,14 +2,37 @@
 
 This module contains functionality required to create a custom logger
 which writes messages and the corresponding UTC timestamp to csv files.
+
+Records are written by a background thread, so logging a message from an
+experiment only queues the record. The writer formats records in batches and
+flushes them to the file every BATCH_SIZE records or FLUSH_INTERVAL
+milliseconds, whichever comes first.
 """
 
 import csv
+import fcntl
 import io
 import logging
-from logging import FileHandler
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 
+from . import trial_log
+
+LOG_DIRECTORY = 'elephant_vending_machine/static/log/'
+# Maximum number of experiment loggers with open log files at once
+MAX_OPEN_LOGGERS = 16
+# Maximum number of records written to the log file before it is flushed
+BATCH_SIZE = 64
+# Maximum number of milliseconds a record waits before being flushed to the log file
+FLUSH_INTERVAL = 100
+
+# Queued to make the writer thread exit after writing every earlier record
+_STOP = object()
+
 class CsvFormatter(logging.Formatter):
     """Instances of CsvFormatter are used to convert a LogRecord instance to text.
 
@@ -34,42 +57,315 @@ class CsvFormatter(logging.Formatter):
         """ Format the specified record as text formatted for csv file.
 
         The specified record is formatted as csv compatible text containing
-        the current UTC timestamp and the record message.
+        the time the record was created and the record message, followed by any
+        values given in the record's columns attribute, such as trial timings.
 
         Parameters:
             record (LogRecord): The log record to be formatted
 
         Returns:
             str: a string formatted as an entry for a csv file containing
-            current UTC timestamp and record text
+            the record's timestamp and text
         """
 
-        self.writer.writerow([datetime.now(), record.getMessage()])
+        self.writer.writerow([datetime.fromtimestamp(record.created), record.getMessage()]
+                             + getattr(record, 'columns', []))
         data = self.output.getvalue()
         self.output.truncate(0)
         self.output.seek(0)
         return data.strip()
 
-def create_experiment_logger(file_name):
+class FastCsvFormatter(logging.Formatter):
+    """Formats LogRecord instances exactly as CsvFormatter does, without a csv writer.
+
+    Each field is quoted directly, and the date and time of the record's timestamp are
+    cached for the current second, so that only the microseconds are formatted for
+    most records.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._second = None
+        self._prefix = ''
+
+    def format(self, record):
+        """ Format the specified record as text formatted for csv file.
+
+        Parameters:
+            record (LogRecord): The log record to be formatted
+
+        Returns:
+            str: the same text CsvFormatter returns for the record
+        """
+
+        # Split the timestamp as datetime.fromtimestamp does, rounding half to even
+        second = int(record.created)
+        microsecond = round((record.created - second) * 1e6)
+        if microsecond >= 1000000:
+            second += 1
+            microsecond -= 1000000
+        if second != self._second:
+            self._second = second
+            self._prefix = f'"{datetime.fromtimestamp(second)}'
+        message = record.getMessage()
+        if '"' in message:
+            message = message.replace('"', '""')
+        if microsecond:
+            line = f'{self._prefix}.{microsecond:06d}","{message}"'
+        else:
+            line = f'{self._prefix}","{message}"'
+        columns = getattr(record, 'columns', None)
+        if columns:
+            line += ''.join([',"' + _csv_text(column).replace('"', '""') + '"'
+                             for column in columns])
+        return line
+
+
+def _csv_text(value):
+    """Returns the text csv.writer writes for a field value."""
+    return '' if value is None else str(value)
+
+
+class BatchingFileHandler(logging.Handler):
+    """Handler which writes records to a file from a background writer thread.
+
+    emit only puts the record on a queue, so logging does not wait for formatting or
+    disk writes. The writer thread formats queued records and writes them to the file in
+    batches, flushing after batch_size records or flush_interval milliseconds after the
+    first record of a batch was queued. Records keep the time they were created.
+
+    Records are formatted after emit returns, so arguments to a log call should not be
+    modified afterwards.
+
+    The handler holds a shared flock on the file until it is closed, which tells any
+    process that the file is still being written (see log_stream.is_being_written).
+
+    Parameters:
+        file_name (str): The path of the file to append records to
+        batch_size (int): The maximum number of records written before flushing
+        flush_interval (int): The maximum number of milliseconds before queued records
+            are flushed
+    """
+
+    # Whether the file is written as bytes, in which case _encode must return bytes
+    binary = False
+
+    def __init__(self, file_name, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        super().__init__()
+        # Named as on logging.FileHandler, for code locating the file of a handler
+        self.baseFilename = os.path.abspath(file_name)  # pylint: disable=invalid-name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        if self.binary:
+            self._stream = open(self.baseFilename, 'ab')
+        else:
+            self._stream = open(self.baseFilename, 'a', encoding='utf-8')
+        fcntl.flock(self._stream, fcntl.LOCK_SH)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_batches,
+                                        name=f'log-writer-{os.path.basename(file_name)}',
+                                        daemon=True)
+        self._thread.start()
+
+    def emit(self, record):
+        """Queues a record for the writer thread.
+
+        Parameters:
+            record (LogRecord): The record to write
+        """
+        self._queue.put(record)
+
+    def flush(self):
+        """Blocks until every record queued so far has been written and flushed."""
+        if self._thread.is_alive():
+            written = threading.Event()
+            self._queue.put(written)
+            written.wait()
+
+    def close(self):
+        """Writes any queued records, stops the writer thread and closes the file."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if not self._stream.closed:
+            self._stream.close()
+        super().close()
+
+    def _encode(self, record):
+        """Returns the text written to the file for a record."""
+        return self.format(record) + '\n'
+
+    def _write_batches(self):
+        """Writes queued records to the file until the stop marker is received."""
+        lines = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, logging.LogRecord):
+                try:
+                    lines.append(self._encode(item))
+                # Formatting errors are reported the same way as by the standard handlers
+                # pylint: disable=broad-except
+                except Exception:
+                    self.handleError(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval / 1000
+                if len(lines) < self.batch_size:
+                    continue
+            if lines:
+                self._stream.writelines(lines)
+                self._stream.flush()
+                lines = []
+            deadline = None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+
+class TrialLogHandler(BatchingFileHandler):
+    """Handler which writes records to a structured trial log from a background thread.
+
+    A record may carry a trial_events attribute, a list of keyword arguments for
+    trial_log.encode_event without the time, each of which is written as one event.
+    Other records are written as MESSAGE events holding the message, with the trial
+    number taken from the first argument of messages starting with 'Trial %s'.
+
+    Parameters:
+        file_name (str): The path of the trial log to append to
+    """
+
+    binary = True
+
+    def __init__(self, file_name, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        super().__init__(file_name, batch_size, flush_interval)
+        if self._stream.tell() == 0:
+            self._stream.write(trial_log.MAGIC)
+
+    def _encode(self, record):
+        """Returns the trial log records written for a log record."""
+        events = getattr(record, 'trial_events', None)
+        if events is not None:
+            return b''.join([trial_log.encode_event(record.created, **event)
+                             for event in events])
+        trial = None
+        if record.args and isinstance(record.msg, str) and record.msg.startswith('Trial %s'):
+            try:
+                trial = int(record.args[0])
+            except (TypeError, ValueError):
+                pass
+        return trial_log.encode_event(record.created, trial=trial, message=record.getMessage())
+
+
+def flush_experiment_logger(logger):
+    """Writes every record logged so far to the experiment's log file.
+
+    Parameters:
+        logger (Logger): A logger returned by create_experiment_logger
+    """
+    for handler in getattr(logger, 'handlers', []):
+        handler.flush()
+
+
+def close_experiment_logger(logger):
+    """Writes any queued records, then closes and removes the logger's handlers.
+
+    Parameters:
+        logger (Logger): A logger returned by create_experiment_logger
+    """
+    for handler in list(getattr(logger, 'handlers', [])):
+        logger.removeHandler(handler)
+        handler.close()
+
+
+class ExperimentLoggerRegistry:
+    """Creates a separate logger for each experiment run and tracks the open ones.
+
+    Loggers are created directly rather than through logging.getLogger, so a run's
+    logger and handler are released once the run is over instead of staying attached
+    to a logger shared by every run. Each logger's parent is the experiment_logger
+    logger. If more than max_open loggers are open, the least recently created or
+    looked up one is closed.
+
+    Parameters:
+        log_directory (str): The directory log files are written to
+        max_open (int): The maximum number of loggers with open log files
+    """
+
+    def __init__(self, log_directory=LOG_DIRECTORY, max_open=MAX_OPEN_LOGGERS):
+        self.log_directory = log_directory
+        self.max_open = max_open
+        self._loggers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._prune()
+            return len(self._loggers)
+
+    def get(self, file_name, structured=False):
+        """Returns the open logger writing to a log file, creating it if necessary.
+
+        Parameters:
+            file_name (str): The name of the log file within the log directory
+            structured (bool): Whether a new logger also writes a trial log next to the
+                log file, through a TrialLogHandler
+
+        Returns:
+            Logger: A logger named experiment_logger.<file_name>, writing INFO level
+            logs to the file through a BatchingFileHandler and FastCsvFormatter
+        """
+        with self._lock:
+            logger = self._loggers.get(file_name)
+            if logger is not None and logger.handlers:
+                self._loggers.move_to_end(file_name)
+                return logger
+            logger = logging.Logger(f'experiment_logger.{file_name}', logging.INFO)
+            logger.parent = logging.getLogger('experiment_logger')
+            handler = BatchingFileHandler(os.path.join(self.log_directory, file_name))
+            handler.setLevel(logging.INFO)
+            handler.setFormatter(FastCsvFormatter())
+            logger.addHandler(handler)
+            if structured:
+                logger.addHandler(TrialLogHandler(
+                    os.path.join(self.log_directory, trial_log.trial_log_name(file_name))))
+            self._loggers[file_name] = logger
+            self._loggers.move_to_end(file_name)
+            self._prune()
+            while len(self._loggers) > self.max_open:
+                _, evicted = self._loggers.popitem(last=False)
+                close_experiment_logger(evicted)
+            return logger
+
+    def _prune(self):
+        """Forgets loggers which have been closed. Must be called with the lock held."""
+        for file_name, logger in list(self._loggers.items()):
+            if not logger.handlers:
+                del self._loggers[file_name]
+
+
+DEFAULT_REGISTRY = ExperimentLoggerRegistry()
+
+
+def create_experiment_logger(file_name, structured=False):
     """ Create experiment logger to log record to csv file.
 
     The specified record is formatted as csv compatible text containing
-    the current UTC timestamp and the record message.
+    the current UTC timestamp and the record message. Every log file gets its
+    own logger from DEFAULT_REGISTRY, which should be closed with
+    close_experiment_logger once the experiment is over.
 
     Parameters:
         file_name (str): The name of the file to which the logs will be written
+        structured (bool): Whether to also write a structured trial log next to the file
 
     Returns:
-        Logger: experiment_logger instance configured to write INFO level logs
-        to log directory
+        Logger: experiment_logger.<file_name> instance configured to write INFO level
+        logs to log directory through a BatchingFileHandler
     """
 
-    log_level = logging.INFO
-    experiment_log_path = 'elephant_vending_machine/static/log/'
-    logger = logging.getLogger('experiment_logger')
-    logger.setLevel(log_level)
-    experiment_log_file_handler = FileHandler(experiment_log_path + file_name)
-    experiment_log_file_handler.setLevel(log_level)
-    experiment_log_file_handler.setFormatter(CsvFormatter())
-    logger.addHandler(experiment_log_file_handler)
-    return logger
+    return DEFAULT_REGISTRY.get(file_name, structured)
@@ -0,0 +1,103 @@
+"""Reading the images of a stimulus set from an uploaded archive.
+
+A whole stimulus set can be uploaded as one zip or tar archive, optionally
+compressed with gzip, bzip2 or xz, instead of a file per image. The images are
+read one at a time, straight from the upload for tar archives, so the archive
+is never unpacked as a whole. Groups have no subdirectories, so directories in
+the archive are flattened, and hidden files and the metadata folders macOS adds
+to zip archives are skipped.
+
+A small archive can unpack to far more data than fits on the disk, so reading
+stops with an ArchiveLimitError once an archive holds more than MAX_MEMBERS
+entries or its files add up to more than MAX_SIZE bytes. Sizes are taken from
+each entry's header before it is read, and the zip and tar readers never
+return more data than the header gives.
+"""
+
+import posixpath
+import tarfile
+import zipfile
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+# Errors raised by a damaged or truncated archive
+ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipFile, EOFError)
+# Largest number of entries of an archive, including those skipped
+MAX_MEMBERS = 10000
+# Largest total size in bytes of the files of an archive once unpacked
+MAX_SIZE = 4 * 1024 * 1024 * 1024
+
+
+class ArchiveLimitError(ValueError):
+    """Raised when an archive holds more entries or data than is allowed."""
+
+
+def is_archive(filename):
+    """Returns whether a file name is that of a supported archive."""
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def member_name(path):
+    """Returns the name an archived file is stored under in a group.
+
+    Parameters:
+        path (str): The path of the file in the archive
+
+    Returns:
+        str: The file name without its directories, or None if the file is skipped
+    """
+    name = posixpath.basename(path)
+    if not name or name.startswith('.') or '__MACOSX' in path.split('/'):
+        return None
+    return name
+
+
+def _check_limits(count, size, max_members, max_size):
+    """Raises ArchiveLimitError if an archive is past either limit after count entries
+    holding size bytes."""
+    if count > max_members:
+        raise ArchiveLimitError(f'Archive holds more than {max_members} files')
+    if size > max_size:
+        raise ArchiveLimitError(f'Archive unpacks to more than {max_size} bytes')
+
+
+def archive_members(stream, filename, max_members=MAX_MEMBERS, max_size=MAX_SIZE):
+    """Yields the files of an archive in the order they were archived.
+
+    Each file must be read before the next one is taken.
+
+    Parameters:
+        stream (file): The archive, which must be seekable for zip archives
+        filename (str): The file name of the archive, which gives its format
+        max_members (int): The largest number of entries of the archive
+        max_size (int): The largest total size of its files in bytes
+
+    Yields:
+        tuple: The name of each file, as returned by member_name, and a binary stream
+        of its contents
+
+    Raises:
+        tarfile.TarError, zipfile.BadZipFile or EOFError: If the archive is damaged
+        ArchiveLimitError: Once the archive is past either limit
+    """
+    count = size = 0
+    if filename.lower().endswith('.zip'):
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                count += 1
+                size += info.file_size
+                _check_limits(count, size, max_members, max_size)
+                name = member_name(info.filename)
+                if info.is_dir() or name is None:
+                    continue
+                with archive.open(info) as member:
+                    yield name, member
+    else:
+        with tarfile.open(fileobj=stream, mode='r|*') as archive:
+            for info in archive:
+                count += 1
+                size += info.size
+                _check_limits(count, size, max_members, max_size)
+                name = member_name(info.name)
+                if not info.isfile() or name is None:
+                    continue
+                yield name, archive.extractfile(info)
@@ -0,0 +1,449 @@
+"""Index of the images in each group, for paginated and filtered listings.
+
+For each group the index holds the size, modification time, dimensions and
+SHA-256 hash of every image, so listings can be sorted by size or time and can
+include metadata without opening the images. An image is described once, when
+it is first seen, and the index of each group is saved as a JSON file so it
+survives restarts.
+
+The index of a group is checked against the group directory's inode and
+modification time. When the directory has changed, added images are described,
+removed images dropped, and images whose size or modification time changed
+described again. Replacing an image under the same name leaves the directory
+unchanged, so routes which write images call refresh.
+
+Pages are selected with opaque cursors holding the sort key of the last image
+of the previous page, so a page costs a binary search rather than a scan of
+the images before it. Dimensions are read from the headers of PNG, GIF and
+JPEG files; other formats have none.
+"""
+
+import base64
+import binascii
+import bisect
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from collections import namedtuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Sort orders of a listing
+NAME = 'name'
+SIZE = 'size'
+MODIFIED = 'modified'
+SORTS = (NAME, SIZE, MODIFIED)
+
+_HASH_CHUNK_SIZE = 64 * 1024
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+# JPEG start of frame markers, which hold the image dimensions
+_JPEG_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# JPEG markers without a length or payload
+_JPEG_STANDALONE = frozenset(range(0xD0, 0xD9)) | {0x01}
+_JPEG_START_OF_SCAN = 0xDA
+
+ImagePage = namedtuple('ImagePage', ['names', 'images', 'next_cursor', 'etag'])
+ImagePage.__doc__ = """One page of a group's images.
+
+Attributes:
+    names (list): The names of the images on the page, in order
+    images (dict): The index entry of each image on the page, or None if metadata
+        was not requested
+    next_cursor (str): The cursor of the next page, or None on the last page
+    etag (str): Changes whenever the listing or an image's entry changes
+"""
+
+
+def _jpeg_dimensions(image_file):
+    """Returns the width and height in the first start of frame segment of a JPEG."""
+    image_file.seek(2)
+    while True:
+        if image_file.read(1) != b'\xff':
+            return None
+        marker = image_file.read(1)
+        while marker == b'\xff':
+            marker = image_file.read(1)
+        if not marker:
+            return None
+        if marker[0] in _JPEG_STANDALONE:
+            continue
+        length = image_file.read(2)
+        if len(length) < 2:
+            return None
+        if marker[0] in _JPEG_SOF:
+            frame = image_file.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>xHH', frame)
+            return width, height
+        (length,) = struct.unpack('>H', length)
+        if marker[0] == _JPEG_START_OF_SCAN or length < 2:
+            return None
+        image_file.seek(length - 2, os.SEEK_CUR)
+
+
+def image_dimensions(path):
+    """Reads the dimensions of an image from its header, without decoding it.
+
+    Parameters:
+        path (str): The path of a PNG, GIF or JPEG image
+
+    Returns:
+        tuple: The width and height in pixels, or (None, None) if the file is in
+        another format or its header is damaged
+    """
+    with open(path, 'rb') as image_file:
+        header = image_file.read(24)
+        dimensions = None
+        if header.startswith(_PNG_SIGNATURE) and header[12:16] == b'IHDR':
+            dimensions = struct.unpack('>II', header[16:24])
+        elif header[:6] in _GIF_SIGNATURES and len(header) >= 10:
+            dimensions = struct.unpack('<HH', header[6:10])
+        elif header.startswith(b'\xff\xd8'):
+            dimensions = _jpeg_dimensions(image_file)
+    return dimensions or (None, None)
+
+
+def file_digest(path):
+    """Returns the SHA-256 hash of a file.
+
+    Parameters:
+        path (str): The path of the file
+
+    Returns:
+        str: The hex SHA-256 hash of the file's contents
+
+    Raises:
+        OSError: If the file cannot be read
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe_image(path, status=None, digest=None):
+    """Returns the index entry of an image.
+
+    Parameters:
+        path (str): The path of the image
+        status (os.stat_result): The result of stat on the image, if already known
+        digest (str): The hex SHA-256 hash of the image, if already known
+
+    Returns:
+        dict: The image's size in bytes, modification time in nanoseconds, width and
+        height in pixels, and hex SHA-256 hash
+
+    Raises:
+        OSError: If the image cannot be read
+    """
+    if status is None:
+        status = os.stat(path)
+    width, height = image_dimensions(path)
+    return {'size': status.st_size, 'modified': status.st_mtime_ns, 'width': width,
+            'height': height, 'sha256': digest or file_digest(path)}
+
+
+def encode_cursor(key):
+    """Encodes the sort key of the last image of a page as an opaque cursor.
+
+    Parameters:
+        key: A name, or a tuple of a sort value and a name
+
+    Returns:
+        str: The URL safe cursor
+    """
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor returned by encode_cursor.
+
+    Parameters:
+        cursor (str): The cursor
+
+    Returns:
+        The sort key held by the cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError) as error:
+        raise ValueError('Malformed cursor') from error
+    if isinstance(key, list):
+        key = tuple(key)
+    if not isinstance(key, (str, tuple)):
+        raise ValueError('Malformed cursor')
+    return key
+
+
+def paginate(keys, limit=None, cursor=None, descending=False):
+    """Selects a page of sort keys following a cursor.
+
+    Parameters:
+        keys (list): Sort keys in ascending order
+        limit (int): The maximum number of keys on the page, or None for no limit
+        cursor: The sort key of the last item of the previous page, or None for the
+            first page
+        descending (bool): Whether the page runs in descending order
+
+    Returns:
+        tuple: The keys on the page, and the key to resume after, or None if the page
+        is the last one
+
+    Raises:
+        ValueError: If the cursor is not comparable with the keys
+    """
+    try:
+        if descending:
+            end = len(keys) if cursor is None else bisect.bisect_left(keys, cursor)
+            start = 0 if limit is None else max(0, end - limit)
+            page = keys[start:end][::-1]
+            more = start > 0
+        else:
+            start = 0 if cursor is None else bisect.bisect_right(keys, cursor)
+            end = len(keys) if limit is None else start + limit
+            page = keys[start:end]
+            more = end < len(keys)
+    except TypeError as error:
+        raise ValueError('Cursor does not match the sort order') from error
+    return page, page[-1] if more and page else None
+
+
+class _GroupIndex:
+    """The index entries of one group and the inode and modification time of the group
+    directory they were built from."""
+
+    def __init__(self, stamp, images):
+        self.stamp = stamp
+        self.images = images
+        self._sorted = {}
+        self._etag = None
+
+    def update(self, stamp, images):
+        """Replaces the entries of the group."""
+        self.stamp = stamp
+        self.images = images
+        self._sorted = {}
+        self._etag = None
+
+    def etag(self):
+        """Returns a hash of the entries, so it only repeats for the same entries, even
+        after a restart."""
+        if self._etag is None:
+            entries = json.dumps(self.images, sort_keys=True).encode()
+            self._etag = hashlib.sha1(entries).hexdigest()[:16]
+        return self._etag
+
+    def sorted_keys(self, sort):
+        """Returns the sort keys of every image in ascending order."""
+        keys = self._sorted.get(sort)
+        if keys is None:
+            if sort == NAME:
+                keys = sorted(self.images)
+            else:
+                keys = sorted((entry[sort], name) for name, entry in self.images.items())
+            self._sorted[sort] = keys
+        return keys
+
+
+class ImageIndex:
+    """Index of the images of each group, saved as one JSON file per group.
+
+    Parameters:
+        index_directory (str): The directory holding the saved indexes, created if it
+            does not exist
+        directory_cache (DirectoryCache): The cache listing the group directories
+    """
+
+    def __init__(self, index_directory, directory_cache):
+        self.index_directory = index_directory
+        self.directory_cache = directory_cache
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def _index_path(self, path):
+        """Returns the path of the saved index of a group directory."""
+        name = hashlib.sha1(path.encode(errors='surrogateescape')).hexdigest()
+        return os.path.join(self.index_directory, name + '.json')
+
+    def _load(self, path):
+        """Returns the saved index of a group, or an empty index if there is none."""
+        try:
+            with open(self._index_path(path), encoding='utf-8') as index_file:
+                saved = json.load(index_file)
+            return _GroupIndex(saved['stamp'], saved['images'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return _GroupIndex(None, {})
+
+    def _save(self, path, group):
+        """Saves the index of a group, logging rather than raising any error."""
+        index_path = self._index_path(path)
+        temporary_path = index_path + '.tmp'
+        try:
+            os.makedirs(self.index_directory, exist_ok=True)
+            with open(temporary_path, 'w', encoding='utf-8') as index_file:
+                json.dump({'path': path, 'stamp': group.stamp, 'images': group.images},
+                          index_file)
+            os.replace(temporary_path, index_path)
+        except OSError as error:
+            LOGGER.warning('Could not save the image index of %s: %s', path, error)
+
+    def _group(self, path):
+        """Returns the index of a group, loading it if needed. Must be called with the
+        lock held."""
+        group = self._groups.get(path)
+        if group is None:
+            group = self._groups[path] = self._load(path)
+        return group
+
+    def _current(self, path, listing):
+        """Returns the index of a group, bringing it up to date with the listing. Must
+        be called with the lock held."""
+        group = self._group(path)
+        status = os.stat(path)
+        stamp = [status.st_ino, status.st_mtime_ns]
+        if group.stamp == stamp:
+            return group
+        images = {}
+        for name in listing.files:
+            if name.startswith('.'):
+                continue
+            image_path = os.path.join(path, name)
+            try:
+                status = os.stat(image_path)
+                entry = group.images.get(name)
+                if entry is None or entry['size'] != status.st_size \
+                        or entry['modified'] != status.st_mtime_ns:
+                    entry = describe_image(image_path, status)
+            except OSError as error:
+                LOGGER.warning('Could not index %s: %s', image_path, error)
+                continue
+            images[name] = entry
+        group.update(stamp, images)
+        self._save(path, group)
+        return group
+
+    def entries(self, path):
+        """Returns the index entry of every image in a group.
+
+        Parameters:
+            path (str): The group directory
+
+        Returns:
+            dict: The entry returned by describe_image for each image name
+
+        Raises:
+            FileNotFoundError: If the group directory does not exist
+        """
+        path = os.path.normpath(path)
+        listing = self.directory_cache.listing(path)
+        with self._lock:
+            return dict(self._current(path, listing).images)
+
+    def refresh(self, path, name, digest=None):
+        """Describes an image again after it was written or removed.
+
+        Parameters:
+            path (str): The group directory
+            name (str): The name of the image
+            digest (str): The hex SHA-256 hash of the image, if already known
+
+        Returns:
+            dict: The new entry of the image, or None if it no longer exists
+        """
+        return self.refresh_images(path, {name: digest}).get(name)
+
+    def refresh_images(self, path, digests):
+        """Describes images again after they were written or removed, saving the index
+        of their group once.
+
+        Parameters:
+            path (str): The group directory
+            digests (dict): The hex SHA-256 hash of each image, or None if not known
+
+        Returns:
+            dict: The new entry of each of the images which still exists
+        """
+        path = os.path.normpath(path)
+        with self._lock:
+            group = self._group(path)
+            # Pages read the entries without the lock, so they are replaced, not changed
+            images = dict(group.images)
+            for name, digest in digests.items():
+                try:
+                    images[name] = describe_image(os.path.join(path, name), digest=digest)
+                except OSError:
+                    images.pop(name, None)
+            group.update(group.stamp, images)
+            self._save(path, group)
+            return {name: images[name] for name in digests if name in images}
+
+    def forget(self, path):
+        """Removes the index of a group which has been deleted.
+
+        Parameters:
+            path (str): The group directory
+        """
+        path = os.path.normpath(path)
+        with self._lock:
+            self._groups.pop(path, None)
+            try:
+                os.remove(self._index_path(path))
+            except FileNotFoundError:
+                pass
+
+    def page(self, path, *, sort=NAME, prefix='', limit=None, cursor=None, descending=False,
+             metadata=False):
+        """Returns one page of the images in a group.
+
+        Images whose name starts with a dot are not listed. Listing by name without
+        metadata only needs the directory listing, so it never reads the images.
+
+        Parameters:
+            path (str): The group directory
+            sort (str): The sort order, one of SORTS
+            prefix (str): Only images whose name starts with this
+            limit (int): The maximum number of images on the page, or None for no limit
+            cursor (str): The next_cursor of the previous page, or None for the first page
+            descending (bool): Whether to list in descending order
+            metadata (bool): Whether to include the index entry of each image
+
+        Returns:
+            ImagePage: The page of images
+
+        Raises:
+            FileNotFoundError: If the group directory does not exist
+            ValueError: If the sort order is unknown or the cursor is invalid
+        """
+        if sort not in SORTS:
+            raise ValueError(f'Unknown sort order {sort}')
+        path = os.path.normpath(path)
+        listing = self.directory_cache.listing(path)
+        if sort == NAME and not metadata:
+            keys = [name for name in listing.files if not name.startswith('.')]
+            images = None
+            etag = listing.etag
+        else:
+            with self._lock:
+                group = self._current(path, listing)
+                keys = group.sorted_keys(sort)
+                images = group.images
+                etag = f'{listing.etag}.{group.etag()}'
+        if prefix:
+            keys = [key for key in keys
+                    if (key if sort == NAME else key[1]).startswith(prefix)]
+        keys, next_key = paginate(keys, limit, None if cursor is None else decode_cursor(cursor),
+                                  descending)
+        names = keys if sort == NAME else [name for _, name in keys]
+        if metadata:
+            images = {name: images[name] for name in names}
+        return ImagePage(names, images, None if next_key is None else encode_cursor(next_key),
+                         etag)
@@ -0,0 +1,181 @@
+"""Queue of input events received from the monitor pis.
+
+Every signal from a monitor pi is kept as an event of (host, timestamp, sequence
+number) in a fixed size ring buffer, so presses are never overwritten by the
+next one and can be matched against the stimulus onset they followed.
+Timestamps are monotonic integer nanoseconds, as returned by monotonic_ns().
+"""
+
+import threading
+import time
+
+HOST = 0
+TIMESTAMP = 1
+SEQUENCE = 2
+
+
+def monotonic_ns():
+    """Returns the time.perf_counter() clock in integer nanoseconds. It stands in for
+    time.perf_counter_ns(), which is only available from Python 3.7.
+
+    Returns:
+        int: The current time in nanoseconds, only meaningful relative to other calls
+    """
+    return int(time.perf_counter() * 1000000000)
+
+
+# The ring buffer is kept as parallel lists next to its bookkeeping
+# pylint: disable=too-many-instance-attributes
+class InputEventQueue:
+    """A bounded ring buffer of timestamped input events.
+
+    Storage for *capacity* events is allocated up front and reused, pushing and popping
+    are O(1). Once full, each new event overwrites the oldest one. Events from a host
+    arriving within *debounce* milliseconds of its previous accepted event are dropped.
+
+    Parameters:
+        capacity (int): The maximum number of events kept
+        debounce (int): The debounce interval in milliseconds, 0 to accept every event
+    """
+
+    def __init__(self, capacity=256, debounce=0):
+        self.capacity = capacity
+        self.debounce_ns = debounce * 1000000
+        self._hosts = [None] * capacity
+        self._timestamps = [0] * capacity
+        self._sequences = [0] * capacity
+        self._head = 0
+        self._count = 0
+        self._next_sequence = 1
+        self._last_accepted = {}
+        self.dropped = 0
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return self._count
+
+    def push(self, host, timestamp=None):
+        """Adds an event to the queue and wakes any waiting threads.
+
+        Parameters:
+            host (str): The address of the monitor pi the event came from
+            timestamp (int): When the event happened, in monotonic_ns time,
+                defaults to now
+
+        Returns:
+            int: The event's sequence number, or None if it was debounced
+        """
+        if timestamp is None:
+            timestamp = monotonic_ns()
+        with self.condition:
+            last = self._last_accepted.get(host)
+            if last is not None and timestamp - last < self.debounce_ns:
+                return None
+            self._last_accepted[host] = timestamp
+            if self._count == self.capacity:
+                self._head = (self._head + 1) % self.capacity
+                self._count -= 1
+                self.dropped += 1
+            index = (self._head + self._count) % self.capacity
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            self._hosts[index] = host
+            self._timestamps[index] = timestamp
+            self._sequences[index] = sequence
+            self._count += 1
+            self.condition.notify_all()
+            return sequence
+
+    def pop(self):
+        """Removes and returns the oldest event.
+
+        Returns:
+            tuple: The (host, timestamp, sequence) of the event, or None if empty
+        """
+        with self.condition:
+            if self._count == 0:
+                return None
+            event = self._event(self._head)
+            self._hosts[self._head] = None
+            self._head = (self._head + 1) % self.capacity
+            self._count -= 1
+            return event
+
+    def events_since(self, timestamp):
+        """Returns the events which happened at or after a time, oldest first.
+
+        Parameters:
+            timestamp (int): The earliest time of interest, in monotonic_ns time
+
+        Returns:
+            list[tuple]: The (host, timestamp, sequence) of each event
+        """
+        with self.condition:
+            return [event for event in self._events() if event[TIMESTAMP] >= timestamp]
+
+    def find(self, hosts, since, after_sequence=0):
+        """Returns the oldest event from one of the given hosts at or after a time.
+
+        Parameters:
+            hosts (collection): The addresses of the hosts of interest
+            since (int): The earliest time of interest, in monotonic_ns time
+            after_sequence (int): Only events with a greater sequence number are considered
+
+        Returns:
+            tuple: The (host, timestamp, sequence) of the event, or None
+        """
+        with self.condition:
+            for event in self._events():
+                if event[SEQUENCE] > after_sequence and event[TIMESTAMP] >= since \
+                        and event[HOST] in hosts:
+                    return event
+            return None
+
+    # pylint: disable=too-many-arguments
+    def wait_for(self, hosts, since, after_sequence, timeout, interrupted=lambda: False):
+        """Blocks until find would return an event, the timeout passes or the wait is
+        interrupted.
+
+        Parameters:
+            hosts (collection): The addresses of the hosts of interest
+            since (int): The earliest time of interest, in monotonic_ns time
+            after_sequence (int): Only events with a greater sequence number are considered
+            timeout (float): The maximum number of milliseconds to wait
+            interrupted (function): Checked whenever the queue is notified, the wait ends
+                early once it returns True
+
+        Returns:
+            tuple: The (host, timestamp, sequence) of the event, or None
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.find(hosts, since, after_sequence) is not None or interrupted(),
+                timeout / 1000)
+            return self.find(hosts, since, after_sequence)
+
+    def notify(self):
+        """Wakes waiting threads so they re-check their interruption condition."""
+        with self.condition:
+            self.condition.notify_all()
+
+    def _event(self, index):
+        """Returns the event stored at an index of the buffer."""
+        return self._hosts[index], self._timestamps[index], self._sequences[index]
+
+    def _events(self):
+        """Yields the stored events, oldest first. Must be called with the condition held."""
+        for offset in range(self._count):
+            yield self._event((self._head + offset) % self.capacity)
+
+
+def reaction_time(event, onset):
+    """Returns the time between a stimulus onset and an input event.
+
+    Parameters:
+        event (tuple): The (host, timestamp, sequence) of the input event
+        onset (int): The stimulus onset, in monotonic_ns time
+
+    Returns:
+        float: The reaction time in milliseconds
+    """
+    return (event[TIMESTAMP] - onset) / 1000000
@@ -0,0 +1,214 @@
+"""Catalog of experiment log files.
+
+The catalog is a small SQLite database holding one row per log file, with the
+experiment's name, when it started and finished, how it ended, the number of
+trials, how many trials ended with each selection and the size of the file.
+Runs update their row as they progress, so the logs can be listed and
+filtered without opening the files.
+
+Log files written before the catalog existed, or by another installation, are
+added by scan, which parses each such file once.
+"""
+
+import csv
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+# Selections counted for each log, as returned by VendingMachine.wait_for_input
+OUTCOMES = ('left', 'middle', 'right', 'timeout')
+COLUMNS = ('file_name', 'experiment', 'started', 'finished', 'status', 'trials') \
+    + tuple(f'{outcome}_count' for outcome in OUTCOMES) + ('size',)
+# Status of a scanned log whose end could not be determined
+UNKNOWN = 'unknown'
+
+_FILE_NAME = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)?) (.+)\.csv$')
+_TRIAL_FINISHED = re.compile(r'^Trial \S+ finished$')
+_TRIAL_OUTCOME = re.compile(r'^Trial \S+ (?:picked (left|middle|right)|no selection made\.?)$')
+_ENDINGS = (('Experiment finished', 'finished'), ('Experiment cancelled', 'cancelled'),
+            ('Experiment failed', 'failed'))
+
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS logs (
+    file_name TEXT PRIMARY KEY,
+    experiment TEXT,
+    started TEXT,
+    finished TEXT,
+    status TEXT,
+    trials INTEGER NOT NULL DEFAULT 0,
+    {', '.join(f'{outcome}_count INTEGER NOT NULL DEFAULT 0' for outcome in OUTCOMES)},
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS logs_started ON logs (started);
+CREATE INDEX IF NOT EXISTS logs_experiment_started ON logs (experiment, started);
+'''
+
+
+def parse_log_file(log_directory, file_name):
+    """Reads the catalog entry of a log file from the file itself.
+
+    Parameters:
+        log_directory (str): The directory containing the log
+        file_name (str): The name of the log, of the form '<start time> <experiment>.csv'
+
+    Returns:
+        dict: The value of each catalog column
+    """
+    match = _FILE_NAME.match(file_name)
+    entry = dict.fromkeys(COLUMNS, 0)
+    entry.update(file_name=file_name, experiment=match.group(2) if match else None,
+                 started=match.group(1) if match else None, finished=None, status=UNKNOWN)
+    path = os.path.join(log_directory, file_name)
+    entry['size'] = os.path.getsize(path)
+    with open(path, newline='', encoding='utf-8', errors='replace') as log_file:
+        for row in csv.reader(log_file):
+            if len(row) < 2:
+                continue
+            message = row[1]
+            entry['finished'] = row[0]
+            if _TRIAL_FINISHED.match(message):
+                entry['trials'] += 1
+                continue
+            outcome = _TRIAL_OUTCOME.match(message)
+            if outcome:
+                entry[f'{outcome.group(1) or "timeout"}_count'] += 1
+                continue
+            for prefix, status in _ENDINGS:
+                if message.startswith(prefix):
+                    entry['status'] = status
+    return entry
+
+
+class LogCatalog:
+    """SQLite backed index of the log files in a directory.
+
+    Parameters:
+        database (str): The path of the SQLite database, created if it does not exist
+        log_directory (str): The directory containing the log files
+    """
+
+    def __init__(self, database, log_directory):
+        self.log_directory = log_directory
+        self._connection = sqlite3.connect(database, check_same_thread=False, timeout=10)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._scanned = False
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        """Closes the database connection."""
+        self._connection.close()
+
+    def _upsert(self, entry):
+        """Inserts or replaces the row of a log. Must be called with the lock held."""
+        self._connection.execute(
+            f'''INSERT OR REPLACE INTO logs ({', '.join(COLUMNS)})
+                VALUES ({', '.join('?' * len(COLUMNS))})''',
+            [entry[column] for column in COLUMNS])
+
+    def record(self, run):
+        """Updates the row of a run's log from the state of the run. A database error is
+        logged rather than raised, so it cannot interrupt the experiment.
+
+        Parameters:
+            run (ExperimentRun): The run writing the log
+        """
+        entry = {
+            'file_name': run.log_file,
+            'experiment': run.experiment,
+            'started': str(run.started),
+            'finished': str(run.finished) if run.finished else None,
+            'status': run.status,
+            'trials': run.completed_trials,
+            'size': 0,
+        }
+        for outcome in OUTCOMES:
+            entry[f'{outcome}_count'] = run.outcomes.get(outcome, 0)
+        try:
+            entry['size'] = os.path.getsize(os.path.join(self.log_directory, run.log_file))
+        except OSError:
+            pass
+        try:
+            with self._lock, self._connection:
+                self._upsert(entry)
+        except sqlite3.Error as error:
+            LOGGER.warning('Could not update the log catalog for %s: %s', run.log_file, error)
+
+    def remove(self, file_name):
+        """Removes the row of a log file.
+
+        Parameters:
+            file_name (str): The name of the log file
+        """
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM logs WHERE file_name = ?', (file_name,))
+
+    def scan(self):
+        """Adds rows for log files which are not in the catalog, and removes rows of log
+        files which no longer exist.
+
+        Returns:
+            int: The number of log files added
+        """
+        file_names = {name for name in os.listdir(self.log_directory)
+                      if name.endswith('.csv') and not name.startswith('.')}
+        with self._lock:
+            known = {row[0] for row in self._connection.execute('SELECT file_name FROM logs')}
+        entries = []
+        for name in sorted(file_names - known):
+            try:
+                entries.append(parse_log_file(self.log_directory, name))
+            except (OSError, csv.Error) as error:
+                LOGGER.warning('Could not add %s to the log catalog: %s', name, error)
+        with self._lock, self._connection:
+            for entry in entries:
+                self._upsert(entry)
+            self._connection.executemany('DELETE FROM logs WHERE file_name = ?',
+                                         [(name,) for name in known - file_names])
+        self._scanned = True
+        return len(entries)
+
+    def query(self, *, experiment=None, started_from=None, started_to=None, status=None,
+              limit=50, offset=0):
+        """Returns the logs matching the given filters, most recently started first.
+
+        The log directory is scanned the first time the catalog is queried.
+
+        Parameters:
+            experiment (str): Only logs of this experiment file
+            started_from (str): Only logs started at or after this time, as text such as
+                2020-03-17 or 2020-03-17 04:26:02
+            started_to (str): Only logs started before this time, in the same format
+            status (str): Only logs of runs which ended this way, such as finished
+            limit (int): The maximum number of logs returned
+            offset (int): The number of matching logs skipped
+
+        Returns:
+            tuple: The total number of matching logs, and a list with a dict of the
+            catalog columns for each returned log
+        """
+        if not self._scanned:
+            self.scan()
+        conditions = []
+        parameters = []
+        for condition, value in (('experiment = ?', experiment), ('started >= ?', started_from),
+                                 ('started < ?', started_to), ('status = ?', status)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        where = f'''WHERE {' AND '.join(conditions)}''' if conditions else ''
+        with self._lock:
+            total = self._connection.execute(
+                f'SELECT COUNT(*) FROM logs {where}', parameters).fetchone()[0]
+            rows = self._connection.execute(
+                f'''SELECT {', '.join(COLUMNS)} FROM logs {where}
+                    ORDER BY started DESC, file_name LIMIT ? OFFSET ?''',
+                parameters + [limit, offset]).fetchall()
+        return total, [dict(row) for row in rows]
@@ -0,0 +1,105 @@
+"""Streaming of experiment log files to clients.
+
+Logs are read and sent in fixed size chunks, so the memory used to serve a log
+does not depend on its size. gzip_chunks compresses a log as it is read, and
+follow_events tails a log that is still being written as server-sent events.
+"""
+
+import fcntl
+import time
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+# Number of seconds between checks for new lines when following a log
+FOLLOW_INTERVAL = 0.25
+
+
+def gzip_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yields the gzip compressed contents of a file, compressing one chunk at a time.
+
+    Parameters:
+        path (str): The path of the file
+        chunk_size (int): The number of bytes read at a time
+
+    Yields:
+        bytes: The next part of the gzip stream
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    with open(path, 'rb') as log_file:
+        for chunk in iter(lambda: log_file.read(chunk_size), b''):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
+
+def is_being_written(path):
+    """Returns whether a log file is still being written, in any process. The handler
+    writing a log holds a shared flock on it until it is closed, so the log is being
+    written while an exclusive lock cannot be taken.
+
+    Parameters:
+        path (str): The path of the log file
+
+    Returns:
+        bool: Whether a handler still has the log open for writing
+    """
+    try:
+        with open(path, 'rb') as log_file:
+            try:
+                fcntl.flock(log_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def _event(line, offset):
+    """Formats a log line as a server-sent event whose id is the offset after the line."""
+    data = line.rstrip(b'\r\n').decode(errors='replace')
+    return f'id: {offset}\ndata: {data}\n\n'
+
+
+def follow_events(path, offset, is_running, interval=FOLLOW_INTERVAL, chunk_size=CHUNK_SIZE):
+    """Yields each line of a log file as a server-sent event, waiting for new lines for as
+    long as the log is being written.
+
+    Each event's id is the byte offset just after its line, which a client can send back
+    as Last-Event-ID to resume. A line without a line ending is only sent once it is
+    complete, or once the log is no longer being written. An end event is sent last.
+
+    Parameters:
+        path (str): The path of the log file
+        offset (int): The byte offset to start reading from
+        is_running (function): Returns whether the log may still grow
+        interval (float): The number of seconds between checks for new lines
+        chunk_size (int): The maximum number of bytes read at a time
+
+    Yields:
+        str: The next server-sent event
+    """
+    with open(path, 'rb') as log_file:
+        log_file.seek(offset)
+        partial = b''
+        while True:
+            # Check before reading, so that lines written before the log stopped growing
+            # are always read
+            running = is_running()
+            while True:
+                line = log_file.readline(chunk_size)
+                if not line:
+                    break
+                if not line.endswith(b'\n') and len(partial) + len(line) < chunk_size:
+                    partial += line
+                    continue
+                offset += len(partial) + len(line)
+                yield _event(partial + line, offset)
+                partial = b''
+            if not running:
+                break
+            time.sleep(interval)
+        if partial:
+            offset += len(partial)
+            yield _event(partial, offset)
+    yield f'event: end\nid: {offset}\ndata: \n\n'
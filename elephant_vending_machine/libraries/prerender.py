@@ -0,0 +1,188 @@
+"""Pre-rendering of stimuli at the resolution of the monitor pis' screens.
+
+Shown as uploaded, every stimulus is decoded and scaled on a pi each time it
+is displayed, which adds CPU bound work on a slow processor right before the
+stimulus onset. Instead, the backend decodes each uploaded image once, scales
+it to fit the screen, centres it on a black background of exactly the screen's
+resolution and saves it as a binary PPM file. A PPM file is uncompressed RGB,
+so the pis only have to read it into memory, and feh and Tk both load it
+without any extra library.
+
+The pre-rendered variant of group/image.png is .prerendered/group/image.png.ppm
+in the image directory, both on the backend and on the pis. The variants are
+kept out of the groups, so an experiment picking a random file from a group
+only ever picks an image. Images Pillow cannot decode, such as SVG and PDF
+files, are not pre-rendered and are still scaled on the pis.
+"""
+
+import logging
+import os
+import posixpath
+import shutil
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from .thumbnails import flatten
+
+LOGGER = logging.getLogger(__name__)
+
+PRERENDER_DIRECTORY = '.prerendered'
+PRERENDER_EXTENSION = '.ppm'
+# Resolution of the monitor pis' screens, as width and height
+DEFAULT_RESOLUTION = (1920, 1080)
+
+
+def can_prerender():
+    """Returns whether images can be pre-rendered, which requires Pillow."""
+    return Image is not None
+
+
+def prerendered_name(image):
+    """Returns the path of an image's pre-rendered variant.
+
+    Parameters:
+        image (str): The path of the image, such as group/image.png
+
+    Returns:
+        str: The path of the variant, such as .prerendered/group/image.png.ppm
+    """
+    return posixpath.join(PRERENDER_DIRECTORY, image + PRERENDER_EXTENSION)
+
+
+def prerendered_group(group):
+    """Returns the path of the directory holding the pre-rendered variants of a group.
+
+    Parameters:
+        group (str): The name of the group
+
+    Returns:
+        str: The path of the directory, such as .prerendered/group
+    """
+    return posixpath.join(PRERENDER_DIRECTORY, group)
+
+
+def letterbox(image, resolution):
+    """Scales an image to fit a resolution and centres it on a black background.
+
+    Parameters:
+        image (PIL.Image.Image): The image
+        resolution (tuple): The width and height of the result
+
+    Returns:
+        PIL.Image.Image: An RGB image of exactly the given resolution
+    """
+    width, height = resolution
+    scale = min(width / image.width, height / image.height)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # Lets JPEG images be decoded at a reduced scale, which is much faster
+    image.draft('RGB', size)
+    image = flatten(image)
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS)
+    if size == (width, height):
+        return image
+    canvas = Image.new('RGB', (width, height))
+    canvas.paste(image, ((width - size[0]) // 2, (height - size[1]) // 2))
+    return canvas
+
+
+def prerender_image(source, target, resolution=DEFAULT_RESOLUTION):
+    """Pre-renders an image as a binary PPM file of exactly the given resolution.
+
+    The file is written to a temporary path first, so a variant which exists is
+    always complete.
+
+    Parameters:
+        source (str): The path of the image
+        target (str): The path of the PPM file
+        resolution (tuple): The width and height of the screens
+
+    Raises:
+        OSError: If the image cannot be read or is not in a format Pillow supports
+    """
+    with Image.open(source) as image:
+        rendered = letterbox(image, resolution)
+    temporary_path = target + '.tmp'
+    rendered.save(temporary_path, 'PPM')
+    os.replace(temporary_path, target)
+
+
+def prerender_stimulus(directory, image, resolution=DEFAULT_RESOLUTION):
+    """Pre-renders a stored stimulus, logging rather than raising any error.
+
+    Parameters:
+        directory (str): The image directory
+        image (str): The path of the stimulus, such as group/image.png
+        resolution (tuple): The width and height of the screens
+
+    Returns:
+        str: The path of the pre-rendered variant, or None if it could not be rendered
+    """
+    if not can_prerender():
+        return None
+    target = os.path.join(directory, prerendered_name(image))
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        prerender_image(os.path.join(directory, image), target, resolution)
+    # Pillow raises many error types for damaged or unsupported images
+    # pylint: disable=broad-except
+    except Exception as error:
+        LOGGER.warning('Could not pre-render %s: %s', image, error)
+        # A variant of an image previously stored under the same name is out of date
+        remove_prerendered(directory, image)
+        return None
+    return target
+
+
+def remove_prerendered(directory, image):
+    """Removes the pre-rendered variant of a stimulus, if it has one.
+
+    Parameters:
+        directory (str): The image directory
+        image (str): The path of the stimulus, such as group/image.png
+    """
+    try:
+        os.remove(os.path.join(directory, prerendered_name(image)))
+    except FileNotFoundError:
+        pass
+
+
+def remove_prerendered_group(directory, group):
+    """Removes the pre-rendered variants of every stimulus of a group.
+
+    Parameters:
+        directory (str): The image directory
+        group (str): The name of the group
+    """
+    shutil.rmtree(os.path.join(directory, prerendered_group(group)), ignore_errors=True)
+
+
+def copy_prerendered(directory, source_image, target_image):
+    """Copies the pre-rendered variant of a stimulus along with the stimulus.
+
+    The copy is a hardlink, as variants are only ever replaced, never written in place.
+
+    Parameters:
+        directory (str): The image directory
+        source_image (str): The path of the stimulus copied, such as group/image.png
+        target_image (str): The path of the copy, such as group_2/image.png
+    """
+    source = os.path.join(directory, prerendered_name(source_image))
+    if not os.path.exists(source):
+        remove_prerendered(directory, target_image)
+        return
+    target = os.path.join(directory, prerendered_name(target_image))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Renaming a link over another link to the same file would do nothing
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return
+    temporary_path = target + '.tmp'
+    try:
+        os.remove(temporary_path)
+    except FileNotFoundError:
+        pass
+    os.link(source, temporary_path)
+    os.replace(temporary_path, target)
@@ -0,0 +1,410 @@
+"""Concurrent synchronization of stimulus images to the monitor pis.
+
+Every change to the images is applied to all the remote hosts at once, from a
+thread per host, so a request waits for the slowest host rather than for the
+sum of all of them. Files are sent with push_files, which creates the remote
+directory and unpacks the files from a tar stream in a single ssh session, in
+place of an ssh call to create the directory followed by an scp call per file.
+
+A failure on some of the hosts does not stop the others. Once every host has
+finished, a RemoteSyncError reports the outcome on each host.
+
+Whole groups are brought up to date with reconcile, which compares the SHA-256
+hash of every local file with a manifest of the files on the host and only
+sends the files the host is missing or holds a different version of, in one
+tar stream. A file whose content the host already holds under another path,
+such as an image copied to another group, is hardlinked there instead of sent,
+and so is a file sent to several paths at once.
+"""
+
+import posixpath
+import shlex
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import CalledProcessError
+
+# Length of a hex SHA-256 hash
+_DIGEST_LENGTH = 64
+
+SyncPlan = namedtuple('SyncPlan', ['send', 'links', 'duplicates', 'remove'])
+SyncPlan.__doc__ = """The changes bringing the files on a host up to date.
+
+Attributes:
+    send (list): The paths of the files to send
+    links (list): The source and target path of each file to hardlink from a file
+        the host already holds, before the files are sent
+    duplicates (list): The source and target path of each file to hardlink from a
+        sent file, after the files are sent
+    remove (list): The paths of the files to remove from the host
+"""
+
+
+class RemoteSyncError(CalledProcessError):
+    """Raised when a remote operation fails on some or all of the hosts.
+
+    It is a CalledProcessError for the first failure, so callers handling a single
+    failed ssh call handle it too, and additionally reports every host.
+
+    Parameters:
+        results (dict): For each host, None if the operation succeeded there or the
+            CalledProcessError it failed with
+    """
+
+    def __init__(self, results):
+        self.results = results
+        failure = next(error for error in results.values() if error is not None)
+        super().__init__(failure.returncode, failure.cmd, failure.output, failure.stderr)
+
+    @property
+    def failed_hosts(self):
+        """The hosts the operation failed on."""
+        return [host for host, error in self.results.items() if error is not None]
+
+    @property
+    def succeeded_hosts(self):
+        """The hosts the operation succeeded on."""
+        return [host for host, error in self.results.items() if error is None]
+
+    def host_report(self):
+        """Returns a JSON serializable description of the outcome on each host.
+
+        Returns:
+            dict: 'ok' for each host the operation succeeded on, otherwise the error
+        """
+        return {host: 'ok' if error is None else f'exit status {error.returncode}'
+                for host, error in self.results.items()}
+
+    def __str__(self):
+        failed = ', '.join(f'{host} (exit status {self.results[host].returncode})'
+                           for host in self.failed_hosts)
+        return f'Failed on {len(self.failed_hosts)} of {len(self.results)} hosts: {failed}'
+
+
+def fan_out(hosts, action):
+    """Runs an action for every host concurrently and waits for all of them.
+
+    Parameters:
+        hosts (list): The addresses of the hosts
+        action (function): Called with each host, raising CalledProcessError on failure
+
+    Returns:
+        dict: The value returned by the action for each host
+
+    Raises:
+        RemoteSyncError: If the action failed on any host, once every host has finished
+    """
+    if not hosts:
+        return {}
+    with ThreadPoolExecutor(len(hosts), thread_name_prefix='remote-sync') as executor:
+        futures = {host: executor.submit(action, host) for host in hosts}
+    results = {}
+    errors = {}
+    for host, future in futures.items():
+        try:
+            results[host] = future.result()
+            errors[host] = None
+        except CalledProcessError as error:
+            errors[host] = error
+    if any(error is not None for error in errors.values()):
+        raise RemoteSyncError(errors)
+    return results
+
+
+# The remote changes are all parameters of the one session.
+# pylint: disable=too-many-arguments
+def push_files(pool, user, host, local_directory, names, remote_directory, remove=(),
+               renames=()):
+    """Copies files to a host in one ssh session, creating the remote directory.
+
+    Parameters:
+        pool (SSHConnectionPool): The pool holding the connection to the host
+        user (str): The user to log in to the host as
+        host (str): The address of the host
+        local_directory (str): The directory the names are relative to
+        names (list): The relative paths of the files, which may include subdirectories
+            and may be empty
+        remote_directory (str): The directory on the host to copy the files to
+        remove (list): Paths relative to remote_directory to remove on the host first
+        renames (list): The source and target path, relative to remote_directory, of
+            each file to rename on the host first
+
+    Raises:
+        CalledProcessError: If the transfer fails, or the host cannot be reached
+    """
+    quoted_directory = shlex.quote(remote_directory)
+    commands = [f'mkdir -p {quoted_directory}', f'cd {quoted_directory}']
+    if remove:
+        commands.append('rm -f ' + ' '.join(shlex.quote(path) for path in remove))
+    commands.extend(f'mv -f {shlex.quote(source)} {shlex.quote(target)}'
+                    for source, target in renames)
+    if not names:
+        return pool.run(user, host, shlex.quote(' && '.join(commands)))
+    commands.append('tar -xf -')
+    archived = ' '.join(shlex.quote(name) for name in names)
+    return pool.pipe(user, host, f'tar -C {shlex.quote(local_directory)} -cf - {archived}',
+                     ' && '.join(commands))
+
+
+# Mirrors push_files, whose parameters it shares.
+# pylint: disable=too-many-arguments
+def push_range(pool, user, host, local_path, offset, length, remote_path):
+    """Writes a range of a local file to the same range of a file on a host, so the
+    ranges of a file may be sent in any order, and sent again.
+
+    Parameters:
+        pool (SSHConnectionPool): The pool holding the connection to the host
+        user (str): The user to log in to the host as
+        host (str): The address of the host
+        local_path (str): The path of the local file
+        offset (int): The offset of the range in bytes
+        length (int): The length of the range in bytes
+        remote_path (str): The path of the file on the host, created if need be
+
+    Raises:
+        CalledProcessError: If the transfer fails, or the host cannot be reached
+    """
+    command = f'mkdir -p {shlex.quote(posixpath.dirname(remote_path))} && ' \
+              f'dd of={shlex.quote(remote_path)} bs=64K oflag=seek_bytes seek={offset} ' \
+              'conv=notrunc status=none'
+    return pool.pipe(user, host,
+                     f'tail -c +{offset + 1} {shlex.quote(local_path)} | head -c {length}',
+                     command)
+
+
+class RangeForwarder:
+    """Sends the ranges of files being uploaded on to every host in the background,
+    while the rest of the files are still arriving.
+
+    Parameters:
+        hosts (list): The addresses of the hosts
+        send (function): Called with a host, the key of a file, and the offset and
+            length of a range of it, sending the range to the host
+        workers (int): The number of ranges sent at once
+    """
+
+    def __init__(self, hosts, send, workers=None):
+        self.hosts = hosts
+        self.send = send
+        self._executor = ThreadPoolExecutor(workers or 2 * len(hosts) or 1,
+                                            thread_name_prefix='range-forward')
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _send(self, key, host, offset, length):
+        """Sends a range, recording on success that the host holds it."""
+        try:
+            self.send(host, key, offset, length)
+        except CalledProcessError:
+            return
+        with self._lock:
+            if key in self._files:
+                self._files[key]['sent'][host].append((offset, length))
+
+    def submit(self, key, offset, length):
+        """Starts sending a range of a file to every host.
+
+        Parameters:
+            key (str): Identifies the file
+            offset (int): The offset of the range in bytes
+            length (int): The length of the range in bytes
+        """
+        if length <= 0:
+            return
+        with self._lock:
+            state = self._files.setdefault(key, {'futures': [],
+                                                 'sent': {host: [] for host in self.hosts}})
+            state['futures'].extend(self._executor.submit(self._send, key, host, offset, length)
+                                    for host in self.hosts)
+
+    def finish(self, key, size):
+        """Waits for the ranges of a file to be sent and forgets the file.
+
+        Parameters:
+            key (str): Identifies the file
+            size (int): The size of the file in bytes
+
+        Returns:
+            list: The hosts which were sent the whole file
+        """
+        with self._lock:
+            state = self._files.get(key)
+        if state is None:
+            return []
+        for future in list(state['futures']):
+            future.result()
+        with self._lock:
+            self._files.pop(key, None)
+        complete = []
+        for host, ranges in state['sent'].items():
+            end = 0
+            for offset, length in sorted(ranges):
+                if offset > end:
+                    break
+                end = max(end, offset + length)
+            if end >= size:
+                complete.append(host)
+        return complete
+
+
+def parse_manifest(output):
+    """Parses the output of sha256sum into a manifest.
+
+    Parameters:
+        output (str): The output of sha256sum, one line per file
+
+    Returns:
+        dict: The hex SHA-256 hash of each file, by path
+    """
+    manifest = {}
+    for line in output.splitlines():
+        # sha256sum escapes names holding a backslash or newline, which image names never do
+        if len(line) <= _DIGEST_LENGTH + 2 or line.startswith('\\'):
+            continue
+        manifest[line[_DIGEST_LENGTH + 2:]] = line[:_DIGEST_LENGTH]
+    return manifest
+
+
+def remote_manifest(pool, user, host, remote_directory, paths):
+    """Hashes the files on a host under each of the given paths.
+
+    Hidden files are left out, but the files in hidden directories, such as
+    pre-rendered variants, are not.
+
+    Parameters:
+        pool (SSHConnectionPool): The pool holding the connection to the host
+        user (str): The user to log in to the host as
+        host (str): The address of the host
+        remote_directory (str): The directory the paths are relative to
+        paths (list): The files and directories to hash, which need not exist
+
+    Returns:
+        dict: The hex SHA-256 hash of each file, by path relative to remote_directory
+
+    Raises:
+        CalledProcessError: If the host cannot be reached
+    """
+    if not paths:
+        return {}
+    quoted_paths = ' '.join(shlex.quote(path) for path in paths)
+    # find reports paths which do not exist, which only means the host has no files there
+    command = f"cd {shlex.quote(remote_directory)} 2>/dev/null && " \
+              f"find {quoted_paths} -type f ! -name '.*' -exec sha256sum {{}} + 2>/dev/null; true"
+    return parse_manifest(pool.output(user, host, shlex.quote(command)))
+
+
+def _within(path, scope):
+    """Returns whether a path is one of the paths in scope or lies under one of them."""
+    return any(path == prefix or path.startswith(prefix + '/') for prefix in scope)
+
+
+def plan_sync(manifest, remote, scope=()):
+    """Works out the changes bringing the files on a host up to date.
+
+    Parameters:
+        manifest (dict): The hash the file at each path should have
+        remote (dict): The hash of each file the host holds
+        scope (list): Paths under which the host should hold only the files in manifest
+
+    Returns:
+        SyncPlan: The files to send, hardlink and remove
+    """
+    # Files which are not about to be replaced keep their content, so can be linked from
+    sources = {}
+    for path, digest in sorted(remote.items()):
+        if manifest.get(path, digest) == digest:
+            sources.setdefault(digest, path)
+    send = []
+    sent = {}
+    links = []
+    duplicates = []
+    for path, digest in sorted(manifest.items()):
+        if remote.get(path) == digest:
+            continue
+        if digest in sources:
+            links.append((sources[digest], path))
+        elif digest in sent:
+            duplicates.append((sent[digest], path))
+        else:
+            sent[digest] = path
+            send.append(path)
+    remove = sorted(path for path in remote if path not in manifest and _within(path, scope))
+    return SyncPlan(send, links, duplicates, remove)
+
+
+def apply_sync(pool, user, host, local_directory, remote_directory, plan, directories=()):
+    """Applies a SyncPlan to a host in one ssh session.
+
+    Parameters:
+        pool (SSHConnectionPool): The pool holding the connection to the host
+        user (str): The user to log in to the host as
+        host (str): The address of the host
+        local_directory (str): The directory holding the files to send
+        remote_directory (str): The directory on the host the plan's paths are relative to
+        plan (SyncPlan): The changes to make
+        directories (list): Directories to create on the host, even if left empty
+
+    Raises:
+        CalledProcessError: If the changes fail, or the host cannot be reached
+    """
+    targets = plan.send + [target for _, target in plan.links + plan.duplicates]
+    created = sorted((set(directories) | {posixpath.dirname(path) for path in targets}) - {''})
+    if not targets and not plan.remove and not created:
+        return
+    quoted_directory = shlex.quote(remote_directory)
+    commands = [f'mkdir -p {quoted_directory}', f'cd {quoted_directory}']
+    if created:
+        commands.append('mkdir -p ' + ' '.join(shlex.quote(path) for path in created))
+    # Linked before anything is removed, as a source may be a file which is removed
+    commands.extend(f'ln -f {shlex.quote(source)} {shlex.quote(target)}'
+                    for source, target in plan.links)
+    # Replaced files are removed first, so files hardlinked to them keep their content
+    if plan.remove or plan.send:
+        commands.append('rm -f ' + ' '.join(shlex.quote(path)
+                                            for path in plan.remove + plan.send))
+    if plan.send:
+        commands.append('tar -xf -')
+    commands.extend(f'ln -f {shlex.quote(source)} {shlex.quote(target)}'
+                    for source, target in plan.duplicates)
+    command = ' && '.join(commands)
+    if plan.send:
+        archived = ' '.join(shlex.quote(path) for path in plan.send)
+        pool.pipe(user, host, f'tar -C {shlex.quote(local_directory)} -cf - {archived}', command)
+    else:
+        pool.run(user, host, shlex.quote(command))
+
+
+# Mirrors apply_sync, whose parameters it passes on.
+# pylint: disable=too-many-arguments
+def reconcile(pool, user, host, local_directory, remote_directory, manifest, scope,
+              sources=(), directories=(), verify=None):
+    """Brings the files on a host up to date with a manifest of local files.
+
+    Parameters:
+        pool (SSHConnectionPool): The pool holding the connection to the host
+        user (str): The user to log in to the host as
+        host (str): The address of the host
+        local_directory (str): The directory holding the files, which the paths of the
+            manifest are relative to
+        remote_directory (str): The directory on the host to hold the files
+        manifest (dict): The hex SHA-256 hash of each file, by path
+        scope (list): Paths under which the host should hold only the files in manifest,
+            which must include every path in the manifest
+        sources (list): Further paths on the host which may hold files to link from
+        directories (list): Directories to create on the host, even if left empty
+        verify (function): Called with the paths of the files about to be sent, raising
+            if any of them is damaged
+
+    Returns:
+        dict: The number of files sent, linked and removed
+
+    Raises:
+        CalledProcessError: If the changes fail, or the host cannot be reached
+    """
+    remote = remote_manifest(pool, user, host, remote_directory, list(scope) + list(sources))
+    plan = plan_sync(manifest, remote, scope)
+    if verify is not None:
+        verify(plan.send)
+    apply_sync(pool, user, host, local_directory, remote_directory, plan, directories)
+    return {'sent': len(plan.send), 'linked': len(plan.links) + len(plan.duplicates),
+            'removed': len(plan.remove)}
@@ -0,0 +1,294 @@
+"""Background execution of experiments.
+
+This module runs experiments in background threads, so the request starting an
+experiment can return immediately, and keeps track of each run's status,
+progress and result for the status routes.
+
+An experiment reports its progress by logging "Trial <n> started" and
+"Trial <n> finished" messages, either formatted by the logger, as in
+``experiment_logger.info('Trial %s started', n)``, or already formatted. The
+number of trials is read from the experiment module's NUM_TRIALS attribute,
+which must be set at module level to be known before the experiment runs.
+"""
+
+import json
+import re
+import threading
+import traceback
+import uuid
+from datetime import datetime
+
+from . import trial_log
+from .experiment_logger import close_experiment_logger
+from .vending_machine import ExperimentCancelled
+
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Number of ended runs kept for the status routes, the oldest are forgotten first
+MAX_ENDED_RUNS = 100
+
+
+# A run is a plain record of everything the status routes report
+# pylint: disable=too-many-instance-attributes
+class ExperimentRun:
+    """The state of a single execution of an experiment.
+
+    Parameters:
+        experiment (str): The file name of the experiment being run
+        log_file (str): The name of the log file the run writes to
+        vending_machine (VendingMachine): The machine the experiment controls
+        total_trials (int): The number of trials in the experiment, if known
+    """
+
+    def __init__(self, experiment, log_file, vending_machine, total_trials=None):
+        self.run_id = uuid.uuid4().hex
+        self.experiment = experiment
+        self.log_file = log_file
+        self.vending_machine = vending_machine
+        self.total_trials = total_trials
+        self.current_trial = None
+        self.completed_trials = 0
+        self.outcomes = {}
+        self.status = RUNNING
+        self.started = datetime.now()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self, status, catalog=None):
+        """Records that the run has ended.
+
+        Parameters:
+            status (str): How the run ended, one of FINISHED, FAILED or CANCELLED
+            catalog (LogCatalog): If given, updated before waiters are woken
+        """
+        self.status = status
+        self.finished = datetime.now()
+        if catalog is not None:
+            catalog.record(self)
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Blocks until the run has ended.
+
+        Parameters:
+            timeout (float): The maximum number of seconds to wait
+
+        Returns:
+            bool: True if the run has ended, False if the timeout passed first
+        """
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        """Returns a JSON serializable description of the run."""
+        return {
+            'run_id': self.run_id,
+            'experiment': self.experiment,
+            'log_file': self.log_file,
+            'status': self.status,
+            'current_trial': self.current_trial,
+            'total_trials': self.total_trials,
+            'completed_trials': self.completed_trials,
+            'outcomes': self.outcomes,
+            'started': str(self.started),
+            'finished': str(self.finished) if self.finished else None,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+# Trial log event type of the messages marking trial boundaries
+_TRIAL_EVENTS = {
+    'started': trial_log.TRIAL_STARTED,
+    'finished': trial_log.TRIAL_FINISHED,
+}
+_TRIAL_MESSAGE = re.compile(r'Trial (\d+) (started|finished)')
+
+
+def trial_boundary(msg, args):
+    """Returns the trial log event type and trial number of a message marking the start
+    or end of a trial, or None for any other message.
+
+    Parameters:
+        msg (str): The message, or its format string
+        args (tuple): The arguments formatted into the message
+
+    Returns:
+        tuple: The event type and the trial number
+    """
+    try:
+        text = str(msg) % args if args else str(msg)
+    except (TypeError, ValueError):
+        return None
+    match = _TRIAL_MESSAGE.fullmatch(text)
+    if match is None:
+        return None
+    return _TRIAL_EVENTS[match.group(2)], int(match.group(1))
+
+
+class _ProgressLogger:
+    """Wraps an experiment logger, recording the trial number of each "Trial <n> started"
+    message on the run before passing the message on.
+
+    Trial boundaries also drive the vending machine's trial timer: its marks are
+    cleared when a trial starts, and its latencies are logged when it finishes. Both
+    messages are written to the trial log as TRIAL_STARTED and TRIAL_FINISHED events.
+    When a trial finishes, its last selection is counted in the run's outcomes and the
+    log catalog, if any, is updated."""
+
+    def __init__(self, logger, run, catalog=None):
+        self._logger = logger
+        self._run = run
+        self._catalog = catalog
+
+    def info(self, msg, *args, **kwargs):
+        """Logs an INFO message, updating the run's current trial."""
+        event, trial = trial_boundary(msg, args) or (None, None)
+        if event == trial_log.TRIAL_STARTED:
+            self._run.current_trial = trial
+            self._run.vending_machine.trial_timer.start_trial(trial)
+            self._run.vending_machine.last_selection = None
+        if event is not None:
+            kwargs['extra'] = dict(kwargs.get('extra') or {},
+                                   trial_events=[{'event': event, 'trial': trial}])
+        self._logger.info(msg, *args, **kwargs)
+        if event == trial_log.TRIAL_FINISHED:
+            self._run.vending_machine.trial_timer.log(self._logger)
+            self._run.completed_trials += 1
+            selection = self._run.vending_machine.last_selection
+            if selection is not None:
+                self._run.outcomes[selection] = self._run.outcomes.get(selection, 0) + 1
+            if self._catalog is not None:
+                self._catalog.record(self._run)
+
+    def __getattr__(self, name):
+        return getattr(self._logger, name)
+
+
+class RunManager:
+    """Starts experiments in background threads and keeps track of their runs.
+
+    Only one experiment may run at a time, since every run controls the same machine.
+
+    Parameters:
+        max_ended_runs (int): The number of ended runs to keep, the oldest are forgotten
+            when a new run starts
+    """
+
+    def __init__(self, max_ended_runs=MAX_ENDED_RUNS):
+        self.max_ended_runs = max_ended_runs
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    # Everything the run needs is handed over as it starts
+    # pylint: disable=too-many-arguments
+    def start(self, run, run_experiment, experiment_logger, signal_transport, catalog=None):
+        """Starts running an experiment in a background thread.
+
+        Parameters:
+            run (ExperimentRun): The run to start
+            run_experiment (function): The experiment's run_experiment function
+            experiment_logger (Logger): The logger the experiment writes to
+            signal_transport: The transport delivering monitor pi signals to the run's
+                vending machine for as long as the run lasts
+            catalog (LogCatalog): The catalog recording the run's log, if any
+
+        Returns:
+            ExperimentRun: The started run
+
+        Raises:
+            RuntimeError: If another experiment is still running, in this process or,
+                for transports shared between processes, in any other
+        """
+        with self._lock:
+            active = self._active()
+            if active is not None:
+                raise RuntimeError(f'Experiment {active.experiment} is already running')
+            signal_transport.subscribe(run.vending_machine.receive_signal)
+            self._forget_ended_runs()
+            self._runs[run.run_id] = run
+        if catalog is not None:
+            catalog.record(run)
+        thread = threading.Thread(target=self._execute,
+                                  args=(run, run_experiment, experiment_logger, signal_transport,
+                                        catalog),
+                                  name=f'experiment-{run.run_id}', daemon=True)
+        thread.start()
+        return run
+
+    @staticmethod
+    def _execute(run, run_experiment, experiment_logger, signal_transport, catalog):
+        """Runs the experiment and records how it ended. The signal transport is released
+        and the logger closed before the run is marked as ended, so waiters see the
+        transport free and the complete log."""
+        try:
+            with run.vending_machine:
+                result = run_experiment(_ProgressLogger(experiment_logger, run, catalog),
+                                        run.vending_machine)
+            try:
+                json.dumps(result)
+                run.result = result
+            except TypeError:
+                run.result = str(result)
+            status = FINISHED
+        except ExperimentCancelled:
+            experiment_logger.info('Experiment cancelled')
+            status = CANCELLED
+        # Any failure of user supplied experiment code must be recorded on the run
+        except Exception as error:  # pylint: disable=broad-except
+            experiment_logger.info('Experiment failed: %s', error)
+            run.error = ''.join(traceback.format_exception_only(type(error), error)).strip()
+            status = FAILED
+        finally:
+            signal_transport.unsubscribe()
+            close_experiment_logger(experiment_logger)
+        run.finish(status, catalog)
+
+    def _forget_ended_runs(self):
+        """Forgets the oldest ended runs, leaving room for one more than max_ended_runs
+        runs to have ended. Must be called with the lock held."""
+        ended = [run_id for run_id, run in self._runs.items() if run.status != RUNNING]
+        for run_id in ended[:max(0, len(ended) - self.max_ended_runs + 1)]:
+            del self._runs[run_id]
+
+    def _active(self):
+        """Returns the run currently executing, if any. Must be called with the lock held."""
+        for run in self._runs.values():
+            if run.status == RUNNING:
+                return run
+        return None
+
+    def active(self):
+        """Returns the run currently executing, or None."""
+        with self._lock:
+            return self._active()
+
+    def get(self, run_id):
+        """Returns the run with the given identifier, or None."""
+        with self._lock:
+            return self._runs.get(run_id)
+
+    def runs(self):
+        """Returns every run started by this manager, oldest first."""
+        with self._lock:
+            return list(self._runs.values())
+
+    def cancel(self, run_id):
+        """Requests cancellation of a run. The experiment stops the next time it
+        waits for input or changes the stimuli on the machine.
+
+        Parameters:
+            run_id (str): The identifier of the run to cancel
+
+        Returns:
+            bool: True if the run was running and has been asked to stop
+        """
+        run = self.get(run_id)
+        if run is None or run.status != RUNNING:
+            return False
+        run.vending_machine.cancel()
+        return True
@@ -0,0 +1,212 @@
+"""Delivery of monitor pi signals to the running experiment.
+
+The sensor pis POST their signals to /signal, which may be handled by any of
+the server's worker processes, while the experiment runs in just one of them.
+A signal transport carries each signal from whichever process received it to
+the process running the experiment.
+
+Two transports are provided. LocalSignalTransport delivers signals within a
+single process. UnixSocketSignalTransport delivers them through a Unix domain
+datagram socket which the experiment's process listens on, so any process on
+the machine can publish to it. The listening process holds an exclusive flock on
+a lock file next to the socket, so only one process at a time replaces and binds
+the socket, and a subscriber which died without unbinding releases it.
+"""
+
+import fcntl
+import os
+import socket
+import threading
+import uuid
+
+
+class SignalTransportBusy(RuntimeError):
+    """Raised when subscribing while another subscriber is still listening."""
+
+
+class LocalSignalTransport:
+    """Delivers signals to a subscriber in the same process."""
+
+    def __init__(self):
+        self._callback = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Starts delivering published signals to a callback.
+
+        Parameters:
+            callback (function): Called with the address of each signal's sender
+
+        Raises:
+            SignalTransportBusy: If another callback is already subscribed
+        """
+        with self._lock:
+            if self._callback is not None:
+                raise SignalTransportBusy('Another experiment is receiving signals')
+            self._callback = callback
+
+    def unsubscribe(self):
+        """Stops delivering signals to the subscribed callback."""
+        with self._lock:
+            self._callback = None
+
+    def busy(self):
+        """Returns whether a callback is subscribed."""
+        with self._lock:
+            return self._callback is not None
+
+    def publish(self, address):
+        """Delivers a signal to the subscriber.
+
+        Parameters:
+            address (str): The address of the monitor pi which sent the signal
+
+        Returns:
+            bool: True if the signal was delivered, False if nothing is subscribed
+        """
+        with self._lock:
+            callback = self._callback
+        if callback is None:
+            return False
+        callback(address)
+        return True
+
+
+class UnixSocketSignalTransport:
+    """Delivers signals to a subscriber in any process through a Unix domain socket.
+
+    The subscriber binds a datagram socket at *path* and receives signals on a
+    background thread. Publishers send one datagram per signal, so publishing costs a
+    single system call and needs no connection. The subscriber holds a lock on
+    *path*.lock for as long as it listens.
+
+    Parameters:
+        path (str): The filesystem path of the socket
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock_file = None
+        self._socket = None
+        self._thread = None
+        self._stop_token = None
+        self._publisher = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Starts delivering published signals to a callback, on a background thread.
+
+        Parameters:
+            callback (function): Called with the address of each signal's sender
+
+        Raises:
+            SignalTransportBusy: If a subscriber in any process is already listening
+        """
+        with self._lock:
+            if self._socket is not None or not self._acquire():
+                raise SignalTransportBusy('Another experiment is receiving signals')
+            try:
+                # Left behind by a subscriber which died without unbinding it
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                receiver.bind(self.path)
+            except OSError:
+                receiver.close()
+                self._release()
+                raise
+            self._socket = receiver
+            self._stop_token = uuid.uuid4().bytes
+            self._thread = threading.Thread(target=self._receive,
+                                            args=(receiver, self._stop_token, callback),
+                                            name='signal-subscriber', daemon=True)
+            self._thread.start()
+
+    def unsubscribe(self):
+        """Stops receiving signals and removes the socket."""
+        with self._lock:
+            if self._socket is None:
+                return
+            self._publisher.sendto(self._stop_token, self.path)
+            self._thread.join()
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self._release()
+
+    def busy(self):
+        """Returns whether a subscriber in any process is listening."""
+        with self._lock:
+            if self._socket is not None:
+                return True
+            if not self._acquire():
+                return True
+            self._release()
+            return False
+
+    def publish(self, address):
+        """Sends a signal to the subscriber.
+
+        Parameters:
+            address (str): The address of the monitor pi which sent the signal
+
+        Returns:
+            bool: True if the signal was delivered, False if nothing is subscribed
+        """
+        try:
+            self._publisher.sendto(address.encode(), self.path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+        return True
+
+    def _acquire(self):
+        """Takes the lock held by the subscriber, without waiting. Must be called with
+        the thread lock held.
+
+        Returns:
+            bool: Whether the lock was taken, rather than held by another subscriber
+        """
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _release(self):
+        """Releases the lock held by the subscriber. Must be called with the thread lock
+        held."""
+        self._lock_file.close()
+        self._lock_file = None
+
+    @staticmethod
+    def _receive(receiver, stop_token, callback):
+        """Passes received signals to the callback until the stop token arrives."""
+        while True:
+            data = receiver.recv(1024)
+            if data == stop_token:
+                return
+            if data:
+                callback(data.decode())
+
+
+def create_signal_transport(config):
+    """Creates the signal transport selected by the application config.
+
+    Parameters:
+        config (dict): Should contain SIGNAL_TRANSPORT, either 'local' or 'unix', and
+            for 'unix' SIGNAL_SOCKET_PATH, the path of the socket
+
+    Returns:
+        The configured signal transport
+    """
+    if config.get('SIGNAL_TRANSPORT', 'local') == 'unix':
+        return UnixSocketSignalTransport(config['SIGNAL_SOCKET_PATH'])
+    return LocalSignalTransport()
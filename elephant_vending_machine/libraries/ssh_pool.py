@@ -0,0 +1,206 @@
+"""Persistent SSH connections to the remote Pis.
+
+This module runs every ssh and scp call to a remote host over one long-lived
+OpenSSH ControlMaster connection per host. Only the first command to a host pays
+for the TCP and key exchange handshake, later commands are multiplexed over the
+existing connection.
+"""
+
+import os
+import shlex
+import subprocess
+import threading
+import time
+from subprocess import CalledProcessError
+
+# ssh exits with 255 when the connection itself failed, rather than the remote command
+SSH_CONNECTION_ERROR = 255
+
+
+# Each pool setting is kept as an attribute, next to the per host state
+# pylint: disable=too-many-instance-attributes
+class SSHConnectionPool:
+    """Shares one multiplexed OpenSSH connection per remote host.
+
+    Commands are run through the ssh and scp clients with ControlMaster=auto, so the
+    master connection is opened on first use and kept alive for *control_persist*
+    seconds after the last command. Connections are health checked before use, and
+    commands failing because the connection dropped are retried on a fresh connection
+    with exponential backoff.
+
+    Parameters:
+        identity_file (str): The path to the private key used to authenticate with the hosts
+        control_directory (str): The directory in which the control sockets are created
+        control_persist (int): The number of seconds an idle connection is kept open
+        max_sessions_per_host (int): The number of commands allowed to run at once on
+            a single host, should not exceed MaxSessions in the hosts' sshd_config
+        retries (int): The number of times to reconnect before giving up on a command
+        backoff (float): The number of seconds to wait before the first reconnect,
+            doubled after each failed attempt
+        health_check_interval (float): The minimum number of seconds between health
+            checks of the same connection
+        port (int): The port sshd listens on on the remote hosts
+    """
+
+    # Pool settings are deliberately all exposed as parameters.
+    # pylint: disable=too-many-arguments
+    def __init__(self, identity_file='/root/.ssh/id_rsa', control_directory='/tmp/evm_ssh',
+                 control_persist=600, max_sessions_per_host=8, retries=3, backoff=0.5,
+                 health_check_interval=30, port=22):
+        self.identity_file = identity_file
+        self.control_directory = control_directory
+        self.control_persist = control_persist
+        self.max_sessions_per_host = max_sessions_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.health_check_interval = health_check_interval
+        self.port = port
+        self._host_limits = {}
+        self._last_checked = {}
+        self._lock = threading.Lock()
+
+    def options(self):
+        """Returns the ssh options shared by every ssh and scp command of the pool.
+
+        Returns:
+            str: ssh command line options selecting the shared control connection
+        """
+        control_path = os.path.join(self.control_directory, '%C')
+        return f'''-oStrictHostKeyChecking=accept-new -i {self.identity_file} \
+-oControlMaster=auto -oControlPath={control_path} -oControlPersist={self.control_persist}'''
+
+    def run(self, user, host, command):
+        """Runs a command on a remote host over its shared connection.
+
+        Parameters:
+            user (str): The user to log in to the remote host as
+            host (str): The address of the remote host
+            command (str): The shell command to run on the remote host
+
+        Raises:
+            CalledProcessError: If the command fails, or the host cannot be reached
+        """
+        return self._run(user, host,
+                         f'ssh {self.options()} -p {self.port} {user}@{host} {command}')
+
+    def output(self, user, host, command):
+        """Runs a command on a remote host over its shared connection and returns what
+        it printed.
+
+        Parameters:
+            user (str): The user to log in to the remote host as
+            host (str): The address of the remote host
+            command (str): The shell command to run on the remote host
+
+        Returns:
+            str: The standard output of the command
+
+        Raises:
+            CalledProcessError: If the command fails, or the host cannot be reached
+        """
+        return self._run(user, host, f'ssh {self.options()} -p {self.port} {user}@{host} {command}',
+                         stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+    def copy(self, user, host, local_path, remote_path):
+        """Copies a local file to a remote host over its shared connection.
+
+        Parameters:
+            user (str): The user to log in to the remote host as
+            host (str): The address of the remote host
+            local_path (str): The path of the local file to be copied
+            remote_path (str): The path on the remote host to copy the file to
+
+        Raises:
+            CalledProcessError: If the copy fails, or the host cannot be reached
+        """
+        return self._run(user, host, f'scp {self.options()} -P {self.port} {local_path} '
+                                     f'{user}@{host}:{remote_path}')
+
+    def pipe(self, user, host, local_command, command):
+        """Runs a command on a remote host with the output of a local command as its
+        input, in a single session over the host's shared connection.
+
+        Parameters:
+            user (str): The user to log in to the remote host as
+            host (str): The address of the remote host
+            local_command (str): The shell command whose output is sent
+            command (str): The shell command to run on the remote host, quoted as a
+                whole so it may contain shell operators
+
+        Raises:
+            CalledProcessError: If the remote command fails, or the host cannot be reached
+        """
+        return self._run(user, host, f'{local_command} | ssh {self.options()} -p {self.port} '
+                                     f'{user}@{host} {shlex.quote(command)}')
+
+    def check(self, user, host):
+        """Checks whether the shared connection to a host is open and responsive.
+
+        Parameters:
+            user (str): The user logged in to the remote host
+            host (str): The address of the remote host
+
+        Returns:
+            bool: True if a master connection to the host is alive, False otherwise
+        """
+        try:
+            subprocess.run(f'ssh {self.options()} -p {self.port} -O check {user}@{host} '
+                           '2>/dev/null', check=True, shell=True)
+        except CalledProcessError:
+            return False
+        return True
+
+    def close(self, user, host):
+        """Closes the shared connection to a host, if one is open.
+
+        Parameters:
+            user (str): The user logged in to the remote host
+            host (str): The address of the remote host
+        """
+        try:
+            subprocess.run(f'ssh {self.options()} -p {self.port} -O exit {user}@{host} 2>/dev/null',
+                           check=True, shell=True)
+        except CalledProcessError:
+            pass
+        with self._lock:
+            self._last_checked.pop(host, None)
+
+    def _host_limit(self, host):
+        """Returns the semaphore limiting concurrent commands on a host."""
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_sessions_per_host)
+            return self._host_limits[host]
+
+    def _ensure_healthy(self, user, host):
+        """Tears down the connection to a host if it is stale, so the next command
+        opens a fresh one. Checks at most once per health_check_interval."""
+        now = time.monotonic()
+        with self._lock:
+            last_checked = self._last_checked.get(host)
+            if last_checked is not None and now - last_checked < self.health_check_interval:
+                return
+            self._last_checked[host] = now
+        if not self.check(user, host):
+            self.close(user, host)
+
+    def _run(self, user, host, command, **options):
+        """Runs an ssh or scp command, reconnecting with backoff if the connection fails.
+        Any options are passed on to subprocess.run."""
+        os.makedirs(self.control_directory, mode=0o700, exist_ok=True)
+        delay = self.backoff
+        with self._host_limit(host):
+            self._ensure_healthy(user, host)
+            for attempt in range(self.retries + 1):
+                try:
+                    return subprocess.run(command, check=True, shell=True, **options)
+                except CalledProcessError as error:
+                    if error.returncode != SSH_CONNECTION_ERROR or attempt == self.retries:
+                        raise
+                self.close(user, host)
+                time.sleep(delay)
+                delay *= 2
+        return None
+
+
+DEFAULT_POOL = SSHConnectionPool()
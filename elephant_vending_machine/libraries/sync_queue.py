@@ -0,0 +1,335 @@
+"""Durable queue of the changes to make to the images on the remote hosts.
+
+Uploading, copying or deleting images and creating or deleting groups used to
+change every monitor pi before the request returned, and failed the request
+when one pi could not be reached. Instead, the change is made locally and the
+matching job is queued for each pi in a small SQLite database, so the request
+returns at once and queued jobs survive a restart.
+
+Each host has a worker thread which takes every job queued for it and performs
+them together, in as few ssh sessions as possible. When that fails, the jobs
+stay queued and the host is retried after a delay which doubles with each
+failure, without holding up the other hosts. Every server process runs these
+workers on the same database, so a worker first leases its host there, and the
+jobs of a host are only ever performed by one process at a time.
+
+A host only ever needs the latest state of each image, so jobs are coalesced:
+there is at most one job per host and path, and a job queued for an image or
+group replaces the one already queued for it. An image uploaded and deleted
+again before a pi was reachable is only deleted there, and deleting a group
+drops the jobs queued for its images. Creating a group again replaces the
+queued removal, but empties the group on the host as the removal would have.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from subprocess import CalledProcessError
+
+LOGGER = logging.getLogger(__name__)
+
+# Jobs for an image, whose path is group/name. The source of a push or delete is a
+# file left over on the host, such as a partially forwarded upload, to remove too.
+PUSH = 'push'
+DELETE = 'delete'
+# Hardlinks the image from its source on the host, if it holds the same content there
+LINK = 'link'
+# Renames the image into place from its source, an upload already forwarded in full
+RENAME = 'rename'
+# Jobs for a group, whose path is the group's name
+CREATE = 'create'
+REMOVE = 'remove'
+GROUP_ACTIONS = (CREATE, REMOVE)
+# Brings every image of a group up to date from their hashes, such as after the host was
+# re-imaged. Its path is the group's name followed by a slash, so it is dropped along
+# with the jobs of the group's images.
+RECONCILE = 'reconcile'
+
+# Number of seconds before a host is retried after its first failure
+RETRY_DELAY = 5
+# Largest number of seconds between the retries of a host
+MAX_RETRY_DELAY = 10 * 60
+# Number of seconds a worker may take to perform the jobs of a host it leased, after
+# which another process may lease it, such as when the one holding it was killed
+LEASE_DURATION = 15 * 60
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    host TEXT NOT NULL,
+    path TEXT NOT NULL,
+    action TEXT NOT NULL,
+    source TEXT,
+    queued REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (host, path)
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    failures INTEGER NOT NULL DEFAULT 0,
+    retry_at REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    lease_until REAL NOT NULL DEFAULT 0
+);
+'''
+
+Job = namedtuple('Job', ['action', 'path', 'source'])
+Job.__new__.__defaults__ = (None,)
+Job.__doc__ = """A change to make on a host.
+
+Parameters:
+    action (str): What to do, one of the actions defined in this module
+    path (str): The image, as group/name, or the group the action applies to
+    source (str): The path of a related file on the host, as described for the action
+"""
+
+
+def _timestamp(seconds):
+    """Formats a time as the run and log times are, or returns None if it is not set."""
+    return str(datetime.fromtimestamp(seconds)) if seconds else None
+
+
+def _host_status():
+    """Returns the status of a host with no jobs queued, which is not failing."""
+    return {'pending': [], 'failed': [], 'failures': 0, 'error': None, 'retry_at': None}
+
+
+def describe_error(error):
+    """Returns a short description of the error a host failed with."""
+    if isinstance(error, CalledProcessError):
+        return f'exit status {error.returncode}'
+    return str(error) or type(error).__name__
+
+
+# The workers share their lock, condition and bookkeeping next to the queue settings
+# pylint: disable=too-many-instance-attributes
+class SyncQueue:
+    """Queues jobs for each host in a SQLite database and performs them in the
+    background.
+
+    Parameters:
+        database (str): The path of the SQLite database, created if it does not exist
+        hosts (list): The addresses of the hosts
+        perform (function): Called with a host and the list of its Jobs, in the order
+            they were queued, to perform them; raises if they failed
+        retry_delay (float): The number of seconds before a host is retried after its
+            first failure
+        max_retry_delay (float): The largest number of seconds between retries
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, database, hosts, perform, retry_delay=RETRY_DELAY,
+                 max_retry_delay=MAX_RETRY_DELAY):
+        self.hosts = list(hosts)
+        self.perform = perform
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._connection = sqlite3.connect(database, check_same_thread=False, timeout=10)
+        self._connection.row_factory = sqlite3.Row
+        self._condition = threading.Condition()
+        # Hosts whose worker may have jobs due
+        self._busy = set(self.hosts)
+        self._threads = []
+        self._stopped = False
+        with self._condition, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(_SCHEMA)
+
+    def start(self):
+        """Starts a worker thread for each host, which first performs any jobs left
+        queued when the queue was last stopped."""
+        for host in self.hosts:
+            thread = threading.Thread(target=self._work, args=(host,), name=f'sync-{host}',
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self):
+        """Stops the worker threads once they have finished the jobs they are performing.
+        Jobs still queued stay in the database."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def close(self):
+        """Closes the database connection."""
+        self._connection.close()
+
+    def enqueue(self, jobs, hosts=None):
+        """Queues jobs for hosts, replacing the jobs already queued for the same paths.
+
+        Parameters:
+            jobs (list): The Jobs, in the order to perform them
+            hosts (list): The hosts to perform them on, by default every host
+        """
+        hosts = self.hosts if hosts is None else hosts
+        now = time.time()
+        with self._condition:
+            with self._connection:
+                for host in hosts:
+                    for job in jobs:
+                        self._replace(host, job, now)
+            self._busy.update(hosts)
+            self._condition.notify_all()
+
+    def _replace(self, host, job, now):
+        """Queues a job in place of the one queued for its path. Must be called with the
+        lock held, in a transaction."""
+        source = job.source
+        if job.action in GROUP_ACTIONS:
+            # The images of a group about to be removed or created afresh need no jobs
+            self._connection.execute(
+                'DELETE FROM jobs WHERE host = ? AND substr(path, 1, ?) = ?',
+                (host, len(job.path) + 1, job.path + '/'))
+        elif source is None and job.action in (PUSH, DELETE):
+            # A left over file the replaced job was to remove still needs removing
+            replaced = self._connection.execute(
+                'SELECT action, source FROM jobs WHERE host = ? AND path = ?',
+                (host, job.path)).fetchone()
+            if replaced is not None and replaced['action'] != LINK:
+                source = replaced['source']
+        self._connection.execute(
+            '''INSERT OR REPLACE INTO jobs (host, path, action, source, queued)
+               VALUES (?, ?, ?, ?, ?)''', (host, job.path, job.action, source, now))
+
+    def _claim(self, host, now):
+        """Leases a host and returns the ids and Jobs queued for it, unless it is waiting
+        to be retried or leased by another process, and then returns the number of
+        seconds until it no longer is, or None if it has no jobs. Must be called with the
+        lock held."""
+        with self._connection:
+            # Takes the write lock of the database at once, so no other process reads
+            # the host as free before it is leased
+            self._connection.execute('BEGIN IMMEDIATE')
+            state = self._connection.execute(
+                'SELECT retry_at, lease_until FROM hosts WHERE host = ?', (host,)).fetchone()
+            rows = self._connection.execute(
+                'SELECT id, action, path, source FROM jobs WHERE host = ? ORDER BY id',
+                (host,)).fetchall()
+            if not rows:
+                return None
+            if state is not None and max(state['retry_at'], state['lease_until']) > now:
+                return max(state['retry_at'], state['lease_until']) - now
+            self._connection.execute('INSERT OR IGNORE INTO hosts (host) VALUES (?)', (host,))
+            self._connection.execute('UPDATE hosts SET lease_until = ? WHERE host = ?',
+                                     (now + LEASE_DURATION, host))
+        return [(row['id'], Job(row['action'], row['path'], row['source'])) for row in rows]
+
+    def run_once(self, host):
+        """Performs every job queued for a host, unless it is waiting to be retried.
+
+        Parameters:
+            host (str): The address of the host
+
+        Returns:
+            bool: Whether any jobs were performed, successfully or not
+        """
+        with self._condition:
+            due = self._claim(host, time.time())
+        if not isinstance(due, list):
+            return False
+        self._perform(host, due)
+        return True
+
+    def _perform(self, host, due):
+        """Performs the jobs claimed for a host and releases its lease, dropping the jobs
+        if they succeeded and otherwise scheduling their retry."""
+        ids = [job_id for job_id, _ in due]
+        try:
+            self.perform(host, [job for _, job in due])
+        # Any error fails the jobs, which are kept to be retried, rather than the worker
+        # pylint: disable=broad-except
+        except Exception as error:
+            LOGGER.warning('Could not sync %d jobs to %s: %s', len(ids), host, error)
+            self._record_failure(host, ids, describe_error(error))
+        else:
+            with self._condition, self._connection:
+                self._connection.executemany('DELETE FROM jobs WHERE id = ?',
+                                             [(job_id,) for job_id in ids])
+                self._connection.execute('DELETE FROM hosts WHERE host = ?', (host,))
+
+    def _record_failure(self, host, ids, error):
+        """Schedules the retry of a host after its jobs failed, releasing its lease."""
+        marks = ', '.join('?' * len(ids))
+        with self._condition, self._connection:
+            row = self._connection.execute('SELECT failures FROM hosts WHERE host = ?',
+                                           (host,)).fetchone()
+            failures = 1 if row is None else row['failures'] + 1
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** (failures - 1))
+            self._connection.execute(
+                '''INSERT OR REPLACE INTO hosts (host, failures, retry_at, error)
+                   VALUES (?, ?, ?, ?)''',
+                (host, failures, time.time() + delay, error))
+            self._connection.execute(
+                f'UPDATE jobs SET attempts = attempts + 1 WHERE id IN ({marks})', ids)
+            # The host may not hold the files to link or rename from, such as after it was
+            # re-imaged, so those images are sent in full when it is retried
+            self._connection.execute(
+                f"UPDATE jobs SET action = ?, source = NULL WHERE action = ? AND id IN ({marks})",
+                [PUSH, LINK] + ids)
+            self._connection.execute(
+                f"UPDATE jobs SET action = ? WHERE action = ? AND id IN ({marks})",
+                [PUSH, RENAME] + ids)
+
+    def _work(self, host):
+        """Performs the jobs of a host as they become due, until the queue is shut down."""
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    due = self._claim(host, time.time())
+                    if isinstance(due, list):
+                        break
+                    self._busy.discard(host)
+                    self._condition.notify_all()
+                    self._condition.wait(due)
+                    # Woken by new jobs, or as the retry or lease expiry became due
+                    self._busy.add(host)
+                if self._stopped:
+                    return
+            self._perform(host, due)
+
+    def wait(self, timeout=None):
+        """Waits until no host has jobs due, because every job was performed or the hosts
+        whose jobs failed are waiting to be retried.
+
+        Parameters:
+            timeout (float): The largest number of seconds to wait
+
+        Returns:
+            bool: Whether no host has jobs due, rather than the timeout having passed
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._busy & set(self.hosts), timeout)
+
+    def status(self):
+        """Returns the jobs queued for each host and whether it is failing.
+
+        Returns:
+            dict: For each host, its queued jobs, split into those which are pending and
+            those which already failed, each with its action, path, the time it was
+            queued and the number of times it failed, and for a failing host the number
+            of times in a row it failed, its last error and when it will be retried
+        """
+        with self._condition:
+            jobs = self._connection.execute(
+                'SELECT host, action, path, queued, attempts FROM jobs ORDER BY id').fetchall()
+            failing = self._connection.execute(
+                'SELECT host, failures, retry_at, error FROM hosts').fetchall()
+        hosts = {host: _host_status() for host in self.hosts}
+        for row in failing:
+            hosts.setdefault(row['host'], _host_status()).update(
+                failures=row['failures'], error=row['error'],
+                retry_at=_timestamp(row['retry_at']))
+        for row in jobs:
+            host = hosts.setdefault(row['host'], _host_status())
+            host['failed' if row['attempts'] else 'pending'].append(
+                {'action': row['action'], 'path': row['path'],
+                 'queued': _timestamp(row['queued']), 'attempts': row['attempts']})
+        return hosts
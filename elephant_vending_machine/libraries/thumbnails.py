@@ -0,0 +1,200 @@
+"""Downscaled variants of stimulus images for the front-end.
+
+Showing a grid of stimuli does not need the full resolution images, which can
+be up to 100MB each. When an image is uploaded or copied, a small thumbnail and
+a screen sized preview are rendered by a pool of background threads, so the
+request does not wait for them.
+
+Variants are content-addressed: each is stored under the SHA-256 hash of the
+image it was rendered from, so an image copied to another group, or uploaded
+again, is never rendered twice. Variants are JPEG files; transparent parts of
+an image are rendered black, the colour of the screens behind the stimuli.
+A variant which could not be rendered, such as that of an SVG image, leaves an
+empty marker file in its place, so it is not attempted again with every
+listing.
+
+Rendering needs Pillow. Without it no variants are rendered, and listings
+report that images have none.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+LOGGER = logging.getLogger(__name__)
+
+# Largest width and height of each variant
+VARIANTS = {
+    'thumbnail': (256, 256),
+    'preview': (1920, 1080),
+}
+WORKERS = 2
+JPEG_QUALITY = 85
+# Extension of the marker left by a variant which could not be rendered
+FAILED_EXTENSION = '.failed'
+
+
+def flatten(image):
+    """Converts an image to RGB, rendering any transparent parts black.
+
+    Parameters:
+        image (PIL.Image.Image): The image to convert
+
+    Returns:
+        PIL.Image.Image: The RGB image
+    """
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size)
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def render_variant(source, target, size):
+    """Scales an image down to fit within a size and saves it as a JPEG.
+
+    The image is written to a temporary file first, so a variant which exists is
+    always complete.
+
+    Parameters:
+        source (str): The path of the image
+        target (str): The path of the variant
+        size (tuple): The largest width and height of the variant
+
+    Raises:
+        OSError: If the image cannot be read or is not in a format Pillow supports
+    """
+    with Image.open(source) as image:
+        # Lets JPEG images be decoded at a reduced scale, which is much faster
+        image.draft('RGB', size)
+        image.thumbnail(size)
+        image = flatten(image)
+        temporary_path = target + '.tmp'
+        image.save(temporary_path, 'JPEG', quality=JPEG_QUALITY)
+    os.replace(temporary_path, target)
+
+
+class ThumbnailPipeline:
+    """Renders the variants of images in background threads, storing them by hash.
+
+    Parameters:
+        directory (str): The directory holding the variants
+        variants (dict): The largest width and height of each variant, by name
+        workers (int): The number of rendering threads
+    """
+
+    def __init__(self, directory, variants=None, workers=WORKERS):
+        self.directory = directory
+        self.variants = VARIANTS if variants is None else variants
+        self.workers = workers
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        """Whether variants can be rendered, which requires Pillow."""
+        return Image is not None
+
+    @staticmethod
+    def variant_name(digest, variant):
+        """Returns the path of a variant relative to the variant directory.
+
+        Parameters:
+            digest (str): The hex SHA-256 hash of the image
+            variant (str): The name of the variant
+
+        Returns:
+            str: The relative path, in a subdirectory named by the first two characters
+            of the hash so no directory grows too large
+        """
+        return f'{digest[:2]}/{digest}-{variant}.jpg'
+
+    @staticmethod
+    def _mark_failed(target):
+        """Leaves the marker of a variant which could not be rendered."""
+        try:
+            with open(target + FAILED_EXTENSION, 'w'):
+                pass
+        except OSError as error:
+            LOGGER.warning('Could not mark %s as failed: %s', target, error)
+
+    def _render(self, source, digest, variant):
+        """Renders one variant, logging rather than raising any error."""
+        target = os.path.join(self.directory, self.variant_name(digest, variant))
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            render_variant(source, target, self.variants[variant])
+        # Pillow raises many error types for damaged or unsupported images
+        # pylint: disable=broad-except
+        except Exception as error:
+            LOGGER.warning('Could not render the %s of %s: %s', variant, source, error)
+            self._mark_failed(target)
+        finally:
+            with self._lock:
+                self._pending.pop((digest, variant), None)
+
+    def submit(self, source, digest):
+        """Starts rendering the variants of an image which do not exist yet.
+
+        Parameters:
+            source (str): The path of the image
+            digest (str): The hex SHA-256 hash of the image
+
+        Returns:
+            list: A Future for each variant being rendered, empty if every variant
+            exists, failed before, is already being rendered or Pillow is not installed
+        """
+        if not self.available:
+            return []
+        futures = []
+        for variant in self.variants:
+            key = (digest, variant)
+            target = os.path.join(self.directory, self.variant_name(digest, variant))
+            if os.path.exists(target) or os.path.exists(target + FAILED_EXTENSION):
+                continue
+            with self._lock:
+                if key in self._pending:
+                    continue
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers,
+                                                        thread_name_prefix='thumbnail')
+                future = self._pending[key] = self._executor.submit(self._render, source, digest,
+                                                                    variant)
+            futures.append(future)
+        return futures
+
+    def variant(self, source, digest, variant):
+        """Returns the variant of an image if it has been rendered, otherwise starts
+        rendering it, so images stored before the pipeline existed get variants too.
+
+        Parameters:
+            source (str): The path of the image
+            digest (str): The hex SHA-256 hash of the image
+            variant (str): The name of the variant
+
+        Returns:
+            str: The path of the variant relative to the variant directory, or None if
+            it does not exist yet or could not be rendered
+        """
+        name = self.variant_name(digest, variant)
+        if os.path.exists(os.path.join(self.directory, name)):
+            return name
+        self.submit(source, digest)
+        return None
+
+    def shutdown(self):
+        """Waits for the variants being rendered and stops the rendering threads."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,229 @@
+"""Structured binary log of the events in each trial of an experiment.
+
+Alongside the csv log, each experiment can write a trial log: an append-only
+stream of length-prefixed records with typed fields, so analysis does not have
+to parse the free text of the csv log. Each record holds the time it was
+logged, the trial number, the event type, the screen, an image name, a latency
+in milliseconds and, for free text log lines, the message.
+
+The file starts with MAGIC. Each record is a 4 byte little-endian length
+followed by that many bytes of payload, so a reader can skip records it does
+not understand and ignores a record cut short by a crash.
+"""
+
+import csv
+import io
+import json
+import math
+import struct
+
+MAGIC = b'EVMTRL01'
+TRIAL_LOG_EXTENSION = '.trials'
+
+# Event types
+MESSAGE = 0
+TRIAL_STARTED = 1
+TRIAL_FINISHED = 2
+STIMULUS_SHOWN = 3
+DISPLAY_LATENCY = 4
+REACTION_TIME = 5
+DISPENSE_LATENCY = 6
+EVENT_NAMES = {
+    MESSAGE: 'message',
+    TRIAL_STARTED: 'trial_started',
+    TRIAL_FINISHED: 'trial_finished',
+    STIMULUS_SHOWN: 'stimulus_shown',
+    DISPLAY_LATENCY: 'display_latency',
+    REACTION_TIME: 'reaction_time',
+    DISPENSE_LATENCY: 'dispense_latency',
+}
+
+SCREENS = (None, 'left', 'middle', 'right')
+FIELDS = ('time', 'trial', 'event', 'screen', 'image', 'latency_ms', 'message')
+
+_LENGTH = struct.Struct('<I')
+# time, trial, event, screen, latency, image length, message length
+_FIXED = struct.Struct('<dIBBdHI')
+_NO_TRIAL = 0xFFFFFFFF
+# Number of characters of csv text exported at a time
+CSV_CHUNK_SIZE = 64 * 1024
+
+
+def trial_log_name(log_file):
+    """Returns the name of the trial log written next to a csv log.
+
+    Parameters:
+        log_file (str): The name or path of the csv log
+
+    Returns:
+        str: The name or path of the trial log
+    """
+    if log_file.endswith('.csv'):
+        log_file = log_file[:-len('.csv')]
+    return log_file + TRIAL_LOG_EXTENSION
+
+
+def encode_event(created, event=MESSAGE, *, trial=None, screen=None, image='', latency=None,
+                 message=''):
+    """Encodes one event as a trial log record.
+
+    Parameters:
+        created (float): The unix time the event was logged
+        event (int): The event type, one of the event type constants
+        trial (int): The trial number, if the event belongs to a trial
+        screen (str): left, middle or right, if the event concerns one screen
+        image (str): The name of the image involved, if any
+        latency (float): The latency in milliseconds, for timing events
+        message (str): The text of a free text log line
+
+    Returns:
+        bytes: The length-prefixed record
+    """
+    image = image.encode() if image else b''
+    message = message.encode() if message else b''
+    payload = _FIXED.pack(created, _NO_TRIAL if trial is None else int(trial), event,
+                          SCREENS.index(screen), math.nan if latency is None else latency,
+                          len(image), len(message)) + image + message
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def _decode_payload(data, offset):
+    """Decodes the payload of the record starting at an offset into data."""
+    created, trial, event, screen, latency, image_length, message_length = \
+        _FIXED.unpack_from(data, offset)
+    image_start = offset + _FIXED.size
+    message_start = image_start + image_length
+    return {
+        'time': created,
+        'trial': None if trial == _NO_TRIAL else trial,
+        'event': EVENT_NAMES.get(event, str(event)),
+        'screen': SCREENS[screen] if screen < len(SCREENS) else None,
+        'image': data[image_start:message_start].decode(),
+        'latency_ms': None if math.isnan(latency) else latency,
+        'message': data[message_start:message_start + message_length].decode(),
+    }
+
+
+def decode_events(data):
+    """Decodes the records of a trial log.
+
+    Parameters:
+        data (bytes): The contents of a trial log, including MAGIC
+
+    Returns:
+        list[dict]: Each event, with the keys in FIELDS
+
+    Raises:
+        ValueError: If the data is not a trial log
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError('Not a trial log')
+    events = []
+    offset = len(MAGIC)
+    while offset + _LENGTH.size <= len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        if offset + length > len(data):
+            break
+        events.append(_decode_payload(data, offset))
+        offset += length
+    return events
+
+
+def iter_trial_log(path):
+    """Opens a trial log file to decode its records one at a time, so the whole log is
+    never held in memory.
+
+    Parameters:
+        path (str): The path of the trial log
+
+    Returns:
+        generator: Yields each event, with the keys in FIELDS, and closes the file once
+        exhausted or closed
+
+    Raises:
+        ValueError: If the file is not a trial log
+    """
+    log_file = open(path, 'rb')
+    if log_file.read(len(MAGIC)) != MAGIC:
+        log_file.close()
+        raise ValueError('Not a trial log')
+    return _read_events(log_file)
+
+
+def _read_events(log_file):
+    """Yields the events read from a trial log file positioned after MAGIC, then closes it."""
+    with log_file:
+        while True:
+            header = log_file.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                return
+            (length,) = _LENGTH.unpack(header)
+            payload = log_file.read(length)
+            if len(payload) < length:
+                return
+            yield _decode_payload(payload, 0)
+
+
+def read_trial_log(path):
+    """Reads and decodes a trial log file.
+
+    Parameters:
+        path (str): The path of the trial log
+
+    Returns:
+        list[dict]: Each event, with the keys in FIELDS
+    """
+    return list(iter_trial_log(path))
+
+
+def iter_csv(events, chunk_size=CSV_CHUNK_SIZE):
+    """Converts trial log events to csv text with a header row, a chunk at a time.
+
+    Parameters:
+        events (iterable): Events returned by decode_events or iter_trial_log
+        chunk_size (int): The number of characters after which a chunk is yielded
+
+    Returns:
+        generator: Yields the csv text in chunks, with empty values for missing fields
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_ALL)
+    writer.writerow(FIELDS)
+    for event in events:
+        writer.writerow([event[field] for field in FIELDS])
+        if output.tell() >= chunk_size:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
+def events_to_csv(events):
+    """Converts decoded trial log events to csv text with a header row.
+
+    Parameters:
+        events (list[dict]): Events returned by decode_events
+
+    Returns:
+        str: The events as csv, with empty values for missing fields
+    """
+    return ''.join(iter_csv(events))
+
+
+def iter_json(events):
+    """Converts trial log events to a JSON object holding them as a list of objects, an
+    event at a time.
+
+    Parameters:
+        events (iterable): Events returned by decode_events or iter_trial_log
+
+    Returns:
+        generator: Yields the JSON text of {"events": [...]} in pieces
+    """
+    yield '{"events": ['
+    separator = ''
+    for event in events:
+        yield separator + json.dumps(event, sort_keys=True)
+        separator = ', '
+    yield ']}\n'
@@ -0,0 +1,101 @@
+"""Timing of the events within each trial of an experiment.
+
+The vending machine marks when each stimulus was sent and shown, when input
+was received and when a treat was dispensed, using the monotonic
+input_events.monotonic_ns() clock at the moment each event happens. The latencies
+between them are written to the experiment log as separate csv columns, so
+they are unaffected by when the log line itself is written.
+"""
+
+from . import trial_log
+from .input_events import monotonic_ns
+
+STIMULUS_SENT = 'stimulus_sent'
+STIMULUS_SHOWN = 'stimulus_shown'
+INPUT_RECEIVED = 'input_received'
+TREAT_DISPENSED = 'treat_dispensed'
+
+# Order of the latency columns written to the experiment log after the message
+TIMING_COLUMNS = ('display_latency_ms', 'reaction_time_ms', 'dispense_latency_ms')
+# Trial log event type of each latency
+_TRIAL_LOG_EVENTS = {
+    'display_latency_ms': trial_log.DISPLAY_LATENCY,
+    'reaction_time_ms': trial_log.REACTION_TIME,
+    'dispense_latency_ms': trial_log.DISPENSE_LATENCY,
+}
+
+
+def _elapsed_ms(start, end):
+    """Returns the milliseconds between two monotonic_ns marks, or None if either is missing."""
+    if start is None or end is None:
+        return None
+    return (end - start) / 1000000
+
+
+class TrialTimer:
+    """Collects the timing marks of the current trial.
+
+    If an event happens more than once in a trial, for example when a fixation
+    stimulus is followed by the trial's stimuli, the latest mark is kept.
+    """
+
+    def __init__(self):
+        self.trial = None
+        self.marks = {}
+
+    def start_trial(self, trial):
+        """Clears the marks of the previous trial.
+
+        Parameters:
+            trial (int): The number of the trial starting
+        """
+        self.trial = trial
+        self.marks = {}
+
+    def mark(self, event, timestamp=None):
+        """Records the time of an event in the current trial.
+
+        Parameters:
+            event (str): One of STIMULUS_SENT, STIMULUS_SHOWN, INPUT_RECEIVED or TREAT_DISPENSED
+            timestamp (int): When the event happened in monotonic_ns() time,
+                defaults to now
+        """
+        self.marks[event] = monotonic_ns() if timestamp is None else timestamp
+
+    def latencies(self):
+        """Returns the latencies between the events of the current trial.
+
+        Returns:
+            dict: display_latency_ms from stimulus sent to shown, reaction_time_ms from
+            stimulus shown to input received, and dispense_latency_ms from input received
+            to treat dispensed. Latencies whose events were not marked are None.
+        """
+        return {
+            'display_latency_ms': _elapsed_ms(self.marks.get(STIMULUS_SENT),
+                                              self.marks.get(STIMULUS_SHOWN)),
+            'reaction_time_ms': _elapsed_ms(self.marks.get(STIMULUS_SHOWN),
+                                            self.marks.get(INPUT_RECEIVED)),
+            'dispense_latency_ms': _elapsed_ms(self.marks.get(INPUT_RECEIVED),
+                                               self.marks.get(TREAT_DISPENSED)),
+        }
+
+    def columns(self):
+        """Returns the latencies in TIMING_COLUMNS order, as strings for the csv log.
+        Missing latencies are empty strings."""
+        latencies = self.latencies()
+        return ['' if latencies[column] is None else f'{latencies[column]:.3f}'
+                for column in TIMING_COLUMNS]
+
+    def log(self, logger):
+        """Writes the latencies of the current trial to an experiment logger, as csv
+        columns and as trial log events.
+
+        Parameters:
+            logger (Logger): The experiment logger to write to
+        """
+        latencies = self.latencies()
+        events = [{'event': _TRIAL_LOG_EVENTS[column], 'trial': self.trial,
+                   'latency': latencies[column]}
+                  for column in TIMING_COLUMNS if latencies[column] is not None]
+        logger.info('Trial %s timing', self.trial,
+                    extra={'columns': self.columns(), 'trial_events': events})
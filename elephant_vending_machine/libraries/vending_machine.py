@@ -6,14 +6,30 @@ This module  allows for display of images, control of LEDs,
 and detecting motion sensor input on the machine.
 """
 
+import logging
 import time
-import subprocess
+from datetime import datetime
 from pssh.clients import ParallelSSHClient
 import requests
+from .display_agent import DisplayAgentClient
+from .input_events import InputEventQueue, monotonic_ns, reaction_time
+from .prerender import prerendered_name
+from .ssh_pool import DEFAULT_POOL
+from . import trial_log
+from .trial_timing import TrialTimer, STIMULUS_SENT, STIMULUS_SHOWN, INPUT_RECEIVED, \
+    TREAT_DISPENSED
 
 LEFT_SCREEN = 1
 MIDDLE_SCREEN = 2
 RIGHT_SCREEN = 3
+DEFAULT_IMAGES = ('all_white_screen.png', 'fixation_stimuli.png', 'all_black_screen.png')
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ExperimentCancelled(Exception):
+    """Raised inside a running experiment once its run has been cancelled."""
+
 
 def get_current_time_milliseconds():
     """Timeouts will be handled in milliseconds.
@@ -25,7 +41,7 @@ def get_current_time_milliseconds():
     return time.perf_counter() * 1000
 
 # This is how our Vending Machine would be logically organized, ignoring linting warning.
-# pylint: disable=too-few-public-methods
+# pylint: disable=too-few-public-methods,too-many-instance-attributes
 class VendingMachine:
     """Provides an abstraction of the physical 'vending machine'.
 
@@ -38,13 +54,33 @@ class VendingMachine:
             REMOTE_LED_SCRIPT_DIRECTORY: a string representing the absolute path
             to the directory on the remote pis where the LED scripts are stored,
             REMOTE_IMAGE_DIRECTORY: a string representing the absolute path
-            to where stimuli images are stored on the remote pis
-    """
+            to where stimuli images are stored on the remote pis,
+            DISPLAY_SETTLE_TIME: the number of milliseconds the screens are kept
+            blank while feh loads a new image,
+            DISPLAY_AGENT_PORT: the port display_agent.py listens on on the remote pis,
+            if set images are displayed through the agents instead of feh,
+            DISPLAY_ONSET_LEAD: the number of milliseconds between arming the display
+            agents and the synchronized onset of the images,
+            INPUT_EVENT_CAPACITY: the number of input events kept in the event queue,
+            INPUT_DEBOUNCE_TIME: the number of milliseconds after an input from a pi
+            during which further input from it is ignored,
+            PRERENDERED_IMAGES: if set the pre-rendered variants of the images are
+            displayed, falling back to the images themselves on pis which lack them
+        experiment_logger (Logger): If given, the measured onset of each stimulus shown
+            through the display agents is written to this log
+
+    The machine holds a single ssh connection to each Pi for its lifetime, close it
+    (or use the machine as a context manager) once the experiment has finished.
 
-    signal_sender = ''
+    Every signal from the pis is recorded in input_events. Only input received after
+    the most recent stimulus onset, and not already returned by wait_for_input, is
+    taken as a selection. The times stimuli are sent and shown, input is received and
+    treats are dispensed are marked on trial_timer.
+    """
 
-    def __init__(self, addresses, config=None):
+    def __init__(self, addresses, config=None, experiment_logger=None):
         self.addresses = addresses
+        self.experiment_logger = experiment_logger
         if config is None:
             self.config = {}
         else:
@@ -53,6 +89,18 @@ class VendingMachine:
             self.config['REMOTE_IMAGE_DIRECTORY'] = '/home/pi/elephant_vending_machine/images'
         if 'REMOTE_LED_SCRIPT_DIRECTORY' not in self.config:
             self.config['REMOTE_LED_SCRIPT_DIRECTORY'] = '/home/pi/rpi_ws281x/python'
+        if 'DISPLAY_SETTLE_TIME' not in self.config:
+            self.config['DISPLAY_SETTLE_TIME'] = 1000
+        if 'DISPLAY_AGENT_PORT' not in self.config:
+            self.config['DISPLAY_AGENT_PORT'] = None
+        if 'DISPLAY_ONSET_LEAD' not in self.config:
+            self.config['DISPLAY_ONSET_LEAD'] = 20
+        if 'INPUT_EVENT_CAPACITY' not in self.config:
+            self.config['INPUT_EVENT_CAPACITY'] = 256
+        if 'INPUT_DEBOUNCE_TIME' not in self.config:
+            self.config['INPUT_DEBOUNCE_TIME'] = 0
+        if 'PRERENDERED_IMAGES' not in self.config:
+            self.config['PRERENDERED_IMAGES'] = False
         self.left_group = SensorGrouping(
             addresses[0], LEFT_SCREEN, self.config)
         self.middle_group = SensorGrouping(
@@ -60,11 +108,93 @@ class VendingMachine:
         self.right_group = SensorGrouping(
             addresses[2], RIGHT_SCREEN, self.config)
         self.result = None
+        self.input_events = InputEventQueue(self.config['INPUT_EVENT_CAPACITY'],
+                                            self.config['INPUT_DEBOUNCE_TIME'])
+        self.stimulus_onset = None
+        self.last_reaction_time = None
+        self.last_selection = None
+        self.trial_timer = TrialTimer()
+        self._consumed_sequence = 0
+        self._cancelled = False
+        self._ssh_client = None
+        self._display_agent = None
+        self._shown_set = None
+        self._preloaded_images = {}
+        self.last_display_timing = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the ssh and display agent connections to the remote hosts."""
+        if self._ssh_client is not None:
+            # ParallelSSHClient has no method closing every connection, so the client of
+            # each host it connected to is disconnected
+            # pylint: disable=protected-access
+            for client in self._ssh_client._host_clients.values():
+                client.disconnect()
+            self._ssh_client = None
+        if self._display_agent is not None:
+            self._display_agent.close()
+            self._display_agent = None
+
+    def _parallel_client(self):
+        """Returns the ParallelSSHClient shared by every command sent to the remote hosts,
+        creating it on first use so its connections are set up only once per run."""
+        if self._ssh_client is None:
+            self._ssh_client = ParallelSSHClient(self.addresses, user='pi')
+        return self._ssh_client
+
+    def _display_agent_client(self):
+        """Returns the DisplayAgentClient connected to the agents on the remote hosts."""
+        if self._display_agent is None:
+            self._display_agent = DisplayAgentClient(
+                self.addresses, self.config['DISPLAY_AGENT_PORT'])
+        return self._display_agent
+
+    def cancel(self):
+        """Stops the experiment using this machine. The experiment is interrupted the next
+        time it waits for input or changes the stimuli, by raising ExperimentCancelled."""
+        self._cancelled = True
+        self.input_events.notify()
+
+    def _check_cancelled(self):
+        """Raises ExperimentCancelled if the experiment has been cancelled."""
+        if self._cancelled:
+            raise ExperimentCancelled()
+
+    def receive_signal(self, address):
+        """Records a signal from the monitor pi at the given address and wakes
+        any thread blocked in wait_for_input.
+
+        Parameters:
+            address (str): The address of the monitor pi which sent the signal
+        """
+        self.input_events.push(address)
+
+    def mark_stimulus_onset(self, timestamp=None):
+        """Records the onset of a new stimulus. Input received before it is no longer
+        taken as a selection, and reaction times are measured from it. Called by
+        display_images, experiments presenting stimuli some other way may call it directly.
+
+        Parameters:
+            timestamp (int): The time of the onset in monotonic_ns() time,
+                defaults to now
+        """
+        self.stimulus_onset = monotonic_ns() if timestamp is None else timestamp
+        self.trial_timer.mark(STIMULUS_SHOWN, self.stimulus_onset)
 
     def wait_for_input(self, groups, timeout):
         """Waits for signal from the monitor pis. If no signal is received by the specified
         time to wait, returns with a result to indicate this.
 
+        Input received since the last stimulus onset counts, or since the start of the
+        wait if no stimulus has been shown. The time from the onset to the selection is
+        stored in last_reaction_time, in milliseconds, and the result in last_selection.
+
         Parameters:
             groups (list[SensorGrouping]): The SensorGroupings which should be monitored for input.
             timeout (int): The amount of time in seconds to wait for input before timing out and
@@ -72,26 +202,36 @@ class VendingMachine:
         Returns:
             String: A string with value 'left', 'middle', 'right', or 'timeout', indicating
             the selection or lack thereof.
+
+        Raises:
+            ExperimentCancelled: If the experiment is cancelled before or while waiting
         """
         selection = 'timeout'
         accepted_addresses = []
         for i in groups:
             accepted_addresses.append(i.address)
 
-        start_time = get_current_time_milliseconds()
-        elapsed_time = get_current_time_milliseconds() - start_time
-
-        while self.signal_sender not in accepted_addresses and elapsed_time < timeout:
-            elapsed_time = get_current_time_milliseconds() - start_time
-        print(self.signal_sender)
-        if self.signal_sender == self.addresses[0] and self.signal_sender in accepted_addresses:
+        since = self.stimulus_onset
+        if since is None:
+            since = monotonic_ns()
+        event = self.input_events.wait_for(accepted_addresses, since, self._consumed_sequence,
+                                           timeout, lambda: self._cancelled)
+        self._check_cancelled()
+        self.last_reaction_time = None
+        if event is None:
+            self.last_selection = selection
+            return selection
+        host, timestamp, self._consumed_sequence = event
+        self.last_reaction_time = reaction_time(event, since)
+        self.trial_timer.mark(INPUT_RECEIVED, timestamp)
+        if host == self.addresses[0]:
             selection = 'left'
-        elif self.signal_sender == self.addresses[1] and self.signal_sender in accepted_addresses:
+        elif host == self.addresses[1]:
             selection = 'middle'
-        elif self.signal_sender == self.addresses[2] and self.signal_sender in accepted_addresses:
+        elif host == self.addresses[2]:
             selection = 'right'
 
-        self.signal_sender = ''
+        self.last_selection = selection
         return selection
 
     def ssh_all_hosts(self, command):
@@ -99,40 +239,137 @@ class VendingMachine:
 
         Parameters:
             command: command to be sent over ssh """
-        hosts = self.addresses
-        client = ParallelSSHClient(hosts, user='pi')
+        self._check_cancelled()
+        client = self._parallel_client()
         client.run_command(command)
         client.join()
 
-    def display_images(self, images):
-        """ Displays images on remote hosts via ssh
-
-        Parameters:
-            images: images to be displayed on the screens """
+    def _remote_image_paths(self, images, prerendered=False):
+        """Returns the paths on the remote hosts of the given images, or of their
+        pre-rendered variants if prerendered is set. Default images have no variants."""
         new_images = []
         for image in images:
-            if image in ('all_white_screen.png', 'fixation_stimuli.png', 'all_black_screen.png'):
+            if image in DEFAULT_IMAGES:
                 new_images.append(f'''/home/pi/elephant_vending_machine/default_img/{image}''')
+            elif prerendered:
+                new_images.append(
+                    f'''{self.config['REMOTE_IMAGE_DIRECTORY']}/{prerendered_name(image)}''')
             else:
                 new_images.append(f'''{self.config['REMOTE_IMAGE_DIRECTORY']}/{image}''')
-        hosts = self.addresses
-        client = ParallelSSHClient(hosts, user='pi')
-        self.ssh_all_hosts('xset -display :0 dpms force off')
-        client.run_command('%s', host_args=(f'''DISPLAY=:0 feh -F -x -Y {new_images[0]} &''', \
-         f'''DISPLAY=:0 feh -F -x -Y {new_images[1]} &''', \
-         f'''DISPLAY=:0 feh -F -x -Y {new_images[2]} &'''))
-        time.sleep(1)
-        self.ssh_all_hosts('xset -display :0 dpms force on')
-
-    @staticmethod
-    def dispense_treat(index):
+        return new_images
+
+    def _feh_image_arguments(self, images):
+        """Returns the image argument of feh for each of the given images, choosing the
+        pre-rendered variant on the remote host if PRERENDERED_IMAGES is set and it exists."""
+        paths = self._remote_image_paths(images)
+        if not self.config['PRERENDERED_IMAGES']:
+            return paths
+        return tuple(path if variant == path else
+                     f'$(test -e {variant} && echo {variant} || echo {path})'
+                     for path, variant in zip(paths, self._remote_image_paths(images, True)))
+
+    def preload_images(self, images):
+        """ Loads images into memory on the remote hosts' display agents, ready to be shown
+        with show_preloaded. Requires DISPLAY_AGENT_PORT to be configured.
+
+        Parameters:
+            images: images to be displayed on the screens
+
+        Returns:
+            int: identifier of the preloaded set of images """
+        if self.config['PRERENDERED_IMAGES']:
+            set_id = self._display_agent_client().preload(
+                self._remote_image_paths(images, True), self._remote_image_paths(images))
+        else:
+            set_id = self._display_agent_client().preload(self._remote_image_paths(images))
+        self._preloaded_images[set_id] = images
+        return set_id
+
+    def show_preloaded(self, set_id):
+        """ Displays a set of images previously loaded with preload_images on all screens.
+
+        All screens are armed to change at the same instant, and report when they actually
+        did. The measured onsets and the skew between the screens are recorded in
+        last_display_timing and written to the experiment log. The previously shown set is
+        then freed.
+
+        Parameters:
+            set_id: identifier returned by preload_images """
+        self._check_cancelled()
+        self.trial_timer.mark(STIMULUS_SENT)
+        client = self._display_agent_client()
+        start = time.perf_counter()
+        onset = client.flip_synchronized(set_id, self.config['DISPLAY_ONSET_LEAD'] / 1000)
+        self.last_display_timing = dict(onset, flip_ms=(time.perf_counter() - start) * 1000)
+        self.mark_stimulus_onset(
+            monotonic_ns() - int((time.time() - min(onset['onsets'])) * 1e9))
+        LOGGER.debug('Displayed set %s: %s', set_id, self.last_display_timing)
+        if self.experiment_logger is not None:
+            images = self._preloaded_images.get(set_id, [''] * len(onset['onsets']))
+            self.experiment_logger.info(
+                'Stimuli onset left %s, middle %s, right %s, skew %.3f ms',
+                *[datetime.fromtimestamp(shown) for shown in onset['onsets']], onset['skew_ms'],
+                extra={'trial_events': [
+                    {'event': trial_log.STIMULUS_SHOWN, 'trial': self.trial_timer.trial,
+                     'screen': screen, 'image': image,
+                     'latency': (shown - onset['target']) * 1000}
+                    for screen, image, shown
+                    in zip(trial_log.SCREENS[1:], images, onset['onsets'])]})
+        if self._shown_set is not None and self._shown_set != set_id:
+            client.discard(self._shown_set)
+            self._preloaded_images.pop(self._shown_set, None)
+        self._shown_set = set_id
+
+    def display_images(self, images):
+        """ Displays images on remote hosts
+
+        If DISPLAY_AGENT_PORT is configured the images are preloaded on the display agents and
+        then shown. Otherwise, blanking the screen, launching feh and turning the screen back
+        on are sent over ssh as one command per host, so each stimulus change costs a single
+        round trip. The time taken is recorded in last_display_timing.
+
+        Parameters:
+            images: images to be displayed on the screens """
+        self._check_cancelled()
+        if self.config['DISPLAY_AGENT_PORT']:
+            set_id = self.preload_images(images)
+            self.show_preloaded(set_id)
+            return
+
+        self.trial_timer.mark(STIMULUS_SENT)
+        settle_seconds = self.config['DISPLAY_SETTLE_TIME'] / 1000
+        commands = tuple(f'''xset -display :0 dpms force off; \
+DISPLAY=:0 feh -F -x -Y {image} >/dev/null 2>&1 & \
+sleep {settle_seconds}; xset -display :0 dpms force on'''
+                         for image in self._feh_image_arguments(images))
+
+        start = time.perf_counter()
+        client = self._parallel_client()
+        connected = time.perf_counter()
+        client.run_command('%s', host_args=commands)
+        client.join()
+        finished = time.perf_counter()
+        self.mark_stimulus_onset()
+        self.last_display_timing = {
+            'client_setup_ms': (connected - start) * 1000,
+            'round_trip_ms': (finished - connected) * 1000,
+            'settle_ms': self.config['DISPLAY_SETTLE_TIME'],
+        }
+        LOGGER.debug('Displayed %s: %s', images, self.last_display_timing)
+
+    def dispense_treat(self, index):
         """ Sends post request to dispense treat in corresponding tray
 
         Parameters:
             index: index (from 1 to 3) of the tray to be opened"""
         #headers = {'Content-Type':'text/plain'}
         response = requests.post(url="192.168.0.14/motor", data=str(index))
-        print(response)
+        self.trial_timer.mark(TREAT_DISPENSED)
+        if self.experiment_logger is not None:
+            self.experiment_logger.info('Treat dispensed from tray %s, status %s', index,
+                                        response.status_code)
+        else:
+            LOGGER.info('Treat dispensed from tray %s, status %s', index, response.status_code)
 
 class SensorGrouping:
     """Provides an abstraction of the devices controlled by Raspberry Pis.
@@ -169,11 +406,9 @@ class SensorGrouping:
             display_time (int): The number of milliseconds that LEDs should display the color
                 before returning to an "off" state.
         """
-        ssh_command = f'''ssh -oStrictHostKeyChecking=no -i /root/.ssh/id_rsa pi@{self.address} \
-            sudo PYTHONPATH=\".:build/lib.linux-armv71-2.7\" python \
-            {self.config['REMOTE_LED_SCRIPT_DIRECTORY']}/led.py \
-            {red} {green} {blue} {display_time}'''
-        subprocess.run(ssh_command, check=True, shell=True)
+        DEFAULT_POOL.run('pi', self.address, f'''sudo PYTHONPATH=\".:build/lib.linux-armv71-2.7\" \
+            python {self.config['REMOTE_LED_SCRIPT_DIRECTORY']}/led.py \
+            {red} {green} {blue} {display_time}''')
 
     # def display_on_screen(self, stimuli_name, default):
     #     """Displays the specified stimuli on the screen.
@@ -0,0 +1,282 @@
+"""Routes serving the experiment logs.
+
+Here, the routes listing, streaming, exporting and deleting the log files and
+querying the log catalog are defined, apart from the rest of the routes in
+views.
+"""
+
+# Circular import OK here. See https://flask.palletsprojects.com/en/1.1.x/patterns/packages/
+# pylint: disable=cyclic-import
+import os
+from flask import request, make_response, jsonify, send_file, Response
+from elephant_vending_machine import APP
+from .libraries.log_stream import follow_events, gzip_chunks, is_being_written
+from .libraries.trial_log import TRIAL_LOG_EXTENSION, iter_csv, iter_json, iter_trial_log, \
+    trial_log_name
+from .views import DIRECTORY_CACHE, LOG_FOLDER, MAX_PAGE_SIZE, get_log_catalog, listing_etag, \
+    listing_response, remove_log
+
+@APP.route('/log/<filename>', methods=['DELETE'])
+def delete_log(filename):
+    """Returns a message indicating whether deletion of the specified file was successful
+
+    **Example request**:
+
+    .. sourcecode::
+
+      DELETE /log/somelog.csv HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+      Content-Length: 59
+      Access-Control-Allow-Origin: *
+      Server: Werkzeug/0.16.1 Python/3.8.2
+      Date: Fri, 27 Mar 2020 16:13:42 GMT
+
+      {
+        "message": "File somelog.csv was successfully deleted."
+      }
+
+    :status 200: log file successfully deleted
+    :status 400: file with specified name could not be found
+    """
+    log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+    if filename not in os.listdir(log_directory):
+        message = f"File {filename} does not exist and so couldn't be deleted."
+        return make_response(jsonify({'message': message}), 400)
+    try:
+        remove_log(log_directory, filename)
+    except IsADirectoryError:
+        message = f"{filename} exists, but is a directory and not a file. Deletion failed."
+        return make_response(jsonify({'message': message}), 400)
+    return make_response(jsonify({'message': f"File {filename} was successfully deleted."}), 200)
+
+@APP.route('/log/<filename>/export', methods=['GET'])
+def export_log(filename):
+    """Returns the structured trial log written next to a log file as CSV or JSON.
+
+    The format is selected with the ``format`` query parameter, either ``csv`` (the
+    default) or ``json``. Each row or object holds the time, trial, event, screen,
+    image, latency_ms and message of one event. The trial log is read and sent an event
+    at a time, so large logs are never held in memory.
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /log/2020-03-17 04:26:02.085651 exampleExperiment.csv/export?format=json HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "events": [
+          {
+            "event": "trial_started",
+            "image": "",
+            "latency_ms": null,
+            "message": "",
+            "screen": null,
+            "time": 1584419162.085651,
+            "trial": 1
+          }
+        ]
+      }
+
+    :status 200: events successfully exported
+    :status 400: no trial log exists for the specified log file, it is not a trial log,
+        or the format is unknown
+    """
+    log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+    export_format = request.args.get('format', 'csv')
+    trial_log_file = trial_log_name(filename)
+    if export_format not in ('csv', 'json'):
+        return make_response(jsonify({'message': f"Unknown export format {export_format}"}), 400)
+    if trial_log_file not in os.listdir(log_directory):
+        return make_response(
+            jsonify({'message': f"No trial log exists for {filename}"}), 400)
+    try:
+        events = iter_trial_log(os.path.join(log_directory, trial_log_file))
+    except ValueError:
+        return make_response(
+            jsonify({'message': f"{trial_log_file} is not a trial log"}), 400)
+    if export_format == 'json':
+        return Response(iter_json(events), 200, mimetype='application/json')
+    return Response(iter_csv(events), 200, mimetype='text/csv')
+
+@APP.route('/log/<filename>/stream', methods=['GET'])
+def stream_log(filename):
+    """Streams a log file in chunks, so large logs are never held in memory.
+
+    Byte ranges can be requested with a ``Range`` header, and the log is gzip compressed
+    when the client accepts it and no range is requested. With the ``follow`` query
+    parameter the log is sent as server-sent events, one per line, and new lines are
+    pushed for as long as the log is being written, by an experiment in any worker
+    process. Following resumes from the ``Last-Event-ID`` header or the ``offset`` query
+    parameter, both byte offsets into the log.
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /log/2020-03-17 04:26:02.085651 exampleExperiment.csv/stream?follow=1 HTTP/1.1
+      Host: 127.0.0.1
+      Accept: text/event-stream
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: text/event-stream
+
+      id: 60
+      data: "2020-03-17 04:26:02.085651","Experiment exampleExperiment.py started"
+
+    :status 200: log successfully streamed
+    :status 206: requested range of the log successfully returned
+    :status 400: file with specified name could not be found, or the offset is invalid
+    :status 416: requested range is not satisfiable
+    """
+    log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+    log_path = os.path.join(log_directory, filename)
+    if filename not in os.listdir(log_directory) or not os.path.isfile(log_path):
+        return make_response(jsonify({'message': f"File {filename} does not exist"}), 400)
+    if 'follow' in request.args:
+        try:
+            offset = int(request.headers.get('Last-Event-ID', request.args.get('offset', 0)))
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            return make_response(jsonify({'message': 'Offset must be a non-negative integer'}), 400)
+        # The log is live for as long as a handler in any worker process has it open
+        return Response(follow_events(log_path, offset, lambda: is_being_written(log_path)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if 'Range' not in request.headers and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        return Response(gzip_chunks(log_path), mimetype='text/csv',
+                        headers={'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+    response = send_file(log_path, mimetype='text/csv', conditional=True)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@APP.route('/log/catalog', methods=['GET'])
+def query_logs():
+    """Returns a page of the log catalog, most recently started first.
+
+    Logs can be filtered with the ``experiment``, ``from``, ``to`` and ``status`` query
+    parameters. ``from`` and ``to`` are start times such as ``2020-03-17`` or
+    ``2020-03-17 04:26:02``, ``to`` being exclusive. Pages are selected with ``page``,
+    starting from 1, and ``per_page``.
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /log/catalog?experiment=exampleExperiment.py&from=2020-03-01&status=finished HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "logs": [
+          {
+            "experiment": "exampleExperiment.py",
+            "file_name": "2020-03-17 04:26:02.085651 exampleExperiment.py.csv",
+            "finished": "2020-03-17 04:41:13.402263",
+            "left_count": 12,
+            "middle_count": 0,
+            "right_count": 7,
+            "size": 5630,
+            "started": "2020-03-17 04:26:02.085713",
+            "status": "finished",
+            "timeout_count": 1,
+            "trials": 20
+          }
+        ],
+        "page": 1,
+        "per_page": 50,
+        "total": 1
+      }
+
+    :status 200: catalog page successfully returned
+    :status 400: page or per_page is not a positive integer, or per_page is too large
+    """
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 50))
+    except ValueError:
+        page = per_page = 0
+    if page < 1 or not 1 <= per_page <= MAX_PAGE_SIZE:
+        return make_response(jsonify({
+            'message': f'page must be a positive integer and per_page between 1 and {MAX_PAGE_SIZE}'
+        }), 400)
+    total, logs = get_log_catalog().query(
+        experiment=request.args.get('experiment'), started_from=request.args.get('from'),
+        started_to=request.args.get('to'), status=request.args.get('status'), limit=per_page,
+        offset=(page - 1) * per_page)
+    return make_response(jsonify({'logs': logs, 'total': total, 'page': page,
+                                  'per_page': per_page}), 200)
+
+@APP.route('/log', methods=['GET'])
+def list_logs():
+    """Returns a list of log resources from the log directory.
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /log HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json; charset=utf-8
+      Content-Length: 212
+      Server: Werkzeug/0.16.1 Python/3.8.1
+      Date: Thu, 13 Feb 2020 15:35:32 GMT
+
+      {
+        "files": [
+          "http://localhost:5000/static/log/2020-03-17 04:26:02.085651 exampleExperiment.csv",
+          "http://localhost:5000/static/log/2020-03-17 04:27:04.019992 exampleExperiment.csv"
+        ]
+      }
+
+    :status 200: log file list successfully returned
+    :status 304: list unchanged since the ETag given in If-None-Match
+    """
+    resource_route = "/static/log/"
+    file_request_path = request.base_url[:request.base_url.rfind('/')] + resource_route
+    path_to_current_file = os.path.dirname(os.path.abspath(__file__))
+    logs_path = os.path.join(path_to_current_file, 'static', 'log')
+    listing = DIRECTORY_CACHE.listing(logs_path)
+    full_log_paths = [file_request_path + f for f in listing.files
+                      if not f.endswith(TRIAL_LOG_EXTENSION) and not f.startswith('.')]
+    return listing_response({'files': full_log_paths}, listing_etag(listing, file_request_path))
@@ -1,6 +1,9 @@
 import random
 import time
 
+# Number of trials, read by the server at module level to report the run's progress
+NUM_TRIALS = 20
+
 def run_experiment(experiment_logger, vending_machine):
     """This is an example of an experiment file used to create custom experiments.
 
@@ -13,7 +16,6 @@ def run_experiment(experiment_logger, vending_machine):
         vending_machine: Instance of vending_machine for interacting with hardware devices
     """
 
-    NUM_TRIALS = 20
     INTERTRIAL_INTERVAL = 5 # seconds
     BLANK_SCREEN = 'all_black_screen.png'
     FIXATION_STIMULI = 'fixation_stimuli.png'
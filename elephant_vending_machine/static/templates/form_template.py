@@ -16,12 +16,14 @@ BLANK_SCREEN = 'all_black_screen.png'
 WHITE_SCREEN = 'all_white_screen.png'
 
 def list_full_paths(directory):
-    """Returns absolute paths to all images in given group
+    """Returns absolute paths to all images in given group, skipping hidden files
+    and subdirectories
         
     Parameters:
         directory: path to a group of images
     """
-    return [os.path.join(directory, file) for file in os.listdir(directory)]
+    return [os.path.join(directory, file) for file in os.listdir(directory)
+            if not file.startswith('.') and os.path.isfile(os.path.join(directory, file))]
 
 def random_image(group_path):
     """Returns path to randomly chosen image in given group
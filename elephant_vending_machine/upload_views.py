@@ -0,0 +1,359 @@
+"""Routes uploading many images at once, or one image in chunks.
+
+Here, the routes uploading a batch of images or archive of images to a group,
+and those uploading a single large image in resumable chunks, are defined,
+apart from the rest of the image routes in image_views.
+"""
+
+# Circular import OK here. See https://flask.palletsprojects.com/en/1.1.x/patterns/packages/
+# pylint: disable=cyclic-import
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from flask import request, make_response, jsonify
+from werkzeug.utils import secure_filename
+from elephant_vending_machine import APP
+from .libraries.chunked_upload import CHUNK_SIZE, UploadConflictError, UploadError
+from .libraries.image_archive import ARCHIVE_ERRORS, ArchiveLimitError, archive_members, \
+    is_archive
+from .libraries.prerender import remove_prerendered
+from .libraries.sync_queue import DELETE, Job
+from .image_views import BATCH_WORKERS, get_blob_store, get_image_index, get_range_forwarder, \
+    get_sync_queue, get_upload_store, remote_part_name, remove_remote_part, save_images
+from .views import ALLOWED_IMG_EXTENSIONS, DIRECTORY_CACHE, IMAGE_UPLOAD_FOLDER, allowed_file
+
+def batch_status(results, succeeded):
+    """Returns the status code of a batch request from the status of each file: 207
+    Multi-Status if it only succeeded for some of the files, 400 if it succeeded for none."""
+    done = sum(result['status'] == succeeded for result in results)
+    if done == len(results):
+        return succeeded
+    return 207 if done else 400
+
+def staged_images(files, executor):
+    """Adds the images of a batch upload to the blob store, unpacking archives.
+
+    Plain files are added by the executor's workers, the files of an archive one at a
+    time, as they are read from it.
+
+    Parameters:
+        files (list): The uploaded files
+        executor (ThreadPoolExecutor): The workers adding the plain files
+
+    Returns:
+        list: The name of each file, with a Future of the hash it was stored under, or
+        an error message if it was rejected
+    """
+    staged = []
+    for file in files:
+        if not is_archive(file.filename):
+            members = [(file.filename, file.stream)]
+        else:
+            members = archive_members(file.stream, file.filename)
+        try:
+            for name, member in members:
+                if not allowed_file(name, ALLOWED_IMG_EXTENSIONS):
+                    staged.append((name, "Error with request: File extension not allowed."))
+                elif member is file.stream:
+                    staged.append((name, executor.submit(get_blob_store().write, member)))
+                else:
+                    future = Future()
+                    future.set_result(get_blob_store().write(member))
+                    staged.append((name, future))
+        except ArchiveLimitError as error:
+            staged.append((file.filename, f"Error with request: {error}."))
+        except ARCHIVE_ERRORS:
+            staged.append((file.filename, "Error with request: Archive could not be read."))
+    return staged
+
+@APP.route('/<group>/images', methods=['POST'])
+def upload_images(group):
+    """Uploads a batch of images to a group
+
+    Every file field of the request is an image, or a zip or tar archive of images. The
+    images are stored by a pool of workers, then queued to be copied to the remote hosts
+    together, in a single ssh session per host, and the result for each image is
+    returned.
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 207 MULTI-STATUS
+      Content-Type: application/json
+
+      {
+        "message": "Saved 1 of 2 images.",
+        "results": [
+          {
+            "message": "Success: Image saved.",
+            "name": "elephant.jpeg",
+            "status": 201
+          },
+          {
+            "message": "Error with request: File extension not allowed.",
+            "name": "notes.txt",
+            "status": 400
+          }
+        ]
+      }
+
+    :status 201: every image saved
+    :status 207: some of the images saved, see results
+    :status 400: no group with the given name, no files, or no image could be saved
+    """
+    save_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER + "/" + group
+    if not os.path.isdir(save_path):
+        return make_response(jsonify({'message': f"Group {group} does not exist"}), 400)
+    files = request.files.getlist('file')
+    if not files:
+        return make_response(jsonify(
+            {'message': "Error with request: No file field in body of request."}), 400)
+    with ThreadPoolExecutor(BATCH_WORKERS, thread_name_prefix='batch-upload') as executor:
+        staged = staged_images(files, executor)
+    results = []
+    digests = {}
+    saved = {}
+    for name, outcome in staged:
+        if isinstance(outcome, str):
+            results.append({'name': name, 'status': 400, 'message': outcome})
+            continue
+        filename = secure_filename(name)
+        digest = outcome.result()
+        if filename in saved:
+            saved[filename].update(status=409, message="Error with request: Replaced by a "
+                                                       "later file of the same name.")
+            replaced = digests.pop(filename)
+            # Nothing links to the replaced blob yet, unless another image shares it
+            if replaced != digest and replaced not in digests.values():
+                get_blob_store().release(replaced)
+        digests[filename] = digest
+        saved[filename] = {'name': filename, 'status': 201, 'message': "Success: Image saved."}
+        results.append(saved[filename])
+    response_body = {'results': results}
+    response_code = batch_status(results, 201)
+    if digests:
+        save_images(group, digests)
+    response_body['message'] = f"Saved {sum(result['status'] == 201 for result in results)} " \
+                               f"of {len(results)} images."
+    return make_response(jsonify(response_body), response_code)
+
+@APP.route('/<group>/images', methods=['DELETE'])
+def delete_images(group):
+    """Deletes a batch of images from a group
+
+    The names of the images are given as the list names of a JSON body, or as repeated
+    name form fields. They are queued to be deleted from the remote hosts together, in a
+    single ssh session per host, and the result for each image is returned as by
+    ``/<group>/images``.
+
+    :status 200: every image deleted
+    :status 207: some of the images deleted, see results
+    :status 400: no group with the given name, no names, or none of the images exist
+    """
+    image_directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER + "/" + group
+    if not os.path.isdir(image_directory):
+        return make_response(jsonify({'message': f"Group {group} does not exist"}), 400)
+    body = request.get_json(silent=True)
+    names = body.get('names') if isinstance(body, dict) else request.form.getlist('name')
+    if not names or not isinstance(names, list) or \
+            not all(isinstance(name, str) for name in names):
+        return make_response(jsonify({'message': "Error with request: No names given."}), 400)
+    files = DIRECTORY_CACHE.listing(image_directory).files
+    results = []
+    found = {}
+    for name in dict.fromkeys(names):
+        if name in files and not name.startswith('.'):
+            found[name] = {'name': name, 'status': 200,
+                           'message': f"File {name} was successfully deleted."}
+            results.append(found[name])
+        else:
+            results.append({'name': name, 'status': 404,
+                            'message': f"File {name} does not exist and so couldn't be deleted."})
+    response_body = {'results': results}
+    response_code = batch_status(results, 200)
+    if found:
+        entries = get_image_index().entries(image_directory)
+        for name in found:
+            os.remove(os.path.join(image_directory, name))
+            if name in entries:
+                get_blob_store().release(entries[name]['sha256'])
+            remove_prerendered(os.path.dirname(image_directory), f'{group}/{name}')
+        DIRECTORY_CACHE.invalidate(image_directory)
+        get_image_index().refresh_images(image_directory, dict.fromkeys(found))
+        get_sync_queue().enqueue([Job(DELETE, f'{group}/{name}') for name in found])
+    response_body['message'] = f"Deleted {sum(result['status'] == 200 for result in results)} " \
+                               f"of {len(results)} images."
+    return make_response(jsonify(response_body), response_code)
+
+def upload_status(upload):
+    """Returns the JSON body describing a chunked upload in progress."""
+    return {'upload_id': upload['upload_id'], 'group': upload['group'], 'name': upload['name'],
+            'size': upload['size'], 'offset': upload['offset'], 'chunk_size': CHUNK_SIZE}
+
+@APP.route('/<group>/uploads', methods=['POST'])
+def start_upload(group):
+    """Starts a resumable upload of an image to a group, sent in chunks
+
+    The image's name and size in bytes are given as the form fields name and size,
+    and optionally its hex SHA-256 hash as sha256, which the upload is checked against
+    once it is complete. Send the image's chunks to ``/uploads/<upload_id>``.
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 201 CREATED
+      Content-Type: application/json
+
+      {
+        "chunk_size": 8388608,
+        "group": "test1",
+        "name": "elephant.jpeg",
+        "offset": 0,
+        "size": 20971520,
+        "upload_id": "8f14e45fceea167a5a36dedd4bea2543"
+      }
+
+    :status 201: upload started
+    :status 400: missing or invalid field, or no group with the given name
+    """
+    name = secure_filename(request.form.get('name', ''))
+    size = request.form.get('size', type=int)
+    digest = request.form.get('sha256')
+    group_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER + "/" + group
+    response = None
+    if not os.path.isdir(group_path):
+        response = f"Group {group} does not exist"
+    elif not allowed_file(name, ALLOWED_IMG_EXTENSIONS):
+        response = "Error with request: File extension not allowed."
+    elif size is None or size <= 0:
+        response = "Error with request: size must be a positive number of bytes."
+    elif digest is not None and (len(digest) != 64 or
+                                 not all(char in '0123456789abcdef' for char in digest)):
+        response = "Error with request: sha256 must be a hex SHA-256 hash."
+    if response is not None:
+        return make_response(jsonify({'message': response}), 400)
+    upload = get_upload_store().create(group, name, size, digest)
+    return make_response(jsonify(upload_status(upload)), 201)
+
+@APP.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Returns the progress of a chunked upload, to resume it from its offset
+
+    :status 200: upload in progress
+    :status 404: no upload with the given id
+    """
+    upload = get_upload_store().get(upload_id)
+    if upload is None:
+        return make_response(jsonify({'message': f"No upload with id {upload_id}"}), 404)
+    return make_response(jsonify(upload_status(upload)), 200)
+
+@APP.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Adds a chunk to an upload
+
+    The chunk is the body of the request, and must start at the offset given as the
+    offset query parameter, which is the upload's offset. It is written to disk as it
+    arrives and sent on to the remote hosts in the background, while the rest of the
+    image is uploaded. If the request fails, get the upload's offset and send the rest
+    of the image from there.
+
+    Once the last chunk has been received, the image is stored in its group and
+    queued to be copied to the remote hosts, as by ``/<group>/image``.
+
+    **Example request**:
+
+    .. sourcecode::
+
+      PUT /uploads/8f14e45fceea167a5a36dedd4bea2543?offset=8388608 HTTP/1.1
+      Content-Type: application/octet-stream
+      Content-Length: 8388608
+
+    :status 200: chunk received, the response holds the upload's new offset
+    :status 201: last chunk received and image saved
+    :status 400: the chunk would make the image larger than its size, or the image does
+        not match the hash the upload was started with
+    :status 404: no upload with the given id, or it was cancelled while the chunk was
+        received
+    :status 409: the chunk does not start at the upload's offset, which the response
+        holds, or another chunk of the upload is being received
+    """
+    store = get_upload_store()
+    upload = store.get(upload_id)
+    if upload is None:
+        return make_response(jsonify({'message': f"No upload with id {upload_id}"}), 404)
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return make_response(jsonify({'message': "Error with request: No offset given.",
+                                      'offset': upload['offset']}), 400)
+    key = (upload['group'], upload_id)
+    start = upload['offset']
+    written = True
+    try:
+        _, digest = store.write(upload_id, offset, request.stream)
+    except UploadConflictError as error:
+        written = False
+        return make_response(jsonify({'message': f"Error with request: {error}",
+                                      'offset': error.offset}), 409)
+    except UploadError as error:
+        return make_response(jsonify({'message': f"Error with request: {error}",
+                                      'offset': error.offset}), 400)
+    except KeyError:
+        # The upload was cancelled since it was read above
+        written = False
+        return chunk_response(upload_id, None, None)
+    finally:
+        # Whatever part of the chunk arrived is sent on, even if the request broke off
+        if written:
+            upload = store.get(upload_id)
+            # Unless the upload was cancelled meanwhile
+            if upload is not None:
+                get_range_forwarder().submit(key, start, upload['offset'] - start)
+    return chunk_response(upload_id, upload, digest)
+
+def chunk_response(upload_id, upload, digest):
+    """Returns the response to a chunk of an upload which was received, saving the image
+    once the last chunk has been.
+
+    Parameters:
+        upload_id (str): The id of the upload
+        upload (dict): The upload after the chunk, or None if it was cancelled meanwhile
+        digest (str): The hex SHA-256 hash of the image if it is complete, otherwise None
+    """
+    if upload is None:
+        return make_response(jsonify({'message': f"Upload {upload_id} was cancelled"}), 404)
+    if digest is None:
+        return make_response(jsonify(upload_status(upload)), 200)
+    store = get_upload_store()
+    forwarded = get_range_forwarder().finish((upload['group'], upload_id), upload['size'])
+    group_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER + "/" \
+        + upload['group']
+    if upload['sha256'] is not None and upload['sha256'] != digest:
+        message = "Error with request: The image does not match the SHA-256 hash it was " \
+                  "started with."
+    elif not os.path.isdir(group_path):
+        message = f"Group {upload['group']} does not exist"
+    else:
+        get_blob_store().add(store.part_path(upload_id), digest)
+        save_images(upload['group'], {upload['name']: digest}, forwarded,
+                    remote_part_name(upload_id))
+        store.discard(upload_id)
+        return make_response(jsonify({'message': "Success: Image saved."}), 201)
+    store.discard(upload_id)
+    remove_remote_part(upload)
+    return make_response(jsonify({'message': message}), 400)
+
+@APP.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """Cancels a chunked upload, discarding the chunks received so far
+
+    :status 200: upload cancelled
+    :status 404: no upload with the given id
+    """
+    upload = get_upload_store().get(upload_id)
+    if upload is None:
+        return make_response(jsonify({'message': f"No upload with id {upload_id}"}), 404)
+    get_range_forwarder().finish((upload['group'], upload_id), upload['size'])
+    get_upload_store().discard(upload_id)
+    remove_remote_part(upload)
+    return make_response(jsonify({'message': f"Upload {upload_id} was cancelled"}), 200)
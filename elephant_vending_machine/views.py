@@ -11,15 +11,16 @@ a lot of routes.
 from datetime import datetime
 import importlib.util
 import os
-import sys
-import shutil
-import subprocess
-from subprocess import CalledProcessError
+import zlib
 import py_compile
 from flask import json, request, make_response, jsonify
-from werkzeug.utils import secure_filename
 from elephant_vending_machine import APP
-from .libraries.experiment_logger import create_experiment_logger
+from .libraries.experiment_logger import create_experiment_logger, close_experiment_logger
+from .libraries.directory_cache import DirectoryCache
+from .libraries.log_catalog import LogCatalog
+from .libraries.run_manager import ExperimentRun, RunManager
+from .libraries.signal_bus import create_signal_transport
+from .libraries.trial_log import trial_log_name
 from .libraries.vending_machine import VendingMachine
 
 ALLOWED_IMG_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'svg'}
@@ -27,12 +28,62 @@ ALLOWED_EXPERIMENT_EXTENSIONS = {'py'}
 IMAGE_UPLOAD_FOLDER = '/static/img'
 EXPERIMENT_UPLOAD_FOLDER = '/static/experiment'
 LOG_FOLDER = '/static/log'
-VENDING_MACHINE_OBJ = None
+THUMBNAIL_FOLDER = '/static/thumbnails'
+RUN_MANAGER = RunManager()
+SIGNAL_TRANSPORT = None
+LOG_CATALOG = None
+DIRECTORY_CACHE = DirectoryCache()
+# Largest page of log catalog results returned at once
+MAX_PAGE_SIZE = 500
+
+def get_signal_transport():
+    """Returns the transport carrying monitor pi signals to the running experiment,
+    creating it from the SIGNAL_TRANSPORT config on first use."""
+    global SIGNAL_TRANSPORT
+    if SIGNAL_TRANSPORT is None:
+        SIGNAL_TRANSPORT = create_signal_transport(APP.config)
+    return SIGNAL_TRANSPORT
+
+def get_log_catalog():
+    """Returns the catalog of log files, opening the database at LOG_CATALOG_PATH on
+    first use."""
+    global LOG_CATALOG
+    if LOG_CATALOG is None:
+        log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+        LOG_CATALOG = LogCatalog(APP.config['LOG_CATALOG_PATH'], log_directory)
+    return LOG_CATALOG
+
+def flag_argument(name):
+    """Returns whether a query parameter is set to true, 1 or yes."""
+    return request.args.get(name, 'false').lower() in ('1', 'true', 'yes')
+
+def listing_response(body, etag):
+    """Returns the JSON response for a directory listing, or an empty 304 Not Modified
+    response if the client's If-None-Match header shows it already has the listing.
+
+    Parameters:
+        body (dict): The JSON body of the listing
+        etag (str): The ETag of the listing
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(jsonify(body), 200)
+    response.set_etag(etag)
+    return response
+
+def listing_etag(listing, file_request_path):
+    """Returns the ETag of a listing response, which depends on the directory's contents
+    and the URL prefix of the listed files."""
+    return f'{listing.etag}-{zlib.crc32(file_request_path.encode()):08x}'
 
 @APP.route('/run-experiment/<filename>', methods=['POST'])
 def run_experiment(filename):
     """Start execution of experiment python file specified by user
 
+    The experiment runs in the background, use the returned run_id with the
+    ``/run/<run_id>`` routes to follow or cancel it.
+
     **Example request**:
 
     .. sourcecode::
@@ -49,13 +100,14 @@ def run_experiment(filename):
 
       HTTP/1.0 200 OK
       Content-Type: application/json; charset=utf-8
-      Content-Length: 88
+      Content-Length: 143
       Server: Werkzeug/0.16.1 Python/3.8.1
       Date: Thu, 13 Feb 2020 15:35:32 GMT
 
       {
         "log_file": "2020-03-17 05:15:06.558356 example_experiment.csv",
-        "message": "Running example_experiment"
+        "message": "Running example_experiment",
+        "run_id": "1d7b2f0c9e8a4c53b6f1a2e3d4c5b6a7"
       }
 
     All requests sent to this route should have an experiment file
@@ -63,15 +115,24 @@ def run_experiment(filename):
 
     :status 200: experiment started
     :status 400: malformed request
+    :status 409: another experiment is already running
     """
     path_to_current_file = os.path.dirname(os.path.abspath(__file__))
     experiment_directory = os.path.join(path_to_current_file, 'static', 'experiment')
     response_message = ""
     response_code = 400
     response_body = {}
-    if filename in os.listdir(experiment_directory):
+    active_run = RUN_MANAGER.active()
+    if active_run is not None:
+        response_message = f"Experiment {active_run.experiment} is already running"
+        response_code = 409
+    elif get_signal_transport().busy():
+        # Running in another worker process, so nothing is created for this run
+        response_message = "Another experiment is already running"
+        response_code = 409
+    elif filename in os.listdir(experiment_directory):
         log_filename = str(datetime.now()) + ' ' + filename + '.csv'
-        exp_logger = create_experiment_logger(log_filename)
+        exp_logger = create_experiment_logger(log_filename, APP.config['STRUCTURED_LOGS'])
 
         exp_logger.info('Experiment %s started', filename)
 
@@ -81,14 +142,29 @@ def run_experiment(filename):
         module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(module)
 
-        vending_machine = VendingMachine(APP.config['REMOTE_HOSTS'], {})
-        global VENDING_MACHINE_OBJ
-        VENDING_MACHINE_OBJ = vending_machine
-        module.run_experiment(exp_logger, vending_machine)
-
-        response_message = 'Running ' + str(filename)
-        response_code = 200
-        response_body['log_file'] = log_filename
+        vending_machine = VendingMachine(APP.config['REMOTE_HOSTS'],
+                                         {'DISPLAY_AGENT_PORT': APP.config['DISPLAY_AGENT_PORT'],
+                                          'DISPLAY_SETTLE_TIME': APP.config['DISPLAY_SETTLE_TIME'],
+                                          'DISPLAY_ONSET_LEAD': APP.config['DISPLAY_ONSET_LEAD'],
+                                          'PRERENDERED_IMAGES': APP.config['PRERENDER_IMAGES']},
+                                         exp_logger)
+        run = ExperimentRun(filename, log_filename, vending_machine,
+                            getattr(module, 'NUM_TRIALS', None))
+        try:
+            RUN_MANAGER.start(run, module.run_experiment, exp_logger, get_signal_transport(),
+                              get_log_catalog())
+            response_message = 'Running ' + str(filename)
+            response_code = 200
+            response_body['log_file'] = log_filename
+            response_body['run_id'] = run.run_id
+        except RuntimeError as error:
+            # Another worker started an experiment since the check above
+            close_experiment_logger(exp_logger)
+            log_directory = path_to_current_file + LOG_FOLDER
+            if os.path.isfile(os.path.join(log_directory, log_filename)):
+                remove_log(log_directory, log_filename)
+            response_message = str(error)
+            response_code = 409
     else:
         response_message = f"No experiment named {filename}"
         response_code = 400
@@ -96,15 +172,81 @@ def run_experiment(filename):
     response_body['message'] = response_message
     return make_response(jsonify(response_body), response_code)
 
+@APP.route('/run', methods=['GET'])
+def list_runs():
+    """Returns the status of every experiment run since the server started
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "runs": [
+          {
+            "current_trial": 3,
+            "error": null,
+            "experiment": "example_experiment.py",
+            "finished": null,
+            "log_file": "2020-03-17 05:15:06.558356 example_experiment.py.csv",
+            "result": null,
+            "run_id": "1d7b2f0c9e8a4c53b6f1a2e3d4c5b6a7",
+            "started": "2020-03-17 05:15:06.558356",
+            "status": "running",
+            "total_trials": 20
+          }
+        ]
+      }
+
+    :status 200: run list successfully returned
+    """
+    return make_response(jsonify({'runs': [run.to_dict() for run in RUN_MANAGER.runs()]}), 200)
+
+@APP.route('/run/<run_id>', methods=['GET'])
+def get_run(run_id):
+    """Returns the status, progress and result of an experiment run
+
+    The status is one of running, finished, failed or cancelled. Progress is reported
+    as current_trial out of total_trials, and result holds the value returned by the
+    experiment once it has finished.
+
+    :status 200: run status successfully returned
+    :status 404: no run with the given id
+    """
+    run = RUN_MANAGER.get(run_id)
+    if run is None:
+        return make_response(jsonify({'message': f"No run with id {run_id}"}), 404)
+    return make_response(jsonify(run.to_dict()), 200)
+
+@APP.route('/run/<run_id>/cancel', methods=['POST'])
+def cancel_run(run_id):
+    """Cancels a running experiment
+
+    The experiment stops the next time it waits for input or changes the stimuli.
+
+    :status 200: run is being cancelled
+    :status 400: run has already ended
+    :status 404: no run with the given id
+    """
+    if RUN_MANAGER.get(run_id) is None:
+        return make_response(jsonify({'message': f"No run with id {run_id}"}), 404)
+    if RUN_MANAGER.cancel(run_id):
+        return make_response(jsonify({'message': f"Cancelling run {run_id}"}), 200)
+    return make_response(jsonify({'message': f"Run {run_id} has already ended"}), 400)
+
 @APP.route('/signal', methods=['POST'])
 def get_signal():
-    """Receives a signal from monitor pi, and sets the vending machine's signal_sender variable
+    """Receives a signal from monitor pi, and delivers it to the running experiment
+
+    The signal is published on the signal transport, so it reaches the experiment
+    whichever server worker process is running it.
     """
     response_message = ""
     response_code = 400
     response_body = {}
-    if VENDING_MACHINE_OBJ:
-        VENDING_MACHINE_OBJ.signal_sender = request.form['address']
+    if get_signal_transport().publish(request.form['address']):
         response_code = 200
         response_body = {}
         response_message = "Success: Signal sent"
@@ -113,41 +255,6 @@ def get_signal():
     response_body['message'] = response_message
     return make_response(jsonify(response_body), response_code)
 
-def add_remote_image(local_image_path, group, filename):
-    """Adds an image to the remote hosts defined in flask config.
-
-    Parameters:
-        local_image_path (str): The local path of the image to be copied
-        filename (str): The filename of the local file to be copied
-
-    Raises:
-        CalledProcessError: If scp or ssh calls fail for one of the hosts
-    """
-    for host in APP.config['REMOTE_HOSTS']:
-        user = APP.config['REMOTE_HOST_USERNAME']
-        directory = APP.config['REMOTE_IMAGE_DIRECTORY'] + '/' + group
-        ssh_command = f'''ssh -oStrictHostKeyChecking=accept-new -i /root/.ssh/id_rsa \
-            {user}@{host} mkdir -p {directory}'''
-        subprocess.run(ssh_command, check=True, shell=True)
-        scp_command = f"scp {local_image_path}/{filename} {user}@{host}:{directory}/{filename}"
-        subprocess.run(scp_command, check=True, shell=True)
-
-def delete_remote_image(group, filename):
-    """Deletes an image from the remote hosts defined in flask config.
-
-    Parameters:
-        filename (str): The filename of the remote file to be deleted
-
-    Raises:
-        CalledProcessError: If scp or ssh calls fail for one of the hosts
-    """
-    for host in APP.config['REMOTE_HOSTS']:
-        user = APP.config['REMOTE_HOST_USERNAME']
-        directory = APP.config['REMOTE_IMAGE_DIRECTORY'] + '/' + group
-        ssh_command = f'''ssh -oStrictHostKeyChecking=accept-new -i /root/.ssh/id_rsa \
-            {user}@{host} rm {directory}/{filename}'''
-        subprocess.run(ssh_command, check=True, shell=True)
-
 def allowed_file(filename, allowed_extensions):
     """Determines whether an uploaded image file has an allowed extension.
 
@@ -162,247 +269,29 @@ def allowed_file(filename, allowed_extensions):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+def uploaded_file(allowed_extensions):
+    """Returns the file sent in the file field of the request, along with the error to
+    respond with instead if it is missing or its extension is not allowed.
 
-@APP.route('/<group>/image', methods=['POST'])
-def upload_image(group):
-    """Return string indicating result of image upload request
-
-    **Example request**:
-
-    .. sourcecode::
-
-      POST /image HTTP/1.1
-      Host: 127.0.0.1:5000
-      Content-Type: multipart/form-data; boundary=--------------------------827430006917349763475527
-      Accept-Encoding: gzip, deflate, br
-      Content-Length: 737067
-      Connection: keep-alive
-      ----------------------------827430006917349763475527
-      Content-Disposition: form-data; name="file"; filename="elephant.jpeg"
-
-      <elephant.jpeg>
-      ----------------------------827430006917349763475527--
-
-    **Example response**:
-
-    .. sourcecode:: http
-
-      HTTP/1.0 200 OK
-      Content-Type: text/html; charset=utf-8
-      Content-Length: 21
-      Server: Werkzeug/0.16.1 Python/3.8.1
-      Date: Thu, 13 Feb 2020 15:35:32 GMT
-
-      {
-          "message":"Success: Image saved."
-      }
-
-    All requests sent to this route should have an image file
-    included in the body of the request, otherwise a 400 error
-    will be returned
+    Parameters:
+        allowed_extensions (array of str): The allowed file extensions
 
-    :status 201: file saved
-    :status 400: malformed request
+    Returns:
+        tuple: The FileStorage and None, or None and the error message
     """
-
-    response = ""
-    response_code = 400
     if 'file' not in request.files:
-        response = "Error with request: No file field in body of request."
-    else:
-        file = request.files['file']
-        if file.filename == '':
-            response = "Error with request: File field in body of response with no file present."
-        elif file and allowed_file(file.filename, ALLOWED_IMG_EXTENSIONS):
-            filename = secure_filename(file.filename)
-            save_path = os.path.dirname(os.path.abspath(__file__)) \
-               + IMAGE_UPLOAD_FOLDER + "/" + group
-            file.save(os.path.join(save_path, filename))
-            response = "Success: Image saved."
-            response_code = 201
-
-            try:
-                add_remote_image(save_path, group, filename)
-            except CalledProcessError:
-                if filename in os.listdir(save_path):
-                    os.remove(os.path.join(save_path, filename))
-                response = "Error: Failed to copy file to hosts. ", \
-                  "Image not saved, please try again"
-                response_code = 500
-        else:
-            response = "Error with request: File extension not allowed."
-    return  make_response(jsonify({'message': response}), response_code)
-
-@APP.route('/<group>/<image>/copy', methods=['POST'])
-def copy_image(group, image):
-    """Returns a message indicating whether copying of the specified file was successful
-
-    **Example request**:
-
-    .. sourcecode::
-
-      POST /test1/blank.jpg/copy HTTP/1.1
-      Host: 127.0.0.1
-      Content-Type: multipart/form-data; boundary=--------------------------827430006917349763475527
-      Accept-Encoding: gzip, deflate, br
-      Content-Length: 737067
-      Connection: keep-alive
-      ----------------------------827430006917349763475527
-      Content-Disposition: form-data; name="test2"
-
-      {name: "test2"}
-      ----------------------------827430006917349763475527--
-
-    **Example response**:
-
-    .. sourcecode:: http
-
-      HTTP/1.0 200 OK
-      Content-Type: application/json
-      Content-Length: 59
-      Access-Control-Allow-Origin: *
-      Server: Werkzeug/0.16.1 Python/3.8.2
-      Date: Fri, 27 Mar 2020 16:13:42 GMT
-
-      {
-        "message": "File blank.jpg was successfully copied to group 'test2'."
-      }
-
-    :status 200: image file successfully copied
-    :status 400: group with specified name could not be found
-    """
-    response = ""
-    response_code = 400
-    group2 = request.form["name"]
-    old_group = image_path = os.path.dirname(os.path.abspath(__file__)) + \
-      IMAGE_UPLOAD_FOLDER + "/" + group
-    image_path = os.path.dirname(os.path.abspath(__file__)) + \
-      IMAGE_UPLOAD_FOLDER + "/" + group + "/" + image
-    group_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER + "/" + group2
-    print(image_path, file=sys.stderr)
-    if os.path.isdir(group_path):
-        if os.path.exists(image_path):
-            try:
-                add_remote_image(old_group, group2, image)
-                shutil.copy(image_path, group_path)
-                response = "File " + image + " was successfully copied to group '" + 	group2 + "'."
-                response_code = 200
-            except CalledProcessError:
-                if os.path.exists(group_path + "/" + image):
-                    os.remove(group_path + "/" + image)
-                response = "Error: Failed to copy file to hosts. ", \
-                  "Image not copied, please try again"
-                response_code = 500
-        else:
-            response = "Error with request: " + image + " does not exist"
-    else:
-        response = "Error with request: " + group2 + " is not an existing directory"
-    return  make_response(jsonify({'message': response}), response_code)
-
-@APP.route('/image/<group>/<filename>', methods=['DELETE'])
-def delete_image(group, filename):
-    """Returns a message indicating whether deletion of the specified file was successful
-
-    **Example request**:
-
-    .. sourcecode::
-
-      DELETE /image/group-name/blank.jpg HTTP/1.1
-      Host: 127.0.0.1
-      Accept-Encoding: gzip, deflate, br
-      Connection: keep-alive
-
-    **Example response**:
-
-    .. sourcecode:: http
-
-      HTTP/1.0 200 OK
-      Content-Type: application/json
-      Content-Length: 59
-      Access-Control-Allow-Origin: *
-      Server: Werkzeug/0.16.1 Python/3.8.2
-      Date: Fri, 27 Mar 2020 16:13:42 GMT
-
-      {
-        "message": "File blank.jpg was successfully deleted."
-      }
-
-    :status 200: image file successfully deleted
-    :status 400: file with specified name could not be found
-    """
-    response_code = 400
-    response = ""
-    image_directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER + "/" + group
-    if os.path.isdir(image_directory):
-        if filename in os.listdir(image_directory):
-            try:
-                try:
-                    delete_remote_image(group, filename)
-                    os.remove(os.path.join(image_directory, filename))
-                    response = f"File {filename} was successfully deleted."
-                    response_code = 200
-                except CalledProcessError:
-                    response_code = 500
-                    response = "Error: Failed to delete file from hosts. ", \
-                    "Image not deleted, please try again"
-            except IsADirectoryError:
-                response = f"{filename} exists, but is a directory and not a file. Deletion failed."
-        else:
-            response = f"File {filename} does not exist and so couldn't be deleted."
-    else:
-        response = f"Group {group} does not exist"
-    return make_response(jsonify({'message': response}), response_code)
-
-@APP.route('/<group>', methods=['GET'])
-def list_images(group):
-    """Returns a list of images from the images directory
-
-    **Example request**:
-
-    .. sourcecode::
-
-      GET /image HTTP/1.1
-      Host: 127.0.0.1
-      Accept-Encoding: gzip, deflate, br
-      Connection: keep-alive
-
-    **Example response**:
-
-    .. sourcecode:: http
-
-      HTTP/1.0 200 OK
-      Content-Type: application/json; charset=utf-8
-      Content-Length: 212
-      Server: Werkzeug/0.16.1 Python/3.8.1
-      Date: Thu, 13 Feb 2020 15:35:32 GMT
-
-      {
-        "files": [
-          "http://localhost/static/img/allBlack.png",
-          "http://localhost/static/img/whiteStimuli.png"
-        ]
-      }
-
-    :status 200: image file list successfully returned
-    """
-    resource_route = "/static/img/" + group + "/"
-    file_request_path = request.base_url[:request.base_url.rfind('/')] + resource_route
-    path_to_current_file = os.path.dirname(os.path.abspath(__file__))
-    images_path = os.path.join(path_to_current_file, 'static', 'img', group)
-    directory_list = os.listdir(images_path)
-    image_files = [f for f in directory_list if os.path.isfile(os.path.join(images_path, f))]
-    image_files.sort()
-    if '.gitignore' in image_files:
-        image_files.remove('.gitignore')
-    full_image_paths = [file_request_path + f for f in image_files]
-    response_code = 200
-    return make_response(jsonify({'files': full_image_paths}), response_code)
+        return None, "Error with request: No file field in body of request."
+    file = request.files['file']
+    if file.filename == '':
+        return None, "Error with request: File field in body of response with no file present."
+    if not allowed_file(file.filename, allowed_extensions):
+        return None, "Error with request: File extension not allowed."
+    return file, None
 
 def allowed_experiment(name):
     """Determines whether a group exists in the directory already"""
     directory = os.path.dirname(os.path.abspath(__file__)) + EXPERIMENT_UPLOAD_FOLDER
-    expr = os.listdir(directory)
-    return name not in expr
+    return not DIRECTORY_CACHE.contains(directory, name)
 
 @APP.route('/experiment/create', methods=['POST'])
 def create_experiment_from_form():
@@ -457,6 +346,7 @@ def create_experiment_from_form():
             + name + ".py")
         with open(filepath, 'w') as file:
             file.write(filedata)
+        DIRECTORY_CACHE.invalidate(os.path.dirname(filepath))
     else:
         response = "Error with request: File extension not allowed."
     return make_response(jsonify({'message':response}), response_code)
@@ -502,30 +392,24 @@ def upload_experiment():
     :status 201: file saved
     :status 400: malformed request
     """
-    response = ""
     response_code = 400
-    if 'file' not in request.files:
-        response = "Error with request: No file field in body of request."
-    else:
-        file = request.files['file']
-        if file.filename == '':
-            response = "Error with request: File field in body of response with no file present."
-        elif file and allowed_file(file.filename, ALLOWED_EXPERIMENT_EXTENSIONS):
-            filename = file.filename
-            save_path = os.path.dirname(os.path.abspath(__file__)) + EXPERIMENT_UPLOAD_FOLDER
-            file.save(os.path.join(save_path, filename))
-            try:
-                py_compile.compile(os.path.join(save_path, filename), doraise=True)
-            except py_compile.PyCompileError:
-                os.remove(os.path.join(save_path, filename))
-                response = "Error: Experiment failed to compile correctly,", \
-                   "please fix the errors and re-upload"
-                response_code = 400
-                return  make_response(jsonify({'message': response}), response_code)
-            response = "Success: Experiment saved."
-            response_code = 201
-        else:
-            response = "Error with request: File extension not allowed."
+    file, response = uploaded_file(ALLOWED_EXPERIMENT_EXTENSIONS)
+    if file:
+        filename = file.filename
+        save_path = os.path.dirname(os.path.abspath(__file__)) + EXPERIMENT_UPLOAD_FOLDER
+        file.save(os.path.join(save_path, filename))
+        DIRECTORY_CACHE.invalidate(save_path)
+        try:
+            py_compile.compile(os.path.join(save_path, filename), doraise=True)
+        except py_compile.PyCompileError:
+            os.remove(os.path.join(save_path, filename))
+            DIRECTORY_CACHE.invalidate(save_path)
+            response = "Error: Experiment failed to compile correctly,", \
+               "please fix the errors and re-upload"
+            response_code = 400
+            return  make_response(jsonify({'message': response}), response_code)
+        response = "Success: Experiment saved."
+        response_code = 201
     return  make_response(jsonify({'message': response}), response_code)
 
 @APP.route('/experiment/<filename>', methods=['DELETE'])
@@ -565,6 +449,7 @@ def delete_experiment(filename):
     if filename in os.listdir(experiment_directory):
         try:
             os.remove(os.path.join(experiment_directory, filename))
+            DIRECTORY_CACHE.invalidate(experiment_directory)
             response = f"File {filename} was successfully deleted."
             response_code = 200
         except IsADirectoryError:
@@ -604,219 +489,31 @@ def list_experiments():
       }
 
     :status 200: experiment file list successfully returned
+    :status 304: list unchanged since the ETag given in If-None-Match
     """
     resource_route = "/static/experiment/"
     file_request_path = request.base_url[:request.base_url.rfind('/')] + resource_route
     path_to_current_file = os.path.dirname(os.path.abspath(__file__))
     experiments_path = os.path.join(path_to_current_file, 'static', 'experiment')
-    directory_list = os.listdir(experiments_path)
-    exper_files = [f for f in directory_list if os.path.isfile(os.path.join(experiments_path, f))]
-    exper_files.sort()
-    if '.gitignore' in exper_files:
-        exper_files.remove('.gitignore')
-    full_experiment_paths = [file_request_path + f for f in exper_files]
-    response_code = 200
-    return make_response(jsonify({'files': full_experiment_paths}), response_code)
-
-@APP.route('/log/<filename>', methods=['DELETE'])
-def delete_log(filename):
-    """Returns a message indicating whether deletion of the specified file was successful
-
-    **Example request**:
-
-    .. sourcecode::
-
-      DELETE /log/somelog.csv HTTP/1.1
-      Host: 127.0.0.1
-      Accept-Encoding: gzip, deflate, br
-      Connection: keep-alive
-
-    **Example response**:
-
-    .. sourcecode:: http
-
-      HTTP/1.0 200 OK
-      Content-Type: application/json
-      Content-Length: 59
-      Access-Control-Allow-Origin: *
-      Server: Werkzeug/0.16.1 Python/3.8.2
-      Date: Fri, 27 Mar 2020 16:13:42 GMT
-
-      {
-        "message": "File somelog.csv was successfully deleted."
-      }
-
-    :status 200: log file successfully deleted
-    :status 400: file with specified name could not be found
-    """
-    log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
-    response_code = 400
-    response = ""
-    if filename in os.listdir(log_directory):
-        try:
-            os.remove(os.path.join(log_directory, filename))
-            response = f"File {filename} was successfully deleted."
-            response_code = 200
-        except IsADirectoryError:
-            response = f"{filename} exists, but is a directory and not a file. Deletion failed."
-    else:
-        response = f"File {filename} does not exist and so couldn't be deleted."
-    return make_response(jsonify({'message': response}), response_code)
+    listing = DIRECTORY_CACHE.listing(experiments_path)
+    full_experiment_paths = [file_request_path + f for f in listing.files if f != '.gitignore']
+    return listing_response({'files': full_experiment_paths},
+                            listing_etag(listing, file_request_path))
 
-@APP.route('/log', methods=['GET'])
-def list_logs():
-    """Returns a list of log resources from the log directory.
-
-    **Example request**:
-
-    .. sourcecode::
-
-      GET /log HTTP/1.1
-      Host: 127.0.0.1
-      Accept-Encoding: gzip, deflate, br
-      Connection: keep-alive
-
-    **Example response**:
-
-    .. sourcecode:: http
-
-      HTTP/1.0 200 OK
-      Content-Type: application/json; charset=utf-8
-      Content-Length: 212
-      Server: Werkzeug/0.16.1 Python/3.8.1
-      Date: Thu, 13 Feb 2020 15:35:32 GMT
-
-      {
-        "files": [
-          "http://localhost:5000/static/log/2020-03-17 04:26:02.085651 exampleExperiment.csv",
-          "http://localhost:5000/static/log/2020-03-17 04:27:04.019992 exampleExperiment.csv"
-        ]
-      }
-
-    :status 200: log file list successfully returned
-    """
-    resource_route = "/static/log/"
-    file_request_path = request.base_url[:request.base_url.rfind('/')] + resource_route
-    path_to_current_file = os.path.dirname(os.path.abspath(__file__))
-    logs_path = os.path.join(path_to_current_file, 'static', 'log')
-    directory_list = os.listdir(logs_path)
-    log_files = [f for f in directory_list if os.path.isfile(os.path.join(logs_path, f))]
-    log_files.sort()
-    if '.gitignore' in log_files:
-        log_files.remove('.gitignore')
-    full_log_paths = [file_request_path + f for f in log_files]
-    response_code = 200
-    return make_response(jsonify({'files': full_log_paths}), response_code)
-
-def allowed_group(name):
-    """Determines whether a group exists in the directory already"""
-    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
-    groups = os.listdir(directory)
-    return name not in groups
-
-def add_remote_group(group_name):
-    """Adds a group to the remote hosts defined in flask config.
+def remove_log(log_directory, filename):
+    """Removes a log file, the structured trial log written next to it and its catalog
+    entry.
 
     Parameters:
-        group_name (str): The filename of the local group to be copied
-
-    Raises:
-        CalledProcessError: If scp or ssh calls fail for one of the hosts
+        log_directory (str): The directory holding the log file
+        filename (str): The name of the log file
     """
-    for host in APP.config['REMOTE_HOSTS']:
-        user = APP.config['REMOTE_HOST_USERNAME']
-        directory = APP.config['REMOTE_IMAGE_DIRECTORY']
-        ssh_command = f'''ssh -oStrictHostKeyChecking=accept-new -i /root/.ssh/id_rsa \
-            {user}@{host} mkdir -p {directory}'''
-        subprocess.run(ssh_command, check=True, shell=True)
-        mkdir_command = f'''ssh -oStrictHostKeyChecking=accept-new -i /root/.ssh/id_rsa \
-            {user}@{host} mkdir -p {directory}/{group_name}'''
-        subprocess.run(mkdir_command, check=True, shell=True)
-
-def delete_remote_group(group_name):
-    """Deletes a group from the remote hosts defined in flask config.
-
-    Parameters:
-        group_name (str): The name of the remote group to be deleted
-
-    Raises:
-        CalledProcessError: If scp or ssh calls fail for one of the hosts
-    """
-    for host in APP.config['REMOTE_HOSTS']:
-        user = APP.config['REMOTE_HOST_USERNAME']
-        directory = APP.config['REMOTE_IMAGE_DIRECTORY']
-        ssh_command = f'''ssh -oStrictHostKeyChecking=accept-new -i /root/.ssh/id_rsa \
-            {user}@{host} rm -r {directory}/{group_name}'''
-        subprocess.run(ssh_command, check=True, shell=True)
-
-@APP.route('/groups', methods=['GET'])
-def list_groups():
-    """Return JSON body with message of all folders in the static/img directory"""
-    path_to_current_file = os.path.dirname(os.path.abspath(__file__))
-    images_path = os.path.join(path_to_current_file, 'static', 'img')
-    groups = os.listdir(images_path)
-    groups.sort()
-    if '.gitignore' in groups:
-        groups.remove('.gitignore')
-    for group in groups:
-        if not os.path.isdir(os.path.join(images_path, group)):
-            groups.remove(group)
-    response_code = 200
-    return make_response(jsonify({'names': groups}), response_code)
-
-@APP.route('/groups', methods=['POST'])
-def create_group():
-    """Return JSON body with message indicating result of group creation request"""
-    response = ""
-    response_code = 400
-    if 'name' not in request.form:
-        response = "Error with request: No name field in body of request."
-    else:
-        group_name = request.form['name']
-        if group_name == '':
-            response = "Error with request: Group name must not be empty."
-        elif allowed_group(group_name):
-            filename = secure_filename(group_name)
-            try:
-                add_remote_group(filename)
-                save_path = os.path.dirname(os.path.abspath(__file__))+IMAGE_UPLOAD_FOLDER
-                folder = os.path.join(save_path, filename)
-                os.makedirs(folder)
-                response = "Success: Group created."
-                response_code = 201
-            except CalledProcessError:
-                response = "Error: Failed to create group on hosts."
-                response_code = 500
-        else:
-            response = "Error with request: Group already exists."
-    return make_response(jsonify({'message': response}), response_code)
-
-
-@APP.route('/groups/<name>', methods=['DELETE'])
-def delete_group(name):
-    """Return JSON body with message indicating result of group deletion request"""
-    directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
-    response_code = 400
-    response = ""
-    if name != "Fixations":
-        if name in os.listdir(directory):
-            try:
-                delete_remote_group(name)
-                try:
-                    shutil.rmtree(os.path.join(directory, name))
-                    response = f"Group {name} was successfully deleted."
-                    response_code = 200
-                except OSError:
-                    response = "An error has occurred and the group could not be deleted"
-            except CalledProcessError:
-                response_code = 500
-                response = "Error: Failed to delete file from hosts. ", \
-                 "Group not deleted, please try again"
-        else:
-            response = f"Group {name} does not exist and so couldn't be deleted."
-    else:
-        response = "The fixations group cannot be deleted"
-    return make_response(jsonify({'message': response}), response_code)
+    os.remove(os.path.join(log_directory, filename))
+    trial_log_path = os.path.join(log_directory, trial_log_name(filename))
+    if trial_log_name(filename) != filename and os.path.isfile(trial_log_path):
+        os.remove(trial_log_path)
+    get_log_catalog().remove(filename)
+    DIRECTORY_CACHE.invalidate(log_directory)
 
 @APP.route('/template', methods=['GET'])
 def download_example_path(filename="form_template.py"):
@@ -0,0 +1,89 @@
+import io
+import os
+
+import pytest
+
+from elephant_vending_machine.libraries.blob_store import BlobCorruptedError, BlobStore
+from elephant_vending_machine.libraries.image_index import file_digest
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / 'group').mkdir()
+    (tmp_path / 'group2').mkdir()
+    return BlobStore(str(tmp_path / '.blobs'))
+
+def stage(store, contents):
+    path = store.staging_path()
+    with open(path, 'wb') as file:
+        file.write(contents)
+    return path
+
+def test_same_content_is_stored_once(store, tmp_path):
+    digest = store.add(stage(store, b'image'))
+    assert store.add(stage(store, b'image')) == digest
+    assert digest == file_digest(store.blob_path(digest))
+    assert [name for name in os.listdir(store.directory) if not name.startswith('.')] == [digest[:2]]
+    assert [name for name in os.listdir(store.directory) if name.startswith('.')] == []
+
+def test_link_shares_the_blob(store, tmp_path):
+    digest = store.add(stage(store, b'image'))
+    store.link(digest, str(tmp_path / 'group' / 'a.png'))
+    store.link(digest, str(tmp_path / 'group2' / 'a.png'))
+    store.link(digest, str(tmp_path / 'group2' / 'a.png'))
+    assert os.path.samefile(tmp_path / 'group' / 'a.png', tmp_path / 'group2' / 'a.png')
+    assert os.stat(store.blob_path(digest)).st_nlink == 3
+    assert os.listdir(tmp_path / 'group2') == ['a.png']
+
+def test_replacing_an_image_keeps_other_links(store, tmp_path):
+    old = store.add(stage(store, b'old'))
+    store.link(old, str(tmp_path / 'group' / 'a.png'))
+    store.link(old, str(tmp_path / 'group2' / 'a.png'))
+    store.link(store.add(stage(store, b'new')), str(tmp_path / 'group' / 'a.png'))
+    assert (tmp_path / 'group' / 'a.png').read_bytes() == b'new'
+    assert (tmp_path / 'group2' / 'a.png').read_bytes() == b'old'
+
+def test_release_and_collect_remove_unlinked_blobs(store, tmp_path):
+    first = store.add(stage(store, b'first'))
+    second = store.add(stage(store, b'second'))
+    store.link(first, str(tmp_path / 'group' / 'a.png'))
+    store.link(second, str(tmp_path / 'group' / 'b.png'))
+    store.release(first)
+    assert os.path.exists(store.blob_path(first))
+    os.remove(tmp_path / 'group' / 'a.png')
+    store.release(first)
+    assert not os.path.exists(store.blob_path(first))
+    os.remove(tmp_path / 'group' / 'b.png')
+    assert store.collect() == 1
+    assert not os.path.exists(store.blob_path(second))
+
+def test_adopt_links_existing_images(store, tmp_path):
+    (tmp_path / 'group' / 'a.png').write_bytes(b'image')
+    (tmp_path / 'group2' / 'a.png').write_bytes(b'image')
+    digest = file_digest(str(tmp_path / 'group' / 'a.png'))
+    store.adopt(str(tmp_path / 'group' / 'a.png'), digest)
+    store.adopt(str(tmp_path / 'group2' / 'a.png'), digest)
+    assert os.stat(store.blob_path(digest)).st_nlink == 3
+
+def test_adopt_checks_the_hash(store, tmp_path):
+    digest = store.add(stage(store, b'image'))
+    (tmp_path / 'group' / 'a.png').write_bytes(b'imagf')
+    with pytest.raises(BlobCorruptedError):
+        store.adopt(str(tmp_path / 'group' / 'a.png'), digest)
+    with pytest.raises(BlobCorruptedError):
+        store.adopt(str(tmp_path / 'group' / 'a.png'), file_digest(stage(store, b'other')))
+    assert (tmp_path / 'group' / 'a.png').read_bytes() == b'imagf'
+    assert os.stat(store.blob_path(digest)).st_nlink == 1
+
+def test_verify(store, tmp_path):
+    digest = store.add(stage(store, b'image'))
+    store.link(digest, str(tmp_path / 'group' / 'a.png'))
+    store.verify(str(tmp_path / 'group' / 'a.png'), digest)
+    (tmp_path / 'group' / 'a.png').write_bytes(b'imagf')
+    with pytest.raises(BlobCorruptedError):
+        store.verify(str(tmp_path / 'group' / 'a.png'), digest)
+
+def test_write_hashes_the_stream(store, tmp_path):
+    digest = store.write(io.BytesIO(b'image'))
+    assert digest == store.add(stage(store, b'image'))
+    assert [name for name in os.listdir(store.directory) if name.startswith('.')] == []
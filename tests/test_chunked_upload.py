@@ -0,0 +1,84 @@
+import hashlib
+import io
+
+import pytest
+
+from elephant_vending_machine.libraries.chunked_upload import UploadConflictError, UploadError, \
+    UploadStore
+
+
+class BrokenStream:
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read(self, size):
+        block = self.stream.read(size)
+        if not block:
+            raise ConnectionResetError()
+        return block
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(str(tmp_path / 'uploads'))
+
+def test_upload_in_chunks(store):
+    upload = store.create('group', 'a.png', 10)
+    assert store.write(upload['upload_id'], 0, io.BytesIO(b'01234')) == (5, None)
+    assert store.get(upload['upload_id'])['offset'] == 5
+    assert store.write(upload['upload_id'], 5, io.BytesIO(b'56789')) == \
+        (10, hashlib.sha256(b'0123456789').hexdigest())
+    with open(store.part_path(upload['upload_id']), 'rb') as part_file:
+        assert part_file.read() == b'0123456789'
+
+def test_chunk_must_start_at_offset(store):
+    upload = store.create('group', 'a.png', 10)
+    store.write(upload['upload_id'], 0, io.BytesIO(b'01234'))
+    with pytest.raises(UploadConflictError) as raised:
+        store.write(upload['upload_id'], 3, io.BytesIO(b'34567'))
+    assert raised.value.offset == 5
+
+def test_upload_cannot_exceed_size(store):
+    upload = store.create('group', 'a.png', 4)
+    with pytest.raises(UploadError) as raised:
+        store.write(upload['upload_id'], 0, io.BytesIO(b'01234'))
+    assert not isinstance(raised.value, UploadConflictError)
+
+def test_resume_after_broken_chunk_and_restart(store, tmp_path):
+    upload = store.create('group', 'a.png', 10)
+    with pytest.raises(ConnectionResetError):
+        store.write(upload['upload_id'], 0, BrokenStream(b'0123'))
+    restarted = UploadStore(str(tmp_path / 'uploads'))
+    assert restarted.get(upload['upload_id'])['offset'] == 4
+    assert restarted.write(upload['upload_id'], 4, io.BytesIO(b'456789'))[1] == \
+        hashlib.sha256(b'0123456789').hexdigest()
+
+def test_unknown_uploads(store):
+    assert store.get('0' * 32) is None
+    assert store.get('../etc') is None
+    with pytest.raises(KeyError):
+        store.write('0' * 32, 0, io.BytesIO(b''))
+
+def test_upload_discarded_while_written(store, monkeypatch):
+    upload = store.create('group', 'a.png', 10)
+    store.discard(upload['upload_id'])
+    monkeypatch.setattr(store, 'get', lambda upload_id: upload)
+    with pytest.raises(KeyError):
+        store.write(upload['upload_id'], 0, io.BytesIO(b'01234'))
+
+def test_purge_and_discard(store):
+    first = store.create('group', 'a.png', 10)
+    second = store.create('group', 'b.png', 10)
+    assert store.purge() == []
+    assert sorted(store.purge(expiry=-1)) == sorted([first['upload_id'], second['upload_id']])
+    assert store.get(first['upload_id']) is None
+    upload = store.create('group', 'c.png', 10)
+    store.discard(upload['upload_id'])
+    assert store.get(upload['upload_id']) is None
+
+def test_purge_calls_expired(tmp_path):
+    expired = []
+    store = UploadStore(str(tmp_path / 'uploads'), expired.append)
+    upload = store.create('group', 'a.png', 10)
+    store.purge(expiry=-1)
+    assert [(entry['upload_id'], entry['group']) for entry in expired] == [(upload['upload_id'], 'group')]
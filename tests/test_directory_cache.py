@@ -0,0 +1,64 @@
+import os
+
+from elephant_vending_machine.libraries import directory_cache
+from elephant_vending_machine.libraries.directory_cache import DirectoryCache, scan_directory
+
+
+def make_old(path):
+    os.utime(path, ns=(0, 0))
+
+def count_scans(monkeypatch):
+    scans = []
+    real_scan = directory_cache.scan_directory
+    monkeypatch.setattr(directory_cache, 'scan_directory', lambda path: scans.append(path) or real_scan(path))
+    return scans
+
+def test_scan_directory(tmp_path):
+    (tmp_path / 'b.png').write_bytes(b'')
+    (tmp_path / 'a.png').write_bytes(b'')
+    (tmp_path / 'group').mkdir()
+    listing = scan_directory(str(tmp_path))
+    assert listing.files == ('a.png', 'b.png')
+    assert listing.directories == ('group',)
+    assert listing.names == {'a.png', 'b.png', 'group'}
+
+def test_etag_changes_with_contents(tmp_path):
+    (tmp_path / 'a.png').write_bytes(b'')
+    first = scan_directory(str(tmp_path)).etag
+    assert scan_directory(str(tmp_path)).etag == first
+    (tmp_path / 'a.png').rename(tmp_path / 'b.png')
+    assert scan_directory(str(tmp_path)).etag != first
+
+def test_unchanged_directory_is_not_scanned_again(tmp_path, monkeypatch):
+    scans = count_scans(monkeypatch)
+    (tmp_path / 'a.png').write_bytes(b'')
+    make_old(tmp_path)
+    cache = DirectoryCache()
+    assert cache.listing(str(tmp_path)).files == ('a.png',)
+    assert cache.contains(str(tmp_path), 'a.png')
+    assert len(scans) == 1
+
+def test_changed_directory_is_scanned_again(tmp_path, monkeypatch):
+    scans = count_scans(monkeypatch)
+    make_old(tmp_path)
+    cache = DirectoryCache()
+    assert cache.listing(str(tmp_path)).files == ()
+    (tmp_path / 'a.png').write_bytes(b'')
+    assert cache.listing(str(tmp_path)).files == ('a.png',)
+    assert len(scans) == 2
+
+def test_recently_changed_directory_is_not_cached(tmp_path, monkeypatch):
+    scans = count_scans(monkeypatch)
+    cache = DirectoryCache(racy_window=60)
+    cache.listing(str(tmp_path))
+    cache.listing(str(tmp_path))
+    assert len(scans) == 2
+
+def test_invalidate(tmp_path, monkeypatch):
+    scans = count_scans(monkeypatch)
+    make_old(tmp_path)
+    cache = DirectoryCache()
+    cache.listing(str(tmp_path))
+    cache.invalidate(str(tmp_path) + '/')
+    cache.listing(str(tmp_path))
+    assert len(scans) == 2
@@ -1,14 +1,23 @@
 import csv
 import io
 import logging
+import os
 import pytest
 import re
+import threading
+import time
+from datetime import datetime
 
-from elephant_vending_machine.libraries.experiment_logger import CsvFormatter, create_experiment_logger
+from elephant_vending_machine.libraries.experiment_logger import CsvFormatter, FastCsvFormatter, \
+    BatchingFileHandler, ExperimentLoggerRegistry, create_experiment_logger, close_experiment_logger, flush_experiment_logger
+from elephant_vending_machine.libraries.run_manager import RunManager, ExperimentRun, FINISHED
+from elephant_vending_machine.libraries.signal_bus import LocalSignalTransport
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
 
 class MockLogRecord:
     def __init__(self, message):
         self.message = message
+        self.created = time.time()
 
     def getMessage(self):
         return self.message
@@ -60,4 +69,171 @@ def test_create_experiment_logger(monkeypatch):
     monkeypatch.setattr('elephant_vending_machine.libraries.experiment_logger.create_experiment_logger', lambda path: MockFileHandler(path))
     exp_logger = create_experiment_logger('unittest.csv')
     assert exp_logger.level == logging.INFO
-    assert exp_logger.name == 'experiment_logger'
+    assert exp_logger.name == 'experiment_logger.unittest.csv'
+    assert exp_logger.parent is logging.getLogger('experiment_logger')
+    close_experiment_logger(exp_logger)
+
+def test_csv_formatter_format_appends_columns():
+    record = MockLogRecord('Trial 1 timing')
+    record.columns = ['12.500', '', '3.000']
+    LOG_ENTRY_REGEX = r'^\"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{6}\",\"Trial 1 timing\",\"12.500\",\"\",\"3.000\"$'
+    formatted_message = formatter.format(record)
+    assert re.match(LOG_ENTRY_REGEX, formatted_message)
+
+def test_csv_formatter_uses_record_creation_time():
+    record = MockLogRecord('created earlier')
+    record.created = datetime(2020, 1, 2, 3, 4, 5, 678901).timestamp()
+    assert formatter.format(record) == '"2020-01-02 03:04:05.678901","created earlier"'
+
+def make_record(message, created=None):
+    record = logging.LogRecord('test', logging.INFO, __file__, 0, message, (), None)
+    if created is not None:
+        record.created = created
+    return record
+
+def read_lines(path):
+    with open(path) as log_file:
+        return log_file.read().splitlines()
+
+def test_batching_handler_flush_writes_queued_records(tmp_path):
+    path = tmp_path / 'log.csv'
+    handler = BatchingFileHandler(str(path), batch_size=1000, flush_interval=60000)
+    handler.setFormatter(CsvFormatter())
+    for index in range(10):
+        handler.handle(make_record(f'message {index}'))
+    handler.flush()
+    lines = read_lines(path)
+    assert len(lines) == 10
+    assert lines[9].endswith('"message 9"')
+    handler.close()
+
+def test_batching_handler_writes_full_batch(tmp_path):
+    path = tmp_path / 'log.csv'
+    handler = BatchingFileHandler(str(path), batch_size=5, flush_interval=60000)
+    handler.setFormatter(CsvFormatter())
+    for index in range(5):
+        handler.handle(make_record(f'message {index}'))
+    deadline = time.monotonic() + 5
+    while len(read_lines(path)) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(read_lines(path)) == 5
+    handler.close()
+
+def test_batching_handler_writes_after_flush_interval(tmp_path):
+    path = tmp_path / 'log.csv'
+    handler = BatchingFileHandler(str(path), batch_size=1000, flush_interval=20)
+    handler.setFormatter(CsvFormatter())
+    handler.handle(make_record('message'))
+    deadline = time.monotonic() + 5
+    while not read_lines(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(read_lines(path)) == 1
+    handler.close()
+
+def test_batching_handler_close_writes_remaining_records(tmp_path):
+    path = tmp_path / 'log.csv'
+    handler = BatchingFileHandler(str(path), batch_size=1000, flush_interval=60000)
+    handler.setFormatter(CsvFormatter())
+    created = datetime(2020, 1, 2, 3, 4, 5, 600000).timestamp()
+    handler.handle(make_record('last words', created))
+    handler.close()
+    assert read_lines(path) == ['"2020-01-02 03:04:05.600000","last words"']
+
+def test_flush_experiment_logger(tmp_path):
+    path = tmp_path / 'log.csv'
+    logger = logging.getLogger('test_flush_experiment_logger')
+    logger.setLevel(logging.INFO)
+    handler = BatchingFileHandler(str(path), batch_size=1000, flush_interval=60000)
+    handler.setFormatter(CsvFormatter())
+    logger.addHandler(handler)
+    logger.info('Trial %s started', 1)
+    flush_experiment_logger(logger)
+    assert read_lines(path)[0].endswith('"Trial 1 started"')
+    logger.removeHandler(handler)
+    handler.close()
+
+def test_registry_gives_each_file_its_own_logger(tmp_path):
+    registry = ExperimentLoggerRegistry(str(tmp_path))
+    first = registry.get('first.csv')
+    second = registry.get('second.csv')
+    assert first is not second
+    assert registry.get('first.csv') is first
+    first.info('only in first')
+    close_experiment_logger(first)
+    close_experiment_logger(second)
+    assert len(read_lines(tmp_path / 'first.csv')) == 1
+    assert read_lines(tmp_path / 'second.csv') == []
+    assert len(registry) == 0
+
+def test_registry_closes_least_recently_used_logger(tmp_path):
+    registry = ExperimentLoggerRegistry(str(tmp_path), max_open=2)
+    first = registry.get('first.csv')
+    second = registry.get('second.csv')
+    registry.get('first.csv')
+    third = registry.get('third.csv')
+    assert len(registry) == 2
+    assert first.handlers and third.handlers
+    assert second.handlers == []
+    close_experiment_logger(first)
+    close_experiment_logger(third)
+
+def open_file_descriptors():
+    return len(os.listdir('/proc/self/fd'))
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc to count file descriptors')
+def test_back_to_back_runs_keep_cost_and_file_descriptors_flat(tmp_path):
+    registry = ExperimentLoggerRegistry(str(tmp_path))
+    run_manager = RunManager()
+    transport = LocalSignalTransport()
+    call_times = []
+
+    def run_experiment(experiment_logger, vending_machine):
+        for trial in range(5):
+            start = time.perf_counter()
+            experiment_logger.info('Trial %s started', trial)
+            experiment_logger.info('Trial %s finished', trial)
+            call_times.append(time.perf_counter() - start)
+
+    def run_once(index):
+        log_file = f'run {index}.csv'
+        run = ExperimentRun('experiment.py', log_file, VendingMachine(['1', '2', '3']))
+        run_manager.start(run, run_experiment, registry.get(log_file), transport)
+        assert run.wait(5)
+        assert run.status == FINISHED
+
+    for index in range(20):
+        run_once(index)
+    file_descriptors = open_file_descriptors()
+    threads = threading.active_count()
+    early_cost = sorted(call_times)[len(call_times) // 2]
+    call_times.clear()
+    for index in range(20, 300):
+        run_once(index)
+    late_cost = sorted(call_times[-100:])[50]
+    assert open_file_descriptors() <= file_descriptors + 2
+    assert threading.active_count() <= threads + 2
+    assert len(registry) == 0
+    assert late_cost < early_cost * 5
+    assert len(read_lines(tmp_path / 'run 299.csv')) == 15
+
+@pytest.mark.parametrize('message, created, columns', [
+    ('Trial %s started', datetime(2020, 1, 2, 3, 4, 5, 678901).timestamp(), None),
+    ('', datetime(2020, 1, 2, 3, 4, 5).timestamp(), None),
+    ('this text "contains a quote"', datetime(2020, 1, 2, 3, 4, 5, 1).timestamp(), None),
+    ('multi\nline, with comma', 1577934245.9999996, None),
+    ('rounds half to even', 1577934245.0000025, None),
+    ('Trial %s timing', 1577934245.5, ['12.500', '', '"quoted"']),
+])
+def test_fast_csv_formatter_matches_csv_formatter(message, created, columns):
+    record = make_record(message, created)
+    if '%s' in message:
+        record.args = (7,)
+    if columns is not None:
+        record.columns = columns
+    assert FastCsvFormatter().format(record) == CsvFormatter().format(record)
+
+def test_fast_csv_formatter_updates_cached_second():
+    fast_formatter = FastCsvFormatter()
+    for created in (1577934245.25, 1577934245.75, 1577934246.25, 1577934245.5):
+        record = make_record('message', created)
+        assert fast_formatter.format(record) == CsvFormatter().format(record)
@@ -0,0 +1,89 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from elephant_vending_machine.libraries.image_archive import ARCHIVE_ERRORS, ArchiveLimitError, \
+    archive_members, is_archive, member_name
+
+
+def zip_archive(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, contents in files.items():
+            archive.writestr(name, contents)
+    buffer.seek(0)
+    return buffer
+
+def tar_archive(files, mode='w:gz'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, contents in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            archive.addfile(info, io.BytesIO(contents))
+    buffer.seek(0)
+    return buffer
+
+FILES = {
+    'set/a.png': b'a',
+    'set/nested/b.jpg': b'b',
+    'set/.DS_Store': b'',
+    '__MACOSX/set/._a.png': b'',
+}
+
+@pytest.mark.parametrize('filename, expected', [
+    ('stimuli.zip', True),
+    ('stimuli.TAR.GZ', True),
+    ('stimuli.tgz', True),
+    ('stimuli.png', False),
+    ('stimuli.gz', False),
+])
+def test_is_archive(filename, expected):
+    assert is_archive(filename) == expected
+
+def test_member_name():
+    assert member_name('set/nested/a.png') == 'a.png'
+    assert member_name('set/') is None
+    assert member_name('set/.hidden.png') is None
+    assert member_name('__MACOSX/set/a.png') is None
+
+@pytest.mark.parametrize('archive, filename', [
+    (zip_archive, 'stimuli.zip'),
+    (tar_archive, 'stimuli.tar.gz'),
+])
+def test_archive_members(archive, filename):
+    members = [(name, member.read()) for name, member in archive_members(archive(FILES), filename)]
+    assert members == [('a.png', b'a'), ('b.jpg', b'b')]
+
+def test_tar_archive_is_streamed():
+    class Unseekable(io.RawIOBase):
+        def __init__(self, buffer):
+            self.buffer = buffer
+        def readable(self):
+            return True
+        def readinto(self, target):
+            data = self.buffer.read(len(target))
+            target[:len(data)] = data
+            return len(data)
+    stream = Unseekable(tar_archive(FILES, 'w:xz'))
+    assert [name for name, _ in archive_members(stream, 'stimuli.tar.xz')] == ['a.png', 'b.jpg']
+
+@pytest.mark.parametrize('filename', ['stimuli.zip', 'stimuli.tar.gz'])
+def test_damaged_archive(filename):
+    with pytest.raises(ARCHIVE_ERRORS):
+        list(archive_members(io.BytesIO(b'not an archive'), filename))
+
+@pytest.mark.parametrize('archive, filename', [
+    (zip_archive, 'stimuli.zip'),
+    (tar_archive, 'stimuli.tar.gz'),
+])
+def test_archive_limits(archive, filename):
+    with pytest.raises(ArchiveLimitError):
+        list(archive_members(archive(FILES), filename, max_members=3))
+    bomb = archive({'a.png': b'\0' * 4096, 'b.png': b'\0' * 4096})
+    members = archive_members(bomb, filename, max_size=6000)
+    assert next(members)[0] == 'a.png'
+    with pytest.raises(ArchiveLimitError):
+        next(members)
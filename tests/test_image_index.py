@@ -0,0 +1,146 @@
+import os
+import struct
+
+import pytest
+
+from elephant_vending_machine.libraries import image_index
+from elephant_vending_machine.libraries.directory_cache import DirectoryCache
+from elephant_vending_machine.libraries.image_index import ImageIndex, decode_cursor, \
+    encode_cursor, image_dimensions, paginate
+
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00'
+
+def gif(width, height):
+    return b'GIF89a' + struct.pack('<HH', width, height) + b'\x00\x00\x00'
+
+def jpeg(width, height):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return b'\xff\xd8' + app0 + sof + b'\xff\xda'
+
+def count_descriptions(monkeypatch):
+    described = []
+    real_describe = image_index.describe_image
+    monkeypatch.setattr(image_index, 'describe_image',
+                        lambda path, status=None: described.append(os.path.basename(path)) or real_describe(path, status))
+    return described
+
+@pytest.mark.parametrize('contents, dimensions', [
+    (png(1920, 1080), (1920, 1080)),
+    (gif(640, 480), (640, 480)),
+    (jpeg(800, 600), (800, 600)),
+    (b'<svg xmlns="http://www.w3.org/2000/svg"/>', (None, None)),
+    (b'\xff\xd8\xff', (None, None)),
+])
+def test_image_dimensions(tmp_path, contents, dimensions):
+    (tmp_path / 'image').write_bytes(contents)
+    assert image_dimensions(str(tmp_path / 'image')) == dimensions
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor('a.png')) == 'a.png'
+    assert decode_cursor(encode_cursor((12, 'a.png'))) == (12, 'a.png')
+    with pytest.raises(ValueError):
+        decode_cursor('not a cursor!')
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(12))
+
+def test_paginate():
+    keys = ['a', 'b', 'c', 'd', 'e']
+    assert paginate(keys, 2) == (['a', 'b'], 'b')
+    assert paginate(keys, 2, 'b') == (['c', 'd'], 'd')
+    assert paginate(keys, 2, 'd') == (['e'], None)
+    assert paginate(keys, 2, descending=True) == (['e', 'd'], 'd')
+    assert paginate(keys, 2, 'b', descending=True) == (['a'], None)
+    assert paginate(keys) == (keys, None)
+    with pytest.raises(ValueError):
+        paginate(keys, 2, (1, 'a'))
+
+def make_group(tmp_path):
+    group = tmp_path / 'group'
+    group.mkdir()
+    (group / 'b.png').write_bytes(png(2, 2) + b'\x00' * 10)
+    (group / 'a.gif').write_bytes(gif(1, 1))
+    (group / 'c.jpg').write_bytes(jpeg(3, 3) + b'\x00' * 20)
+    (group / '.gitignore').write_bytes(b'')
+    return str(group)
+
+def test_page_by_name_does_not_read_images(tmp_path, monkeypatch):
+    group = make_group(tmp_path)
+    described = count_descriptions(monkeypatch)
+    index = ImageIndex(str(tmp_path / 'index'), DirectoryCache())
+    first = index.page(group, limit=2)
+    assert first.names == ['a.gif', 'b.png']
+    assert first.images is None
+    second = index.page(group, limit=2, cursor=first.next_cursor)
+    assert second.names == ['c.jpg']
+    assert second.next_cursor is None
+    assert index.page(group, prefix='b').names == ['b.png']
+    assert described == []
+
+def test_page_by_size_with_metadata(tmp_path):
+    group = make_group(tmp_path)
+    index = ImageIndex(str(tmp_path / 'index'), DirectoryCache())
+    page = index.page(group, sort='size', limit=2, descending=True, metadata=True)
+    assert page.names == ['c.jpg', 'b.png']
+    assert (page.images['c.jpg']['width'], page.images['c.jpg']['height']) == (3, 3)
+    assert page.images['b.png']['size'] == os.path.getsize(os.path.join(group, 'b.png'))
+    assert len(page.images['b.png']['sha256']) == 64
+    assert index.page(group, sort='size', limit=2, cursor=page.next_cursor, descending=True).names == ['a.gif']
+    with pytest.raises(ValueError):
+        index.page(group, sort='name', cursor=page.next_cursor)
+
+def test_images_are_described_once(tmp_path, monkeypatch):
+    group = make_group(tmp_path)
+    described = count_descriptions(monkeypatch)
+    index = ImageIndex(str(tmp_path / 'index'), DirectoryCache(racy_window=0))
+    index.entries(group)
+    index.entries(group)
+    assert sorted(described) == ['a.gif', 'b.png', 'c.jpg']
+    (tmp_path / 'group' / 'd.gif').write_bytes(gif(4, 4))
+    assert index.entries(group)['d.gif']['width'] == 4
+    assert sorted(described) == ['a.gif', 'b.png', 'c.jpg', 'd.gif']
+
+def test_index_is_saved(tmp_path, monkeypatch):
+    group = make_group(tmp_path)
+    entries = ImageIndex(str(tmp_path / 'index'), DirectoryCache()).entries(group)
+    described = count_descriptions(monkeypatch)
+    assert ImageIndex(str(tmp_path / 'index'), DirectoryCache()).entries(group) == entries
+    assert described == []
+
+def test_refresh_after_image_is_replaced(tmp_path):
+    group = make_group(tmp_path)
+    index = ImageIndex(str(tmp_path / 'index'), DirectoryCache())
+    before = index.page(group, metadata=True)
+    (tmp_path / 'group' / 'a.gif').write_bytes(gif(5, 5))
+    index.refresh(group, 'a.gif')
+    after = index.page(group, metadata=True)
+    assert after.images['a.gif']['width'] == 5
+    assert after.etag != before.etag
+    restarted = ImageIndex(str(tmp_path / 'index'), DirectoryCache()).page(group, metadata=True)
+    assert restarted.etag == after.etag
+    os.remove(os.path.join(group, 'a.gif'))
+    index.refresh(group, 'a.gif')
+    assert 'a.gif' not in index.entries(group)
+
+def test_forget(tmp_path):
+    group = make_group(tmp_path)
+    index = ImageIndex(str(tmp_path / 'index'), DirectoryCache())
+    index.entries(group)
+    index.forget(group)
+    assert os.listdir(str(tmp_path / 'index')) == []
+
+def test_refresh_images(tmp_path, monkeypatch):
+    group = make_group(tmp_path)
+    index = ImageIndex(str(tmp_path / 'index'), DirectoryCache())
+    index.entries(group)
+    (tmp_path / 'group' / 'a.gif').write_bytes(gif(5, 5))
+    os.remove(os.path.join(group, 'b.png'))
+    saved = []
+    save = index._save
+    monkeypatch.setattr(index, '_save', lambda *args: saved.append(args) or save(*args))
+    entries = index.refresh_images(group, dict.fromkeys(['a.gif', 'b.png']))
+    assert len(saved) == 1
+    assert entries['a.gif']['width'] == 5
+    assert 'b.png' not in entries
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from elephant_vending_machine.libraries.input_events import InputEventQueue, monotonic_ns, reaction_time
+
+
+def test_push_and_pop_in_order():
+    queue = InputEventQueue(capacity=4)
+    assert queue.push('1', 100) == 1
+    assert queue.push('2', 200) == 2
+    assert len(queue) == 2
+    assert queue.pop() == ('1', 100, 1)
+    assert queue.pop() == ('2', 200, 2)
+    assert queue.pop() is None
+
+def test_full_queue_overwrites_oldest():
+    queue = InputEventQueue(capacity=3)
+    for timestamp in range(5):
+        queue.push('1', timestamp)
+    assert len(queue) == 3
+    assert queue.dropped == 2
+    assert [event[1] for event in queue.events_since(0)] == [2, 3, 4]
+
+def test_debounce_drops_repeated_input_from_same_host():
+    queue = InputEventQueue(debounce=50)
+    assert queue.push('1', 0) is not None
+    assert queue.push('1', 10000000) is None
+    assert queue.push('2', 10000000) is not None
+    assert queue.push('1', 60000000) is not None
+    assert len(queue) == 3
+
+def test_events_since():
+    queue = InputEventQueue()
+    queue.push('1', 100)
+    queue.push('2', 200)
+    queue.push('3', 300)
+    assert queue.events_since(200) == [('2', 200, 2), ('3', 300, 3)]
+
+def test_find_filters_by_host_time_and_sequence():
+    queue = InputEventQueue()
+    queue.push('1', 100)
+    queue.push('2', 200)
+    queue.push('1', 300)
+    assert queue.find({'1'}, 150) == ('1', 300, 3)
+    assert queue.find({'1', '2'}, 0, after_sequence=1) == ('2', 200, 2)
+    assert queue.find({'3'}, 0) is None
+
+def test_wait_for_wakes_on_push():
+    queue = InputEventQueue()
+    since = monotonic_ns()
+    threading.Timer(0.05, queue.push, args=['2']).start()
+    event = queue.wait_for({'2'}, since, 0, 5000)
+    assert event[0] == '2'
+    assert reaction_time(event, since) >= 40
+
+def test_wait_for_times_out():
+    queue = InputEventQueue()
+    assert queue.wait_for({'1'}, 0, 0, 50) is None
+
+def test_wait_for_interrupted():
+    queue = InputEventQueue()
+    interrupted = threading.Event()
+    threading.Timer(0.05, lambda: (interrupted.set(), queue.notify())).start()
+    start = time.perf_counter()
+    assert queue.wait_for({'1'}, 0, 0, 5000, interrupted.is_set) is None
+    assert time.perf_counter() - start < 1
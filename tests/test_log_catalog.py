@@ -0,0 +1,89 @@
+from elephant_vending_machine.libraries.log_catalog import LogCatalog, parse_log_file
+from elephant_vending_machine.libraries.run_manager import RunManager, ExperimentRun
+from elephant_vending_machine.libraries.signal_bus import LocalSignalTransport
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
+
+LOG_LINES = [
+    '"2020-03-17 04:26:02.085651","Experiment example.py started"',
+    '"2020-03-17 04:26:03.000000","Trial 1 started"',
+    '"2020-03-17 04:26:04.000000","Trial 1 picked left when selecting fixation cross"',
+    '"2020-03-17 04:26:05.000000","Trial 1 picked right"',
+    '"2020-03-17 04:26:06.000000","Trial 1 finished"',
+    '"2020-03-17 04:26:07.000000","Trial 2 started"',
+    '"2020-03-17 04:26:08.000000","Trial 2 no selection made."',
+    '"2020-03-17 04:26:09.000000","Trial 2 finished"',
+    '"2020-03-17 04:26:10.000000","Experiment finished"',
+]
+
+def write_log(directory, name, lines=LOG_LINES):
+    (directory / name).write_text('\r\n'.join(lines) + '\r\n')
+
+def test_parse_log_file(tmp_path):
+    write_log(tmp_path, '2020-03-17 04:26:02.085651 example.py.csv')
+    entry = parse_log_file(str(tmp_path), '2020-03-17 04:26:02.085651 example.py.csv')
+    assert entry['experiment'] == 'example.py'
+    assert entry['started'] == '2020-03-17 04:26:02.085651'
+    assert entry['finished'] == '2020-03-17 04:26:10.000000'
+    assert entry['status'] == 'finished'
+    assert entry['trials'] == 2
+    assert (entry['left_count'], entry['right_count'], entry['timeout_count']) == (0, 1, 1)
+    assert entry['size'] > 0
+
+def test_scan_adds_and_removes_logs(tmp_path):
+    catalog = LogCatalog(str(tmp_path / 'catalog.db'), str(tmp_path))
+    write_log(tmp_path, '2020-03-17 04:26:02.085651 example.py.csv')
+    write_log(tmp_path, '2020-04-01 10:00:00.000000 other.py.csv', LOG_LINES[:2])
+    assert catalog.scan() == 2
+    assert catalog.scan() == 0
+    (tmp_path / '2020-04-01 10:00:00.000000 other.py.csv').unlink()
+    catalog.scan()
+    total, logs = catalog.query()
+    assert total == 1
+    assert logs[0]['experiment'] == 'example.py'
+    catalog.close()
+
+def test_query_filters_and_paginates(tmp_path):
+    for day in range(1, 6):
+        write_log(tmp_path, f'2020-03-0{day} 10:00:00.000000 example.py.csv')
+    write_log(tmp_path, '2020-03-03 11:00:00.000000 other.py.csv', LOG_LINES[:2])
+    catalog = LogCatalog(str(tmp_path / 'catalog.db'), str(tmp_path))
+    total, logs = catalog.query(experiment='example.py', started_from='2020-03-02',
+                                started_to='2020-03-05', limit=2)
+    assert total == 3
+    assert [log['started'][:10] for log in logs] == ['2020-03-04', '2020-03-03']
+    total, logs = catalog.query(experiment='example.py', started_from='2020-03-02',
+                                started_to='2020-03-05', limit=2, offset=2)
+    assert [log['started'][:10] for log in logs] == ['2020-03-02']
+    total, logs = catalog.query(status='unknown')
+    assert total == 1
+    assert logs[0]['experiment'] == 'other.py'
+    catalog.close()
+
+def test_runs_update_catalog(tmp_path):
+    catalog = LogCatalog(str(tmp_path / 'catalog.db'), str(tmp_path))
+    (tmp_path / 'run.csv').write_text('')
+    vending_machine = VendingMachine(['1', '2', '3'])
+    run = ExperimentRun('example.py', 'run.csv', vending_machine)
+
+    def run_experiment(experiment_logger, vending_machine):
+        for trial in range(3):
+            experiment_logger.info('Trial %s started', trial)
+            vending_machine.mark_stimulus_onset()
+            if trial < 2:
+                vending_machine.receive_signal('1')
+            vending_machine.wait_for_input([vending_machine.left_group], 0)
+            experiment_logger.info('Trial %s finished', trial)
+
+    class Logger:
+        def info(self, *args, **kwargs):
+            pass
+
+    RunManager().start(run, run_experiment, Logger(), LocalSignalTransport(), catalog)
+    assert run.wait(5)
+    total, logs = catalog.query()
+    assert total == 1
+    assert logs[0]['status'] == 'finished'
+    assert logs[0]['trials'] == 3
+    assert (logs[0]['left_count'], logs[0]['timeout_count']) == (2, 1)
+    assert run.outcomes == {'left': 2, 'timeout': 1}
+    catalog.close()
@@ -0,0 +1,61 @@
+import gzip
+import threading
+import time
+
+from elephant_vending_machine.libraries.experiment_logger import BatchingFileHandler
+from elephant_vending_machine.libraries.log_stream import gzip_chunks, follow_events, \
+    is_being_written
+
+
+def test_gzip_chunks_round_trip(tmp_path):
+    path = tmp_path / 'log.csv'
+    contents = b''.join(b'"2020-01-01 00:00:00","Trial %d started"\r\n' % trial for trial in range(5000))
+    path.write_bytes(contents)
+    chunks = list(gzip_chunks(str(path), chunk_size=1024))
+    assert len(chunks) > 1
+    assert gzip.decompress(b''.join(chunks)) == contents
+
+def test_follow_finished_log(tmp_path):
+    path = tmp_path / 'log.csv'
+    path.write_bytes(b'"a"\r\n"b"\r\n"c"')
+    events = list(follow_events(str(path), 0, lambda: False))
+    assert events == ['id: 5\ndata: "a"\n\n', 'id: 10\ndata: "b"\n\n', 'id: 13\ndata: "c"\n\n',
+                      'event: end\nid: 13\ndata: \n\n']
+
+def test_follow_resumes_from_offset(tmp_path):
+    path = tmp_path / 'log.csv'
+    path.write_bytes(b'"a"\r\n"b"\r\n')
+    events = list(follow_events(str(path), 5, lambda: False))
+    assert events == ['id: 10\ndata: "b"\n\n', 'event: end\nid: 10\ndata: \n\n']
+
+def test_follow_pushes_lines_while_running(tmp_path):
+    path = tmp_path / 'log.csv'
+    path.write_bytes(b'"first"\r\n')
+    running = threading.Event()
+    running.set()
+
+    def write_more():
+        time.sleep(0.05)
+        with open(path, 'ab') as log_file:
+            log_file.write(b'"sec')
+            log_file.flush()
+            time.sleep(0.05)
+            log_file.write(b'ond"\r\n')
+        running.clear()
+
+    writer = threading.Thread(target=write_more)
+    writer.start()
+    events = list(follow_events(str(path), 0, running.is_set, interval=0.01))
+    writer.join()
+    assert events == ['id: 9\ndata: "first"\n\n', 'id: 19\ndata: "second"\n\n',
+                      'event: end\nid: 19\ndata: \n\n']
+
+def test_log_is_being_written_until_its_handler_closes(tmp_path):
+    path = str(tmp_path / 'log.csv')
+    assert not is_being_written(path)
+    handler = BatchingFileHandler(path)
+    assert is_being_written(path)
+    events = follow_events(path, 0, lambda: is_being_written(path), interval=0.01)
+    threading.Timer(0.05, handler.close).start()
+    assert list(events) == ['event: end\nid: 0\ndata: \n\n']
+    assert not is_being_written(path)
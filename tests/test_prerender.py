@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from elephant_vending_machine.libraries import prerender
+from elephant_vending_machine.libraries.prerender import copy_prerendered, prerender_stimulus, prerendered_name, \
+    remove_prerendered_group
+
+
+def test_prerendered_name():
+    assert prerendered_name('group/image.png') == '.prerendered/group/image.png.ppm'
+
+def test_nothing_is_prerendered_without_pillow(tmp_path, monkeypatch):
+    monkeypatch.setattr(prerender, 'Image', None)
+    (tmp_path / 'group').mkdir()
+    (tmp_path / 'group' / 'image.png').write_bytes(b'')
+    assert prerender_stimulus(str(tmp_path), 'group/image.png') is None
+    assert not (tmp_path / '.prerendered').exists()
+
+def test_failed_prerender_removes_out_of_date_variant(tmp_path, monkeypatch):
+    monkeypatch.setattr(prerender, 'Image', object())
+    (tmp_path / 'group').mkdir()
+    (tmp_path / 'group' / 'image.png').write_bytes(b'not an image')
+    (tmp_path / '.prerendered' / 'group').mkdir(parents=True)
+    (tmp_path / '.prerendered' / 'group' / 'image.png.ppm').write_bytes(b'P6 old')
+    assert prerender_stimulus(str(tmp_path), 'group/image.png') is None
+    assert not (tmp_path / '.prerendered' / 'group' / 'image.png.ppm').exists()
+
+def test_copy_prerendered(tmp_path):
+    variants = tmp_path / '.prerendered'
+    (variants / 'a').mkdir(parents=True)
+    (variants / 'a' / 'image.png.ppm').write_bytes(b'P6')
+    copy_prerendered(str(tmp_path), 'a/image.png', 'b/image.png')
+    assert (variants / 'b' / 'image.png.ppm').read_bytes() == b'P6'
+    assert os.path.samefile(variants / 'a' / 'image.png.ppm', variants / 'b' / 'image.png.ppm')
+    copy_prerendered(str(tmp_path), 'a/image.png', 'b/image.png')
+    assert os.listdir(str(variants / 'b')) == ['image.png.ppm']
+    os.remove(str(variants / 'a' / 'image.png.ppm'))
+    copy_prerendered(str(tmp_path), 'a/image.png', 'b/image.png')
+    assert not (variants / 'b' / 'image.png.ppm').exists()
+    remove_prerendered_group(str(tmp_path), 'b')
+    assert not (variants / 'b').exists()
+
+@pytest.mark.parametrize('size, box', [((400, 100), (0, 15, 80, 35)), ((50, 100), (27, 0, 52, 50))])
+def test_prerender_letterboxes_to_the_resolution(tmp_path, size, box):
+    image_module = pytest.importorskip('PIL.Image')
+    (tmp_path / 'group').mkdir()
+    image_module.new('RGBA', size, (255, 255, 255, 255)).save(str(tmp_path / 'group' / 'image.png'))
+    target = prerender_stimulus(str(tmp_path), 'group/image.png', (80, 50))
+    assert target == os.path.join(str(tmp_path), '.prerendered', 'group', 'image.png.ppm')
+    with open(target, 'rb') as variant:
+        assert variant.read(2) == b'P6'
+    with image_module.open(target) as variant:
+        assert variant.size == (80, 50)
+        assert variant.getbbox() == box
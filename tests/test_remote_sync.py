@@ -0,0 +1,120 @@
+from subprocess import CalledProcessError
+import threading
+
+import pytest
+
+from elephant_vending_machine.libraries.remote_sync import RangeForwarder, RemoteSyncError, \
+    apply_sync, fan_out, parse_manifest, plan_sync, push_files, push_range, reconcile
+
+
+class MockPool:
+    def __init__(self, output=''):
+        self.pipes = []
+        self.runs = []
+        self.outputs = []
+        self._output = output
+
+    def pipe(self, user, host, local_command, command):
+        self.pipes.append((user, host, local_command, command))
+
+    def run(self, user, host, command):
+        self.runs.append(command)
+
+    def output(self, user, host, command):
+        self.outputs.append(command)
+        return self._output
+
+
+def fail_on(*failing_hosts):
+    def action(host):
+        if host in failing_hosts:
+            raise CalledProcessError(255, ['ssh', host])
+        return host.upper()
+    return action
+
+def test_fan_out_returns_result_of_each_host():
+    assert fan_out(['a', 'b'], fail_on()) == {'a': 'A', 'b': 'B'}
+    assert fan_out([], fail_on()) == {}
+
+def test_fan_out_runs_hosts_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    fan_out(['a', 'b', 'c'], lambda host: barrier.wait())
+
+def test_fan_out_reports_every_host_after_partial_failure():
+    with pytest.raises(RemoteSyncError) as raised:
+        fan_out(['a', 'b', 'c'], fail_on('b'))
+    error = raised.value
+    assert isinstance(error, CalledProcessError)
+    assert error.returncode == 255
+    assert error.failed_hosts == ['b']
+    assert error.succeeded_hosts == ['a', 'c']
+    assert error.host_report() == {'a': 'ok', 'b': 'exit status 255', 'c': 'ok'}
+    assert str(error) == 'Failed on 1 of 3 hosts: b (exit status 255)'
+
+def test_push_files_sends_one_tar_stream():
+    pool = MockPool()
+    push_files(pool, 'pi', 'host', '/local/img/My Group', ['a.png', '.prerendered/a.png.ppm'],
+               '/home/pi/img/My Group', remove=['b.png'])
+    user, host, local_command, command = pool.pipes[0]
+    assert (user, host) == ('pi', 'host')
+    assert local_command == "tar -C '/local/img/My Group' -cf - a.png .prerendered/a.png.ppm"
+    assert command == ("mkdir -p '/home/pi/img/My Group' && cd '/home/pi/img/My Group' && "
+                       "rm -f b.png && tar -xf -")
+
+def test_parse_manifest():
+    digest = 'a' * 64
+    assert parse_manifest(f'{digest}  g/a.png\n{digest}  g/.prerendered/a.png.ppm\n\\{digest}  g/b\\\\c\n') == \
+        {'g/a.png': digest, 'g/.prerendered/a.png.ppm': digest}
+
+def test_plan_sync():
+    manifest = {'g/same.png': '1', 'g/changed.png': '2', 'g/copied.png': '1', 'g/new.png': '3',
+                'h/new.png': '3', 'h/renamed.png': '4'}
+    remote = {'g/same.png': '1', 'g/changed.png': '9', 'g/old.png': '4', 'other/x.png': '5'}
+    plan = plan_sync(manifest, remote, ['g', 'h'])
+    assert plan.send == ['g/changed.png', 'g/new.png']
+    assert plan.links == [('g/same.png', 'g/copied.png'), ('g/old.png', 'h/renamed.png')]
+    assert plan.duplicates == [('g/new.png', 'h/new.png')]
+    assert plan.remove == ['g/old.png']
+
+def test_plan_does_not_link_from_replaced_files():
+    plan = plan_sync({'g/a.png': '2', 'g/b.png': '1'}, {'g/a.png': '1'}, ['g'])
+    assert plan.send == ['g/a.png', 'g/b.png']
+    assert plan.links == []
+
+def test_up_to_date_host_is_left_alone():
+    pool = MockPool()
+    apply_sync(pool, 'pi', 'host', '/local', '/remote', plan_sync({'g/a.png': '1'}, {'g/a.png': '1'}, ['g']))
+    assert pool.pipes == [] and pool.runs == []
+
+def test_reconcile_links_before_removing_and_sending():
+    pool = MockPool(output='1' * 64 + '  g/old.png\n')
+    counts = reconcile(pool, 'pi', 'host', '/local', '/remote', {'g/new.png': '1' * 64, 'g/b.png': '2' * 64},
+                       ['g'], directories=['g'])
+    assert counts == {'sent': 1, 'linked': 1, 'removed': 1}
+    _, _, local_command, command = pool.pipes[0]
+    assert local_command == 'tar -C /local -cf - g/b.png'
+    assert command == ('mkdir -p /remote && cd /remote && mkdir -p g && ln -f g/old.png g/new.png && '
+                       'rm -f g/old.png g/b.png && tar -xf -')
+
+def test_push_files_without_files_runs_renames():
+    pool = MockPool()
+    push_files(pool, 'pi', 'host', '/local', [], '/remote', remove=['.a.png.ppm'], renames=[('.x.part', 'a.png')])
+    assert pool.pipes == []
+    assert pool.runs == ["'mkdir -p /remote && cd /remote && rm -f .a.png.ppm && mv -f .x.part a.png'"]
+
+def test_push_range_writes_at_the_offset():
+    pool = MockPool()
+    push_range(pool, 'pi', 'host', '/local/x.part', 100, 50, '/remote/g/.x.part')
+    _, _, local_command, command = pool.pipes[0]
+    assert local_command == 'tail -c +101 /local/x.part | head -c 50'
+    assert command == 'mkdir -p /remote/g && dd of=/remote/g/.x.part bs=64K oflag=seek_bytes seek=100 conv=notrunc status=none'
+
+def test_range_forwarder_reports_hosts_sent_the_whole_file():
+    def send(host, key, offset, length):
+        if host == 'b' and offset == 10:
+            raise CalledProcessError(255, ['ssh'])
+    forwarder = RangeForwarder(['a', 'b'], send)
+    forwarder.submit('x', 0, 10)
+    forwarder.submit('x', 10, 10)
+    assert forwarder.finish('x', 20) == ['a']
+    assert forwarder.finish('x', 20) == []
@@ -0,0 +1,44 @@
+from elephant_vending_machine.libraries import trial_log
+from elephant_vending_machine.libraries.run_manager import RunManager, ExperimentRun, \
+    trial_boundary
+from elephant_vending_machine.libraries.signal_bus import LocalSignalTransport
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
+
+class Logger:
+    def __init__(self):
+        self.messages = []
+
+    def info(self, *args, **kwargs):
+        self.messages.append(list(args))
+
+def test_trial_boundary_accepts_formatted_messages():
+    assert trial_boundary('Trial %s started', (3,)) == (trial_log.TRIAL_STARTED, 3)
+    assert trial_boundary('Trial %d finished', (3,)) == (trial_log.TRIAL_FINISHED, 3)
+    assert trial_boundary('Trial 4 started', ()) == (trial_log.TRIAL_STARTED, 4)
+    assert trial_boundary('Trial %s picked left', (3,)) is None
+    assert trial_boundary('Trial %s started', ()) is None
+
+def test_progress_from_preformatted_messages():
+    run = ExperimentRun('example.py', 'run.csv', VendingMachine(['1', '2', '3'], {}), 2)
+
+    def run_experiment(experiment_logger, vending_machine):
+        for trial in range(1, 3):
+            experiment_logger.info(f'Trial {trial} started')
+            experiment_logger.info(f'Trial {trial} finished')
+
+    RunManager().start(run, run_experiment, Logger(), LocalSignalTransport())
+    assert run.wait(5)
+    assert run.current_trial == 2
+    assert run.completed_trials == 2
+
+def test_ended_runs_are_forgotten():
+    manager = RunManager(max_ended_runs=2)
+    runs = []
+    for _ in range(4):
+        run = ExperimentRun('example.py', 'run.csv', VendingMachine(['1', '2', '3'], {}))
+        manager.start(run, lambda experiment_logger, vending_machine: None, Logger(),
+                      LocalSignalTransport())
+        assert run.wait(5)
+        runs.append(run)
+    assert manager.runs() == runs[2:]
+    assert manager.get(runs[0].run_id) is None
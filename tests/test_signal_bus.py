@@ -0,0 +1,87 @@
+import socket
+import threading
+
+import pytest
+
+from elephant_vending_machine.libraries.signal_bus import LocalSignalTransport, UnixSocketSignalTransport, \
+    SignalTransportBusy, create_signal_transport
+
+
+class Receiver:
+    def __init__(self):
+        self.addresses = []
+        self.received = threading.Event()
+
+    def __call__(self, address):
+        self.addresses.append(address)
+        self.received.set()
+
+def test_local_transport_delivers_to_subscriber():
+    transport = LocalSignalTransport()
+    assert not transport.publish('192.168.0.11')
+    receiver = Receiver()
+    transport.subscribe(receiver)
+    with pytest.raises(SignalTransportBusy):
+        transport.subscribe(Receiver())
+    assert transport.publish('192.168.0.11')
+    transport.unsubscribe()
+    assert not transport.publish('192.168.0.12')
+    assert receiver.addresses == ['192.168.0.11']
+
+def test_unix_transport_delivers_between_instances(tmp_path):
+    path = str(tmp_path / 'signal.sock')
+    subscriber = UnixSocketSignalTransport(path)
+    publisher = UnixSocketSignalTransport(path)
+    assert not publisher.publish('192.168.0.11')
+    receiver = Receiver()
+    subscriber.subscribe(receiver)
+    assert publisher.publish('192.168.0.11')
+    assert receiver.received.wait(5)
+    assert receiver.addresses == ['192.168.0.11']
+    with pytest.raises(SignalTransportBusy):
+        publisher.subscribe(Receiver())
+    subscriber.unsubscribe()
+    assert not publisher.publish('192.168.0.12')
+
+def test_unix_transport_replaces_stale_socket(tmp_path):
+    path = str(tmp_path / 'signal.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    stale.bind(path)
+    stale.close()
+    transport = UnixSocketSignalTransport(path)
+    assert not transport.publish('192.168.0.11')
+    receiver = Receiver()
+    transport.subscribe(receiver)
+    assert transport.publish('192.168.0.13')
+    assert receiver.received.wait(5)
+    transport.unsubscribe()
+
+def test_unix_transport_busy_while_subscribed(tmp_path):
+    path = str(tmp_path / 'signal.sock')
+    subscriber = UnixSocketSignalTransport(path)
+    other = UnixSocketSignalTransport(path)
+    assert not other.busy()
+    subscriber.subscribe(Receiver())
+    assert subscriber.busy()
+    assert other.busy()
+    subscriber.unsubscribe()
+    assert not other.busy()
+    other.subscribe(Receiver())
+    other.unsubscribe()
+
+def test_unix_transport_lock_keeps_socket_of_subscriber(tmp_path):
+    path = str(tmp_path / 'signal.sock')
+    subscriber = UnixSocketSignalTransport(path)
+    receiver = Receiver()
+    subscriber.subscribe(receiver)
+    for _ in range(3):
+        with pytest.raises(SignalTransportBusy):
+            UnixSocketSignalTransport(path).subscribe(Receiver())
+    assert UnixSocketSignalTransport(path).publish('192.168.0.11')
+    assert receiver.received.wait(5)
+    subscriber.unsubscribe()
+
+def test_create_signal_transport(tmp_path):
+    assert isinstance(create_signal_transport({'SIGNAL_TRANSPORT': 'local'}), LocalSignalTransport)
+    transport = create_signal_transport({'SIGNAL_TRANSPORT': 'unix', 'SIGNAL_SOCKET_PATH': str(tmp_path / 's')})
+    assert isinstance(transport, UnixSocketSignalTransport)
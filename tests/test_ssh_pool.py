@@ -0,0 +1,83 @@
+from elephant_vending_machine.libraries.ssh_pool import SSHConnectionPool, SSH_CONNECTION_ERROR
+from subprocess import CompletedProcess, CalledProcessError
+import pytest
+
+
+class MockRun:
+    def __init__(self, failures=None):
+        self.commands = []
+        self.failures = failures or []
+
+    def __call__(self, command, check, shell, **options):
+        self.commands.append(command)
+        if ' -O ' not in command and self.failures:
+            returncode = self.failures.pop(0)
+            if returncode:
+                raise CalledProcessError(returncode, ['ssh'])
+        return CompletedProcess(['ssh'], returncode=0, stdout='output\n')
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    return SSHConnectionPool(control_directory=str(tmp_path))
+
+def test_run_uses_shared_control_connection(pool, monkeypatch):
+    mock_run = MockRun()
+    monkeypatch.setattr('subprocess.run', mock_run)
+    pool.run('pi', '192.168.0.11', 'mkdir -p /tmp/test')
+    command = mock_run.commands[-1]
+    assert command.startswith('ssh ')
+    assert '-oControlMaster=auto' in command
+    assert f'-oControlPath={pool.control_directory}/%C' in command
+    assert command.endswith('pi@192.168.0.11 mkdir -p /tmp/test')
+
+def test_copy_uses_shared_control_connection(pool, monkeypatch):
+    mock_run = MockRun()
+    monkeypatch.setattr('subprocess.run', mock_run)
+    pool.copy('pi', '192.168.0.11', '/local/a.png', '/remote/a.png')
+    command = mock_run.commands[-1]
+    assert command.startswith('scp ')
+    assert '-oControlMaster=auto' in command
+    assert command.endswith('/local/a.png pi@192.168.0.11:/remote/a.png')
+
+def test_output_returns_what_the_command_printed(pool, monkeypatch):
+    mock_run = MockRun()
+    monkeypatch.setattr('subprocess.run', mock_run)
+    assert pool.output('pi', '192.168.0.11', 'hostname') == 'output\n'
+    assert mock_run.commands[-1].endswith('pi@192.168.0.11 hostname')
+
+def test_health_check_runs_once_per_interval(pool, monkeypatch):
+    mock_run = MockRun()
+    monkeypatch.setattr('subprocess.run', mock_run)
+    pool.run('pi', '192.168.0.11', 'true')
+    pool.run('pi', '192.168.0.11', 'true')
+    checks = [command for command in mock_run.commands if ' -O check ' in command]
+    assert len(checks) == 1
+
+def test_reconnects_after_connection_error(pool, monkeypatch):
+    mock_run = MockRun(failures=[SSH_CONNECTION_ERROR, SSH_CONNECTION_ERROR, 0])
+    monkeypatch.setattr('subprocess.run', mock_run)
+    pool.run('pi', '192.168.0.11', 'true')
+    exits = [command for command in mock_run.commands if ' -O exit ' in command]
+    assert len(exits) == 2
+
+def test_gives_up_after_retries(pool, monkeypatch):
+    mock_run = MockRun(failures=[SSH_CONNECTION_ERROR] * (pool.retries + 1))
+    monkeypatch.setattr('subprocess.run', mock_run)
+    with pytest.raises(CalledProcessError):
+        pool.run('pi', '192.168.0.11', 'true')
+
+def test_command_failure_is_not_retried(pool, monkeypatch):
+    mock_run = MockRun(failures=[1, 0])
+    monkeypatch.setattr('subprocess.run', mock_run)
+    with pytest.raises(CalledProcessError):
+        pool.run('pi', '192.168.0.11', 'false')
+    assert mock_run.failures == [0]
+
+def test_host_concurrency_is_limited(pool):
+    limit = pool._host_limit('192.168.0.11')
+    assert limit is pool._host_limit('192.168.0.11')
+    for _ in range(pool.max_sessions_per_host):
+        assert limit.acquire(blocking=False)
+    assert not limit.acquire(blocking=False)
@@ -0,0 +1,167 @@
+import time
+from subprocess import CalledProcessError
+
+import pytest
+
+from elephant_vending_machine.libraries import sync_queue
+from elephant_vending_machine.libraries.sync_queue import CREATE, DELETE, LINK, PUSH, REMOVE, \
+    RENAME, Job, SyncQueue
+
+HOSTS = ['pi1', 'pi2']
+
+
+class Perform:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def __call__(self, host, jobs):
+        self.calls.append((host, jobs))
+        if host in self.failing:
+            raise CalledProcessError(255, ['ssh'])
+
+@pytest.fixture
+def perform():
+    return Perform()
+
+@pytest.fixture
+def queue(tmp_path, perform):
+    queue = SyncQueue(str(tmp_path / 'queue.sqlite3'), HOSTS, perform)
+    yield queue
+    queue.shutdown()
+    queue.close()
+
+def queued(queue, host):
+    status = queue.status()[host]
+    return [(job['action'], job['path']) for job in status['failed'] + status['pending']]
+
+def test_jobs_are_performed_together(queue, perform):
+    queue.enqueue([Job(CREATE, 'group'), Job(PUSH, 'group/a.png'), Job(PUSH, 'group/b.png')])
+    assert queue.run_once('pi1')
+    assert perform.calls == [('pi1', [Job(CREATE, 'group'), Job(PUSH, 'group/a.png'),
+                                      Job(PUSH, 'group/b.png')])]
+    assert queued(queue, 'pi1') == []
+    assert not queue.run_once('pi1')
+    assert len(queued(queue, 'pi2')) == 3
+
+def test_later_job_replaces_queued_job(queue, perform):
+    queue.enqueue([Job(PUSH, 'group/a.png'), Job(PUSH, 'group/b.png')])
+    queue.enqueue([Job(DELETE, 'group/a.png')])
+    assert queued(queue, 'pi1') == [('push', 'group/b.png'), ('delete', 'group/a.png')]
+
+def test_left_over_file_is_still_removed(queue, perform):
+    queue.enqueue([Job(PUSH, 'group/a.png', 'group/.upload.part')], ['pi1'])
+    queue.enqueue([Job(RENAME, 'group/b.png', 'group/.other.part')], ['pi1'])
+    queue.enqueue([Job(DELETE, 'group/a.png'), Job(PUSH, 'group/b.png')], ['pi1'])
+    queue.run_once('pi1')
+    assert perform.calls[0][1] == [Job(DELETE, 'group/a.png', 'group/.upload.part'),
+                                   Job(PUSH, 'group/b.png', 'group/.other.part')]
+
+def test_group_jobs_drop_jobs_for_its_images(queue, perform):
+    queue.enqueue([Job(PUSH, 'group/a.png'), Job(PUSH, 'group_2/a.png'), Job(PUSH, 'groupX/a.png')])
+    queue.enqueue([Job(REMOVE, 'group')])
+    assert queued(queue, 'pi1') == [('push', 'group_2/a.png'), ('push', 'groupX/a.png'),
+                                    ('remove', 'group')]
+    queue.enqueue([Job(CREATE, 'group')])
+    assert queued(queue, 'pi1')[-1] == ('create', 'group')
+
+def test_failed_host_is_retried_with_backoff(tmp_path):
+    perform = Perform(failing=['pi1'])
+    queue = SyncQueue(str(tmp_path / 'queue.sqlite3'), HOSTS, perform, retry_delay=60)
+    queue.enqueue([Job(PUSH, 'group/a.png'), Job(LINK, 'group/b.png', 'other/b.png'),
+                   Job(RENAME, 'group/c.png', 'group/.upload.part')])
+    assert queue.run_once('pi1')
+    assert queue.run_once('pi2')
+    status = queue.status()
+    assert status['pi1']['failures'] == 1
+    assert status['pi1']['error'] == 'exit status 255'
+    assert status['pi1']['retry_at'] is not None
+    assert [job['attempts'] for job in status['pi1']['failed']] == [1, 1, 1]
+    assert status['pi2'] == {'pending': [], 'failed': [], 'failures': 0, 'error': None,
+                             'retry_at': None}
+    # Waiting to be retried, even when more jobs are queued
+    queue.enqueue([Job(PUSH, 'group/d.png')])
+    assert not queue.run_once('pi1')
+    queue.retry_delay = 0
+    with queue._condition, queue._connection:
+        queue._connection.execute('UPDATE hosts SET retry_at = 0')
+    assert queue.run_once('pi1')
+    # Hosts which failed may not hold the files to link or rename from
+    assert perform.calls[-1][1][:3] == [Job(PUSH, 'group/a.png'), Job(PUSH, 'group/b.png'),
+                                        Job(PUSH, 'group/c.png', 'group/.upload.part')]
+    assert queue.status()['pi1']['failures'] == 2
+    perform.failing.clear()
+    assert queue.run_once('pi1')
+    assert queue.status()['pi1']['failures'] == 0
+    assert queued(queue, 'pi1') == []
+    queue.close()
+
+def test_backoff_is_capped(tmp_path):
+    queue = SyncQueue(str(tmp_path / 'queue.sqlite3'), HOSTS, Perform(failing=HOSTS),
+                      retry_delay=600, max_retry_delay=0)
+    queue.enqueue([Job(PUSH, 'group/a.png')], ['pi1'])
+    for _ in range(3):
+        assert queue.run_once('pi1')
+    assert queue.status()['pi1']['failures'] == 3
+    queue.close()
+
+def test_jobs_survive_restart(tmp_path, perform):
+    queue = SyncQueue(str(tmp_path / 'queue.sqlite3'), HOSTS, perform)
+    queue.enqueue([Job(PUSH, 'group/a.png')])
+    queue.close()
+    queue = SyncQueue(str(tmp_path / 'queue.sqlite3'), HOSTS, perform)
+    queue.start()
+    assert queue.wait(10)
+    assert sorted(host for host, _ in perform.calls) == HOSTS
+    assert queued(queue, 'pi1') == []
+    queue.shutdown()
+    queue.close()
+
+def test_workers_perform_queued_jobs(queue, perform):
+    queue.start()
+    assert queue.wait(10)
+    queue.enqueue([Job(PUSH, 'group/a.png')])
+    assert queue.wait(10)
+    assert sorted(host for host, _ in perform.calls) == HOSTS
+
+def test_worker_survives_unexpected_errors(tmp_path):
+    def perform(host, jobs):
+        raise KeyError(jobs[0].path)
+    queue = SyncQueue(str(tmp_path / 'queue.sqlite3'), HOSTS, perform, retry_delay=60)
+    queue.start()
+    queue.enqueue([Job(PUSH, 'group/a.png')])
+    assert queue.wait(10)
+    assert queue.status()['pi1']['error'] == "'group/a.png'"
+    queue.shutdown()
+    queue.close()
+
+def test_leased_host_is_not_performed_by_another_process(tmp_path, perform):
+    database = str(tmp_path / 'queue.sqlite3')
+    other = Perform()
+    first = SyncQueue(database, HOSTS, perform)
+    second = SyncQueue(database, HOSTS, other)
+    first.enqueue([Job(PUSH, 'group/a.png')], ['pi1'])
+    with first._condition:
+        claimed = first._claim('pi1', time.time())
+    assert [job for _, job in claimed] == [Job(PUSH, 'group/a.png')]
+    assert not second.run_once('pi1')
+    first._perform('pi1', claimed)
+    second.enqueue([Job(PUSH, 'group/b.png')], ['pi1'])
+    assert second.run_once('pi1')
+    assert other.calls == [('pi1', [Job(PUSH, 'group/b.png')])]
+    first.close()
+    second.close()
+
+def test_expired_lease_is_taken_over(tmp_path, perform, monkeypatch):
+    database = str(tmp_path / 'queue.sqlite3')
+    first = SyncQueue(database, HOSTS, Perform())
+    second = SyncQueue(database, HOSTS, perform)
+    first.enqueue([Job(PUSH, 'group/a.png')], ['pi1'])
+    monkeypatch.setattr(sync_queue, 'LEASE_DURATION', -1)
+    with first._condition:
+        assert first._claim('pi1', time.time())
+    # The first process was killed while performing the jobs
+    assert second.run_once('pi1')
+    assert perform.calls == [('pi1', [Job(PUSH, 'group/a.png')])]
+    first.close()
+    second.close()
@@ -0,0 +1,73 @@
+import os
+import threading
+
+import pytest
+
+from elephant_vending_machine.libraries import thumbnails
+from elephant_vending_machine.libraries.thumbnails import ThumbnailPipeline
+
+DIGEST = 'ab' + '0' * 62
+
+
+@pytest.fixture
+def fake_renderer(monkeypatch):
+    rendered = []
+    release = threading.Event()
+    def render(source, target, size):
+        release.wait(5)
+        rendered.append((source, size))
+        with open(target, 'wb') as variant:
+            variant.write(b'jpeg')
+    monkeypatch.setattr(thumbnails, 'Image', object())
+    monkeypatch.setattr(thumbnails, 'render_variant', render)
+    return rendered, release
+
+def test_variant_name():
+    assert ThumbnailPipeline.variant_name(DIGEST, 'thumbnail') == f'ab/{DIGEST}-thumbnail.jpg'
+
+def test_nothing_is_rendered_without_pillow(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'Image', None)
+    pipeline = ThumbnailPipeline(str(tmp_path))
+    assert not pipeline.available
+    assert pipeline.submit('image.png', DIGEST) == []
+    assert pipeline.variant('image.png', DIGEST, 'thumbnail') is None
+
+def test_variants_are_rendered_once(tmp_path, fake_renderer):
+    rendered, release = fake_renderer
+    pipeline = ThumbnailPipeline(str(tmp_path), {'thumbnail': (8, 8), 'preview': (64, 64)})
+    futures = pipeline.submit('image.png', DIGEST)
+    assert len(futures) == 2
+    assert pipeline.submit('copy.png', DIGEST) == []
+    release.set()
+    for future in futures:
+        future.result()
+    assert sorted(rendered) == [('image.png', (8, 8)), ('image.png', (64, 64))]
+    assert pipeline.submit('other.png', DIGEST) == []
+    assert pipeline.variant('image.png', DIGEST, 'preview') == f'ab/{DIGEST}-preview.jpg'
+    pipeline.shutdown()
+
+def test_render_failure_is_logged(tmp_path, monkeypatch, caplog):
+    attempts = []
+    def render(source, target, size):
+        attempts.append(source)
+        raise OSError('cannot identify image file')
+    monkeypatch.setattr(thumbnails, 'Image', object())
+    monkeypatch.setattr(thumbnails, 'render_variant', render)
+    pipeline = ThumbnailPipeline(str(tmp_path), {'thumbnail': (8, 8)})
+    for future in pipeline.submit('image.svg', DIGEST):
+        future.result()
+    assert 'Could not render the thumbnail of image.svg' in caplog.text
+    assert pipeline.variant('image.svg', DIGEST, 'thumbnail') is None
+    assert pipeline.submit('copy.svg', DIGEST) == []
+    assert ThumbnailPipeline(str(tmp_path), {'thumbnail': (8, 8)}).submit('image.svg', DIGEST) == []
+    assert attempts == ['image.svg']
+    pipeline.shutdown()
+
+def test_render_variant(tmp_path):
+    image_module = pytest.importorskip('PIL.Image')
+    image_module.new('RGBA', (400, 100), (255, 0, 0, 128)).save(str(tmp_path / 'image.png'))
+    thumbnails.render_variant(str(tmp_path / 'image.png'), str(tmp_path / 'variant.jpg'), (200, 200))
+    with image_module.open(str(tmp_path / 'variant.jpg')) as variant:
+        assert variant.format == 'JPEG'
+        assert variant.size == (200, 50)
+    assert not os.path.exists(str(tmp_path / 'variant.jpg.tmp'))
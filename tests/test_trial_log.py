@@ -0,0 +1,103 @@
+import json
+import logging
+import math
+
+import pytest
+
+from elephant_vending_machine.libraries import trial_log
+from elephant_vending_machine.libraries.experiment_logger import ExperimentLoggerRegistry, \
+    close_experiment_logger
+from elephant_vending_machine.libraries.run_manager import RunManager, ExperimentRun
+from elephant_vending_machine.libraries.signal_bus import LocalSignalTransport
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
+
+
+def test_encode_decode_round_trip():
+    data = trial_log.MAGIC + trial_log.encode_event(
+        1584419162.5, trial_log.STIMULUS_SHOWN, trial=3, screen='middle', image='cross.png',
+        latency=1.25) + trial_log.encode_event(1584419163.0, message='Trial 3 picked left')
+    assert trial_log.decode_events(data) == [
+        {'time': 1584419162.5, 'trial': 3, 'event': 'stimulus_shown', 'screen': 'middle',
+         'image': 'cross.png', 'latency_ms': 1.25, 'message': ''},
+        {'time': 1584419163.0, 'trial': None, 'event': 'message', 'screen': None,
+         'image': '', 'latency_ms': None, 'message': 'Trial 3 picked left'},
+    ]
+
+def test_decode_ignores_truncated_record():
+    data = trial_log.MAGIC + trial_log.encode_event(1.0, trial_log.TRIAL_STARTED, trial=1)
+    truncated = data + trial_log.encode_event(2.0, trial_log.TRIAL_FINISHED, trial=1)[:-3]
+    assert len(trial_log.decode_events(truncated)) == 1
+
+def test_decode_rejects_other_files():
+    try:
+        trial_log.decode_events(b'"2020-01-01 00:00:00","text"')
+        assert False
+    except ValueError:
+        pass
+
+def test_events_to_csv():
+    events = trial_log.decode_events(trial_log.MAGIC + trial_log.encode_event(
+        1.5, trial_log.REACTION_TIME, trial=2, latency=350.0))
+    assert trial_log.events_to_csv(events).splitlines() == [
+        '"time","trial","event","screen","image","latency_ms","message"',
+        '"1.5","2","reaction_time","","","350.0",""']
+
+def test_trial_log_name():
+    assert trial_log.trial_log_name('2020 example.py.csv') == '2020 example.py.trials'
+
+def test_structured_logger_writes_trial_log(tmp_path):
+    registry = ExperimentLoggerRegistry(str(tmp_path))
+    run = ExperimentRun('experiment.py', 'run.csv', VendingMachine(['1', '2', '3']))
+
+    def run_experiment(experiment_logger, vending_machine):
+        experiment_logger.info('Trial %s started', 1)
+        vending_machine.mark_stimulus_onset()
+        experiment_logger.info('Trial %s picked left', 1)
+        experiment_logger.info('Trial %s finished', 1)
+
+    RunManager().start(run, run_experiment, registry.get('run.csv', structured=True),
+                       LocalSignalTransport())
+    assert run.wait(5)
+    events = trial_log.read_trial_log(str(tmp_path / 'run.trials'))
+    assert [(event['event'], event['trial']) for event in events] == [
+        ('trial_started', 1), ('message', 1), ('trial_finished', 1)]
+    assert events[1]['message'] == 'Trial 1 picked left'
+    assert len(registry) == 0
+
+def test_timing_latencies_written_as_events(tmp_path):
+    registry = ExperimentLoggerRegistry(str(tmp_path))
+    logger = registry.get('timing.csv', structured=True)
+    vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.trial_timer.start_trial(4)
+    vending_machine.mark_stimulus_onset(0)
+    vending_machine.trial_timer.mark('input_received', 480000000)
+    vending_machine.trial_timer.log(logger)
+    close_experiment_logger(logger)
+    events = trial_log.read_trial_log(str(tmp_path / 'timing.trials'))
+    assert [(event['event'], event['trial'], event['latency_ms']) for event in events] == [
+        ('reaction_time', 4, 480.0)]
+
+def test_iter_trial_log_reads_records_one_at_a_time(tmp_path):
+    path = tmp_path / 'run.trials'
+    path.write_bytes(trial_log.MAGIC + b''.join(
+        trial_log.encode_event(float(trial), trial_log.TRIAL_STARTED, trial=trial)
+        for trial in range(100)) + b'\x10')
+    events = trial_log.iter_trial_log(str(path))
+    assert next(events)['trial'] == 0
+    assert [event['trial'] for event in events] == list(range(1, 100))
+    assert trial_log.read_trial_log(str(path)) == trial_log.decode_events(path.read_bytes())
+
+def test_iter_trial_log_rejects_other_files(tmp_path):
+    path = tmp_path / 'run.trials'
+    path.write_bytes(b'"2020-01-01 00:00:00","text"')
+    with pytest.raises(ValueError):
+        trial_log.iter_trial_log(str(path))
+
+def test_iter_csv_and_json_in_chunks():
+    events = trial_log.decode_events(trial_log.MAGIC + b''.join(
+        trial_log.encode_event(1.5, trial_log.REACTION_TIME, trial=trial, latency=350.0)
+        for trial in range(50)))
+    chunks = list(trial_log.iter_csv(iter(events), chunk_size=100))
+    assert len(chunks) > 10
+    assert ''.join(chunks) == trial_log.events_to_csv(events)
+    assert json.loads(''.join(trial_log.iter_json(iter(events)))) == {'events': events}
@@ -0,0 +1,53 @@
+from elephant_vending_machine.libraries.trial_timing import TrialTimer, STIMULUS_SENT, \
+    STIMULUS_SHOWN, INPUT_RECEIVED, TREAT_DISPENSED
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
+
+
+class MockLogger:
+    def info(self, *args, **kwargs):
+        self.args = list(args)
+        self.kwargs = kwargs
+
+def test_latencies_between_marks():
+    timer = TrialTimer()
+    timer.start_trial(1)
+    timer.mark(STIMULUS_SENT, 1000000)
+    timer.mark(STIMULUS_SHOWN, 21000000)
+    timer.mark(INPUT_RECEIVED, 521500000)
+    timer.mark(TREAT_DISPENSED, 531500000)
+    assert timer.latencies() == {'display_latency_ms': 20.0, 'reaction_time_ms': 500.5,
+                                 'dispense_latency_ms': 10.0}
+    assert timer.columns() == ['20.000', '500.500', '10.000']
+
+def test_missing_marks_are_empty_columns():
+    timer = TrialTimer()
+    timer.mark(STIMULUS_SENT, 0)
+    timer.mark(STIMULUS_SHOWN, 5000000)
+    assert timer.latencies()['reaction_time_ms'] is None
+    assert timer.columns() == ['5.000', '', '']
+
+def test_start_trial_clears_marks():
+    timer = TrialTimer()
+    timer.mark(STIMULUS_SENT, 0)
+    timer.start_trial(2)
+    assert timer.trial == 2
+    assert timer.marks == {}
+
+def test_log_writes_columns():
+    timer = TrialTimer()
+    timer.start_trial(3)
+    timer.mark(STIMULUS_SHOWN, 0)
+    timer.mark(INPUT_RECEIVED, 250000000)
+    logger = MockLogger()
+    timer.log(logger)
+    assert logger.args == ['Trial %s timing', 3]
+    assert logger.kwargs['extra']['columns'] == ['', '250.000', '']
+
+def test_vending_machine_marks_onset_and_input():
+    vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.mark_stimulus_onset(1000)
+    vending_machine.input_events.push('1', 2001000)
+    assert vending_machine.wait_for_input([vending_machine.left_group], 0) == 'left'
+    assert vending_machine.trial_timer.marks[STIMULUS_SHOWN] == 1000
+    assert vending_machine.trial_timer.marks[INPUT_RECEIVED] == 2001000
+    assert vending_machine.trial_timer.latencies()['reaction_time_ms'] == 2.0
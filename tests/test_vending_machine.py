@@ -1,6 +1,8 @@
-from elephant_vending_machine.libraries.vending_machine import VendingMachine, SensorGrouping, LEFT_SCREEN
+from elephant_vending_machine.libraries.vending_machine import VendingMachine, SensorGrouping, LEFT_SCREEN, ExperimentCancelled
+from elephant_vending_machine.libraries.display_agent import DisplayAgentClient, DisplayAgentError, LocalDisplayAgent
 from subprocess import CompletedProcess, CalledProcessError
 import pytest
+import threading
 import time
 
 
@@ -14,34 +16,66 @@ def new_init_timeout(self):
 def raise_(ex):
     raise ex
 
-def test_wait_for_input_left(monkeypatch):
-    monkeypatch.setattr('elephant_vending_machine.libraries.vending_machine.VendingMachine.signal_sender', '1')
+def test_wait_for_input_left():
     vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.mark_stimulus_onset()
+    vending_machine.receive_signal('1')
     result = vending_machine.wait_for_input(
         [vending_machine.left_group, vending_machine.right_group], 5000)
     assert result == 'left'
 
-def test_wait_for_input_right(monkeypatch):
-    monkeypatch.setattr('elephant_vending_machine.libraries.vending_machine.VendingMachine.signal_sender', '3')
+def test_wait_for_input_right():
     vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.mark_stimulus_onset()
+    vending_machine.receive_signal('3')
     result = vending_machine.wait_for_input(
         [vending_machine.left_group, vending_machine.right_group], 5000)
     assert result == 'right'
 
-def test_wait_for_input_middle(monkeypatch):
-    monkeypatch.setattr('elephant_vending_machine.libraries.vending_machine.VendingMachine.signal_sender', '2')
+def test_wait_for_input_middle():
     vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.mark_stimulus_onset()
+    vending_machine.receive_signal('2')
     result = vending_machine.wait_for_input(
         [vending_machine.left_group, vending_machine.middle_group, vending_machine.right_group], 5000)
     assert result == 'middle'
 
-def test_wait_for_input_timeout(monkeypatch):
-    monkeypatch.setattr('elephant_vending_machine.libraries.vending_machine.VendingMachine.signal_sender', '')
+def test_wait_for_input_timeout():
     vending_machine = VendingMachine(['1', '2', '3'])
     result = vending_machine.wait_for_input(
         [vending_machine.left_group, vending_machine.right_group], 1000)
     assert result == 'timeout'
 
+def test_wait_for_input_ignores_input_before_onset():
+    vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.receive_signal('1')
+    vending_machine.mark_stimulus_onset()
+    result = vending_machine.wait_for_input([vending_machine.left_group], 100)
+    assert result == 'timeout'
+    assert len(vending_machine.input_events) == 1
+
+def test_wait_for_input_does_not_count_an_event_twice():
+    vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.mark_stimulus_onset()
+    vending_machine.receive_signal('1')
+    vending_machine.receive_signal('3')
+    groups = [vending_machine.left_group, vending_machine.right_group]
+    assert vending_machine.wait_for_input(groups, 100) == 'left'
+    assert vending_machine.wait_for_input(groups, 100) == 'right'
+    assert vending_machine.wait_for_input(groups, 100) == 'timeout'
+
+def test_wait_for_input_reaction_time():
+    vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.mark_stimulus_onset()
+    threading.Timer(0.05, vending_machine.receive_signal, args=['1']).start()
+    vending_machine.wait_for_input([vending_machine.left_group], 5000)
+    assert 40 < vending_machine.last_reaction_time < 1000
+
+def test_wait_for_input_cancelled():
+    vending_machine = VendingMachine(['1', '2', '3'])
+    threading.Timer(0.05, vending_machine.cancel).start()
+    with pytest.raises(ExperimentCancelled):
+        vending_machine.wait_for_input([vending_machine.left_group], 5000)
 
 @pytest.mark.skip(reason="There is no good way to unit test an ssh connection and visual display with pytest.")
 def test_display(monkeypatch):
@@ -66,3 +100,160 @@ def test_led_exception_if_ssh_fails(monkeypatch):
         vending_machine = VendingMachine(['192.168.1.35', '2', '3'], {})
         monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(CalledProcessError(1, ['ssh'])))
         vending_machine.left_group.led_color_with_time(255, 255, 255, 1000)
+
+def test_wait_for_input_wakes_on_signal():
+    vending_machine = VendingMachine(['1', '2', '3'])
+    threading.Timer(0.05, vending_machine.receive_signal, args=['3']).start()
+    start = time.perf_counter()
+    result = vending_machine.wait_for_input(
+        [vending_machine.left_group, vending_machine.right_group], 5000)
+    assert result == 'right'
+    assert time.perf_counter() - start < 1
+
+def test_wait_for_input_ignores_unaccepted_signal():
+    vending_machine = VendingMachine(['1', '2', '3'])
+    threading.Timer(0.05, vending_machine.receive_signal, args=['2']).start()
+    result = vending_machine.wait_for_input(
+        [vending_machine.left_group, vending_machine.right_group], 300)
+    assert result == 'timeout'
+
+class MockSSHClient:
+    def __init__(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+class MockParallelSSHClient:
+    instances = []
+
+    def __init__(self, hosts, user):
+        self.hosts = hosts
+        self.commands = []
+        self._host_clients = {}
+        MockParallelSSHClient.instances.append(self)
+
+    def run_command(self, command, host_args=None):
+        self.commands.append((command, host_args))
+        for index, host in enumerate(self.hosts):
+            self._host_clients.setdefault((index, host), MockSSHClient())
+
+    def join(self):
+        pass
+
+def test_display_images_reuses_one_client_and_one_round_trip(monkeypatch):
+    MockParallelSSHClient.instances = []
+    monkeypatch.setattr('elephant_vending_machine.libraries.vending_machine.ParallelSSHClient', MockParallelSSHClient)
+    with VendingMachine(['1', '2', '3'], {'DISPLAY_SETTLE_TIME': 0}) as vending_machine:
+        vending_machine.display_images(['all_black_screen.png', 'fixation_stimuli.png', 'elephant.png'])
+        vending_machine.display_images(['a.png', 'b.png', 'c.png'])
+        vending_machine.ssh_all_hosts('true')
+    assert len(MockParallelSSHClient.instances) == 1
+    commands = MockParallelSSHClient.instances[0].commands
+    assert len(commands) == 3
+    command, host_args = commands[0]
+    assert command == '%s'
+    assert len(host_args) == 3
+    assert 'dpms force off' in host_args[0]
+    assert '/home/pi/elephant_vending_machine/default_img/all_black_screen.png' in host_args[0]
+    assert '/home/pi/elephant_vending_machine/images/elephant.png' in host_args[2]
+    assert host_args[2].endswith('dpms force on')
+    assert set(vending_machine.last_display_timing) == {'client_setup_ms', 'round_trip_ms', 'settle_ms'}
+    assert vending_machine._ssh_client is None
+    host_clients = MockParallelSSHClient.instances[0]._host_clients.values()
+    assert len(host_clients) == 3
+    assert not any(client.connected for client in host_clients)
+
+def test_display_images_through_display_agents():
+    with LocalDisplayAgent('127.0.0.1') as left_agent, \
+            LocalDisplayAgent('127.0.0.2', int(left_agent.address.split(':')[1])) as middle_agent, \
+            LocalDisplayAgent('127.0.0.3', int(left_agent.address.split(':')[1])) as right_agent:
+        port = int(left_agent.address.split(':')[1])
+        with VendingMachine(['127.0.0.1', '127.0.0.2', '127.0.0.3'], {'DISPLAY_AGENT_PORT': port}) as vending_machine:
+            vending_machine.display_images(['all_black_screen.png', 'fixation_stimuli.png', 'elephant.png'])
+            next_set = vending_machine.preload_images(['a.png', 'b.png', 'c.png'])
+            assert right_agent.shown[-1][1] == '/home/pi/elephant_vending_machine/images/elephant.png'
+            vending_machine.show_preloaded(next_set)
+            assert vending_machine.last_display_timing['flip_ms'] < 50
+            assert len(vending_machine.last_display_timing['onsets']) == 3
+    assert left_agent.shown[0][1] == '/home/pi/elephant_vending_machine/default_img/all_black_screen.png'
+    assert middle_agent.shown[-1][1] == '/home/pi/elephant_vending_machine/images/b.png'
+    assert list(right_agent.preloaded) == [next_set]
+
+def test_display_agent_flip_unknown_set_fails():
+    with LocalDisplayAgent() as agent:
+        client = DisplayAgentClient([agent.address])
+        with pytest.raises(DisplayAgentError):
+            client.flip(42)
+        client.close()
+
+class MockLogger:
+    def info(self, *args, **kwargs):
+        self.args = list(args)
+        self.kwargs = kwargs
+
+def test_synchronized_onset_corrects_clock_offsets():
+    with LocalDisplayAgent(clock_offset=0) as left_agent, \
+            LocalDisplayAgent(clock_offset=5) as middle_agent, \
+            LocalDisplayAgent(clock_offset=-3) as right_agent:
+        client = DisplayAgentClient([left_agent.address, middle_agent.address, right_agent.address])
+        offsets = client.estimate_offsets()
+        assert abs(offsets[middle_agent.address][0] - 5) < 0.01
+        assert abs(offsets[right_agent.address][0] + 3) < 0.01
+        set_id = client.preload(['a.png', 'b.png', 'c.png'])
+        onset = client.flip_synchronized(set_id, lead=0.05)
+        client.close()
+    assert all(abs(shown - onset['target']) < 0.02 for shown in onset['onsets'])
+    assert onset['skew_ms'] < 20
+    assert abs(middle_agent.shown[0][2] - right_agent.shown[0][2] - 8) < 0.02
+
+def test_measured_onset_is_logged():
+    mock_logger = MockLogger()
+    with LocalDisplayAgent('127.0.0.1') as left_agent, \
+            LocalDisplayAgent('127.0.0.2', int(left_agent.address.split(':')[1])), \
+            LocalDisplayAgent('127.0.0.3', int(left_agent.address.split(':')[1])):
+        port = int(left_agent.address.split(':')[1])
+        with VendingMachine(['127.0.0.1', '127.0.0.2', '127.0.0.3'], {'DISPLAY_AGENT_PORT': port}, mock_logger) as vending_machine:
+            vending_machine.display_images(['a.png', 'b.png', 'c.png'])
+    assert mock_logger.args[0] == 'Stimuli onset left %s, middle %s, right %s, skew %.3f ms'
+    assert abs(mock_logger.args[1].timestamp() - left_agent.shown[0][2]) < 0.001
+    events = mock_logger.kwargs['extra']['trial_events']
+    assert [(event['screen'], event['image']) for event in events] == [('left', 'a.png'), ('middle', 'b.png'), ('right', 'c.png')]
+
+def test_display_images_prefers_prerendered_images(monkeypatch):
+    MockParallelSSHClient.instances = []
+    monkeypatch.setattr('elephant_vending_machine.libraries.vending_machine.ParallelSSHClient', MockParallelSSHClient)
+    with VendingMachine(['1', '2', '3'], {'DISPLAY_SETTLE_TIME': 0, 'PRERENDERED_IMAGES': True}) as vending_machine:
+        vending_machine.display_images(['all_black_screen.png', 'group/b.png', 'group/c.png'])
+    _, host_args = MockParallelSSHClient.instances[0].commands[0]
+    assert '$(test' not in host_args[0]
+    assert 'feh -F -x -Y $(test -e /home/pi/elephant_vending_machine/images/.prerendered/group/b.png.ppm' \
+        ' && echo /home/pi/elephant_vending_machine/images/.prerendered/group/b.png.ppm' \
+        ' || echo /home/pi/elephant_vending_machine/images/group/b.png)' in host_args[1]
+
+def test_display_agents_preload_prerendered_images():
+    with LocalDisplayAgent('127.0.0.1') as left_agent, \
+            LocalDisplayAgent('127.0.0.2', int(left_agent.address.split(':')[1])) as middle_agent, \
+            LocalDisplayAgent('127.0.0.3', int(left_agent.address.split(':')[1])):
+        port = int(left_agent.address.split(':')[1])
+        messages = []
+        real_handle_message = middle_agent.handle_message
+        middle_agent.handle_message = lambda message: messages.append(message) or real_handle_message(message)
+        with VendingMachine(['127.0.0.1', '127.0.0.2', '127.0.0.3'],
+                            {'DISPLAY_AGENT_PORT': port, 'PRERENDERED_IMAGES': True}) as vending_machine:
+            vending_machine.display_images(['all_black_screen.png', 'group/b.png', 'group/c.png'])
+    assert left_agent.shown[0][1] == '/home/pi/elephant_vending_machine/default_img/all_black_screen.png'
+    preload = next(message for message in messages if message['op'] == 'preload')
+    assert preload['image'] == '/home/pi/elephant_vending_machine/images/.prerendered/group/b.png.ppm'
+    assert preload['fallback'] == '/home/pi/elephant_vending_machine/images/group/b.png'
+
+class MockResponse:
+    status_code = 200
+
+def test_dispense_treat_logs_response(monkeypatch):
+    monkeypatch.setattr('requests.post', lambda url, data: MockResponse())
+    mock_logger = MockLogger()
+    vending_machine = VendingMachine(['1', '2', '3'], {}, mock_logger)
+    vending_machine.dispense_treat(2)
+    assert mock_logger.args == ['Treat dispensed from tray %s, status %s', 2, 200]
+    assert 'treat_dispensed' in vending_machine.trial_timer.marks
@@ -0,0 +1,46 @@
+import pytest
+
+from elephant_vending_machine import elephant_vending_machine, image_views, views
+from elephant_vending_machine.libraries.blob_store import BlobStore
+
+
+@pytest.fixture(autouse=True)
+def sync_queue(monkeypatch, tmp_path):
+    """Gives each test an empty sync queue, stopped before subprocess.run is restored."""
+    monkeypatch.setitem(elephant_vending_machine.APP.config, 'SYNC_QUEUE_PATH', str(tmp_path / 'sync_queue.sqlite3'))
+    monkeypatch.setattr(image_views, 'SYNC_QUEUE', None)
+    yield
+    if image_views.SYNC_QUEUE is not None:
+        image_views.SYNC_QUEUE.shutdown()
+        image_views.SYNC_QUEUE.close()
+
+@pytest.fixture(autouse=True)
+def log_catalog(monkeypatch, tmp_path):
+    """Gives each test its own log catalog database, rather than the one in the log directory."""
+    monkeypatch.setitem(elephant_vending_machine.APP.config, 'LOG_CATALOG_PATH', str(tmp_path / 'catalog.sqlite3'))
+    monkeypatch.setattr(views, 'LOG_CATALOG', None)
+    yield
+    if views.LOG_CATALOG is not None:
+        views.LOG_CATALOG.close()
+
+@pytest.fixture(autouse=True)
+def image_index(monkeypatch, tmp_path):
+    """Gives each test its own saved image indexes, rather than those in the package."""
+    monkeypatch.setitem(elephant_vending_machine.APP.config, 'IMAGE_INDEX_DIRECTORY', str(tmp_path / 'image_index'))
+    monkeypatch.setattr(image_views, 'IMAGE_INDEX', None)
+
+@pytest.fixture(autouse=True)
+def blob_store(monkeypatch, tmp_path):
+    """Gives each test its own blob store and chunked uploads, rather than those in the
+    image directory."""
+    monkeypatch.setattr(image_views, 'BLOB_STORE', BlobStore(str(tmp_path / 'blobs')))
+    monkeypatch.setattr(image_views, 'UPLOAD_STORE', None)
+
+@pytest.fixture
+def sync_status():
+    """Returns a function waiting until the sync queue has no jobs due, then returning
+    the status of each host."""
+    def status():
+        assert image_views.get_sync_queue().wait(10)
+        return image_views.get_sync_queue().status()
+    return status
@@ -0,0 +1,122 @@
+import io
+import json
+import os
+import subprocess
+import zipfile
+from io import BytesIO
+from subprocess import CalledProcessError, CompletedProcess
+
+import pytest
+
+from elephant_vending_machine import elephant_vending_machine
+
+GROUP = "elephant_vending_machine/static/img/GRP_TST"
+
+def raise_(ex):
+    raise ex
+
+@pytest.fixture
+def client():
+    elephant_vending_machine.APP.config['TESTING'] = True
+
+    with elephant_vending_machine.APP.test_client() as client:
+        subprocess.call(["mkdir", GROUP])
+        yield client
+        subprocess.call(["rm", "-rf", GROUP])
+        subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/.prerendered/GRP_TST"])
+
+@pytest.fixture
+def commands(monkeypatch):
+    commands = []
+    def run(command, check, shell, **options):
+        commands.append(command)
+        return CompletedProcess(['ssh'], returncode=0, stdout='')
+    monkeypatch.setattr('subprocess.run', run)
+    return commands
+
+def zip_archive(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, contents in files.items():
+            archive.writestr(name, contents)
+    buffer.seek(0)
+    return buffer
+
+def test_upload_images_sends_one_batch_per_host(client, commands, sync_status):
+    data = {'file': [(BytesIO(b"first"), 'first.png'),
+                     (BytesIO(b"second"), 'second.jpg'),
+                     (zip_archive({'set/third.png': b"third", 'set/.DS_Store': b""}), 'set.zip')]}
+    response = client.post('/GRP_TST/images', data=data)
+    assert response.status_code == 201
+    body = json.loads(response.data)
+    assert [result['name'] for result in body['results']] == ['first.png', 'second.jpg', 'third.png']
+    assert body['message'] == 'Saved 3 of 3 images.'
+    with open(os.path.join(GROUP, 'third.png'), 'rb') as image:
+        assert image.read() == b"third"
+    sync_status()
+    transfers = [command for command in commands if 'tar -C' in command]
+    assert len(transfers) == 3
+    assert all('first.png' in command and 'third.png' in command for command in transfers)
+
+def test_upload_images_reports_each_file(client, commands):
+    data = {'file': [(BytesIO(b"first"), 'first.png'),
+                     (BytesIO(b"script"), 'script.sh'),
+                     (BytesIO(b"damaged"), 'set.zip'),
+                     (BytesIO(b"again"), 'first.png')]}
+    response = client.post('/GRP_TST/images', data=data)
+    assert response.status_code == 207
+    results = json.loads(response.data)['results']
+    assert [result['status'] for result in results] == [409, 400, 400, 201]
+    assert results[2]['message'] == "Error with request: Archive could not be read."
+    with open(os.path.join(GROUP, 'first.png'), 'rb') as image:
+        assert image.read() == b"again"
+
+def test_upload_images_no_group_or_files(client):
+    assert client.post('/NO_GROUP/images', data={'file': (BytesIO(b"a"), 'a.png')}).status_code == 400
+    assert client.post('/GRP_TST/images').status_code == 400
+    response = client.post('/GRP_TST/images', data={'file': (BytesIO(b"a"), 'a.sh')})
+    assert response.status_code == 400
+
+def test_upload_images_copying_exception(client, monkeypatch, sync_status):
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell, **options: raise_(CalledProcessError(1, ['ssh'])))
+    data = {'file': [(BytesIO(b"first"), 'first.png'), (BytesIO(b"second"), 'second.png')]}
+    response = client.post('/GRP_TST/images', data=data)
+    assert response.status_code == 201
+    assert sorted(name for name in os.listdir(GROUP) if not name.startswith('.')) == ['first.png', 'second.png']
+    for host in sync_status().values():
+        assert [job['path'] for job in host['failed']] == ['GRP_TST/first.png', 'GRP_TST/second.png']
+
+def test_delete_images(client, commands, sync_status):
+    for name in ('a.png', 'b.png', 'c.png'):
+        subprocess.call(["touch", os.path.join(GROUP, name)])
+    response = client.delete('/GRP_TST/images', json={'names': ['a.png', 'b.png', 'missing.png', 'a.png']})
+    assert response.status_code == 207
+    results = json.loads(response.data)['results']
+    assert [(result['name'], result['status']) for result in results] == \
+        [('a.png', 200), ('b.png', 200), ('missing.png', 404)]
+    assert [name for name in os.listdir(GROUP) if not name.startswith('.')] == ['c.png']
+    sync_status()
+    deletions = [command for command in commands if 'rm -f' in command]
+    assert len(deletions) == 3
+    assert all('a.png' in command and 'b.png' in command for command in deletions)
+
+def test_delete_images_form_fields(client, commands):
+    subprocess.call(["touch", os.path.join(GROUP, 'a.png')])
+    response = client.delete('/GRP_TST/images', data={'name': ['a.png']})
+    assert response.status_code == 200
+    assert client.delete('/GRP_TST/images', data={'name': ['a.png']}).status_code == 400
+    assert client.delete('/GRP_TST/images').status_code == 400
+    assert client.delete('/NO_GROUP/images', json={'names': ['a.png']}).status_code == 400
+
+def test_upload_then_delete_is_coalesced(client, monkeypatch, sync_status):
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell, **options: raise_(CalledProcessError(1, ['ssh'])))
+    subprocess.call(["touch", os.path.join(GROUP, 'a.png')])
+    response = client.post('/GRP_TST/images', data={'file': [(BytesIO(b"b"), 'b.png')]})
+    assert response.status_code == 201
+    response = client.delete('/GRP_TST/images', json={'names': ['a.png', 'b.png']})
+    assert response.status_code == 200
+    assert [name for name in os.listdir(GROUP) if not name.startswith('.')] == []
+    for host in sync_status().values():
+        jobs = host['pending'] + host['failed']
+        assert sorted((job['action'], job['path']) for job in jobs) == \
+            [('delete', 'GRP_TST/a.png'), ('delete', 'GRP_TST/b.png')]
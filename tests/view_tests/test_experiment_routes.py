@@ -1,3 +1,4 @@
+import importlib.util
 import py_compile
 import pytest
 import os
@@ -107,4 +108,51 @@ def test_template_creation(client):
     data = {'name': "name", 'intermediate_duration': 5, 'intertrial_duration': 5, 'stimuli_duration': 5, 'fixation_duration': 5, 'fixation_default': "true", 'trials':2, 'replacement': "False", "monitors":'[true, false, true]', "fixation":"", "outcomes":'[["group1","treat1","tray1"]]'}
     response = client.post('/experiment/create', data=data) 
     assert response.status_code == 200
-    assert json.loads(response.data)['message'] == "File successfully created."
\ No newline at end of file
+    assert json.loads(response.data)['message'] == "File successfully created."
+def test_experiment_list_not_modified(client):
+    subprocess.call(["touch", "elephant_vending_machine/static/experiment/test_file.py"])
+    response = client.get('/experiment')
+    etag = response.headers['ETag']
+    response = client.get('/experiment', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    subprocess.call(["touch", "elephant_vending_machine/static/experiment/test_file2.py"])
+    response = client.get('/experiment', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def load_template_experiment(client, group):
+    data = {'name': "unittestTemplate", 'intermediate_duration': 5, 'intertrial_duration': 5, 'stimuli_duration': 5, 'fixation_duration': 5, 'fixation_default': "true", 'trials': 2, 'replacement': "False", "monitors": '[true, false, true]', "fixation": "", "outcomes": json.dumps([[group, "treat1", 1]])}
+    assert client.post('/experiment/create', data=data).status_code == 200
+    path = "elephant_vending_machine/static/experiment/unittestTemplate.py"
+    spec = importlib.util.spec_from_file_location('unittestTemplate', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    os.remove(path)
+    return module
+
+def test_template_random_image_skips_hidden_files_and_directories(client, tmp_path):
+    module = load_template_experiment(client, 'GRP_TST')
+    group = tmp_path / 'group'
+    (group / 'subdirectory').mkdir(parents=True)
+    (group / 'image.png').write_bytes(b'')
+    (group / '.DS_Store').write_bytes(b'')
+    assert {module.random_image(str(group)) for _ in range(20)} == {'group/image.png'}
+
+def test_template_random_image_skips_prerendered_images(client, monkeypatch):
+    image_module = pytest.importorskip('PIL.Image')
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: CompletedProcess(['ssh'], returncode=0))
+    module = load_template_experiment(client, 'GRP_TST')
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
+    image = BytesIO()
+    image_module.new('RGB', (40, 30)).save(image, 'PNG')
+    image.seek(0)
+    try:
+        response = client.post('/GRP_TST/image', data={'file': (image, 'test_file.png')})
+        assert response.status_code == 201
+        assert os.path.exists("elephant_vending_machine/static/img/.prerendered/GRP_TST/test_file.png.ppm")
+        group_path = os.path.abspath("elephant_vending_machine/static/img/GRP_TST")
+        assert {module.random_image(group_path) for _ in range(20)} == {'GRP_TST/test_file.png'}
+    finally:
+        subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/GRP_TST"])
+        subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/.prerendered/GRP_TST"])
@@ -1,3 +1,4 @@
+import os
 import pytest
 import subprocess
 from io import BytesIO
@@ -5,7 +6,7 @@ import json
 
 from werkzeug.wrappers import Response
 
-from elephant_vending_machine import elephant_vending_machine
+from elephant_vending_machine import elephant_vending_machine, image_views
 from subprocess import CompletedProcess, CalledProcessError
 
 def raise_(ex):
@@ -38,12 +39,13 @@ def test_post_group_route_duplicate(client):
     assert response.status_code == 400
     assert json.loads(response.data)['message'] == 'Error with request: Group already exists.'
 
-def test_post_group_route_copying_exception(monkeypatch, client):
+def test_post_group_route_copying_exception(monkeypatch, client, sync_status):
     monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(CalledProcessError(1, ['ssh'])))
     data = {'name': 'test'}
     response = client.post('/groups', data=data)
-    assert response.status_code == 500
-    assert json.loads(response.data)['message'] == 'Error: Failed to create group on hosts.'
+    assert response.status_code == 201
+    for host in sync_status().values():
+        assert [(job['action'], job['path']) for job in host['failed']] == [('create', 'test')]
 
 def test_post_group_route_happy_path(monkeypatch, client):
     monkeypatch.setattr('subprocess.run', lambda command, check, shell: CompletedProcess(['some_command'], returncode=0))
@@ -52,6 +54,16 @@ def test_post_group_route_happy_path(monkeypatch, client):
     assert response.status_code == 201
     assert b'Success: Group created.'
 
+def test_post_group_route_creates_group_on_hosts(monkeypatch, client, sync_status):
+    commands = []
+    def run(command, check, shell):
+        commands.append(command)
+        return CompletedProcess(['ssh'], returncode=0)
+    monkeypatch.setattr('subprocess.run', run)
+    assert client.post('/groups', data={'name': 'test'}).status_code == 201
+    sync_status()
+    assert sum('rm -rf test .prerendered/test && mkdir -p test' in command for command in commands) == 3
+
 def test_delete_group_route_not_exist(client):
     response = client.delete('/groups/test')
     assert response.status_code == 400
@@ -78,13 +90,44 @@ def test_delete_fixations_group(monkeypatch, client):
     assert response.status_code == 400
     assert b'The fixations group cannot be deleted' in response.data 
 
-def test_delete_group_no_connection(monkeypatch, client):
+def test_delete_group_no_connection(monkeypatch, client, sync_status):
     monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(CalledProcessError(1, ['ssh'])))
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/test"])
     response = client.delete('/groups/test')
-    assert response.status_code == 500
-    assert json.loads(response.data)['message'] == ['Error: Failed to delete file from hosts. ', \
-         'Group not deleted, please try again'] 
+    assert response.status_code == 200
+    assert not os.path.exists("elephant_vending_machine/static/img/test")
+    for host in sync_status().values():
+        assert [(job['action'], job['path']) for job in host['failed']] == [('remove', 'test')]
+
+def test_group_created_again_replaces_queued_jobs(monkeypatch, client, sync_status):
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(CalledProcessError(1, ['ssh'])))
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/test"])
+    subprocess.call(["touch", "elephant_vending_machine/static/img/test/blank.jpg"])
+    assert client.delete('/image/test/blank.jpg').status_code == 200
+    assert client.delete('/groups/test').status_code == 200
+    assert client.post('/groups', data={'name': 'test'}).status_code == 201
+    for host in sync_status().values():
+        assert [(job['action'], job['path']) for job in host['pending'] + host['failed']] == [('create', 'test')]
+
+def test_group_created_again_is_emptied_on_hosts(monkeypatch, client, sync_status):
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(CalledProcessError(1, ['ssh'])))
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/test"])
+    assert client.delete('/groups/test').status_code == 200
+    assert client.post('/groups', data={'name': 'test'}).status_code == 201
+    sync_status()
+    commands = []
+    def run(command, check, shell):
+        commands.append(command)
+        return CompletedProcess(['ssh'], returncode=0)
+    monkeypatch.setattr('subprocess.run', run)
+    queue = image_views.SYNC_QUEUE
+    with queue._condition, queue._connection:
+        queue._connection.execute('UPDATE hosts SET retry_at = 0')
+    # Wakes the workers, which now find the jobs due
+    queue.enqueue([])
+    assert all(not host['pending'] + host['failed'] for host in sync_status().values())
+    assert len(commands) == 3
+    assert all('rm -rf test .prerendered/test && mkdir -p test' in command for command in commands)
 
 def test_get_group_route(client):
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/test"])
@@ -97,3 +140,55 @@ def test_get_group_route(client):
 
 
 
+
+def test_get_group_route_skips_hidden_directories(client):
+    subprocess.call(["mkdir", "-p", "elephant_vending_machine/static/img/.hidden"])
+    try:
+        response = client.get('/groups')
+    finally:
+        subprocess.call(["rmdir", "elephant_vending_machine/static/img/.hidden"])
+    assert not any(name.startswith('.') for name in json.loads(response.data)['names'])
+
+def test_get_group_route_not_modified(client):
+    response = client.get('/groups')
+    response = client.get('/groups', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+def test_sync_group_not_found(client):
+    response = client.post('/groups/test/sync')
+    assert response.status_code == 404
+
+def test_hidden_directories_are_not_groups(client):
+    subprocess.call(["mkdir", "-p", "elephant_vending_machine/static/img/.hidden"])
+    try:
+        assert client.post('/groups/.hidden/sync').status_code == 404
+        assert client.delete('/groups/.hidden').status_code == 400
+        assert os.path.isdir("elephant_vending_machine/static/img/.hidden")
+    finally:
+        subprocess.call(["rmdir", "elephant_vending_machine/static/img/.hidden"])
+
+def test_sync_group_sends_only_missing_files(monkeypatch, client, sync_status):
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/test"])
+    with open("elephant_vending_machine/static/img/test/a.png", "wb") as image:
+        image.write(b'a')
+    with open("elephant_vending_machine/static/img/test/b.png", "wb") as image:
+        image.write(b'b')
+    # The hosts hold an up to date a.png and a file no longer in the group
+    a_digest = 'ca978112ca1bbdcafac231b39a23dc4da786eff8147c4e72b9807785afee48bb'
+    commands = []
+    def run(command, check, shell, **options):
+        commands.append(command)
+        return CompletedProcess(['ssh'], returncode=0,
+                                stdout=f'{a_digest}  test/a.png\n{a_digest}  test/old.png\n')
+    monkeypatch.setattr('subprocess.run', run)
+    try:
+        response = client.post('/groups/test/sync')
+        assert response.status_code == 202
+        assert json.loads(response.data)['status'] == '/sync'
+        for host in sync_status().values():
+            assert host['pending'] == host['failed'] == []
+    finally:
+        subprocess.call(["rm", "-r", "elephant_vending_machine/static/img/test"])
+    transfers = [command for command in commands if command.startswith('tar ')]
+    assert len(transfers) == 3
+    assert all(' -cf - test/b.png |' in command for command in transfers)
@@ -1,3 +1,4 @@
+import os
 import pytest
 import subprocess
 from io import BytesIO
@@ -20,6 +21,8 @@ def client():
         subprocess.call(["rm", "elephant_vending_machine/static/img/GRP_TST/blank.jpg"])
         subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/GRP_TST"])
         subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/GRP_TST2"])
+        subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/.prerendered/GRP_TST"])
+        subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/.prerendered/GRP_TST2"])
 
 def test_post_image_route_no_file(client):
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
@@ -50,15 +53,16 @@ def test_post_image_route_with_file(monkeypatch, client):
     assert response.status_code == 201
     assert b'Success: Image saved.' in response.data
 
-def test_post_image_route_copying_exception(monkeypatch, client):
+def test_post_image_route_copying_exception(monkeypatch, client, sync_status):
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
     monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(CalledProcessError(1, ['ssh'])))
-    subprocess.call(["touch", "elephant_vending_machine/static/img/GRP_TST/test_delete.jpg"])
-    data = {'file': (BytesIO(b"Testing: \x00\x01"), 'test_delete.png')}
+    data = {'file': (BytesIO(b"Testing: \x00\x01"), 'test_file.png')}
     response = client.post('/GRP_TST/image', data=data) 
-    assert response.status_code == 500
-    assert b"Error: Failed to copy file to hosts. ", \
-        "Image not saved, please try again" in response.data
+    assert response.status_code == 201
+    assert os.path.exists("elephant_vending_machine/static/img/GRP_TST/test_file.png")
+    for host in sync_status().values():
+        assert [(job['action'], job['path']) for job in host['failed']] == [('push', 'GRP_TST/test_file.png')]
+        assert host['error'] == 'exit status 1'
 
 def test_get_image_endpoint(client):
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
@@ -78,14 +82,15 @@ def test_delete_image_happy_path(monkeypatch, client):
     assert response.status_code == 200
     assert json.loads(response.data)['message'] == 'File blank.jpg was successfully deleted.'
     
-def test_delete_image_route_copying_exception(monkeypatch, client):
+def test_delete_image_route_copying_exception(monkeypatch, client, sync_status):
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
     monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(CalledProcessError(1, ['ssh'])))
     subprocess.call(["touch", "elephant_vending_machine/static/img/GRP_TST/test_delete.jpg"])
     response = client.delete('/image/GRP_TST/test_delete.jpg')
-    assert b"Error: Failed to delete file from hosts. ", \
-        "Image not deleted, please try again" in response.data
-    assert response.status_code == 500
+    assert response.status_code == 200
+    assert not os.path.exists("elephant_vending_machine/static/img/GRP_TST/test_delete.jpg")
+    for host in sync_status().values():
+        assert [(job['action'], job['path']) for job in host['failed']] == [('delete', 'GRP_TST/test_delete.jpg')]
 
 def test_delete_image_no_group(monkeypatch, client):
     monkeypatch.setattr('subprocess.run', lambda command, check, shell: CompletedProcess(['some_command'], returncode=0))
@@ -112,12 +117,32 @@ def test_image_copy_to_group_happy_path(client, monkeypatch):
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST2"])
     subprocess.call(["touch", "elephant_vending_machine/static/img/GRP_TST/blank.jpg"])
-    monkeypatch.setattr('subprocess.run', lambda command, check, shell: CompletedProcess(['some_command'], returncode=0))
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell, **options: CompletedProcess(['some_command'], returncode=0, stdout=''))
     data = {"name": "GRP_TST2"}
     response = client.post("/GRP_TST/blank.jpg/copy", data=data)
     assert response.status_code == 200
     assert json.loads(response.data)['message'] == "File blank.jpg was successfully copied to group 'GRP_TST2'."
 
+def test_image_copy_of_unindexed_image(client, monkeypatch, sync_status):
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST2"])
+    subprocess.call(["touch", "elephant_vending_machine/static/img/GRP_TST/.blank.jpg"])
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell, **options: CompletedProcess(['some_command'], returncode=0, stdout=''))
+    response = client.post("/GRP_TST/.blank.jpg/copy", data={"name": "GRP_TST2"})
+    assert response.status_code == 200
+    assert os.path.exists("elephant_vending_machine/static/img/GRP_TST2/.blank.jpg")
+    sync_status()
+
+def test_image_copy_to_hidden_directory(client):
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
+    subprocess.call(["touch", "elephant_vending_machine/static/img/GRP_TST/blank.jpg"])
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/.hidden"])
+    try:
+        response = client.post("/GRP_TST/blank.jpg/copy", data={"name": ".hidden"})
+    finally:
+        subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/.hidden"])
+    assert response.status_code == 400
+
 def test_image_copy_to_group_no_group2(client):
     data = {"name": "GRP_TST2"}
     response = client.post("/GRP_TST1/blank.jpg/copy", data=data)
@@ -131,12 +156,127 @@ def test_image_copy_to_group_no_image(client):
     assert response.status_code == 400
     assert json.loads(response.data)['message'] == 'Error with request: blank.jpg does not exist'
 
-def test_image_copy_to_group_copying_exception(client, monkeypatch):
+def test_image_copy_to_group_copying_exception(client, monkeypatch, sync_status):
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
     subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST2"])
     subprocess.call(["touch", "elephant_vending_machine/static/img/GRP_TST/blank.jpg"])
-    monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(CalledProcessError(1, ['ssh'])))
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell, **options: raise_(CalledProcessError(1, ['ssh'])))
     data = {"name": "GRP_TST2"}
     response = client.post("/GRP_TST/blank.jpg/copy", data=data)
-    assert response.status_code == 500
-    assert json.loads(response.data)['message'] == ['Error: Failed to copy file to hosts. ', 'Image not copied, please try again'] 
+    assert response.status_code == 200
+    assert os.path.exists("elephant_vending_machine/static/img/GRP_TST2/blank.jpg")
+    # The hosts may not hold the image to link from, so it is sent in full when retried
+    for host in sync_status().values():
+        assert [(job['action'], job['path']) for job in host['failed']] == [('push', 'GRP_TST2/blank.jpg')]
+
+def make_test_group():
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
+    with open("elephant_vending_machine/static/img/GRP_TST/test_file.png", "wb") as image:
+        image.write(b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x02\x00\x00\x00\x03\x08\x02\x00\x00\x00')
+    with open("elephant_vending_machine/static/img/GRP_TST/test_file2.jpg", "wb") as image:
+        image.write(b'\xff\xd8')
+
+def test_get_image_endpoint_paginated(client):
+    make_test_group()
+    response = client.get('/GRP_TST?limit=1')
+    body = json.loads(response.data)
+    assert body['files'] == ["http://localhost/static/img/GRP_TST/test_file.png"]
+    response = client.get('/GRP_TST?limit=1&cursor=' + body['next_cursor'])
+    body = json.loads(response.data)
+    assert body['files'] == ["http://localhost/static/img/GRP_TST/test_file2.jpg"]
+    assert body['next_cursor'] is None
+
+def test_get_image_endpoint_prefix_and_sort(client):
+    make_test_group()
+    response = client.get('/GRP_TST?prefix=test_file2')
+    assert json.loads(response.data)['files'] == ["http://localhost/static/img/GRP_TST/test_file2.jpg"]
+    response = client.get('/GRP_TST?sort=size&order=desc')
+    assert json.loads(response.data)['files'] == ["http://localhost/static/img/GRP_TST/test_file.png",
+                                                  "http://localhost/static/img/GRP_TST/test_file2.jpg"]
+
+def test_get_image_endpoint_metadata(client):
+    make_test_group()
+    response = client.get('/GRP_TST?metadata=true&prefix=test_file.')
+    image = json.loads(response.data)['files'][0]
+    assert image['name'] == 'test_file.png'
+    assert image['url'] == "http://localhost/static/img/GRP_TST/test_file.png"
+    assert (image['width'], image['height'], image['size']) == (2, 3, 29)
+    assert len(image['sha256']) == 64
+
+def test_get_image_endpoint_not_modified(client):
+    make_test_group()
+    response = client.get('/GRP_TST?limit=1')
+    response = client.get('/GRP_TST?limit=1', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    response = client.get('/GRP_TST?limit=2', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 200
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=x', 'sort=colour', 'order=up', 'cursor=nonsense'])
+def test_get_image_endpoint_bad_query(client, query):
+    make_test_group()
+    response = client.get('/GRP_TST?' + query)
+    assert response.status_code == 400
+
+def test_get_image_endpoint_thumbnails(client, monkeypatch, tmp_path):
+    from elephant_vending_machine import image_views
+    from elephant_vending_machine.libraries import thumbnails
+    make_test_group()
+    monkeypatch.setattr(thumbnails, 'Image', None)
+    monkeypatch.setattr(image_views, 'THUMBNAIL_PIPELINE', thumbnails.ThumbnailPipeline(str(tmp_path)))
+    response = client.get('/GRP_TST?thumbnails=true&prefix=test_file.')
+    body = json.loads(response.data)
+    assert body['thumbnails'] == [None]
+    digest = image_views.get_image_index().entries(os.path.abspath('elephant_vending_machine/static/img/GRP_TST'))['test_file.png']['sha256']
+    (tmp_path / digest[:2]).mkdir()
+    (tmp_path / digest[:2] / f'{digest}-thumbnail.jpg').write_bytes(b'jpeg')
+    response = client.get('/GRP_TST?thumbnails=true&prefix=test_file.', headers={'If-None-Match': response.headers['ETag']})
+    body = json.loads(response.data)
+    assert body['thumbnails'] == [f"http://localhost/static/thumbnails/{digest[:2]}/{digest}-thumbnail.jpg"]
+    assert body['previews'] == [None]
+
+def test_post_image_route_reports_failed_hosts(monkeypatch, client, sync_status):
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
+    def run(command, check, shell):
+        if '192.168.0.12' in command:
+            raise CalledProcessError(255, ['ssh'])
+        return CompletedProcess(['ssh'], returncode=0)
+    monkeypatch.setattr('subprocess.run', run)
+    data = {'file': (BytesIO(b"Testing: \x00\x01"), 'test_file.png')}
+    response = client.post('/GRP_TST/image', data=data)
+    assert response.status_code == 201
+    sync_status()
+    hosts = json.loads(client.get('/sync').data)['hosts']
+    assert hosts['192.168.0.12']['error'] == 'exit status 255'
+    assert hosts['192.168.0.12']['failures'] == 1
+    assert hosts['192.168.0.12']['retry_at'] is not None
+    assert [job['path'] for job in hosts['192.168.0.12']['failed']] == ['GRP_TST/test_file.png']
+    assert hosts['192.168.0.11'] == {'pending': [], 'failed': [], 'failures': 0, 'error': None, 'retry_at': None}
+
+def test_image_copy_links_image_hosts_already_hold(client, monkeypatch, sync_status):
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST2"])
+    subprocess.call(["touch", "elephant_vending_machine/static/img/GRP_TST/blank.jpg"])
+    empty_digest = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+    commands = []
+    def run(command, check, shell, **options):
+        commands.append(command)
+        return CompletedProcess(['ssh'], returncode=0, stdout=f'{empty_digest}  GRP_TST/blank.jpg\n')
+    monkeypatch.setattr('subprocess.run', run)
+    response = client.post("/GRP_TST/blank.jpg/copy", data={"name": "GRP_TST2"})
+    assert response.status_code == 200
+    assert all(not host['pending'] and not host['failed'] for host in sync_status().values())
+    assert not any('tar ' in command or 'scp ' in command for command in commands)
+    assert sum('ln -f GRP_TST/blank.jpg GRP_TST2/blank.jpg' in command for command in commands) == 3
+
+def test_image_copy_links_the_stored_image(client, monkeypatch):
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell, **options: CompletedProcess(['ssh'], returncode=0, stdout=''))
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
+    subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST2"])
+    response = client.post('/GRP_TST/image', data={'file': (BytesIO(b"Testing: \x00\x01"), 'test_file.png')})
+    assert response.status_code == 201
+    response = client.post("/GRP_TST/test_file.png/copy", data={"name": "GRP_TST2"})
+    assert response.status_code == 200
+    source = os.stat("elephant_vending_machine/static/img/GRP_TST/test_file.png")
+    copy = os.stat("elephant_vending_machine/static/img/GRP_TST2/test_file.png")
+    assert source.st_ino == copy.st_ino
+    assert source.st_nlink == 3
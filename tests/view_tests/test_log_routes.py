@@ -1,7 +1,9 @@
 import pytest
 import subprocess
 from io import BytesIO
+import gzip
 import json
+import os
 
 from elephant_vending_machine import elephant_vending_machine
 from subprocess import CompletedProcess, CalledProcessError
@@ -44,4 +46,116 @@ def test_delete_log_is_a_directory_exception(client, monkeypatch):
     monkeypatch.setattr('os.remove', lambda file: (_ for _ in ()).throw(IsADirectoryError))
     response = client.delete('/log/empty.csv')
     assert response.status_code == 400
-    assert json.loads(response.data)['message'] == 'empty.csv exists, but is a directory and not a file. Deletion failed.'
\ No newline at end of file
+    assert json.loads(response.data)['message'] == 'empty.csv exists, but is a directory and not a file. Deletion failed.'
+def write_trial_log(name, *events):
+    from elephant_vending_machine.libraries import trial_log
+    with open(f"elephant_vending_machine/static/log/{name}", 'wb') as log_file:
+        log_file.write(trial_log.MAGIC + b''.join(trial_log.encode_event(created, event, **fields) for created, event, fields in events))
+
+def test_export_log_json(client):
+    subprocess.call(["touch", "elephant_vending_machine/static/log/test_file.csv"])
+    write_trial_log('test_file.trials', (1.5, 1, {'trial': 7}), (2.0, 0, {'trial': 7, 'message': 'Trial 7 picked left'}))
+    response = client.get('/log/test_file.csv/export?format=json')
+    assert response.status_code == 200
+    events = json.loads(response.data)['events']
+    assert [(event['event'], event['trial']) for event in events] == [('trial_started', 7), ('message', 7)]
+    assert events[1]['message'] == 'Trial 7 picked left'
+    subprocess.call(["rm", "elephant_vending_machine/static/log/test_file.trials"])
+
+def test_export_log_csv(client):
+    write_trial_log('test_file.trials', (1.5, 1, {'trial': 7}))
+    response = client.get('/log/test_file.csv/export')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/csv')
+    assert response.data.decode().splitlines()[1] == '"1.5","7","trial_started","","","",""'
+    subprocess.call(["rm", "elephant_vending_machine/static/log/test_file.trials"])
+
+def test_export_log_without_trial_log(client):
+    response = client.get('/log/test_file.csv/export')
+    assert response.status_code == 400
+    assert json.loads(response.data)['message'] == 'No trial log exists for test_file.csv'
+
+def test_export_log_not_a_trial_log(client):
+    write_log('test_file.trials', b'"2020-01-01 00:00:00","text"')
+    response = client.get('/log/test_file.csv/export')
+    subprocess.call(["rm", "elephant_vending_machine/static/log/test_file.trials"])
+    assert response.status_code == 400
+    assert json.loads(response.data)['message'] == 'test_file.trials is not a trial log'
+
+def test_export_log_unknown_format(client):
+    response = client.get('/log/test_file.csv/export?format=xml')
+    assert response.status_code == 400
+    assert json.loads(response.data)['message'] == 'Unknown export format xml'
+
+def test_trial_logs_not_listed_and_deleted_with_log(client):
+    subprocess.call(["touch", "elephant_vending_machine/static/log/empty.csv"])
+    write_trial_log('empty.trials', (1.5, 1, {'trial': 7}))
+    response = client.get('/log')
+    assert "http://localhost/static/log/empty.trials" not in json.loads(response.data)['files']
+    response = client.delete('/log/empty.csv')
+    assert response.status_code == 200
+    assert not os.path.exists("elephant_vending_machine/static/log/empty.trials")
+
+def write_log(name, contents):
+    with open(f"elephant_vending_machine/static/log/{name}", 'wb') as log_file:
+        log_file.write(contents)
+
+def test_stream_log_whole_file(client):
+    write_log('test_file.csv', b'"a"\r\n"b"\r\n')
+    response = client.get('/log/test_file.csv/stream')
+    assert response.status_code == 200
+    assert response.data == b'"a"\r\n"b"\r\n'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+def test_stream_log_range(client):
+    write_log('test_file.csv', b'"a"\r\n"b"\r\n')
+    response = client.get('/log/test_file.csv/stream', headers={'Range': 'bytes=5-'})
+    assert response.status_code == 206
+    assert response.data == b'"b"\r\n'
+    assert response.headers['Content-Range'] == 'bytes 5-9/10'
+
+def test_stream_log_gzip(client):
+    write_log('test_file.csv', b'"a"\r\n"b"\r\n')
+    response = client.get('/log/test_file.csv/stream', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == b'"a"\r\n"b"\r\n'
+
+def test_stream_log_follow(client):
+    write_log('test_file.csv', b'"a"\r\n"b"\r\n')
+    response = client.get('/log/test_file.csv/stream?follow=1', headers={'Last-Event-ID': '5'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.data == b'id: 10\ndata: "b"\n\nevent: end\nid: 10\ndata: \n\n'
+
+def test_stream_log_invalid_offset(client):
+    write_log('test_file.csv', b'"a"\r\n')
+    response = client.get('/log/test_file.csv/stream?follow=1&offset=start')
+    assert response.status_code == 400
+    assert json.loads(response.data)['message'] == 'Offset must be a non-negative integer'
+
+def test_stream_log_not_found(client):
+    response = client.get('/log/missing.csv/stream')
+    assert response.status_code == 400
+    assert json.loads(response.data)['message'] == 'File missing.csv does not exist'
+
+def test_query_log_catalog(client, monkeypatch, tmp_path):
+    from elephant_vending_machine.libraries.log_catalog import LogCatalog
+    (tmp_path / '2020-03-17 04:26:02.085651 example.py.csv').write_text('"2020-03-17 04:26:03","Experiment finished"\r\n')
+    (tmp_path / '2020-03-18 04:26:02.085651 example.py.csv').write_text('"2020-03-18 04:26:03","Trial 1 finished"\r\n')
+    monkeypatch.setattr('elephant_vending_machine.views.LOG_CATALOG', LogCatalog(str(tmp_path / 'catalog.db'), str(tmp_path)))
+    response = client.get('/log/catalog?experiment=example.py&status=finished')
+    assert response.status_code == 200
+    body = json.loads(response.data)
+    assert body['total'] == 1
+    assert body['logs'][0]['started'] == '2020-03-17 04:26:02.085651'
+    response = client.get('/log/catalog?per_page=1&page=2')
+    body = json.loads(response.data)
+    assert body['total'] == 2
+    assert [log['started'] for log in body['logs']] == ['2020-03-17 04:26:02.085651']
+
+def test_query_log_catalog_invalid_page(client):
+    response = client.get('/log/catalog?page=0')
+    assert response.status_code == 400
+    response = client.get('/log/catalog?per_page=many')
+    assert response.status_code == 400
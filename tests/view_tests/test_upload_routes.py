@@ -0,0 +1,102 @@
+import hashlib
+import json
+import subprocess
+from subprocess import CompletedProcess
+
+import pytest
+
+from elephant_vending_machine import elephant_vending_machine, image_views
+
+
+@pytest.fixture
+def client():
+    elephant_vending_machine.APP.config['TESTING'] = True
+
+    with elephant_vending_machine.APP.test_client() as client:
+        subprocess.call(["mkdir", "elephant_vending_machine/static/img/GRP_TST"])
+        yield client
+        subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/GRP_TST"])
+        subprocess.call(["rm", "-rf", "elephant_vending_machine/static/img/.prerendered/GRP_TST"])
+
+@pytest.fixture
+def commands(monkeypatch):
+    commands = []
+    def run(command, check, shell, **options):
+        commands.append(command)
+        return CompletedProcess(['ssh'], returncode=0, stdout='')
+    monkeypatch.setattr('subprocess.run', run)
+    return commands
+
+def start(client, size, **fields):
+    response = client.post('/GRP_TST/uploads', data={'name': 'test_file.png', 'size': size, **fields})
+    assert response.status_code == 201
+    return json.loads(response.data)['upload_id']
+
+def test_start_upload_validates_fields(client):
+    assert client.post('/GRP_TST/uploads', data={'name': 'a.exe', 'size': 10}).status_code == 400
+    assert client.post('/GRP_TST/uploads', data={'name': 'a.png', 'size': 'ten'}).status_code == 400
+    assert client.post('/GRP_TST/uploads', data={'name': 'a.png', 'size': 10, 'sha256': 'abc'}).status_code == 400
+    assert client.post('/NO_GROUP/uploads', data={'name': 'a.png', 'size': 10}).status_code == 400
+
+def test_chunked_upload(client, commands, sync_status):
+    upload_id = start(client, 10)
+    response = client.put(f'/uploads/{upload_id}?offset=0', data=b'01234')
+    assert response.status_code == 200
+    assert json.loads(response.data)['offset'] == 5
+    response = client.put(f'/uploads/{upload_id}?offset=0', data=b'01234')
+    assert response.status_code == 409
+    assert json.loads(response.data)['offset'] == 5
+    assert json.loads(client.get(f'/uploads/{upload_id}').data)['offset'] == 5
+    response = client.put(f'/uploads/{upload_id}?offset=5', data=b'56789')
+    assert response.status_code == 201
+    with open("elephant_vending_machine/static/img/GRP_TST/test_file.png", "rb") as image:
+        assert image.read() == b'0123456789'
+    assert client.get(f'/uploads/{upload_id}').status_code == 404
+    sync_status()
+    # Chunks were sent on as they arrived, so the hosts only rename the whole image
+    assert sum(' seek=0 ' in command for command in commands) == 3
+    assert sum(' seek=5 ' in command for command in commands) == 3
+    assert sum(f'mv -f GRP_TST/.{upload_id}.part GRP_TST/test_file.png' in command for command in commands) == 3
+    assert not any('test_file.png' in command and 'tar -C' in command for command in commands)
+
+def removes_part(commands, upload_id):
+    return sum('rm -f ' in command and f'GRP_TST/.{upload_id}.part' in command for command in commands)
+
+def test_chunked_upload_checks_hash(client, commands, sync_status):
+    upload_id = start(client, 3, sha256=hashlib.sha256(b'abc').hexdigest())
+    response = client.put(f'/uploads/{upload_id}?offset=0', data=b'abd')
+    assert response.status_code == 400
+    assert client.get(f'/uploads/{upload_id}').status_code == 404
+    sync_status()
+    assert removes_part(commands, upload_id) == 3
+
+def test_cancel_upload(client, commands, sync_status):
+    upload_id = start(client, 10)
+    assert client.put(f'/uploads/{upload_id}?offset=0', data=b'01234').status_code == 200
+    assert client.delete(f'/uploads/{upload_id}').status_code == 200
+    assert client.put(f'/uploads/{upload_id}?offset=0', data=b'0').status_code == 404
+    sync_status()
+    assert removes_part(commands, upload_id) == 3
+
+def test_upload_cancelled_before_chunk_is_written(client, commands, monkeypatch):
+    upload_id = start(client, 10)
+    store = image_views.get_upload_store()
+    submitted = []
+    monkeypatch.setattr(image_views.get_range_forwarder(), 'submit', lambda *args: submitted.append(args))
+    real_write = store.write
+    def write(*args):
+        # Cancelled by another request as this one is about to write the chunk
+        store.discard(upload_id)
+        return real_write(*args)
+    monkeypatch.setattr(store, 'write', write)
+    response = client.put(f'/uploads/{upload_id}?offset=0', data=b'01234')
+    assert response.status_code == 404
+    assert json.loads(response.data)['message'] == f"Upload {upload_id} was cancelled"
+    assert submitted == []
+
+def test_expired_upload_is_removed_from_hosts(client, commands, sync_status):
+    upload_id = start(client, 10)
+    assert image_views.get_upload_store().purge(expiry=-1) == [upload_id]
+    assert client.get(f'/uploads/{upload_id}').status_code == 404
+    sync_status()
+    assert removes_part(commands, upload_id) == 3
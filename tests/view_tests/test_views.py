@@ -5,11 +5,21 @@ from flask import jsonify, make_response
 import json
 
 from elephant_vending_machine import elephant_vending_machine
+from elephant_vending_machine import views
+from elephant_vending_machine.libraries import trial_log
+from elephant_vending_machine.libraries.display_agent import LocalDisplayAgent
+from elephant_vending_machine.libraries.experiment_logger import ExperimentLoggerRegistry
+from elephant_vending_machine.libraries.signal_bus import LocalSignalTransport, UnixSocketSignalTransport
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
 
 class MockLogger:
 
+    def __init__(self):
+        self.messages = []
+
     def info(self, *args, **kwargs):
         self.args = list(args)
+        self.messages.append(self.args)
  
 
 @pytest.fixture
@@ -21,7 +31,7 @@ def client():
 
 def test_run_trial_route_success(client, monkeypatch):
     mock_logger = MockLogger()
-    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name: mock_logger)
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, structured=False: mock_logger)
 
     experiment_path = "elephant_vending_machine/static/experiment/unittestExperiment.py"
     subprocess.call(["touch", experiment_path])
@@ -33,6 +43,7 @@ def test_run_trial_route_success(client, monkeypatch):
     response = client.post('/run-experiment/unittestExperiment.py')
     assert b'Running unittestExperiment' in response.data
     assert response.status_code == 200
+    assert views.RUN_MANAGER.get(json.loads(response.data)['run_id']).wait(5)
     assert mock_logger.args == ['Entered unit test experiment']
     subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestExperiment.py"])
 
@@ -40,3 +51,169 @@ def test_run_trial_experiment_file_doesnt_exist(client):
     response = client.post('/run-experiment/aNonexistentExperiment.py')
     assert b'No experiment named aNonexistentExperiment' in response.data
     assert response.status_code == 400
+
+def test_signal_no_running_experiment(client, monkeypatch):
+    monkeypatch.setattr('elephant_vending_machine.views.SIGNAL_TRANSPORT', LocalSignalTransport())
+    response = client.post('/signal', data={'address': '192.168.0.11'})
+    assert response.status_code == 400
+    assert b'Error: There is currently no running experiment' in response.data
+
+def test_signal_delivered_to_vending_machine(client, monkeypatch):
+    transport = LocalSignalTransport()
+    monkeypatch.setattr('elephant_vending_machine.views.SIGNAL_TRANSPORT', transport)
+    vending_machine = VendingMachine(['192.168.0.11', '192.168.0.12', '192.168.0.13'])
+    transport.subscribe(vending_machine.receive_signal)
+    vending_machine.mark_stimulus_onset()
+    response = client.post('/signal', data={'address': '192.168.0.11'})
+    assert response.status_code == 200
+    assert vending_machine.wait_for_input([vending_machine.left_group], 0) == 'left'
+
+def test_signal_delivered_to_running_experiment(client, monkeypatch, tmp_path):
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, structured=False: MockLogger())
+    monkeypatch.setattr('elephant_vending_machine.views.SIGNAL_TRANSPORT', UnixSocketSignalTransport(str(tmp_path / 'signal.sock')))
+    write_experiment('unittestSignal.py', [
+        'def run_experiment(experiment_logger, vending_machine):',
+        '    return vending_machine.wait_for_input([vending_machine.left_group], 5000)'])
+    response = client.post('/run-experiment/unittestSignal.py')
+    run_id = json.loads(response.data)['run_id']
+    response = client.post('/signal', data={'address': elephant_vending_machine.APP.config['REMOTE_HOSTS'][0]})
+    assert response.status_code == 200
+    assert views.RUN_MANAGER.get(run_id).wait(5)
+    assert views.RUN_MANAGER.get(run_id).result == 'left'
+    assert client.post('/signal', data={'address': '192.168.0.11'}).status_code == 400
+    subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestSignal.py"])
+
+def test_run_refused_while_another_process_runs_an_experiment(client, monkeypatch, tmp_path):
+    path = str(tmp_path / 'signal.sock')
+    monkeypatch.setattr('elephant_vending_machine.views.SIGNAL_TRANSPORT', UnixSocketSignalTransport(path))
+    created = []
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, structured=False: created.append(file_name))
+    other_process = UnixSocketSignalTransport(path)
+    other_process.subscribe(lambda address: None)
+    write_experiment('unittestBusy.py', [
+        'def run_experiment(experiment_logger, vending_machine):',
+        '    pass'])
+    response = client.post('/run-experiment/unittestBusy.py')
+    other_process.unsubscribe()
+    subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestBusy.py"])
+    assert response.status_code == 409
+    assert created == []
+
+def write_experiment(name, lines):
+    experiment_path = f"elephant_vending_machine/static/experiment/{name}"
+    with open(experiment_path, 'w') as experiment_file:
+        experiment_file.write('\n'.join(lines))
+
+def test_run_status_reports_progress_and_result(client, monkeypatch):
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, structured=False: MockLogger())
+    write_experiment('unittestProgress.py', [
+        'NUM_TRIALS = 2',
+        'def run_experiment(experiment_logger, vending_machine):',
+        '    for trial in range(NUM_TRIALS):',
+        '        experiment_logger.info("Trial %s started", trial + 1)',
+        '    return {"correct": 2}'])
+    response = client.post('/run-experiment/unittestProgress.py')
+    run_id = json.loads(response.data)['run_id']
+    assert views.RUN_MANAGER.get(run_id).wait(5)
+    response = client.get(f'/run/{run_id}')
+    status = json.loads(response.data)
+    assert response.status_code == 200
+    assert status['status'] == 'finished'
+    assert status['current_trial'] == 2
+    assert status['total_trials'] == 2
+    assert status['result'] == {'correct': 2}
+    assert run_id in [run['run_id'] for run in json.loads(client.get('/run').data)['runs']]
+    subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestProgress.py"])
+
+def test_cancel_running_experiment(client, monkeypatch):
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, structured=False: MockLogger())
+    write_experiment('unittestWaiting.py', [
+        'def run_experiment(experiment_logger, vending_machine):',
+        '    vending_machine.wait_for_input([vending_machine.left_group], 60000)'])
+    response = client.post('/run-experiment/unittestWaiting.py')
+    run_id = json.loads(response.data)['run_id']
+    response = client.post('/run-experiment/unittestWaiting.py')
+    assert response.status_code == 409
+    response = client.post(f'/run/{run_id}/cancel')
+    assert response.status_code == 200
+    assert views.RUN_MANAGER.get(run_id).wait(5)
+    assert json.loads(client.get(f'/run/{run_id}').data)['status'] == 'cancelled'
+    assert client.post(f'/run/{run_id}/cancel').status_code == 400
+    subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestWaiting.py"])
+
+def test_failed_experiment_reports_error(client, monkeypatch):
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, structured=False: MockLogger())
+    write_experiment('unittestFailing.py', [
+        'def run_experiment(experiment_logger, vending_machine):',
+        '    raise ValueError("bad stimuli")'])
+    response = client.post('/run-experiment/unittestFailing.py')
+    run_id = json.loads(response.data)['run_id']
+    assert views.RUN_MANAGER.get(run_id).wait(5)
+    status = json.loads(client.get(f'/run/{run_id}').data)
+    assert status['status'] == 'failed'
+    assert status['error'] == 'ValueError: bad stimuli'
+    subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestFailing.py"])
+
+def test_run_not_found(client):
+    assert client.get('/run/nonexistent').status_code == 404
+    assert client.post('/run/nonexistent/cancel').status_code == 404
+
+def test_run_logs_trial_timing(client, monkeypatch):
+    logger = MockLogger()
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, structured=False: logger)
+    write_experiment('unittestTiming.py', [
+        'def run_experiment(experiment_logger, vending_machine):',
+        '    experiment_logger.info("Trial %s started", 1)',
+        '    vending_machine.mark_stimulus_onset()',
+        '    experiment_logger.info("Trial %s finished", 1)'])
+    response = client.post('/run-experiment/unittestTiming.py')
+    run_id = json.loads(response.data)['run_id']
+    assert views.RUN_MANAGER.get(run_id).wait(5)
+    assert views.RUN_MANAGER.get(run_id).status == 'finished'
+    assert ['Trial %s timing', 1] in logger.messages
+    subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestTiming.py"])
+
+def test_run_displays_images_through_display_agents(client, monkeypatch):
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, structured=False: MockLogger())
+    monkeypatch.setattr('elephant_vending_machine.libraries.vending_machine.ParallelSSHClient', None)
+    write_experiment('unittestAgent.py', [
+        'def run_experiment(experiment_logger, vending_machine):',
+        '    vending_machine.display_images(["a.png", "b.png", "c.png"])'])
+    with LocalDisplayAgent('127.0.0.1') as left_agent, \
+            LocalDisplayAgent('127.0.0.2', int(left_agent.address.split(':')[1])), \
+            LocalDisplayAgent('127.0.0.3', int(left_agent.address.split(':')[1])) as right_agent:
+        monkeypatch.setitem(elephant_vending_machine.APP.config, 'REMOTE_HOSTS', ['127.0.0.1', '127.0.0.2', '127.0.0.3'])
+        monkeypatch.setitem(elephant_vending_machine.APP.config, 'DISPLAY_AGENT_PORT', int(left_agent.address.split(':')[1]))
+        monkeypatch.setitem(elephant_vending_machine.APP.config, 'PRERENDER_IMAGES', False)
+        response = client.post('/run-experiment/unittestAgent.py')
+        run_id = json.loads(response.data)['run_id']
+        assert views.RUN_MANAGER.get(run_id).wait(5)
+    subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestAgent.py"])
+    assert views.RUN_MANAGER.get(run_id).status == 'finished'
+    assert right_agent.shown[-1][1] == '/home/pi/elephant_vending_machine/images/c.png'
+
+def test_run_logs_measured_onsets(client, monkeypatch, tmp_path):
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', ExperimentLoggerRegistry(str(tmp_path)).get)
+    write_experiment('unittestOnset.py', [
+        'def run_experiment(experiment_logger, vending_machine):',
+        '    experiment_logger.info("Trial %s started", 1)',
+        '    vending_machine.display_images(["a.png", "b.png", "c.png"])',
+        '    experiment_logger.info("Trial %s finished", 1)'])
+    with LocalDisplayAgent('127.0.0.1') as left_agent, \
+            LocalDisplayAgent('127.0.0.2', int(left_agent.address.split(':')[1])), \
+            LocalDisplayAgent('127.0.0.3', int(left_agent.address.split(':')[1])):
+        monkeypatch.setitem(elephant_vending_machine.APP.config, 'REMOTE_HOSTS', ['127.0.0.1', '127.0.0.2', '127.0.0.3'])
+        monkeypatch.setitem(elephant_vending_machine.APP.config, 'DISPLAY_AGENT_PORT', int(left_agent.address.split(':')[1]))
+        monkeypatch.setitem(elephant_vending_machine.APP.config, 'DISPLAY_ONSET_LEAD', 50)
+        monkeypatch.setitem(elephant_vending_machine.APP.config, 'PRERENDER_IMAGES', False)
+        response = client.post('/run-experiment/unittestOnset.py')
+        log_file = json.loads(response.data)['log_file']
+        assert views.RUN_MANAGER.get(json.loads(response.data)['run_id']).wait(5)
+    subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestOnset.py"])
+    with open(tmp_path / log_file) as log:
+        assert 'Stimuli onset left' in log.read()
+    shown = [event for event in trial_log.read_trial_log(str(tmp_path / trial_log.trial_log_name(log_file)))
+             if event['event'] == 'stimulus_shown']
+    assert [(event['trial'], event['screen'], event['image']) for event in shown] == \
+        [(1, 'left', 'a.png'), (1, 'middle', 'b.png'), (1, 'right', 'c.png')]
+    assert all(abs(event['latency_ms']) < 20 for event in shown)